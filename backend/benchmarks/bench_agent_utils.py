@@ -0,0 +1,157 @@
+"""agent/utils.py のマイクロベンチマーク.
+
+大きなレポートを想定した合成データで、引用マーカーの挿入と短縮URLの展開を計測する。
+比較のため、1件ごとに文字列を作り直していた以前の実装も参照実装として計測し、
+両者の出力が一致することも確認する。
+
+実行方法（backend ディレクトリで）:
+    make bench
+    python benchmarks/bench_agent_utils.py --repeat 5
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+# agent パッケージの import 時にキーの有無が検査されるため。API は呼び出さない
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from agent.utils import (  # noqa: E402
+    SHORT_URL_PREFIX,
+    expand_short_urls,
+    insert_citation_markers,
+)
+
+# (本文の文字数, 引用の件数)
+REPORT_SIZES = [(10_000, 50), (100_000, 1_000), (400_000, 4_000)]
+# 1つの短縮URLが sources_gathered に重複して現れる回数（リサーチループをまたいだ重複を再現）
+SOURCE_DUPLICATION = 3
+
+
+def reference_insert_citation_markers(text, citations_list):
+    """以前の実装.
+
+    引用ごとに文字列全体をスライスで作り直す。
+    """
+    sorted_citations = sorted(
+        citations_list, key=lambda c: (c["end_index"], c["start_index"]), reverse=True
+    )
+    modified_text = text
+    for citation_info in sorted_citations:
+        end_idx = citation_info["end_index"]
+        marker_to_insert = ""
+        for segment in citation_info["segments"]:
+            marker_to_insert += f" [{segment['label']}]({segment['short_url']})"
+        modified_text = (
+            modified_text[:end_idx] + marker_to_insert + modified_text[end_idx:]
+        )
+    return modified_text
+
+
+def reference_expand_short_urls(text, sources):
+    """以前の実装.
+
+    sources_gathered の要素ごとに本文全体へ str.replace をかける。
+    """
+    unique_sources = []
+    for source in sources:
+        if source["short_url"] in text:
+            text = text.replace(source["short_url"], source["value"])
+            unique_sources.append(source)
+    return text, unique_sources
+
+
+def build_report(text_length: int, citation_count: int, rng: random.Random):
+    """日本語と英語が混在した本文と、ランダムな位置の引用を生成する."""
+    alphabet = "コンプライアンスの調査結果 research summary, "
+    text = "".join(rng.choice(alphabet) for _ in range(text_length))
+    citations = []
+    for citation_index in range(citation_count):
+        end_index = rng.randint(1, text_length)
+        segments = [
+            {
+                "label": f"source{citation_index}-{segment_index}",
+                "short_url": f"{SHORT_URL_PREFIX}{citation_index % 7}-{citation_index}",
+                "value": f"https://example.com/article/{citation_index}",
+            }
+            for segment_index in range(rng.randint(1, 3))
+        ]
+        citations.append(
+            {
+                "start_index": max(0, end_index - 40),
+                "end_index": end_index,
+                "segments": segments,
+            }
+        )
+    return text, citations
+
+
+def best_of(function, repeat: int) -> float:
+    """関数を repeat 回実行したうちの最速値（ミリ秒）を返す."""
+    return min(timeit.repeat(function, number=1, repeat=repeat)) * 1000
+
+
+def print_row(
+    report, case: str, size: str, reference_ms: float, current_ms: float
+) -> None:
+    """1ケースの参照実装と現在の実装の所要時間を表の1行として書き出す."""
+    speedup = reference_ms / current_ms if current_ms else float("inf")
+    print(
+        f"{case:<24}{size:>22}{reference_ms:>14.2f}{current_ms:>14.2f}{speedup:>10.1f}x",
+        file=report,
+    )
+
+
+def run(repeat: int, report) -> None:
+    """すべての大きさのレポートで参照実装と現在の実装を比べ、結果を report に書き出す."""
+    rng = random.Random(0)
+    print(
+        f"{'case':<24}{'size':>22}{'reference ms':>14}{'current ms':>14}{'speedup':>11}",
+        file=report,
+    )
+
+    for text_length, citation_count in REPORT_SIZES:
+        text, citations = build_report(text_length, citation_count, rng)
+        size = f"{text_length} chars/{citation_count}"
+
+        expected = reference_insert_citation_markers(text, citations)
+        marked_text = insert_citation_markers(text, citations)
+        assert marked_text == expected, (
+            "insert_citation_markers の出力が参照実装と一致しません"
+        )
+        print_row(
+            report,
+            "insert_citation_markers",
+            size,
+            best_of(lambda: reference_insert_citation_markers(text, citations), repeat),
+            best_of(lambda: insert_citation_markers(text, citations), repeat),
+        )
+
+        sources = [
+            segment for citation in citations for segment in citation["segments"]
+        ] * SOURCE_DUPLICATION
+        expanded_text, _ = expand_short_urls(marked_text, sources)
+        assert SHORT_URL_PREFIX not in expanded_text, (
+            "展開されていない短縮URLがあります"
+        )
+        print_row(
+            report,
+            "expand_short_urls",
+            size,
+            best_of(lambda: reference_expand_short_urls(marked_text, sources), repeat),
+            best_of(lambda: expand_short_urls(marked_text, sources), repeat),
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="各ケースの試行回数（最速値を採用）"
+    )
+    run(parser.parse_args().repeat, sys.stdout)
@@ -0,0 +1,293 @@
+"""バックエンド全体のスループットベンチマーク.
+
+fake_providers.py のローカルサーバーを OpenAI / Gemini の代わりに立て、Flask アプリを
+実際にHTTPで呼び出して、エンドポイントごと・同時実行数ごとに
+スループット（req/s）とレイテンシのパーセンタイル（p50 / p95 / p99）を計測する。
+リサーチエージェントはHTTPエンドポイントを持たないため、analyze_with_gemini_deep_research を
+プロセス内で直接呼び出して計測する。
+
+外部APIの待ち時間は --latency-scale で調整できる（0 にするとバックエンド自身のオーバーヘッドだけを測れる）。
+レートリミッターは既定で無効にする。--rate-limit を付けると有効にしたまま計測する。
+
+同じ内容のリクエストは実行中の分析に合流し（core/single_flight.py）、同じ音声の文字起こしはキャッシュから返る
+（media/transcript_cache.py）ため、既定では送信ごとに発言者情報へ異なる値（nonce）を入れ、文字起こしのキャッシュも無効にして、
+毎回パイプライン全体を実行させる。--identical-requests を付けると同じリクエストを送り、キャッシュも有効にしたまま計測する。
+
+実行方法（backend ディレクトリで）:
+    python benchmarks/bench_throughput.py --latency-scale 0 --concurrency 1,4,16 --requests 32
+    python benchmarks/bench_throughput.py --endpoints text,video --latency-scale 0.1
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from fake_providers import (
+    add_config_arguments,
+    config_from_arguments,
+    start_fake_provider_server,
+)
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+SAMPLE_IMAGE_PATH = BACKEND_DIR / "data" / "images" / "5c638ab13b000033046b26ff.webp"
+SAMPLE_VIDEO_PATH = BACKEND_DIR / "data" / "videos" / "test_video1.mp4"
+SPEAKER_BACKGROUND = {
+    "name": "ベンチマーク用ユーザー",
+    "past_incidents": [],
+    "character_type": "一般ユーザー",
+    "usual_style": "通常の発言スタイル",
+}
+ENDPOINTS = ("text", "image-text", "video", "research")
+
+
+def configure_environment(
+    provider_base_url: str, is_rate_limit_enabled: bool, is_cache_enabled: bool
+) -> None:
+    """アプリを import する前に、外部APIの接続先とローカルの保存先をベンチマーク用に切り替える."""
+    os.environ["OPENAI_BASE_URL"] = f"{provider_base_url}/v1"
+    os.environ["GOOGLE_GEMINI_BASE_URL"] = provider_base_url
+    os.environ["OPENAI_API_KEY"] = "benchmark"
+    os.environ["GEMINI_API_KEY"] = "benchmark"
+    os.environ["RATE_LIMIT_ENABLED"] = "1" if is_rate_limit_enabled else "0"
+    os.environ["PREWARM_ENABLED"] = "0"
+    os.environ["TRANSCRIPT_CACHE_ENABLED"] = "1" if is_cache_enabled else "0"
+    os.environ["BACKEND_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-cache-")
+    sys.path.insert(0, str(BACKEND_DIR / "src"))
+
+
+def start_backend_server():
+    """Flask アプリをスレッド化したWSGIサーバーで起動し、そのベースURLを返す."""
+    from werkzeug.serving import make_server
+
+    from app import app
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="backend", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def encode_multipart(
+    fields: dict, files: dict[str, tuple[str, bytes]]
+) -> tuple[bytes, str]:
+    """標準ライブラリの urllib で送る multipart/form-data のボディと Content-Type を作る.
+
+    files はフィールド名から (ファイル名, 内容) への対応。
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode()
+        )
+        parts.append(content)
+        parts.append(b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def build_request_body(
+    endpoint: str, speaker_background: dict, files: dict[str, tuple[str, bytes]]
+) -> tuple[bytes, str]:
+    """エンドポイントに送るボディと Content-Type を作る."""
+    if endpoint == "text":
+        body = json.dumps(
+            {
+                "text": "ベンチマーク用の投稿テキストです。",
+                "speaker_background": speaker_background,
+            }
+        ).encode("utf-8")
+        return body, "application/json"
+    fields = {"speaker_background": json.dumps(speaker_background, ensure_ascii=False)}
+    if endpoint == "image-text":
+        fields["text"] = "ベンチマーク用の投稿テキストです。"
+    return encode_multipart(fields, files)
+
+
+def build_http_request(backend_url: str, endpoint: str, is_identical: bool = False):
+    """エンドポイントごとのリクエストを、送信のたびに作り直せる関数として返す.
+
+    is_identical が False なら、送信ごとに発言者情報へ nonce を入れ、実行中の同じ分析への合流を避ける。
+    """
+    files = {}
+    if endpoint == "image-text":
+        files["image"] = (SAMPLE_IMAGE_PATH.name, SAMPLE_IMAGE_PATH.read_bytes())
+    elif endpoint == "video":
+        files["video"] = (SAMPLE_VIDEO_PATH.name, SAMPLE_VIDEO_PATH.read_bytes())
+    identical_body = build_request_body(endpoint, SPEAKER_BACKGROUND, files)
+
+    def send() -> None:
+        if is_identical:
+            body, content_type = identical_body
+        else:
+            body, content_type = build_request_body(
+                endpoint, {**SPEAKER_BACKGROUND, "nonce": uuid.uuid4().hex}, files
+            )
+        request = urllib.request.Request(
+            f"{backend_url}/api/analyze/{endpoint}",
+            data=body,
+            headers={"Content-Type": content_type},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=600) as response:
+            payload = json.loads(response.read())
+        # 分析中のエラーは HTTP 200 のまま error として返るため、失敗として数える
+        if payload.get("status") != "success" or payload.get("error"):
+            raise RuntimeError(payload.get("error") or payload)
+
+    return send
+
+
+def build_research_request():
+    """発言者リサーチを1回実行する関数を返す."""
+    from checker import analyze_with_gemini_deep_research
+
+    def send() -> None:
+        result = analyze_with_gemini_deep_research({"name": SPEAKER_BACKGROUND["name"]})
+        if result.get("error"):
+            raise RuntimeError(result["error"])
+
+    return send
+
+
+def percentile(sorted_values: list[float], ratio: float) -> float:
+    """最近傍順位法によるパーセンタイル."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, round(ratio * len(sorted_values) + 0.5))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_level(send, concurrency: int, request_count: int) -> dict:
+    """同時実行数 concurrency で request_count 件を送り、スループットとレイテンシを集計する."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def timed_send() -> None:
+        started_at = time.perf_counter()
+        try:
+            send()
+        except (urllib.error.URLError, RuntimeError, OSError) as error:
+            with lock:
+                errors.append(str(error))
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(request_count):
+            executor.submit(timed_send)
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "requests": request_count,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+def print_header(report) -> None:
+    """結果の表の見出しを書き出す."""
+    print(
+        f"{'endpoint':<12}{'conc':>6}{'reqs':>6}{'errors':>8}{'req/s':>10}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}",
+        file=report,
+    )
+
+
+def print_row(report, endpoint: str, concurrency: int, stats: dict) -> None:
+    """エンドポイントと同時実行数ごとの結果を表の1行として書き出す."""
+    print(
+        f"{endpoint:<12}{concurrency:>6}{stats['requests']:>6}{stats['errors']:>8}{stats['throughput']:>10.2f}"
+        f"{stats['p50_ms']:>11.1f}{stats['p95_ms']:>11.1f}{stats['p99_ms']:>11.1f}",
+        file=report,
+    )
+    if stats["first_error"]:
+        print(f"  最初のエラー: {stats['first_error'][:200]}", file=report)
+
+
+def run(arguments: argparse.Namespace) -> None:
+    """偽のAPIサーバーとアプリを起動し、エンドポイントと同時実行数の組ごとに負荷をかけて結果を書き出す."""
+    report = sys.stdout
+    # チェッカーの DEBUG 出力で結果が埋もれないよう、既定ではアプリの標準出力を捨てる
+    if not arguments.show_app_output:
+        sys.stdout = open(os.devnull, "w")
+
+    provider_server = start_fake_provider_server(config_from_arguments(arguments))
+    configure_environment(
+        provider_server.base_url, arguments.rate_limit, arguments.identical_requests
+    )
+    backend_url = start_backend_server()
+
+    endpoints = [endpoint.strip() for endpoint in arguments.endpoints.split(",")]
+    concurrency_levels = [int(level) for level in arguments.concurrency.split(",")]
+    print_header(report)
+    for endpoint in endpoints:
+        send = (
+            build_research_request()
+            if endpoint == "research"
+            else build_http_request(backend_url, endpoint, arguments.identical_requests)
+        )
+        # 初回の import やコネクション確立を計測から除く
+        send()
+        for concurrency in concurrency_levels:
+            request_count = max(arguments.requests, concurrency)
+            print_row(
+                report,
+                endpoint,
+                concurrency,
+                run_level(send, concurrency, request_count),
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--endpoints",
+        default=",".join(ENDPOINTS),
+        help=f"計測するエンドポイント（{', '.join(ENDPOINTS)}）",
+    )
+    parser.add_argument(
+        "--concurrency", default="1,4,16", help="同時実行数（カンマ区切り）"
+    )
+    parser.add_argument(
+        "--requests", type=int, default=32, help="同時実行数ごとのリクエスト数"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        action="store_true",
+        help="レートリミッターを有効にしたまま計測する",
+    )
+    parser.add_argument(
+        "--identical-requests",
+        action="store_true",
+        help="同じリクエストを送り、文字起こしのキャッシュも有効にする（合流とキャッシュの効果を含めて計測する）",
+    )
+    parser.add_argument(
+        "--show-app-output",
+        action="store_true",
+        help="アプリの標準出力（DEBUGログ）も表示する",
+    )
+    add_config_arguments(parser)
+    run(parser.parse_args())
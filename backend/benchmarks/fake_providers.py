@@ -0,0 +1,700 @@
+"""OpenAI（Whisper / Chat Completions）と Gemini API の代わりに応答するローカルHTTPサーバー.
+
+チェッカーとリサーチエージェントが使うエンドポイントだけを模倣し、APIキーなしで
+バックエンド全体を動かせるようにする。応答の遅延、エラー（429 / 500）の発生率、
+応答の大きさ（文字起こしのセグメント数、違反件数、回答の文字数）を設定できる。
+
+クライアント側は次の環境変数でこのサーバーへ向ける。
+    OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+    GOOGLE_GEMINI_BASE_URL=http://127.0.0.1:<port>
+
+単体で起動する場合（backend ディレクトリで）:
+    python benchmarks/fake_providers.py --port 8765 --latency-scale 0.5 --rate-limit-error-rate 0.05
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SHORT_URL_PATTERN = re.compile(r"https://vertexaisearch\.cloud\.google\.com/id/\d+-\d+")
+
+# 実際のAPIでおおよそ観測される応答時間（秒）。latency_scale で一括して伸縮する
+DEFAULT_LATENCY_SECONDS = {
+    "transcription": 3.0,
+    "chat": 1.5,
+    "generate": 2.0,
+    "upload": 0.5,
+    "files": 0.05,
+    "cache": 0.5,
+}
+# アップロードしたファイル1つを入力に含めたときに数える入力トークン数
+FILE_PART_TOKENS = 1000
+# OpenAI のプロンプトキャッシュが効く最小の入力トークン数と、キャッシュから読まれるトークン数の単位
+OPENAI_CACHE_MIN_TOKENS = 1024
+OPENAI_CACHE_BLOCK_TOKENS = 128
+
+
+@dataclass
+class FakeProviderConfig:
+    """応答の遅延、エラー率、応答の大きさの設定."""
+
+    latency_seconds: dict = field(default_factory=lambda: dict(DEFAULT_LATENCY_SECONDS))
+    latency_scale: float = 1.0
+    # 遅延のばらつき（±の割合）
+    jitter_ratio: float = 0.2
+    rate_limit_error_rate: float = 0.0
+    server_error_rate: float = 0.0
+    transcript_segments: int = 20
+    words_per_segment: int = 8
+    violations: int = 2
+    answer_chars: int = 2000
+    # アップロードしたファイルが PROCESSING のまま返される files.get の回数
+    processing_polls: int = 0
+    seed: int | None = None
+
+
+class FakeProviderServer(ThreadingHTTPServer):
+    """偽の応答を返すHTTPサーバー。アップロードされたファイルなどの状態をスレッド間で共有する."""
+
+    daemon_threads = True
+
+    def __init__(self, address, config: FakeProviderConfig):
+        """指定した遅延・エラー率・応答の大きさ（config）で応答するサーバーを address で待ち受ける."""
+        super().__init__(address, FakeProviderHandler)
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.random_lock = threading.Lock()
+        self.files: dict[str, dict] = {}
+        self.files_lock = threading.Lock()
+        self.upload_ids = itertools.count(1)
+        # コンテキストキャッシュ（名前 -> 指示の本文とトークン数）と、OpenAI のプロンプトで既に送られた先頭部分
+        self.caches: dict[str, dict] = {}
+        self.prompt_prefixes: set[str] = set()
+        self.cache_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        """クライアントを向けるベースURLを返す."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self) -> float:
+        """遅延とエラーの判定に使う乱数を返す（シードで再現できるよう、スレッド間で1つの乱数列を共有する）."""
+        with self.random_lock:
+            return self.random.random()
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    """OpenAI と Gemini API のエンドポイントを模倣するリクエストハンドラー."""
+
+    server: FakeProviderServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """アクセスログを出さない."""
+        # ベンチマーク中の標準エラー出力を汚さないよう、アクセスログは出さない
+        pass
+
+    # --- 共通処理 ---
+
+    def read_body(self) -> bytes:
+        """リクエストのボディを読む."""
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(
+        self, status: int, payload: dict, headers: dict | None = None
+    ) -> None:
+        """JSONのレスポンスを返す."""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate(self, route: str) -> bool:
+        """設定に従って待機し、エラーを返す場合は応答まで済ませる.
+
+        Returns:
+            bool: 正常な応答を続けてよい場合は True。
+        """
+        config = self.server.config
+        base_latency = config.latency_seconds.get(route, 0.0) * config.latency_scale
+        jitter = (self.server.draw() * 2 - 1) * config.jitter_ratio
+        time.sleep(max(0.0, base_latency * (1 + jitter)))
+
+        draw = self.server.draw()
+        if draw < config.rate_limit_error_rate:
+            self.send_json(
+                429,
+                {
+                    "error": {
+                        "code": 429,
+                        "message": "Resource has been exhausted (fake).",
+                        "status": "RESOURCE_EXHAUSTED",
+                    }
+                },
+                {"Retry-After": "1"},
+            )
+            return False
+        if draw < config.rate_limit_error_rate + config.server_error_rate:
+            self.send_json(
+                500,
+                {
+                    "error": {
+                        "code": 500,
+                        "message": "Internal error (fake).",
+                        "status": "INTERNAL",
+                    }
+                },
+            )
+            return False
+        return True
+
+    # --- ルーティング ---
+
+    def do_POST(self):
+        """パスに応じて POST のリクエストを振り分ける."""
+        path = self.path.split("?", 1)[0]
+        if path == "/v1/audio/transcriptions":
+            self.handle_transcription()
+        elif path == "/v1/chat/completions":
+            self.handle_chat_completion()
+        elif path.startswith("/upload/") and path.endswith("/files"):
+            self.handle_upload()
+        elif path.endswith(":generateContent"):
+            self.handle_generate_content(path.rsplit("/", 1)[-1].split(":")[0])
+        elif path == "/v1beta/cachedContents":
+            self.handle_create_cache()
+        else:
+            self.read_body()
+            self.send_json(
+                404, {"error": {"code": 404, "message": f"unknown path {path}"}}
+            )
+
+    def do_DELETE(self):
+        """作成したキャッシュを削除する."""
+        match = re.match(r"^/v1beta/(cachedContents/[^/?]+)", self.path)
+        self.read_body()
+        if not match:
+            self.send_json(
+                404, {"error": {"code": 404, "message": f"unknown path {self.path}"}}
+            )
+            return
+        with self.server.cache_lock:
+            self.server.caches.pop(match.group(1), None)
+        self.send_json(200, {})
+
+    def do_GET(self):
+        """アップロードしたファイルの状態を返す."""
+        match = re.match(r"^/v1beta/(files/[^/?]+)", self.path)
+        if not match:
+            self.send_json(
+                404, {"error": {"code": 404, "message": f"unknown path {self.path}"}}
+            )
+            return
+        self.handle_get_file(match.group(1))
+
+    # --- OpenAI ---
+
+    def handle_transcription(self):
+        """Whisper の文字起こし（verbose_json）に応答する."""
+        self.read_body()
+        if not self.simulate("transcription"):
+            return
+
+        config = self.server.config
+        segments = []
+        words = []
+        for index in range(config.transcript_segments):
+            start = index * 4.0
+            segment_words = [
+                f"単語{index}_{word_index}"
+                for word_index in range(config.words_per_segment)
+            ]
+            segments.append(
+                {
+                    "id": index,
+                    "seek": 0,
+                    "start": start,
+                    "end": start + 4.0,
+                    "text": " ".join(segment_words),
+                    "tokens": [],
+                    "temperature": 0.0,
+                    "avg_logprob": -0.2,
+                    "compression_ratio": 1.2,
+                    "no_speech_prob": 0.01,
+                }
+            )
+            step = 4.0 / config.words_per_segment
+            words.extend(
+                {
+                    "word": word,
+                    "start": start + word_index * step,
+                    "end": start + (word_index + 1) * step,
+                }
+                for word_index, word in enumerate(segment_words)
+            )
+
+        self.send_json(
+            200,
+            {
+                "task": "transcribe",
+                "language": "japanese",
+                "duration": config.transcript_segments * 4.0,
+                "text": " ".join(segment["text"] for segment in segments),
+                "segments": segments,
+                "words": words,
+            },
+        )
+
+    def handle_chat_completion(self):
+        """Chat Completions（文脈判断）に応答する."""
+        request = json.loads(self.read_body() or b"{}")
+        if not self.simulate("chat"):
+            return
+
+        content = json.dumps(
+            {
+                "contextual_intent": "冗談として述べられた発言と判断される（fake）",
+                "gpt_context_assessment": "文脈を踏まえるとリスクは限定的",
+                "gpt_additional_risk_factor": "なし",
+                "gpt_risk_modifier": "なし",
+                "speaker_context_impact": "背景情報による影響は小さい",
+                "final_judgment": "要注意",
+            },
+            ensure_ascii=False,
+        )
+        messages = request.get("messages", [])
+        prompt_tokens = (
+            sum(len(message.get("content", "")) for message in messages) // 2
+        )
+        cached_tokens = self.read_cached_prefix_tokens(messages)
+        self.send_json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-3.5-turbo"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": 120,
+                    "total_tokens": prompt_tokens + 120,
+                    "prompt_tokens_details": {"cached_tokens": cached_tokens},
+                },
+            },
+        )
+
+    def read_cached_prefix_tokens(self, messages: list) -> int:
+        """最後のメッセージを除いた先頭部分が以前のリクエストと同じなら、その分をキャッシュから読んだトークン数として返す.
+
+        実際のAPIと同じく、短いプロンプトには効かず、OPENAI_CACHE_BLOCK_TOKENS 単位で数える。
+        """
+        prefix = json.dumps(messages[:-1], ensure_ascii=False, sort_keys=True)
+        prefix_tokens = (
+            sum(len(message.get("content", "")) for message in messages[:-1]) // 2
+        )
+        with self.server.cache_lock:
+            seen = prefix in self.server.prompt_prefixes
+            self.server.prompt_prefixes.add(prefix)
+        if not seen or prefix_tokens < OPENAI_CACHE_MIN_TOKENS:
+            return 0
+        return prefix_tokens // OPENAI_CACHE_BLOCK_TOKENS * OPENAI_CACHE_BLOCK_TOKENS
+
+    # --- Gemini: ファイル ---
+
+    def handle_upload(self):
+        """google-genai の resumable upload（start → upload, finalize）を模倣する."""
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        body = self.read_body()
+
+        if command == "start":
+            metadata = json.loads(body or b"{}").get("file", {})
+            upload_id = next(self.server.upload_ids)
+            with self.server.files_lock:
+                self.server.files[f"upload:{upload_id}"] = {
+                    "mimeType": self.headers.get(
+                        "X-Goog-Upload-Header-Content-Type",
+                        metadata.get("mimeType", "application/octet-stream"),
+                    ),
+                    "displayName": metadata.get("displayName", ""),
+                    "sizeBytes": 0,
+                }
+            self.send_json(
+                200,
+                {},
+                {
+                    "X-Goog-Upload-URL": f"{self.server.base_url}/upload/v1beta/files?upload_id={upload_id}",
+                    "X-Goog-Upload-Status": "active",
+                },
+            )
+            return
+
+        upload_id = self.path.split("upload_id=", 1)[-1]
+        with self.server.files_lock:
+            pending = self.server.files.get(f"upload:{upload_id}")
+            if pending is not None:
+                pending["sizeBytes"] += len(body)
+        if pending is None:
+            self.send_json(404, {"error": {"code": 404, "message": "unknown upload"}})
+            return
+        if "finalize" not in command:
+            self.send_json(200, {}, {"X-Goog-Upload-Status": "active"})
+            return
+
+        if not self.simulate("upload"):
+            return
+        name = f"files/{uuid.uuid4().hex[:12]}"
+        file_resource = {
+            "name": name,
+            "displayName": pending["displayName"],
+            "mimeType": pending["mimeType"],
+            "sizeBytes": str(pending["sizeBytes"]),
+            "uri": f"{self.server.base_url}/v1beta/{name}",
+            "state": "PROCESSING"
+            if self.server.config.processing_polls > 0
+            else "ACTIVE",
+        }
+        with self.server.files_lock:
+            del self.server.files[f"upload:{upload_id}"]
+            self.server.files[name] = {
+                **file_resource,
+                "polls_left": self.server.config.processing_polls,
+            }
+        self.send_json(200, {"file": file_resource}, {"X-Goog-Upload-Status": "final"})
+
+    def handle_get_file(self, name: str):
+        """ファイルの状態を返す。処理中の状態を processing_polls 回返してから ACTIVE にする."""
+        if not self.simulate("files"):
+            return
+        with self.server.files_lock:
+            stored = self.server.files.get(name)
+            if stored is not None:
+                stored["polls_left"] = max(0, stored["polls_left"] - 1)
+                stored["state"] = "PROCESSING" if stored["polls_left"] > 0 else "ACTIVE"
+                file_resource = {
+                    key: value for key, value in stored.items() if key != "polls_left"
+                }
+        if stored is None:
+            self.send_json(
+                404,
+                {
+                    "error": {
+                        "code": 404,
+                        "message": f"{name} not found",
+                        "status": "NOT_FOUND",
+                    }
+                },
+            )
+            return
+        self.send_json(200, file_resource)
+
+    # --- Gemini: コンテキストキャッシュ ---
+
+    def handle_create_cache(self):
+        """コンテキストキャッシュを作成する."""
+        request = json.loads(self.read_body() or b"{}")
+        if not self.simulate("cache"):
+            return
+
+        instruction = " ".join(
+            part.get("text", "")
+            for part in request.get("systemInstruction", {}).get("parts", [])
+        )
+        parts = [
+            part
+            for content in request.get("contents", [])
+            for part in content.get("parts", [])
+        ]
+        token_count = (
+            len(instruction) + sum(len(part.get("text", "")) for part in parts)
+        ) // 2 + FILE_PART_TOKENS * sum(1 for part in parts if "fileData" in part)
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        with self.server.cache_lock:
+            self.server.caches[name] = {
+                "instruction": instruction,
+                "token_count": token_count,
+            }
+        now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        self.send_json(
+            200,
+            {
+                "name": name,
+                "model": request.get("model", ""),
+                "createTime": now,
+                "updateTime": now,
+                "usageMetadata": {"totalTokenCount": token_count},
+            },
+        )
+
+    # --- Gemini: generateContent ---
+
+    def handle_generate_content(self, model: str):
+        """Gemini の generateContent に応答する."""
+        request = json.loads(self.read_body() or b"{}")
+        if not self.simulate("generate"):
+            return
+
+        cached_tokens = 0
+        cached_instruction = ""
+        if request.get("cachedContent"):
+            with self.server.cache_lock:
+                cache = self.server.caches.get(request["cachedContent"])
+            if cache is None:
+                self.send_json(
+                    404,
+                    {
+                        "error": {
+                            "code": 404,
+                            "message": "cached content not found",
+                            "status": "NOT_FOUND",
+                        }
+                    },
+                )
+                return
+            cached_tokens, cached_instruction = (
+                cache["token_count"],
+                cache["instruction"],
+            )
+
+        parts = [
+            part
+            for content in request.get("contents", [])
+            for part in content.get("parts", [])
+        ]
+        instruction = " ".join(
+            part.get("text", "")
+            for part in request.get("systemInstruction", {}).get("parts", [])
+        )
+        prompt_text = " ".join(
+            [cached_instruction, instruction] + [part.get("text", "") for part in parts]
+        ).strip()
+        generation_config = request.get("generationConfig", {})
+        schema = (
+            generation_config.get("responseJsonSchema")
+            or generation_config.get("responseSchema")
+            or {}
+        )
+        uses_google_search = any(
+            "googleSearch" in tool or "google_search" in tool
+            for tool in request.get("tools", [])
+        )
+
+        grounding_metadata = None
+        if uses_google_search:
+            text, grounding_metadata = self.build_grounded_answer()
+        elif schema:
+            text = json.dumps(
+                self.build_structured_output(schema.get("properties", {})),
+                ensure_ascii=False,
+            )
+        elif "violations" in prompt_text:
+            text = f"```json\n{json.dumps(self.build_compliance_result(), ensure_ascii=False)}\n```"
+        else:
+            text = self.build_final_answer(prompt_text)
+
+        candidate = {
+            "content": {"role": "model", "parts": [{"text": text}]},
+            "finishReason": "STOP",
+            "index": 0,
+        }
+        if grounding_metadata:
+            candidate["groundingMetadata"] = grounding_metadata
+        # 入力トークン数にはキャッシュから読んだ分も含める（実際のAPIと同じ）
+        prompt_tokens = (
+            cached_tokens
+            + (len(instruction) + sum(len(part.get("text", "")) for part in parts)) // 2
+            + FILE_PART_TOKENS * sum(1 for part in parts if "fileData" in part)
+        )
+        output_tokens = len(text) // 2
+        usage_metadata = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+        if cached_tokens:
+            usage_metadata["cachedContentTokenCount"] = cached_tokens
+        self.send_json(
+            200,
+            {
+                "candidates": [candidate],
+                "usageMetadata": usage_metadata,
+                "modelVersion": model,
+            },
+        )
+
+    def build_structured_output(self, properties: dict) -> dict:
+        """リサーチエージェントの構造化出力（SearchQueryList / Reflection）を返す."""
+        if "is_sufficient" in properties:
+            return {
+                "is_sufficient": False,
+                "knowledge_gap": "過去の発言に関する一次情報が不足している（fake）",
+                "follow_up_queries": ["発言者 過去 炎上 経緯"],
+            }
+        return {
+            "rationale": "発言者の過去のコンプライアンス関連情報を調べる（fake）",
+            "query": [
+                "発言者 不適切発言",
+                "発言者 炎上 謝罪",
+                "発言者 ハラスメント 報道",
+            ],
+        }
+
+    def build_compliance_result(self) -> dict:
+        """動画・画像とテキストの分析結果（両方の形式を兼ねる）を返す."""
+        violations = [
+            {
+                "type": "発言",
+                "description": f"不適切な表現の可能性がある発言（fake #{index + 1}）",
+                "start_time": index * 4.0,
+                "end_time": index * 4.0 + 3.0,
+                "severity": "中",
+                "related_text": f"単語{index}_0 単語{index}_1",
+                "location": "テキスト内",
+                "detected_text": f"単語{index}_0",
+                "image_content": "人物が話している様子",
+                "context_analysis": "文脈上は冗談と解釈できる",
+            }
+            for index in range(self.server.config.violations)
+        ]
+        return {
+            "violations": violations,
+            "summary": "軽微な懸念が見つかりました（fake）",
+            "risk_level": "中" if violations else "低",
+            "recommendations": ["表現を見直してください"],
+        }
+
+    def build_grounded_answer(self) -> tuple[str, dict]:
+        """web_research 用に、引用付きの検索結果と groundingMetadata を返す."""
+        sentences = [f"検索結果の要約文その{index}。" for index in range(4)]
+        text = "".join(sentences)
+        chunks = [
+            {
+                "web": {
+                    "uri": f"https://example.com/article/{uuid.uuid4().hex[:8]}",
+                    "title": f"example{index}.com",
+                }
+            }
+            for index in range(len(sentences))
+        ]
+        supports = []
+        offset = 0
+        for index, sentence in enumerate(sentences):
+            supports.append(
+                {
+                    "segment": {
+                        "startIndex": offset,
+                        "endIndex": offset + len(sentence),
+                        "text": sentence,
+                    },
+                    "groundingChunkIndices": [index],
+                }
+            )
+            offset += len(sentence)
+        return text, {
+            "groundingChunks": chunks,
+            "groundingSupports": supports,
+            "webSearchQueries": ["fake"],
+        }
+
+    def build_final_answer(self, prompt_text: str) -> str:
+        """最終回答.
+
+        プロンプト中の短縮URLを引用として含め、指定の文字数まで本文を伸ばす。
+        """
+        citations = " ".join(
+            f"[source]({url})"
+            for url in dict.fromkeys(SHORT_URL_PATTERN.findall(prompt_text))
+        )
+        filler = "調査結果の詳細な説明です。" * (
+            self.server.config.answer_chars // 13 + 1
+        )
+        return f"{filler[: self.server.config.answer_chars]} {citations}".strip()
+
+
+def start_fake_provider_server(
+    config: FakeProviderConfig | None = None, host: str = "127.0.0.1", port: int = 0
+) -> FakeProviderServer:
+    """バックグラウンドスレッドでサーバーを起動する.
+
+    port=0 の場合は空いているポートを使う。
+    """
+    server = FakeProviderServer((host, port), config or FakeProviderConfig())
+    threading.Thread(
+        target=server.serve_forever, name="fake-providers", daemon=True
+    ).start()
+    return server
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    """FakeProviderConfig をコマンドライン引数から指定できるようにする."""
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="既定の応答時間に掛ける倍率（0で待機なし）",
+    )
+    parser.add_argument("--jitter-ratio", type=float, default=0.2)
+    parser.add_argument(
+        "--rate-limit-error-rate", type=float, default=0.0, help="429を返す割合"
+    )
+    parser.add_argument(
+        "--server-error-rate", type=float, default=0.0, help="500を返す割合"
+    )
+    parser.add_argument("--transcript-segments", type=int, default=20)
+    parser.add_argument("--violations", type=int, default=2)
+    parser.add_argument("--answer-chars", type=int, default=2000)
+    parser.add_argument("--processing-polls", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_arguments(arguments: argparse.Namespace) -> FakeProviderConfig:
+    """コマンドライン引数から FakeProviderConfig を作る."""
+    return FakeProviderConfig(
+        latency_scale=arguments.latency_scale,
+        jitter_ratio=arguments.jitter_ratio,
+        rate_limit_error_rate=arguments.rate_limit_error_rate,
+        server_error_rate=arguments.server_error_rate,
+        transcript_segments=arguments.transcript_segments,
+        violations=arguments.violations,
+        answer_chars=arguments.answer_chars,
+        processing_polls=arguments.processing_polls,
+        seed=arguments.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    arguments = parser.parse_args()
+    server = FakeProviderServer(
+        (arguments.host, arguments.port), config_from_arguments(arguments)
+    )
+    sys.stdout.write(
+        f"OPENAI_BASE_URL={server.base_url}/v1\nGOOGLE_GEMINI_BASE_URL={server.base_url}\n"
+    )
+    sys.stdout.flush()
+    server.serve_forever()
@@ -1,3 +1,3 @@
-from agent.graph import graph
+from agent.graph import async_graph, graph
 
-__all__ = ["graph"]
+__all__ = ["graph", "async_graph"]
@@ -0,0 +1,111 @@
+"""Time and search budgets for a single research run."""
+
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from agent.configuration import Configuration
+
+# Share of the deadline kept free for finalize_answer, which runs after the last loop.
+FINALIZE_TIME_RESERVE_RATIO = 0.2
+
+
+@dataclass(frozen=True)
+class ResearchBudget:
+    """Per-run limits for wall-clock time, total tokens and grounded searches."""
+
+    deadline_seconds: float
+    max_tokens: int
+    max_searches: int
+    # Time a resumed run spent waiting to be resumed, excluded from the elapsed time.
+    paused_seconds: float = 0.0
+
+    @classmethod
+    def from_state(
+        cls, state: dict[str, Any], configurable: Configuration
+    ) -> "ResearchBudget":
+        """Resolve the budget, letting per-run state values override the configuration."""
+
+        def resolve(state_key: str, default: Any) -> Any:
+            value = state.get(state_key)
+            return value if value is not None else default
+
+        return cls(
+            deadline_seconds=resolve(
+                "research_deadline_seconds", configurable.research_deadline_seconds
+            ),
+            max_tokens=resolve("max_research_tokens", configurable.max_research_tokens),
+            max_searches=resolve("max_search_queries", configurable.max_search_queries),
+            paused_seconds=configurable.research_paused_seconds,
+        )
+
+
+def elapsed_seconds(
+    state: dict[str, Any], now: float | None = None, paused_seconds: float = 0.0
+) -> float:
+    """Return the wall-clock time spent since the run started, minus the time paused."""
+    started_at: float | None = state.get("research_started_at")
+    if started_at is None:
+        return 0.0
+    return max(0.0, (now or time.time()) - started_at - paused_seconds)
+
+
+def find_exhausted_budget(
+    state: dict[str, Any], budget: ResearchBudget, now: float | None = None
+) -> str | None:
+    """Check whether another research loop would overrun the budget.
+
+    The cost of the next loop is projected from the average cost of the loops run so
+    far, so the run stops while there is still room to write the final answer.
+
+    Args:
+        state: Current graph state after reflection.
+        budget: The resolved budget for this run.
+        now: Current time, mainly for deterministic callers.
+
+    Returns:
+        The name of the budget that would be exceeded, or None if another loop fits.
+    """
+    loops_done = max(1, state.get("research_loop_count", 1))
+
+    elapsed = elapsed_seconds(state, now, budget.paused_seconds)
+    average_loop_seconds = elapsed / loops_done
+    usable_seconds = budget.deadline_seconds * (1 - FINALIZE_TIME_RESERVE_RATIO)
+    if elapsed + average_loop_seconds > usable_seconds:
+        return "deadline"
+
+    tokens_used = state.get("tokens_used") or 0
+    average_loop_tokens = tokens_used / loops_done
+    # The final answer reads every summary again, so reserve about one more loop for it.
+    if tokens_used + 2 * average_loop_tokens > budget.max_tokens:
+        return "max_research_tokens"
+
+    if len(state.get("search_query", [])) >= budget.max_searches:
+        return "max_search_queries"
+    return None
+
+
+def remaining_searches(state: dict[str, Any], budget: ResearchBudget) -> int:
+    """Return how many more grounded searches the budget allows."""
+    return max(0, budget.max_searches - len(state.get("search_query", [])))
+
+
+def summarize_usage(
+    state: dict[str, Any],
+    budget: ResearchBudget,
+    stopped_by: str,
+    now: float | None = None,
+) -> dict[str, Any]:
+    """Build the usage report returned with the final answer."""
+    return {
+        "elapsed_seconds": round(elapsed_seconds(state, now, budget.paused_seconds), 3),
+        "tokens_used": state.get("tokens_used") or 0,
+        "searches_run": len(state.get("search_query", [])),
+        "research_loops": state.get("research_loop_count", 0),
+        "stopped_by": stopped_by,
+        "budget": {
+            "deadline_seconds": budget.deadline_seconds,
+            "max_tokens": budget.max_tokens,
+            "max_searches": budget.max_searches,
+        },
+    }
@@ -0,0 +1,301 @@
+"""Checkpointing for research runs so an interrupted run can resume from its last completed step."""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, cast
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+from langgraph.graph.state import CompiledStateGraph
+
+from agent.graph import async_builder, builder
+from core.paths import resolve_cache_path
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DB_FILENAME = "research_checkpoints.sqlite3"
+# Attempts per run, counting the first one. Later attempts resume from the last checkpoint.
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 2.0
+# Checkpoints of failed runs that are not resumed within this time are deleted.
+DEFAULT_CHECKPOINT_TTL_SECONDS = 7 * 24 * 60 * 60
+# How often a process looks for expired runs, at the start of a research run.
+SWEEP_INTERVAL_SECONDS = 60 * 60
+
+_saver: SqliteSaver | None = None
+_graph: CompiledStateGraph[Any, Any, Any, Any] | None = None
+_lock = threading.Lock()
+_last_sweep_at = 0.0
+
+
+def get_checkpoint_db_path() -> str:
+    """Return the SQLite file that stores research checkpoints.
+
+    The path can be overridden with `RESEARCH_CHECKPOINT_DB_PATH`.
+    """
+    return os.getenv("RESEARCH_CHECKPOINT_DB_PATH") or resolve_cache_path(
+        CHECKPOINT_DB_FILENAME
+    )
+
+
+def get_checkpoint_ttl_seconds() -> float:
+    """Return how long the checkpoints of an unfinished run are kept.
+
+    The TTL can be overridden with `RESEARCH_CHECKPOINT_TTL_SECONDS`.
+    """
+    return float(
+        os.getenv("RESEARCH_CHECKPOINT_TTL_SECONDS") or DEFAULT_CHECKPOINT_TTL_SECONDS
+    )
+
+
+def new_run_id() -> str:
+    """Create a thread ID for a new research run."""
+    return uuid.uuid4().hex
+
+
+def _thread_config(run_id: str, paused_seconds: float = 0.0) -> RunnableConfig:
+    return {
+        "configurable": {
+            "thread_id": run_id,
+            "research_paused_seconds": paused_seconds,
+        }
+    }
+
+
+def _connect_runs() -> sqlite3.Connection:
+    """Open the table of unfinished runs, kept in the checkpoint file.
+
+    LangGraph's own tables have no timestamps to expire threads by, and the time a
+    run waited to be resumed has to survive the process that gave up on it.
+    """
+    conn = sqlite3.connect(get_checkpoint_db_path(), timeout=30, isolation_level=None)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS research_runs (
+            run_id TEXT PRIMARY KEY,
+            paused_seconds REAL NOT NULL DEFAULT 0,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    return conn
+
+
+def _paused_since_checkpoint(
+    snapshot: Any, now: float, last_attempt_at: float = 0.0
+) -> float:
+    """Return the time the run waited since its last progress when the attempt resumes it.
+
+    The deadline of a resumed run counts only the time spent up to its last
+    checkpoint and after the resume. Progress is the later of the last checkpoint and
+    the previous attempt, so a retry that failed without a new checkpoint is not
+    counted twice. A run that failed before `generate_query` stored its start time
+    has nothing to exclude.
+    """
+    if not snapshot.next or snapshot.values.get("research_started_at") is None:
+        return 0.0
+    if not snapshot.created_at:
+        return 0.0
+    checkpointed_at = datetime.fromisoformat(snapshot.created_at).timestamp()
+    return max(0.0, now - max(checkpointed_at, last_attempt_at))
+
+
+def _begin_attempt(run_id: str, snapshot: Any) -> float:
+    """Record an attempt of a run and return the total time it has been paused."""
+    now = time.time()
+    conn = _connect_runs()
+    try:
+        row = conn.execute(
+            "SELECT paused_seconds, updated_at FROM research_runs WHERE run_id = ?",
+            (run_id,),
+        ).fetchone()
+        # A thread without pending nodes starts over, so earlier pauses no longer apply.
+        paused_seconds, last_attempt_at = row if row and snapshot.next else (0.0, 0.0)
+        paused_seconds += _paused_since_checkpoint(snapshot, now, last_attempt_at)
+        conn.execute(
+            "INSERT OR REPLACE INTO research_runs (run_id, paused_seconds, updated_at) VALUES (?, ?, ?)",
+            (run_id, paused_seconds, now),
+        )
+        return paused_seconds
+    finally:
+        conn.close()
+
+
+def _finish_run(run_id: str) -> None:
+    conn = _connect_runs()
+    try:
+        conn.execute("DELETE FROM research_runs WHERE run_id = ?", (run_id,))
+    finally:
+        conn.close()
+
+
+def sweep_expired_runs(now: float | None = None) -> int:
+    """Delete the checkpoints of runs that were not resumed within the TTL.
+
+    Returns:
+        The number of runs deleted.
+    """
+    now = now or time.time()
+    saver = _get_saver()
+    conn = _connect_runs()
+    try:
+        expired = [
+            run_id
+            for (run_id,) in conn.execute(
+                "SELECT run_id FROM research_runs WHERE updated_at < ?",
+                (now - get_checkpoint_ttl_seconds(),),
+            ).fetchall()
+        ]
+        for run_id in expired:
+            saver.delete_thread(run_id)
+            conn.execute("DELETE FROM research_runs WHERE run_id = ?", (run_id,))
+    finally:
+        conn.close()
+    if expired:
+        logger.info("Deleted checkpoints of %d expired research runs", len(expired))
+    return len(expired)
+
+
+def _maybe_sweep() -> None:
+    """Run `sweep_expired_runs` at most once per `SWEEP_INTERVAL_SECONDS` per process."""
+    global _last_sweep_at
+    now = time.time()
+    with _lock:
+        if now - _last_sweep_at < SWEEP_INTERVAL_SECONDS:
+            return
+        _last_sweep_at = now
+    try:
+        sweep_expired_runs(now)
+    except sqlite3.Error as error:
+        # A failed sweep is retried on the next interval and must not fail the run.
+        logger.warning("Failed to delete expired research checkpoints: %s", error)
+
+
+def get_checkpointed_graph() -> CompiledStateGraph[Any, Any, Any, Any]:
+    """Return the sync research graph compiled with the shared SQLite checkpointer.
+
+    The connection is shared by all threads of the process; `SqliteSaver` serializes
+    access with its own lock, and WAL mode lets several worker processes use the file.
+    """
+    global _saver, _graph
+    with _lock:
+        if _graph is None:
+            conn = sqlite3.connect(get_checkpoint_db_path(), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            _saver = SqliteSaver(conn)
+            _graph = builder.compile(checkpointer=_saver, name="pro-search-agent")
+        return _graph
+
+
+def _get_saver() -> SqliteSaver:
+    get_checkpointed_graph()
+    # Set together with _graph, so it is no longer None here.
+    return cast(SqliteSaver, _saver)
+
+
+def _next_input(snapshot: Any, graph_input: dict[str, Any]) -> dict[str, Any] | None:
+    """Pick the input for the next attempt on a thread.
+
+    A thread with pending nodes is resumed with `None`, so LangGraph continues after
+    the last completed super-step and reuses the writes of tasks that finished in the
+    failed one, such as parallel `web_research` branches.
+    """
+    return None if snapshot.next else graph_input
+
+
+def invoke_resumable(
+    graph_input: dict[str, Any],
+    run_id: str | None = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> dict[str, Any]:
+    """Run the research graph, resuming from its checkpoint when an attempt fails.
+
+    Calling this again with the run ID of a failed run also resumes it, so grounded
+    searches that were already paid for are not repeated. The time a run waited to be
+    resumed is not counted against its deadline. Checkpoints of a finished run are
+    deleted, and those of runs not resumed within the TTL are swept.
+
+    Args:
+        graph_input: The initial graph state, used only when the thread has no
+            pending nodes.
+        run_id: Thread ID of the run. A new one is created when omitted.
+        max_attempts: Attempts made by this call before the last error is raised.
+
+    Returns:
+        The final graph state.
+    """
+    graph = get_checkpointed_graph()
+    _maybe_sweep()
+    run_id = run_id or new_run_id()
+
+    attempt = 1
+    while True:
+        snapshot = graph.get_state(_thread_config(run_id))
+        config = _thread_config(run_id, _begin_attempt(run_id, snapshot))
+        try:
+            result: dict[str, Any] = graph.invoke(
+                _next_input(snapshot, graph_input), config
+            )
+        except Exception as error:
+            if attempt >= max_attempts:
+                raise
+            logger.warning(
+                "Research run %s failed (attempt %d/%d), resuming: %s",
+                run_id,
+                attempt,
+                max_attempts,
+                error,
+            )
+            time.sleep(RETRY_DELAY_SECONDS * attempt)
+            attempt += 1
+            continue
+        _get_saver().delete_thread(run_id)
+        _finish_run(run_id)
+        return result
+
+
+async def ainvoke_resumable(
+    graph_input: dict[str, Any],
+    run_id: str | None = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+) -> dict[str, Any]:
+    """Async version of `invoke_resumable` using the async research graph.
+
+    aiosqlite connections belong to the event loop that opened them, so each call
+    opens its own connection to the shared checkpoint file.
+    """
+    await asyncio.to_thread(_maybe_sweep)
+    run_id = run_id or new_run_id()
+
+    async with AsyncSqliteSaver.from_conn_string(get_checkpoint_db_path()) as saver:
+        graph = async_builder.compile(checkpointer=saver, name="pro-search-agent-async")
+        attempt = 1
+        while True:
+            snapshot = await graph.aget_state(_thread_config(run_id))
+            paused_seconds = await asyncio.to_thread(_begin_attempt, run_id, snapshot)
+            config = _thread_config(run_id, paused_seconds)
+            try:
+                result = await graph.ainvoke(_next_input(snapshot, graph_input), config)
+            except Exception as error:
+                if attempt >= max_attempts:
+                    raise
+                logger.warning(
+                    "Research run %s failed (attempt %d/%d), resuming: %s",
+                    run_id,
+                    attempt,
+                    max_attempts,
+                    error,
+                )
+                await asyncio.sleep(RETRY_DELAY_SECONDS * attempt)
+                attempt += 1
+                continue
+            await saver.adelete_thread(run_id)
+            await asyncio.to_thread(_finish_run, run_id)
+            return result
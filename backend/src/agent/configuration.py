@@ -39,6 +39,32 @@ class Configuration(BaseModel):
         metadata={"description": "The maximum number of research loops to perform."},
     )
 
+    research_deadline_seconds: float = Field(
+        default=180.0,
+        metadata={
+            "description": "The wall-clock budget in seconds for one research run, including the final answer."
+        },
+    )
+
+    max_research_tokens: int = Field(
+        default=200_000,
+        metadata={"description": "The total token budget for one research run."},
+    )
+
+    max_search_queries: int = Field(
+        default=12,
+        metadata={
+            "description": "The maximum number of grounded web searches per research run."
+        },
+    )
+
+    research_paused_seconds: float = Field(
+        default=0.0,
+        metadata={
+            "description": "Wall-clock seconds a resumed run spent waiting between its failed attempts and the resume. Set by invoke_resumable and not counted against the deadline."
+        },
+    )
+
     @classmethod
     def from_runnable_config(
         cls, config: Optional[RunnableConfig] = None
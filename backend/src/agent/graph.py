@@ -1,4 +1,7 @@
+import functools
+import inspect
 import os
+import time
 
 from agent.tools_and_schemas import SearchQueryList, Reflection
 from dotenv import load_dotenv
@@ -13,8 +16,15 @@ from agent.state import (
     OverallState,
     QueryGenerationState,
     ReflectionState,
+    ResearchEvaluationState,
     WebSearchState,
 )
+from agent.budget import (
+    ResearchBudget,
+    find_exhausted_budget,
+    remaining_searches,
+    summarize_usage,
+)
 from agent.configuration import Configuration
 from agent.prompts import (
     get_current_date,
@@ -25,11 +35,21 @@ from agent.prompts import (
 )
 from langchain_google_genai import ChatGoogleGenerativeAI
 from agent.utils import (
+    dedupe_sources_by_url,
+    expand_short_urls,
     get_citations,
     get_research_topic,
     insert_citation_markers,
     resolve_urls,
 )
+from core.metrics import span
+from core.rate_limiter import (
+    acall_with_rate_limit,
+    call_with_rate_limit,
+    read_gemini_token_usage,
+    read_langchain_token_usage,
+)
+from core.token_budget import estimate_tokens
 
 load_dotenv()
 
@@ -40,34 +60,42 @@ if os.getenv("GEMINI_API_KEY") is None:
 genai_client = Client(api_key=os.getenv("GEMINI_API_KEY"))
 
 
-# Nodes
-def generate_query(state: OverallState, config: RunnableConfig) -> QueryGenerationState:
-    """LangGraph node that generates a search queries based on the User's question.
+# Node helpers shared by the sync and async node implementations
+def _parse_structured_output(result: dict):
+    """Return the parsed object from an `include_raw` structured output call."""
+    if result.get("parsing_error") is not None:
+        raise result["parsing_error"]
+    return result["parsed"]
 
-    Uses Gemini 2.0 Flash to create an optimized search query for web research based on
-    the User's question.
 
-    Args:
-        state: Current graph state containing the User's question
-        config: Configuration for the runnable, including LLM provider settings
+def _read_structured_token_usage(result: dict):
+    """Read the token usage of an `include_raw` structured output call."""
+    return read_langchain_token_usage(result["raw"])
 
-    Returns:
-        Dictionary with state update, including search_query key containing the generated query
-    """
+
+def _prepare_query_generation(state: OverallState, config: RunnableConfig):
+    """Build the structured query writer and its prompt for `generate_query`."""
     configurable = Configuration.from_runnable_config(config)
 
+    # the research budget deadline counts from the first node of the run
+    if state.get("research_started_at") is None:
+        state["research_started_at"] = time.time()
+
     # check for custom initial search query count
     if state.get("initial_search_query_count") is None:
         state["initial_search_query_count"] = configurable.number_of_initial_queries
 
     # init Gemini 2.0 Flash
+    # Retries are left to call_with_rate_limit, which backs off through the shared limiter;
+    # LangChain's own retries would resend 429s without telling the limiter.
     llm = ChatGoogleGenerativeAI(
         model=configurable.query_generator_model,
         temperature=1.0,
-        max_retries=2,
+        max_retries=0,
         api_key=os.getenv("GEMINI_API_KEY"),
     )
-    structured_llm = llm.with_structured_output(SearchQueryList)
+    # include_raw keeps the AIMessage so token usage can be counted against the budget
+    structured_llm = llm.with_structured_output(SearchQueryList, include_raw=True)
 
     # Format the prompt
     current_date = get_current_date()
@@ -76,9 +104,184 @@ def generate_query(state: OverallState, config: RunnableConfig) -> QueryGenerati
         research_topic=get_research_topic(state["messages"]),
         number_queries=state["initial_search_query_count"],
     )
+    return configurable.query_generator_model, structured_llm, formatted_prompt
+
+
+def _finish_query_generation(state: OverallState, result: dict) -> QueryGenerationState:
+    """Turn the structured query list into the `generate_query` state update."""
+    return {
+        "query_list": _parse_structured_output(result).query,
+        "research_started_at": state["research_started_at"],
+        "tokens_used": _read_structured_token_usage(result) or 0,
+    }
+
+
+def _prepare_web_research(state: WebSearchState, config: RunnableConfig):
+    """Build the model name, prompt and request config for a grounded search."""
+    configurable = Configuration.from_runnable_config(config)
+    formatted_prompt = web_searcher_instructions.format(
+        current_date=get_current_date(),
+        research_topic=state["search_query"],
+    )
+    request_config = {
+        "tools": [{"google_search": {}}],
+        "temperature": 0,
+    }
+    return configurable.query_generator_model, formatted_prompt, request_config
+
+
+def _finish_web_research(state: WebSearchState, response) -> OverallState:
+    """Turn a grounded search response into the `web_research` state update."""
+    # resolve the urls to short urls for saving tokens and time
+    resolved_urls = resolve_urls(
+        response.candidates[0].grounding_metadata.grounding_chunks, state["id"]
+    )
+    # Gets the citations and adds them to the generated text
+    citations = get_citations(response, resolved_urls)
+    modified_text = insert_citation_markers(response.text, citations)
+    sources_gathered = dedupe_sources_by_url(
+        [item for citation in citations for item in citation["segments"]]
+    )
+
+    return {
+        "sources_gathered": sources_gathered,
+        "search_query": [state["search_query"]],
+        "web_research_result": [modified_text],
+        "tokens_used": read_gemini_token_usage(response) or 0,
+    }
+
+
+def _prepare_reflection(state: OverallState, config: RunnableConfig):
+    """Build the structured reflection model and its prompt for `reflection`."""
+    configurable = Configuration.from_runnable_config(config)
+    # Increment the research loop count and get the reasoning model
+    state["research_loop_count"] = state.get("research_loop_count", 0) + 1
+    reasoning_model = state.get("reasoning_model") or configurable.reflection_model
+
+    # Format the prompt
+    current_date = get_current_date()
+    formatted_prompt = reflection_instructions.format(
+        current_date=current_date,
+        research_topic=get_research_topic(state["messages"]),
+        summaries="\n\n---\n\n".join(state["web_research_result"]),
+    )
+    # init Reasoning Model
+    llm = ChatGoogleGenerativeAI(
+        model=reasoning_model,
+        temperature=1.0,
+        max_retries=0,
+        api_key=os.getenv("GEMINI_API_KEY"),
+    )
+    structured_llm = llm.with_structured_output(Reflection, include_raw=True)
+    return reasoning_model, structured_llm, formatted_prompt
+
+
+def _finish_reflection(state: OverallState, result: dict) -> ReflectionState:
+    """Turn a structured reflection into the `reflection` state update."""
+    reflection_result = _parse_structured_output(result)
+    return {
+        "is_sufficient": reflection_result.is_sufficient,
+        "knowledge_gap": reflection_result.knowledge_gap,
+        "follow_up_queries": reflection_result.follow_up_queries,
+        "research_loop_count": state["research_loop_count"],
+        "number_of_ran_queries": len(state["search_query"]),
+        "tokens_used": _read_structured_token_usage(result) or 0,
+    }
+
+
+def _prepare_final_answer(state: OverallState, config: RunnableConfig):
+    """Build the answer model and its prompt for `finalize_answer`."""
+    configurable = Configuration.from_runnable_config(config)
+    reasoning_model = state.get("reasoning_model") or configurable.reflection_model
+
+    # Format the prompt
+    current_date = get_current_date()
+    formatted_prompt = answer_instructions.format(
+        current_date=current_date,
+        research_topic=get_research_topic(state["messages"]),
+        summaries="\n---\n\n".join(state["web_research_result"]),
+    )
+
+    # init Reasoning Model, default to Gemini 2.5 Flash
+    llm = ChatGoogleGenerativeAI(
+        model=reasoning_model,
+        temperature=0,
+        max_retries=0,
+        api_key=os.getenv("GEMINI_API_KEY"),
+    )
+    return reasoning_model, llm, formatted_prompt
+
+
+def _finish_final_answer(
+    state: ResearchEvaluationState, config: RunnableConfig, result
+):
+    """Expand the short urls in the answer and build the `finalize_answer` state update."""
+    # Replace the short urls with the original urls and add all used urls to the sources_gathered
+    result.content, unique_sources = expand_short_urls(
+        result.content, state["sources_gathered"]
+    )
+
+    # report the usage including this node's own tokens
+    answer_tokens = read_langchain_token_usage(result) or 0
+    usage_state = {
+        **state,
+        "tokens_used": (state.get("tokens_used") or 0) + answer_tokens,
+    }
+    budget = ResearchBudget.from_state(
+        state, Configuration.from_runnable_config(config)
+    )
+
+    return {
+        "messages": [AIMessage(content=result.content)],
+        "sources_gathered": unique_sources,
+        "tokens_used": answer_tokens,
+        "research_usage": summarize_usage(
+            usage_state, budget, _find_stop_reason(state, config)
+        ),
+    }
+
+
+# Nodes
+def generate_query(state: OverallState, config: RunnableConfig) -> QueryGenerationState:
+    """LangGraph node that generates a search queries based on the User's question.
+
+    Uses Gemini 2.0 Flash to create an optimized search query for web research based on
+    the User's question.
+
+    Args:
+        state: Current graph state containing the User's question
+        config: Configuration for the runnable, including LLM provider settings
+
+    Returns:
+        Dictionary with state update, including search_query key containing the generated query
+    """
+    model, structured_llm, formatted_prompt = _prepare_query_generation(state, config)
     # Generate the search queries
-    result = structured_llm.invoke(formatted_prompt)
-    return {"query_list": result.query}
+    result = call_with_rate_limit(
+        "gemini",
+        model,
+        lambda: structured_llm.invoke(formatted_prompt),
+        estimated_tokens=estimate_tokens(formatted_prompt),
+        read_token_usage=_read_structured_token_usage,
+        cassette_request={"prompt": formatted_prompt},
+    )
+    return _finish_query_generation(state, result)
+
+
+async def agenerate_query(
+    state: OverallState, config: RunnableConfig
+) -> QueryGenerationState:
+    """Async variant of `generate_query`."""
+    model, structured_llm, formatted_prompt = _prepare_query_generation(state, config)
+    result = await acall_with_rate_limit(
+        "gemini",
+        model,
+        lambda: structured_llm.ainvoke(formatted_prompt),
+        estimated_tokens=estimate_tokens(formatted_prompt),
+        read_token_usage=_read_structured_token_usage,
+        cassette_request={"prompt": formatted_prompt},
+    )
+    return _finish_query_generation(state, result)
 
 
 def continue_to_web_research(state: QueryGenerationState):
@@ -104,36 +307,40 @@ def web_research(state: WebSearchState, config: RunnableConfig) -> OverallState:
     Returns:
         Dictionary with state update, including sources_gathered, research_loop_count, and web_research_results
     """
-    # Configure
-    configurable = Configuration.from_runnable_config(config)
-    formatted_prompt = web_searcher_instructions.format(
-        current_date=get_current_date(),
-        research_topic=state["search_query"],
-    )
+    model, formatted_prompt, request_config = _prepare_web_research(state, config)
 
     # Uses the google genai client as the langchain client doesn't return grounding metadata
-    response = genai_client.models.generate_content(
-        model=configurable.query_generator_model,
-        contents=formatted_prompt,
-        config={
-            "tools": [{"google_search": {}}],
-            "temperature": 0,
-        },
+    response = call_with_rate_limit(
+        "gemini",
+        model,
+        lambda: genai_client.models.generate_content(
+            model=model,
+            contents=formatted_prompt,
+            config=request_config,
+        ),
+        estimated_tokens=estimate_tokens(formatted_prompt),
+        read_token_usage=read_gemini_token_usage,
+        cassette_request={"contents": formatted_prompt, "config": request_config},
     )
-    # resolve the urls to short urls for saving tokens and time
-    resolved_urls = resolve_urls(
-        response.candidates[0].grounding_metadata.grounding_chunks, state["id"]
+    return _finish_web_research(state, response)
+
+
+async def aweb_research(state: WebSearchState, config: RunnableConfig) -> OverallState:
+    """Async variant of `web_research` using the async genai client."""
+    model, formatted_prompt, request_config = _prepare_web_research(state, config)
+    response = await acall_with_rate_limit(
+        "gemini",
+        model,
+        lambda: genai_client.aio.models.generate_content(
+            model=model,
+            contents=formatted_prompt,
+            config=request_config,
+        ),
+        estimated_tokens=estimate_tokens(formatted_prompt),
+        read_token_usage=read_gemini_token_usage,
+        cassette_request={"contents": formatted_prompt, "config": request_config},
     )
-    # Gets the citations and adds them to the generated text
-    citations = get_citations(response, resolved_urls)
-    modified_text = insert_citation_markers(response.text, citations)
-    sources_gathered = [item for citation in citations for item in citation["segments"]]
-
-    return {
-        "sources_gathered": sources_gathered,
-        "search_query": [state["search_query"]],
-        "web_research_result": [modified_text],
-    }
+    return _finish_web_research(state, response)
 
 
 def reflection(state: OverallState, config: RunnableConfig) -> ReflectionState:
@@ -150,44 +357,61 @@ def reflection(state: OverallState, config: RunnableConfig) -> ReflectionState:
     Returns:
         Dictionary with state update, including search_query key containing the generated follow-up query
     """
-    configurable = Configuration.from_runnable_config(config)
-    # Increment the research loop count and get the reasoning model
-    state["research_loop_count"] = state.get("research_loop_count", 0) + 1
-    reasoning_model = state.get("reasoning_model") or configurable.reflection_model
+    reasoning_model, structured_llm, formatted_prompt = _prepare_reflection(
+        state, config
+    )
+    result = call_with_rate_limit(
+        "gemini",
+        reasoning_model,
+        lambda: structured_llm.invoke(formatted_prompt),
+        estimated_tokens=estimate_tokens(formatted_prompt),
+        read_token_usage=_read_structured_token_usage,
+        cassette_request={"prompt": formatted_prompt},
+    )
+    return _finish_reflection(state, result)
 
-    # Format the prompt
-    current_date = get_current_date()
-    formatted_prompt = reflection_instructions.format(
-        current_date=current_date,
-        research_topic=get_research_topic(state["messages"]),
-        summaries="\n\n---\n\n".join(state["web_research_result"]),
+
+async def areflection(state: OverallState, config: RunnableConfig) -> ReflectionState:
+    """Async variant of `reflection`."""
+    reasoning_model, structured_llm, formatted_prompt = _prepare_reflection(
+        state, config
     )
-    # init Reasoning Model
-    llm = ChatGoogleGenerativeAI(
-        model=reasoning_model,
-        temperature=1.0,
-        max_retries=2,
-        api_key=os.getenv("GEMINI_API_KEY"),
+    result = await acall_with_rate_limit(
+        "gemini",
+        reasoning_model,
+        lambda: structured_llm.ainvoke(formatted_prompt),
+        estimated_tokens=estimate_tokens(formatted_prompt),
+        read_token_usage=_read_structured_token_usage,
+        cassette_request={"prompt": formatted_prompt},
     )
-    result = llm.with_structured_output(Reflection).invoke(formatted_prompt)
+    return _finish_reflection(state, result)
 
-    return {
-        "is_sufficient": result.is_sufficient,
-        "knowledge_gap": result.knowledge_gap,
-        "follow_up_queries": result.follow_up_queries,
-        "research_loop_count": state["research_loop_count"],
-        "number_of_ran_queries": len(state["search_query"]),
-    }
+
+def _find_stop_reason(state: ResearchEvaluationState, config: RunnableConfig):
+    """Return why the research loop should stop now, or None to keep researching."""
+    configurable = Configuration.from_runnable_config(config)
+    max_research_loops = (
+        state.get("max_research_loops")
+        if state.get("max_research_loops") is not None
+        else configurable.max_research_loops
+    )
+    if state.get("is_sufficient"):
+        return "sufficient"
+    if state.get("research_loop_count", 0) >= max_research_loops:
+        return "max_research_loops"
+    return find_exhausted_budget(state, ResearchBudget.from_state(state, configurable))
 
 
 def evaluate_research(
-    state: ReflectionState,
+    state: ResearchEvaluationState,
     config: RunnableConfig,
 ) -> OverallState:
     """LangGraph routing function that determines the next step in the research flow.
 
     Controls the research loop by deciding whether to continue gathering information
-    or to finalize the summary based on the configured maximum number of research loops.
+    or to finalize the summary based on the configured maximum number of research loops
+    and the per-run budget for wall-clock time, tokens and searches. When another loop
+    would not fit in the budget, the answer is finalized with the research gathered so far.
 
     Args:
         state: Current graph state containing the research loop count
@@ -196,28 +420,27 @@ def evaluate_research(
     Returns:
         String literal indicating the next node to visit ("web_research" or "finalize_summary")
     """
-    configurable = Configuration.from_runnable_config(config)
-    max_research_loops = (
-        state.get("max_research_loops")
-        if state.get("max_research_loops") is not None
-        else configurable.max_research_loops
-    )
-    if state["is_sufficient"] or state["research_loop_count"] >= max_research_loops:
+    if _find_stop_reason(state, config) is not None:
         return "finalize_answer"
-    else:
-        return [
-            Send(
-                "web_research",
-                {
-                    "search_query": follow_up_query,
-                    "id": state["number_of_ran_queries"] + int(idx),
-                },
-            )
-            for idx, follow_up_query in enumerate(state["follow_up_queries"])
-        ]
-
-
-def finalize_answer(state: OverallState, config: RunnableConfig):
+
+    # only send as many follow-up queries as the search budget still allows
+    budget = ResearchBudget.from_state(
+        state, Configuration.from_runnable_config(config)
+    )
+    follow_up_queries = state["follow_up_queries"][: remaining_searches(state, budget)]
+    return [
+        Send(
+            "web_research",
+            {
+                "search_query": follow_up_query,
+                "id": state["number_of_ran_queries"] + int(idx),
+            },
+        )
+        for idx, follow_up_query in enumerate(follow_up_queries)
+    ]
+
+
+def finalize_answer(state: ResearchEvaluationState, config: RunnableConfig):
     """LangGraph node that finalizes the research summary.
 
     Prepares the final output by deduplicating and formatting sources, then
@@ -230,64 +453,107 @@ def finalize_answer(state: OverallState, config: RunnableConfig):
     Returns:
         Dictionary with state update, including running_summary key containing the formatted final summary with sources
     """
-    configurable = Configuration.from_runnable_config(config)
-    reasoning_model = state.get("reasoning_model") or configurable.reflection_model
-
-    # Format the prompt
-    current_date = get_current_date()
-    formatted_prompt = answer_instructions.format(
-        current_date=current_date,
-        research_topic=get_research_topic(state["messages"]),
-        summaries="\n---\n\n".join(state["web_research_result"]),
+    reasoning_model, llm, formatted_prompt = _prepare_final_answer(state, config)
+    result = call_with_rate_limit(
+        "gemini",
+        reasoning_model,
+        lambda: llm.invoke(formatted_prompt),
+        estimated_tokens=estimate_tokens(formatted_prompt),
+        read_token_usage=read_langchain_token_usage,
+        cassette_request={"prompt": formatted_prompt},
     )
-
-    # init Reasoning Model, default to Gemini 2.5 Flash
-    llm = ChatGoogleGenerativeAI(
-        model=reasoning_model,
-        temperature=0,
-        max_retries=2,
-        api_key=os.getenv("GEMINI_API_KEY"),
+    return _finish_final_answer(state, config, result)
+
+
+async def afinalize_answer(state: ResearchEvaluationState, config: RunnableConfig):
+    """Async variant of `finalize_answer`."""
+    reasoning_model, llm, formatted_prompt = _prepare_final_answer(state, config)
+    result = await acall_with_rate_limit(
+        "gemini",
+        reasoning_model,
+        lambda: llm.ainvoke(formatted_prompt),
+        estimated_tokens=estimate_tokens(formatted_prompt),
+        read_token_usage=read_langchain_token_usage,
+        cassette_request={"prompt": formatted_prompt},
     )
-    result = llm.invoke(formatted_prompt)
+    return _finish_final_answer(state, config, result)
 
-    # Replace the short urls with the original urls and add all used urls to the sources_gathered
-    unique_sources = []
-    for source in state["sources_gathered"]:
-        if source["short_url"] in result.content:
-            result.content = result.content.replace(
-                source["short_url"], source["value"]
-            )
-            unique_sources.append(source)
 
-    return {
-        "messages": [AIMessage(content=result.content)],
-        "sources_gathered": unique_sources,
-    }
+def _traced_node(name: str, node):
+    """Wrap a node so each run is recorded as an `agent.<name>` timing span.
 
+    `functools.wraps` keeps the annotations LangGraph reads to infer the node's
+    input schema, and async nodes stay coroutine functions.
+    """
+    stage = f"agent.{name}"
+    if inspect.iscoroutinefunction(node):
 
-# Create our Agent Graph
-builder = StateGraph(OverallState, config_schema=Configuration)
-
-# Define the nodes we will cycle between
-builder.add_node("generate_query", generate_query)
-builder.add_node("web_research", web_research)
-builder.add_node("reflection", reflection)
-builder.add_node("finalize_answer", finalize_answer)
-
-# Set the entrypoint as `generate_query`
-# This means that this node is the first one called
-builder.add_edge(START, "generate_query")
-# Add conditional edge to continue with search queries in a parallel branch
-builder.add_conditional_edges(
-    "generate_query", continue_to_web_research, ["web_research"]
-)
-# Reflect on the web research
-builder.add_edge("web_research", "reflection")
-# Evaluate the research
-builder.add_conditional_edges(
-    "reflection", evaluate_research, ["web_research", "finalize_answer"]
-)
-# Finalize the answer
-builder.add_edge("finalize_answer", END)
+        @functools.wraps(node)
+        async def traced_async_node(state, config: RunnableConfig):
+            with span(stage):
+                return await node(state, config)
+
+        return traced_async_node
+
+    @functools.wraps(node)
+    def traced_node(state, config: RunnableConfig):
+        with span(stage):
+            return node(state, config)
+
+    return traced_node
+
+
+def build_graph(
+    generate_query_node=generate_query,
+    web_research_node=web_research,
+    reflection_node=reflection,
+    finalize_answer_node=finalize_answer,
+) -> StateGraph:
+    """Create the research agent graph from the given node implementations.
+
+    The sync and async graphs share the same topology and only differ in the node
+    functions, so both are built here.
 
+    Returns:
+        The uncompiled StateGraph builder.
+    """
+    builder = StateGraph(OverallState, config_schema=Configuration)
+
+    # Define the nodes we will cycle between
+    builder.add_node(
+        "generate_query", _traced_node("generate_query", generate_query_node)
+    )
+    builder.add_node("web_research", _traced_node("web_research", web_research_node))
+    builder.add_node("reflection", _traced_node("reflection", reflection_node))
+    builder.add_node(
+        "finalize_answer", _traced_node("finalize_answer", finalize_answer_node)
+    )
+
+    # Set the entrypoint as `generate_query`
+    # This means that this node is the first one called
+    builder.add_edge(START, "generate_query")
+    # Add conditional edge to continue with search queries in a parallel branch
+    builder.add_conditional_edges(
+        "generate_query", continue_to_web_research, ["web_research"]
+    )
+    # Reflect on the web research
+    builder.add_edge("web_research", "reflection")
+    # Evaluate the research
+    builder.add_conditional_edges(
+        "reflection", evaluate_research, ["web_research", "finalize_answer"]
+    )
+    # Finalize the answer
+    builder.add_edge("finalize_answer", END)
+    return builder
+
+
+# Create our Agent Graph
+builder = build_graph()
 graph = builder.compile(name="pro-search-agent")
+
+# Async nodes await the async genai/LangChain clients, so many runs and their parallel
+# web_research branches can share one event loop instead of each occupying a thread.
+async_builder = build_graph(
+    agenerate_query, aweb_research, areflection, afinalize_answer
+)
+async_graph = async_builder.compile(name="pro-search-agent-async")
@@ -1,9 +1,11 @@
+import os
 from datetime import datetime
 
 
-# Get current date in a readable format
+# Get current date in a readable format. AGENT_CURRENT_DATE pins it (e.g. "June 01, 2025")
+# so prompts stay identical between recording and replaying cassettes.
 def get_current_date():
-    return datetime.now().strftime("%B %d, %Y")
+    return os.getenv("AGENT_CURRENT_DATE") or datetime.now().strftime("%B %d, %Y")
 
 
 query_writer_instructions = """Your goal is to generate sophisticated and diverse web search queries. These queries are intended for an advanced automated web research tool capable of analyzing complex results, following links, and synthesizing information.
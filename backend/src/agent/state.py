@@ -21,6 +21,12 @@ class OverallState(TypedDict):
     max_research_loops: int
     research_loop_count: int
     reasoning_model: str
+    research_started_at: float
+    research_deadline_seconds: float
+    max_research_tokens: int
+    max_search_queries: int
+    tokens_used: Annotated[int, operator.add]
+    research_usage: dict
 
 
 class ReflectionState(TypedDict):
@@ -31,6 +37,10 @@ class ReflectionState(TypedDict):
     number_of_ran_queries: int
 
 
+class ResearchEvaluationState(OverallState, ReflectionState):
+    """The reflection result together with the run settings and usage needed to decide whether to stop."""
+
+
 class Query(TypedDict):
     query: str
     rationale: str
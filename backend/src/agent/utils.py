@@ -1,6 +1,12 @@
-from typing import Any, Dict, List
+import re
+from typing import Any, Dict, List, Tuple
 from langchain_core.messages import AnyMessage, AIMessage, HumanMessage
 
+SHORT_URL_PREFIX = "https://vertexaisearch.cloud.google.com/id/"
+# Matches every short url produced by `resolve_urls`. The greedy digits make sure
+# ".../id/1-1" never matches inside ".../id/1-10".
+SHORT_URL_PATTERN = re.compile(re.escape(SHORT_URL_PREFIX) + r"\d+-\d+")
+
 
 def get_research_topic(messages: List[AnyMessage]) -> str:
     """
@@ -24,7 +30,7 @@ def resolve_urls(urls_to_resolve: List[Any], id: int) -> Dict[str, str]:
     Create a map of the vertex ai search urls (very long) to a short url with a unique id for each url.
     Ensures each original URL gets a consistent shortened form while maintaining uniqueness.
     """
-    prefix = f"https://vertexaisearch.cloud.google.com/id/"
+    prefix = SHORT_URL_PREFIX
     urls = [site.web.uri for site in urls_to_resolve]
 
     # Create a dictionary that maps each unique URL to its first occurrence index
@@ -40,6 +46,9 @@ def insert_citation_markers(text, citations_list):
     """
     Inserts citation markers into a text string based on start and end indices.
 
+    All markers are placed in a single left-to-right pass that joins the text
+    pieces once, instead of rebuilding the whole string for every citation.
+
     Args:
         text (str): The original text string.
         citations_list (list): A list of dictionaries, where each dictionary
@@ -50,29 +59,59 @@ def insert_citation_markers(text, citations_list):
     Returns:
         str: The text with citation markers inserted.
     """
-    # Sort citations by end_index in descending order.
-    # If end_index is the same, secondary sort by start_index descending.
-    # This ensures that insertions at the end of the string don't affect
-    # the indices of earlier parts of the string that still need to be processed.
+    # Citations sharing an end_index keep the order of the previous implementation,
+    # which placed the one with the smaller start_index first and, for identical
+    # indices, the one listed last.
     sorted_citations = sorted(
-        citations_list, key=lambda c: (c["end_index"], c["start_index"]), reverse=True
+        reversed(citations_list), key=lambda c: (c["end_index"], c["start_index"])
     )
 
-    modified_text = text
+    pieces = []
+    cursor = 0
     for citation_info in sorted_citations:
-        # These indices refer to positions in the *original* text,
-        # but since we iterate from the end, they remain valid for insertion
-        # relative to the parts of the string already processed.
-        end_idx = citation_info["end_index"]
-        marker_to_insert = ""
+        end_idx = min(citation_info["end_index"], len(text))
+        if end_idx > cursor:
+            pieces.append(text[cursor:end_idx])
+            cursor = end_idx
         for segment in citation_info["segments"]:
-            marker_to_insert += f" [{segment['label']}]({segment['short_url']})"
-        # Insert the citation marker at the original end_idx position
-        modified_text = (
-            modified_text[:end_idx] + marker_to_insert + modified_text[end_idx:]
-        )
+            pieces.append(f" [{segment['label']}]({segment['short_url']})")
+    pieces.append(text[cursor:])
+
+    return "".join(pieces)
+
+
+def dedupe_sources_by_url(sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keep the first source for every original url, preserving order."""
+    unique_sources = {}
+    for source in sources:
+        unique_sources.setdefault(source["value"], source)
+    return list(unique_sources.values())
 
-    return modified_text
+
+def expand_short_urls(
+    text: str, sources: List[Dict[str, Any]]
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """Replace every short url in the text with its original url in one pass.
+
+    Args:
+        text (str): Text containing short urls created by `resolve_urls`.
+        sources (list): Sources gathered during research, each with 'short_url' and 'value'.
+
+    Returns:
+        tuple: The expanded text and the sources it cites, deduplicated by original url.
+    """
+    sources_by_short_url = {source["short_url"]: source for source in sources}
+    used_sources = {}
+
+    def replace(match):
+        source = sources_by_short_url.get(match.group(0))
+        if source is None:
+            return match.group(0)
+        used_sources.setdefault(source["value"], source)
+        return source["value"]
+
+    expanded_text = SHORT_URL_PATTERN.sub(replace, text)
+    return expanded_text, list(used_sources.values())
 
 
 def get_citations(response, resolved_urls_map):
@@ -0,0 +1 @@
+"""コンプライアンス分析を補助するドメインロジック."""
@@ -0,0 +1,212 @@
+"""分析結果をアラート（重・中・予）にし、投稿全体のアラートに統合する."""
+
+from typing import Any
+
+# アラートレベルの優先度（重 > 中 > 予）
+ALERT_LEVEL_PRIORITY = {"予": 1, "中": 2, "重": 3}
+ALERT_LEVELS = ("予", "中", "重")
+# 分析結果の重要度・リスクレベルとアラートレベルの対応
+SEVERITY_TO_ALERT_LEVEL = {"低": "予", "中": "中", "高": "重"}
+NO_CONCERN_REASON = "特段の懸念事項は見られませんでした。"
+
+
+def get_alert_level_priority(level: str) -> int:
+    """アラートレベルの優先度を返す（不明なレベルは 0）."""
+    return ALERT_LEVEL_PRIORITY.get(level, 0)
+
+
+def _shift_level(level: str, steps: int) -> str:
+    index = min(max(ALERT_LEVELS.index(level) + steps, 0), len(ALERT_LEVELS) - 1)
+    return ALERT_LEVELS[index]
+
+
+def _format_timestamp(start_time: Any, end_time: Any) -> str:
+    try:
+        start_time, end_time = float(start_time), float(end_time)
+    except (TypeError, ValueError):
+        return "不明"
+    return f"{int(start_time // 60)}:{int(start_time % 60):02d} - {int(end_time // 60)}:{int(end_time % 60):02d}"
+
+
+def _violation_level(violation: dict[str, Any]) -> str:
+    """違反の重要度をアラートレベルにし、文脈判断（GPT）の結果で1段階上げ下げする."""
+    level = SEVERITY_TO_ALERT_LEVEL.get(str(violation.get("severity")), "予")
+    modifier = (violation.get("context_judgement") or {}).get("gpt_risk_modifier")
+    if modifier == "増幅":
+        return _shift_level(level, 1)
+    if modifier == "軽減":
+        return _shift_level(level, -1)
+    return level
+
+
+def video_alert(
+    compliance_result: dict[str, Any] | None,
+    music_detection_result: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    """動画の分析結果（文脈判断済みの違反と音楽の検出結果）からアラートを作る.
+
+    Returns:
+        dict: {'level': 重・中・予, 'reason', 'timestamp': "分:秒 - 分:秒" または "不明", 'original_text_segment'}
+    """
+    level = "予"
+    reasons = []
+    timestamp = "不明"
+    original_text_segment = "該当テキストなし"
+
+    # 著作権のある音楽は最優先で「重」とし、音楽の時刻を採用する
+    if (
+        music_detection_result
+        and music_detection_result.get("detected")
+        and music_detection_result.get("is_copyrighted")
+    ):
+        level = "重"
+        reasons.append(
+            f"**著作権違反の音楽検出**: 著作権保護された音楽 '{music_detection_result.get('title') or '不明'}' "
+            f"by '{music_detection_result.get('artist') or '不明'}' が検出されました。"
+        )
+        timestamp = _format_timestamp(
+            music_detection_result.get("start_time"),
+            music_detection_result.get("end_time"),
+        )
+        original_text_segment = "動画内の音楽部分（文字起こしなし）"
+
+    violations = (compliance_result or {}).get("violations", [])
+    if violations:
+        levels = [_violation_level(violation) for violation in violations]
+        top_index = max(
+            range(len(violations)),
+            key=lambda index: get_alert_level_priority(levels[index]),
+        )
+        top_violation = violations[top_index]
+        if get_alert_level_priority(levels[top_index]) > get_alert_level_priority(
+            level
+        ):
+            level = levels[top_index]
+        reasons.append(
+            f"**動画の違反（{len(violations)}件）**: 最も重大なものは「{top_violation.get('description', '不明')}」"
+            f"（重要度: {top_violation.get('severity', '不明')}）。"
+        )
+        intent = (top_violation.get("context_judgement") or {}).get("contextual_intent")
+        if intent:
+            reasons.append(f"**文脈評価（GPT）**: {intent}")
+        if timestamp == "不明":
+            timestamp = _format_timestamp(
+                top_violation.get("start_time"), top_violation.get("end_time")
+            )
+        if original_text_segment == "該当テキストなし" and top_violation.get(
+            "related_text"
+        ):
+            original_text_segment = top_violation["related_text"]
+
+    return {
+        "level": level,
+        "reason": " ".join(reasons) if reasons else NO_CONCERN_REASON,
+        "timestamp": timestamp,
+        "original_text_segment": original_text_segment,
+    }
+
+
+def text_alert(analysis_result: dict[str, Any] | None) -> dict[str, Any]:
+    """テキストの分析結果（analyze_image_and_text_compliance の結果）からアラートを作る.
+
+    テキストには時刻がない。
+    """
+    analysis_result = analysis_result or {}
+    level = SEVERITY_TO_ALERT_LEVEL.get(str(analysis_result.get("risk_level")), "予")
+    violations = analysis_result.get("violations", [])
+    detected_texts = [
+        violation["detected_text"]
+        for violation in violations
+        if violation.get("detected_text")
+    ]
+    reason = analysis_result.get("summary") or NO_CONCERN_REASON
+    return {
+        "level": level,
+        "reason": f"**テキストのリスク評価（{analysis_result.get('risk_level', '不明')}）**: {reason}",
+        "timestamp": "不明",
+        "original_text_segment": detected_texts[0]
+        if detected_texts
+        else "該当テキストなし",
+    }
+
+
+def unverified_alert(error: str) -> dict[str, Any]:
+    """分析に失敗した（結果がない）ソースのアラートを作る.
+
+    失敗は懸念がなかったことではないため NO_CONCERN_REASON は使わず、理由にエラーを残して未確認であることを示す。
+    未確認であることだけではレベルを上げない。
+    """
+    return {
+        "level": "予",
+        "reason": f"**未確認**: 分析に失敗したため、懸念事項の有無を確認できていません（{error}）。",
+        "timestamp": "不明",
+        "original_text_segment": "該当テキストなし",
+        "unverified": True,
+    }
+
+
+def research_alert(research_result: dict[str, Any] | None) -> dict[str, Any] | None:
+    """発言者リサーチの結果（research_speaker_for_post の結果）からアラートを作る.
+
+    要約がなければ None。
+    リサーチは投稿の内容ではなく発言者の背景のため、レベルは「予」としてそれだけではアラートを上げず、
+    理由に要約を残して動画・テキストのアラートと合わせて判断できるようにする。
+    """
+    if not research_result or not research_result.get("summary"):
+        return None
+    summary = research_result["summary"]
+    source = "事前調査" if research_result.get("source") == "precomputed" else "調査"
+    return {
+        "level": "予",
+        "reason": f"**発言者の背景（{source}）**: {summary}",
+        "timestamp": "不明",
+        "original_text_segment": "該当テキストなし",
+    }
+
+
+def integrate_multi_source_alerts(
+    video_result: dict[str, Any] | None = None,
+    text_result: dict[str, Any] | None = None,
+    research_result: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    """動画由来・テキスト由来・発言者リサーチのアラートを統合する.
+
+    レベルは最も高いものを採り、理由はすべて残す。
+    タイムスタンプと該当テキストは動画のものを優先し、なければテキストのものを使う。
+    unverified_alert のソースは unverified_sources にラベルを残す。
+    """
+    final_level = "予"
+    final_reasons = []
+    unverified_sources: list[str] = []
+    final_timestamp = "不明"
+    final_original_text_segment = "N/A"
+
+    for label, alert in (
+        ("動画分析", video_result),
+        ("テキスト分析", text_result),
+        ("発言者リサーチ", research_result),
+    ):
+        if alert is None:
+            continue
+        if get_alert_level_priority(alert["level"]) > get_alert_level_priority(
+            final_level
+        ):
+            final_level = alert["level"]
+        final_reasons.append(f"[{label}]: {alert['reason']}")
+        if alert.get("unverified"):
+            unverified_sources.append(label)
+        if final_timestamp == "不明" and alert["timestamp"] != "不明":
+            final_timestamp = alert["timestamp"]
+        if (
+            final_original_text_segment == "N/A"
+            and alert["original_text_segment"] != "該当テキストなし"
+        ):
+            final_original_text_segment = alert["original_text_segment"]
+
+    return {
+        "level": final_level,
+        "reason": " ".join(final_reasons) if final_reasons else NO_CONCERN_REASON,
+        "timestamp": final_timestamp,
+        "original_text_segment": final_original_text_segment,
+        "unverified_sources": unverified_sources,
+    }
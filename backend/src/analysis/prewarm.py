@@ -0,0 +1,308 @@
+"""ウォッチリストの発言者について Deep Research を事前実行し、ライブ分析では保存済みの結果を使う."""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from analysis.speaker_research_store import (
+    SpeakerResearchStore,
+    get_speaker_research_store,
+    is_fresh,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WATCHLIST_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "watchlist.json")
+)
+DEFAULT_INTERVAL_SECONDS = 300
+DEFAULT_REFRESH_HOURS = 24
+DEFAULT_MAX_RUNS_PER_DAY = 20
+DEFAULT_MAX_TOKENS_PER_DAY = 2_000_000
+QUOTA_WINDOW_SECONDS = 24 * 60 * 60
+# ライブ分析が続いている間、事前実行を再確認するまでの間隔
+IDLE_POLL_SECONDS = 1.0
+# プロンプトに含める事前調査結果の最大文字数
+MAX_RESEARCH_SUMMARY_CHARS = 2000
+
+_live_analysis_count = 0
+_live_analysis_condition = threading.Condition()
+# このプロセスで起動したスケジューラーと、起動したプロセスのID（フォークした子プロセスでは一致しない）
+_scheduler: "PrewarmScheduler | None" = None
+_scheduler_pid: int | None = None
+_scheduler_lock = threading.Lock()
+
+
+@contextmanager
+def live_analysis() -> Iterator[None]:
+    """ライブ分析（拡張機能からのリクエスト）の実行中であることを示す.
+
+    事前実行はこの間は新しい調査を始めず、ライブ分析にクォータを譲る。
+    """
+    global _live_analysis_count
+    with _live_analysis_condition:
+        _live_analysis_count += 1
+    try:
+        yield
+    finally:
+        with _live_analysis_condition:
+            _live_analysis_count -= 1
+            _live_analysis_condition.notify_all()
+
+
+def wait_for_idle(stop_event: threading.Event) -> bool:
+    """実行中のライブ分析がなくなるまで待つ.
+
+    Returns:
+        bool: 待機を終えて実行してよい場合は True。停止を指示された場合は False。
+    """
+    with _live_analysis_condition:
+        while _live_analysis_count > 0:
+            if stop_event.is_set():
+                return False
+            _live_analysis_condition.wait(IDLE_POLL_SECONDS)
+    return not stop_event.is_set()
+
+
+def load_watchlist(path: str) -> list[dict[str, Any]]:
+    """ウォッチリスト（JSON配列）を読み込む.
+
+    各要素は少なくとも name を持ち、account_url などの発言者情報をそのまま Deep Research に渡す。
+
+    例: [{"name": "フワちゃん", "account_url": "https://x.com/fuwa876"}]
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as watchlist_file:
+        entries = json.load(watchlist_file)
+    return [entry for entry in entries if entry.get("name")]
+
+
+class PrewarmScheduler:
+    """ウォッチリストの発言者について、定期的に Deep Research を実行して結果を保存するスケジューラー.
+
+    1本のデーモンスレッドで1件ずつ順に実行し、ライブ分析の実行中は新しい調査を始めない。
+    直近24時間の実行回数と消費トークン数が上限に達した場合は、次の周期まで実行を見送る。
+    """
+
+    def __init__(
+        self,
+        research: Callable[[dict[str, Any]], dict[str, Any]],
+        store: SpeakerResearchStore,
+        watchlist_path: str = DEFAULT_WATCHLIST_PATH,
+        interval_seconds: float = DEFAULT_INTERVAL_SECONDS,
+        refresh_seconds: float = DEFAULT_REFRESH_HOURS * 60 * 60,
+        max_runs_per_day: int = DEFAULT_MAX_RUNS_PER_DAY,
+        max_tokens_per_day: int = DEFAULT_MAX_TOKENS_PER_DAY,
+    ):
+        """引数の research には、発言者の情報を受け取ってリサーチ結果を返す関数を渡す."""
+        self.research = research
+        self.store = store
+        self.watchlist_path = watchlist_path
+        self.interval_seconds = interval_seconds
+        self.refresh_seconds = refresh_seconds
+        self.max_runs_per_day = max_runs_per_day
+        self.max_tokens_per_day = max_tokens_per_day
+        self._stop_event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        """バックグラウンドのスレッドで定期実行を開始する."""
+        self._thread = threading.Thread(
+            target=self._run_forever, name="speaker-research-prewarm", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """定期実行を止める（実行中の調査は最後まで行う）."""
+        self._stop_event.set()
+
+    def _run_forever(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error("発言者リサーチの事前実行中にエラーが発生しました: %s", e)
+            self._stop_event.wait(self.interval_seconds)
+
+    def has_quota(self, now: float) -> bool:
+        """直近24時間の実行回数と消費トークン数が上限に達していなければ True を返す."""
+        runs, tokens_used = self.store.read_usage_since(now - QUOTA_WINDOW_SECONDS)
+        return runs < self.max_runs_per_day and tokens_used < self.max_tokens_per_day
+
+    def run_once(self) -> int:
+        """結果が古いか未調査の発言者を1周分調査する.
+
+        Returns:
+            int: 実行した調査の件数。
+        """
+        self.store.delete_runs_before(time.time() - QUOTA_WINDOW_SECONDS)
+        runs = 0
+        for speaker_info in load_watchlist(self.watchlist_path):
+            if is_fresh(self.store.find(speaker_info["name"]), self.refresh_seconds):
+                continue
+            if not self.has_quota(time.time()):
+                logger.debug(
+                    "発言者リサーチの事前実行はクォータ上限に達したため、次の周期まで見送ります。"
+                )
+                break
+            if not wait_for_idle(self._stop_event):
+                break
+
+            self.research_speaker(speaker_info)
+            runs += 1
+        return runs
+
+    def research_speaker(self, speaker_info: dict[str, Any]) -> None:
+        """1人の発言者を調査し、結果を保存する."""
+        logger.debug("発言者リサーチを事前実行します: %s", speaker_info["name"])
+        run_and_store_research(self.store, self.research, speaker_info)
+
+
+def run_and_store_research(
+    store: SpeakerResearchStore,
+    research: Callable[[dict[str, Any]], dict[str, Any]],
+    speaker_info: dict[str, Any],
+) -> dict[str, Any]:
+    """調査を実行して実績を記録し、成功すれば結果を保存する.
+
+    実行した調査の結果を返す。
+    """
+    started_at = time.time()
+    result = research(speaker_info)
+
+    usage = result.get("research_usage") or {}
+    succeeded = "error" not in result
+    store.record_run(
+        speaker_info["name"], started_at, usage.get("tokens_used", 0), succeeded
+    )
+    if succeeded:
+        store.save(speaker_info, result, time.time())
+    return result
+
+
+def start_prewarm_scheduler_from_env(
+    research: Callable[[dict[str, Any]], dict[str, Any]],
+) -> PrewarmScheduler | None:
+    """環境変数 PREWARM_ENABLED=1 のとき、事前実行スケジューラーを起動する.
+
+    間隔や上限は PREWARM_* の環境変数で変更できる。
+    """
+    if os.getenv("PREWARM_ENABLED", "0") != "1":
+        return None
+
+    scheduler = PrewarmScheduler(
+        research=research,
+        store=get_speaker_research_store(),
+        watchlist_path=os.getenv("PREWARM_WATCHLIST_PATH", DEFAULT_WATCHLIST_PATH),
+        interval_seconds=float(
+            os.getenv("PREWARM_INTERVAL_SECONDS", DEFAULT_INTERVAL_SECONDS)
+        ),
+        refresh_seconds=float(os.getenv("PREWARM_REFRESH_HOURS", DEFAULT_REFRESH_HOURS))
+        * 60
+        * 60,
+        max_runs_per_day=int(
+            os.getenv("PREWARM_MAX_RUNS_PER_DAY", DEFAULT_MAX_RUNS_PER_DAY)
+        ),
+        max_tokens_per_day=int(
+            os.getenv("PREWARM_MAX_TOKENS_PER_DAY", DEFAULT_MAX_TOKENS_PER_DAY)
+        ),
+    )
+    scheduler.start()
+    logger.debug(
+        "発言者リサーチの事前実行を開始しました（ウォッチリスト: %s）",
+        scheduler.watchlist_path,
+    )
+    return scheduler
+
+
+def ensure_prewarm_scheduler(
+    research: Callable[[dict[str, Any]], dict[str, Any]],
+) -> PrewarmScheduler | None:
+    """このプロセスで未起動であれば、start_prewarm_scheduler_from_env でスケジューラーを起動する.
+
+    WSGIサーバーのワーカーのようにフォークしたプロセスには親のスレッドが引き継がれないため、プロセスごとに1回起動する。
+    """
+    global _scheduler, _scheduler_pid
+    pid = os.getpid()
+    if _scheduler_pid == pid:
+        return _scheduler
+    with _scheduler_lock:
+        if _scheduler_pid != pid:
+            _scheduler = start_prewarm_scheduler_from_env(research)
+            _scheduler_pid = pid
+        return _scheduler
+
+
+def enrich_speaker_background(
+    speaker_background: dict[str, Any] | None,
+) -> dict[str, Any] | None:
+    """事前実行済みのリサーチ結果があれば、発言者の背景情報に precomputed_research として加える.
+
+    ライブ分析はエージェントを実行せず、この結果をプロンプトに含めて文脈判断に使う。
+    """
+    if not speaker_background or not speaker_background.get("name"):
+        return speaker_background
+
+    entry = get_speaker_research_store().find(speaker_background["name"])
+    if entry is None:
+        return speaker_background
+
+    summary = entry["result"].get("user_research_summary") or ""
+    return {
+        **speaker_background,
+        "precomputed_research": {
+            "summary": summary[:MAX_RESEARCH_SUMMARY_CHARS],
+            "researched_at": entry["researched_at"],
+        },
+    }
+
+
+def research_speaker_for_post(
+    speaker_background: dict[str, Any] | None,
+    research: Callable[[dict[str, Any]], dict[str, Any]],
+    run_live: bool,
+) -> dict[str, Any] | None:
+    """投稿のマルチソース分析（動画・テキスト）と並行して、発言者リサーチの結果を用意する.
+
+    保存済みの結果があればそれを返す。なければ run_live のときだけエージェントを実行し、次回以降のために保存する。
+
+    Returns:
+        dict | None: {'source': 'precomputed' または 'live', 'summary', 'researched_at'}（失敗時は 'error' を含む）。
+                     発言者が指定されていない、または調査しない場合は None。
+    """
+    if not speaker_background or not speaker_background.get("name"):
+        return None
+
+    store = get_speaker_research_store()
+    entry = store.find(speaker_background["name"])
+    if entry is not None:
+        return {
+            "source": "precomputed",
+            "summary": (entry["result"].get("user_research_summary") or "")[
+                :MAX_RESEARCH_SUMMARY_CHARS
+            ],
+            "researched_at": entry["researched_at"],
+        }
+    if not run_live:
+        return None
+
+    logger.debug(
+        "保存済みの結果がないため、発言者リサーチを実行します: %s",
+        speaker_background["name"],
+    )
+    result = run_and_store_research(store, research, speaker_background)
+    research_result = {
+        "source": "live",
+        "summary": (result.get("user_research_summary") or "")[
+            :MAX_RESEARCH_SUMMARY_CHARS
+        ],
+        "researched_at": time.time(),
+    }
+    if "error" in result:
+        research_result["error"] = result["error"]
+    return research_result
@@ -0,0 +1,163 @@
+"""事前実行した発言者リサーチの結果と実行実績を保存するSQLiteストア."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from core.paths import resolve_cache_path
+
+
+def normalize_speaker_key(name: str) -> str:
+    """発言者名を検索用のキーに正規化する.
+
+    ウォッチリストと拡張機能で表記が揺れても一致するよう、前後の空白と先頭の @ を除き大文字小文字を無視する。
+    """
+    return name.strip().lstrip("@").casefold()
+
+
+class SpeakerResearchStore:
+    """事前に実行した発言者リサーチの結果と、事前実行の実績（クォータ計算用）を保存するSQLiteストア."""
+
+    def __init__(self, db_path: str):
+        """db_path のデータベースを開き、なければテーブルを作る."""
+        self.db_path = db_path
+        self._local = threading.local()
+        self._initialize_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3の接続はスレッド間で共有できないため、スレッドごとに保持する
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _initialize_schema(self) -> None:
+        connection = self._connect()
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS speaker_research (
+                speaker_key TEXT PRIMARY KEY,
+                speaker_info TEXT NOT NULL,
+                result TEXT NOT NULL,
+                researched_at REAL NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS prewarm_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                speaker_key TEXT NOT NULL,
+                started_at REAL NOT NULL,
+                tokens_used INTEGER NOT NULL DEFAULT 0,
+                succeeded INTEGER NOT NULL
+            )
+            """
+        )
+
+    def find(self, name: str) -> dict[str, Any] | None:
+        """発言者の保存済みリサーチ結果を返す.
+
+        Returns:
+            dict | None: {'speaker_info', 'result', 'researched_at'}。未調査の場合は None。
+        """
+        row = (
+            self._connect()
+            .execute(
+                "SELECT speaker_info, result, researched_at FROM speaker_research WHERE speaker_key = ?",
+                (normalize_speaker_key(name),),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return {
+            "speaker_info": json.loads(row[0]),
+            "result": json.loads(row[1]),
+            "researched_at": row[2],
+        }
+
+    def save(
+        self, speaker_info: dict[str, Any], result: dict[str, Any], researched_at: float
+    ) -> None:
+        """発言者のリサーチ結果を保存する（同じ発言者の結果は上書きする）."""
+        self._connect().execute(
+            """
+            INSERT INTO speaker_research (speaker_key, speaker_info, result, researched_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(speaker_key) DO UPDATE SET
+                speaker_info = excluded.speaker_info,
+                result = excluded.result,
+                researched_at = excluded.researched_at
+            """,
+            (
+                normalize_speaker_key(speaker_info["name"]),
+                json.dumps(speaker_info, ensure_ascii=False),
+                json.dumps(result, ensure_ascii=False),
+                researched_at,
+            ),
+        )
+
+    def record_run(
+        self, name: str, started_at: float, tokens_used: int, succeeded: bool
+    ) -> None:
+        """事前実行1回分の実績を記録する.
+
+        失敗した実行もクォータに数える。
+        """
+        self._connect().execute(
+            "INSERT INTO prewarm_runs (speaker_key, started_at, tokens_used, succeeded) VALUES (?, ?, ?, ?)",
+            (normalize_speaker_key(name), started_at, tokens_used, int(succeeded)),
+        )
+
+    def read_usage_since(self, since: float) -> tuple[int, int]:
+        """指定時刻以降の事前実行の回数と消費トークン数の合計を返す."""
+        runs, tokens_used = (
+            self._connect()
+            .execute(
+                "SELECT COUNT(*), COALESCE(SUM(tokens_used), 0) FROM prewarm_runs WHERE started_at >= ?",
+                (since,),
+            )
+            .fetchone()
+        )
+        return runs, tokens_used
+
+    def delete_runs_before(self, before: float) -> None:
+        """クォータの計算に使わなくなった古い実績を削除する."""
+        self._connect().execute(
+            "DELETE FROM prewarm_runs WHERE started_at < ?", (before,)
+        )
+
+
+_store: SpeakerResearchStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_speaker_research_store() -> SpeakerResearchStore:
+    """プロセス内で共有するストアを返す.
+
+    保存先は環境変数 PREWARM_DB_PATH で変更できる。
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            db_path = os.getenv("PREWARM_DB_PATH") or resolve_cache_path(
+                "speaker_research.sqlite3"
+            )
+            _store = SpeakerResearchStore(db_path)
+        return _store
+
+
+def is_fresh(
+    entry: dict[str, Any] | None, max_age_seconds: float, now: float | None = None
+) -> bool:
+    """保存済みの結果が、再調査の間隔より新しいかどうか."""
+    if entry is None:
+        return False
+    researched_at: float = entry["researched_at"]
+    return (now or time.time()) - researched_at < max_age_seconds
@@ -0,0 +1,205 @@
+"""動画分析で同じ場面について重複して報告された違反を統合する."""
+
+import re
+from typing import Any
+
+# 重要度の高さ（統合した違反には最も高い重要度を残す）
+SEVERITY_RANK = {"低": 0, "中": 1, "高": 2}
+# 同じ種類の違反がこの秒数以内で隣り合っていれば1つにまとめる
+DEFAULT_MERGE_GAP_SECONDS = 1.0
+# 同じ場面を動作と発言の両面から報告することが多いため、時間帯が重なっていれば種類が違っても統合する
+INTERCHANGEABLE_TYPES = frozenset({"動作", "発言"})
+JOINED_TEXT_SEPARATOR = " / "
+# 説明から違反の分類を判定するキーワード。分類が分かる違反同士は、分類が重なる場合だけ統合する
+VIOLATION_CATEGORY_KEYWORDS = {
+    "暴力": ("暴力", "暴行", "殴", "蹴", "叩", "突き飛ば", "凶器"),
+    "ハラスメント": (
+        "ハラスメント",
+        "セクハラ",
+        "パワハラ",
+        "威圧",
+        "侮辱",
+        "暴言",
+        "罵",
+        "恫喝",
+        "脅",
+    ),
+    "差別": ("差別", "人種", "民族", "偏見", "蔑称"),
+    "性的": ("性的", "わいせつ", "卑猥"),
+}
+# 分類が分からない違反は、説明の文字2-gramの重なり（Dice係数）がこの値以上なら同じ内容とみなす
+DESCRIPTION_SIMILARITY_THRESHOLD = 0.3
+# 説明や関連テキストを比べるときに無視する文字
+COMPARE_IGNORED_PATTERN = re.compile(r"[\s、。，,.!?！？…「」『』\"']")
+
+
+def _as_seconds(value: Any) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _severity_rank(violation: dict[str, Any]) -> int:
+    return SEVERITY_RANK.get(str(violation.get("severity")), -1)
+
+
+def _join_unique(values: list[str | None]) -> str:
+    unique_values: list[str] = []
+    for value in values:
+        if value and value not in unique_values:
+            unique_values.append(value)
+    return JOINED_TEXT_SEPARATOR.join(unique_values)
+
+
+def _compare_key(text: str | None) -> str:
+    return COMPARE_IGNORED_PATTERN.sub("", text or "")
+
+
+def _categories(violation: dict[str, Any]) -> set[str]:
+    description = violation.get("description") or ""
+    return {
+        category
+        for category, keywords in VIOLATION_CATEGORY_KEYWORDS.items()
+        if any(keyword in description for keyword in keywords)
+    }
+
+
+def _bigrams(text: str) -> set[str]:
+    return {text[index : index + 2] for index in range(len(text) - 1)} or {text}
+
+
+def _description_similarity(first: str, second: str) -> float:
+    first_bigrams, second_bigrams = _bigrams(first), _bigrams(second)
+    return (
+        2
+        * len(first_bigrams & second_bigrams)
+        / (len(first_bigrams) + len(second_bigrams))
+    )
+
+
+def _is_same_subject(first: dict[str, Any], second: dict[str, Any]) -> bool:
+    """時間帯が近い2つの違反が同じ内容についての報告かを判定する.
+
+    同じ発言を指している（関連テキストの一方が他方を含む）か、説明から分かる分類が重なれば同じとみなす。
+    分類が分からない場合は説明の文字の重なりで判定し、説明がなければ時間帯だけで判断する。
+    """
+    first_related, second_related = (
+        _compare_key(first.get("related_text")),
+        _compare_key(second.get("related_text")),
+    )
+    if (
+        first_related
+        and second_related
+        and (first_related in second_related or second_related in first_related)
+    ):
+        return True
+    first_categories, second_categories = _categories(first), _categories(second)
+    if first_categories and second_categories:
+        return bool(first_categories & second_categories)
+    first_description, second_description = (
+        _compare_key(first.get("description")),
+        _compare_key(second.get("description")),
+    )
+    if not first_description or not second_description:
+        return True
+    return (
+        _description_similarity(first_description, second_description)
+        >= DESCRIPTION_SIMILARITY_THRESHOLD
+    )
+
+
+def _can_merge(
+    group: list[dict[str, Any]],
+    group_end: float,
+    violation: dict[str, Any],
+    start_time: float,
+    max_gap_seconds: float,
+) -> bool:
+    """違反をグループに統合できるかを判定する.
+
+    グループに同じ種類の違反があれば時間帯が重なるか max_gap_seconds 以内で隣り合う場合、
+    動作と発言の組み合わせであれば時間帯が重なる場合に統合する。
+    同じ場面でも別の問題（暴言と暴力など）の報告は分けて判断できるよう、グループのいずれかと同じ内容の場合に限る。
+    """
+    types = {member.get("type") for member in group}
+    violation_type = violation.get("type")
+    if violation_type in types:
+        close_enough = start_time <= group_end + max_gap_seconds
+    elif types | {violation_type} <= INTERCHANGEABLE_TYPES:
+        close_enough = start_time < group_end
+    else:
+        return False
+    return close_enough and any(_is_same_subject(member, violation) for member in group)
+
+
+def _merge_group(
+    group: list[dict[str, Any]], start_time: float, end_time: float
+) -> dict[str, Any]:
+    if len(group) == 1:
+        return group[0]
+    # 説明以外の項目は最も重要度の高い違反のものを使う
+    most_severe = max(group, key=_severity_rank)
+    merged = dict(most_severe)
+    merged.update(
+        {
+            "type": "・".join(
+                dict.fromkeys(member.get("type", "不明") for member in group)
+            ),
+            "description": _join_unique(
+                [member.get("description") for member in group]
+            ),
+            "start_time": start_time,
+            "end_time": end_time,
+        }
+    )
+    related_text = _join_unique([member.get("related_text") for member in group])
+    if related_text:
+        merged["related_text"] = related_text
+    return merged
+
+
+def merge_violations(
+    violations: list[dict[str, Any]], max_gap_seconds: float = DEFAULT_MERGE_GAP_SECONDS
+) -> list[dict[str, Any]]:
+    """同じ場面について重複して報告された違反を統合し、開始時刻順に並べて返す.
+
+    違反を開始時刻で並べ、時間帯が重なる（同じ種類なら隣り合う）同じ内容の違反を1つにまとめる。
+    統合した違反の時間帯は全体を覆う範囲、重要度は最も高いもの、説明と関連テキストは重複を除いて連結したものにする。
+    時刻が数値でない違反は統合せず末尾に残す。
+
+    Args:
+        violations (list[dict]): analyze_video_compliance が返した違反のリスト。
+        max_gap_seconds (float): 同じ種類の違反を隣り合うとみなす間隔（秒）。
+
+    Returns:
+        list[dict]: 統合後の違反のリスト。
+    """
+    timed = []
+    untimed = []
+    for violation in violations:
+        start_time = _as_seconds(violation.get("start_time"))
+        end_time = _as_seconds(violation.get("end_time"))
+        if start_time is None or end_time is None:
+            untimed.append(violation)
+        else:
+            timed.append((start_time, max(start_time, end_time), violation))
+    timed.sort(key=lambda item: item[0])
+
+    merged = []
+    group: list[dict[str, Any]] = []
+    group_start = group_end = 0.0
+    for start_time, end_time, violation in timed:
+        if group and _can_merge(
+            group, group_end, violation, start_time, max_gap_seconds
+        ):
+            group.append(violation)
+            group_end = max(group_end, end_time)
+            continue
+        if group:
+            merged.append(_merge_group(group, group_start, group_end))
+        group = [violation]
+        group_start, group_end = start_time, end_time
+    if group:
+        merged.append(_merge_group(group, group_start, group_end))
+    return merged + untimed
@@ -1,14 +1,192 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
+import json
 import os
+import tempfile
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from checker import detailed_image_text_analysis, detailed_video_analysis, detailed_text_only_analysis
+from checker import (
+    analyze_with_gemini_deep_research,
+    detailed_image_text_analysis,
+    detailed_post_analysis,
+    detailed_text_only_analysis,
+    detailed_video_analysis,
+)
+from analysis.prewarm import ensure_prewarm_scheduler, live_analysis
+from core.hashing import file_sha256, json_sha256
+from core.metrics import end_request, observe_request, render_metrics, span, start_request
+from core.priority_scheduler import (
+    INTERACTIVE,
+    SlotTicket,
+    UnknownPriorityError,
+    get_analysis_scheduler,
+    parse_priority,
+)
+from core.responses import gzip_body, select_fields
+from core.single_flight import get_single_flight
+from media.download_cache import MediaDownloadError, get_media_cache
 
 # 環境変数の読み込み
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app)  # CORSを有効化
+CORS(app, expose_headers=["X-Request-ID"])  # CORSを有効化
+
+# after_request は登録と逆順に実行されるため、圧縮が最後になるよう最初に登録する
+@app.after_request
+def compress_response(response):
+    """クライアントが gzip を受け付ける場合、成功したレスポンスのボディを圧縮する."""
+    if response.direct_passthrough or response.status_code != 200 or "Content-Encoding" in response.headers:
+        return response
+
+    compressed = gzip_body(response.get_data(), request.headers.get("Accept-Encoding", ""))
+    if compressed is not None:
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+# WSGIサーバーから起動した場合も事前実行が動くよう、各プロセスの最初のリクエストでスケジューラーを起動する
+@app.before_request
+def start_prewarm_scheduler():
+    """このプロセスで未起動であれば、発言者リサーチの事前実行スケジューラーを起動する（PREWARM_ENABLED=1 のとき）."""
+    ensure_prewarm_scheduler(analyze_with_gemini_deep_research)
+
+# リクエストごとに処理段階の所要時間（スパン）を記録する
+@app.before_request
+def start_request_timing():
+    """リクエストの計測を開始する."""
+    g.request_started_at = time.perf_counter()
+    g.request_timing, g.request_timing_token = start_request(request.headers.get("X-Request-ID"))
+
+@app.after_request
+def finish_request_timing(response):
+    """所要時間を記録し、レスポンスに X-Request-ID（?timing=1 のときは内訳）を付ける."""
+    timing = g.get("request_timing")
+    if timing is None:
+        return response
+
+    observe_request(request.url_rule.rule if request.url_rule else "unknown", response.status_code,
+                    time.perf_counter() - g.request_started_at)
+    response.headers["X-Request-ID"] = timing.request_id
+    # ?timing=1 のときは、レスポンスに段階ごとの所要時間の内訳を含める
+    if request.args.get("timing") == "1" and response.is_json:
+        body = response.get_json()
+        body["timing"] = timing.to_dict()
+        response.set_data(json.dumps(body, ensure_ascii=False))
+    return response
+
+@app.teardown_request
+def reset_request_timing(error=None):
+    """リクエストの計測を終え、元のコンテキストへ戻す."""
+    token = g.pop("request_timing_token", None)
+    if token is not None:
+        end_request(token)
+
+# Prometheus 形式のメトリクス
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus のメトリクスを返す."""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+def spool_upload(file_storage, suffix: str) -> str:
+    """アップロードされたファイルを一時ファイルに保存し、そのパスを返す.
+
+    同時に処理するリクエストどうしで上書きし合わないよう、リクエストごとに別のファイルにする。
+    """
+    with span("spool"):
+        file_descriptor, temp_path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            file_storage.save(temp_file)
+    return temp_path
+
+def read_request_data():
+    """JSON と multipart/form-data のどちらで送られたリクエストも同じように読む."""
+    return request.get_json() if request.is_json else request.form
+
+def parse_speaker_background(speaker_background):
+    """文字列で送られた発言者の背景情報（JSON）を dict にする."""
+    if speaker_background and isinstance(speaker_background, str):
+        return json.loads(speaker_background)
+    return speaker_background
+
+@contextmanager
+def media_input(file_field: str, url_field: str, suffix: str, data):
+    """アップロードされたファイル、またはURLで指定されたメディアのローカルパスを返す.
+
+    URLの場合はバックエンドが直接取得し、キャッシュ済みであれば取得し直さない。どちらもなければ None を返す。
+    """
+    if file_field in request.files:
+        temp_path = spool_upload(request.files[file_field], suffix)
+        try:
+            yield temp_path
+        finally:
+            os.remove(temp_path)
+    elif data.get(url_field):
+        with get_media_cache().fetch(data[url_field], suffix) as cached_path:
+            yield cached_path
+    else:
+        yield None
+
+@contextmanager
+def analysis_slot(ticket: SlotTicket):
+    """優先度に応じて分析の実行枠を待ってから、ライブ分析として実行する.
+
+    投稿前チェック（interactive）は、タイムラインのスキャン（background）より先に枠が割り当てられる。
+    """
+    with get_analysis_scheduler().slot(ticket), live_analysis():
+        yield
+
+def media_sha256(path: str) -> str:
+    """メディアの内容のハッシュを計算する.
+
+    hashlib は大きなチャンクの計算中にGILを解放するため、ワーカープロセスには送らずリクエストのスレッドで計算する。
+    """
+    with span("media.hash"):
+        return file_sha256(path)
+
+def run_analysis(endpoint: str, inputs: dict, priority: str, analyze):
+    """分析を実行する.
+
+    入力内容が同じ分析が実行中であれば、新しく実行せずにその結果を共有する。
+    合流したリクエストは実行枠を使わずに待つ。
+    background の分析が枠を待っている間に投稿前チェック（interactive）が合流した場合は、その分析を interactive の枠で実行する。
+    """
+    ticket = SlotTicket(priority)
+
+    def run():
+        with analysis_slot(ticket):
+            return analyze()
+
+    def promote_if_interactive(leader_ticket: SlotTicket):
+        if priority == INTERACTIVE:
+            get_analysis_scheduler().promote(leader_ticket)
+
+    key = json_sha256({"endpoint": endpoint, **inputs})
+    result, _ = get_single_flight().do(endpoint, key, run, context=ticket, on_join=promote_if_interactive)
+    return result
+
+def is_verbose_request() -> bool:
+    """?verbose=1 が指定されていれば True を返す."""
+    return request.args.get("verbose") == "1"
+
+def build_analysis_response(result: dict, body: dict):
+    """分析APIのレスポンスを組み立てる.
+
+    既定では処理ログを含めず（?verbose=1 で含める）、?fields= で返すフィールドを絞り込める。
+    """
+    body = {"status": "success", **body}
+    if result.get("error"):
+        body["error"] = result["error"]
+    if is_verbose_request():
+        body["logs"] = result.get("logs")
+
+    fields = request.args.get("fields")
+    if fields:
+        body = select_fields(body, fields.split(","))
+    return jsonify(body)
 
 # エラーハンドリング
 @app.errorhandler(Exception)
@@ -19,104 +197,142 @@ def handle_error(error):
     }
     return jsonify(response), 500
 
+@app.errorhandler(MediaDownloadError)
+@app.errorhandler(UnknownPriorityError)
+def handle_bad_request_error(error):
+    """入力の誤り（取得できないURL、不明な優先度）を 400 で返す."""
+    return jsonify({"error": str(error), "status": "error"}), 400
+
 # 動画のコンプライアンス分析API
 @app.route('/api/analyze/video', methods=['POST'])
 def analyze_video():
-    try:
-        if 'video' not in request.files:
-            return jsonify({"error": "動画ファイルが提供されていません"}), 400
-
-        video_file = request.files['video']
-        speaker_background = request.form.get('speaker_background', None)
-        if speaker_background:
-            import json
-            speaker_background = json.loads(speaker_background)
+    data = read_request_data()
+    priority = parse_priority(data.get('priority'))
+    speaker_background = parse_speaker_background(data.get('speaker_background', None))
 
-        temp_video_path = "temp_video.mp4"
-        video_file.save(temp_video_path)
+    # 動画ファイル（video）または動画のURL（video_url）を受け付ける
+    with media_input('video', 'video_url', ".mp4", data) as video_path:
+        if video_path is None:
+            return jsonify({"error": "動画ファイルまたは動画のURLが提供されていません"}), 400
 
         # ここで詳細分析関数を呼び出し
-        result = detailed_video_analysis(temp_video_path, speaker_background)
-
-        os.remove(temp_video_path)
-
-        return jsonify({
-            "status": "success",
-            "logs": result.get("logs"),
-            "transcript": result.get("transcript_result"),
-            "compliance_analysis": result.get("compliance_result")
-        })
+        result = run_analysis(
+            "video",
+            {"video_sha256": media_sha256(video_path), "speaker_background": speaker_background},
+            priority,
+            lambda: detailed_video_analysis(video_path, speaker_background),
+        )
 
-    except Exception as e:
-        if os.path.exists(temp_video_path):
-            os.remove(temp_video_path)
-        raise e
+    transcript = result.get("transcript_result")
+    return build_analysis_response(result, {
+        # 文字起こしは列ごとの配列で保持しているため、ここで初めて dict に変換する（単語単位は verbose のときだけ）
+        "transcript": transcript.to_dict(include_words=is_verbose_request()) if transcript is not None else None,
+        "compliance_analysis": result.get("compliance_result"),
+        "music_detection": result.get("music_detection_result")
+    })
 
 # 画像とテキストのコンプライアンス分析API
 @app.route('/api/analyze/image-text', methods=['POST'])
 def analyze_image_text():
-    try:
-        if 'image' not in request.files:
-            return jsonify({"error": "画像ファイルが提供されていません"}), 400
+    data = read_request_data()
+    priority = parse_priority(data.get('priority'))
+    text_input = data.get('text', None)
+    speaker_background = parse_speaker_background(data.get('speaker_background', None))
 
-        image_file = request.files['image']
-        text_input = request.form.get('text', None)
-        speaker_background = request.form.get('speaker_background', None)
-        if speaker_background:
-            import json
-            speaker_background = json.loads(speaker_background)
-
-        temp_image_path = "temp_image.jpg"
-        image_file.save(temp_image_path)
+    # 画像ファイル（image）または画像のURL（image_url）を受け付ける
+    with media_input('image', 'image_url', ".jpg", data) as image_path:
+        if image_path is None:
+            return jsonify({"error": "画像ファイルまたは画像のURLが提供されていません"}), 400
 
         # 詳細分析関数を呼び出し
-        result = detailed_image_text_analysis(
-            temp_image_path,
-            text_input,
-            speaker_background
+        result = run_analysis(
+            "image-text",
+            {"image_sha256": media_sha256(image_path), "text": text_input, "speaker_background": speaker_background},
+            priority,
+            lambda: detailed_image_text_analysis(
+                image_path,
+                text_input,
+                speaker_background
+            ),
         )
 
-        os.remove(temp_image_path)
-
-        return jsonify({
-            "status": "success",
-            "logs": result.get("logs"),
-            "analysis_result": result.get("analysis_result")
-        })
-
-    except Exception as e:
-        if os.path.exists(temp_image_path):
-            os.remove(temp_image_path)
-        raise e
+    return build_analysis_response(result, {
+        "analysis_result": result.get("analysis_result")
+    })
 
 # テキストのみのコンプライアンス分析API
 @app.route('/api/analyze/text', methods=['POST'])
 def analyze_text_only():
+    data = read_request_data()
+    priority = parse_priority(data.get('priority'))
     try:
-        data = request.get_json() if request.is_json else request.form
         text_input = data.get('text', None)
-        speaker_background = data.get('speaker_background', None)
-        if speaker_background and isinstance(speaker_background, str):
-            import json
-            speaker_background = json.loads(speaker_background)
+        speaker_background = parse_speaker_background(data.get('speaker_background', None))
 
         if not text_input:
             return jsonify({"error": "テキストが提供されていません"}), 400
 
-        result = detailed_text_only_analysis(
-            text_input,
-            speaker_background
+        result = run_analysis(
+            "text",
+            {"text": text_input, "speaker_background": speaker_background},
+            priority,
+            lambda: detailed_text_only_analysis(
+                text_input,
+                speaker_background
+            ),
         )
 
-        return jsonify({
-            "status": "success",
-            "logs": result.get("logs"),
+        return build_analysis_response(result, {
             "analysis_result": result.get("analysis_result")
         })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# 動画とテキストを含む投稿のコンプライアンス分析API
+@app.route('/api/analyze/post', methods=['POST'])
+def analyze_post():
+    """動画とテキストを含む投稿を分析し、統合したアラートを返す."""
+    data = read_request_data()
+    priority = parse_priority(data.get('priority'))
+    text_input = data.get('text', None)
+    speaker_background = parse_speaker_background(data.get('speaker_background', None))
+    live_research = str(data.get('live_research', '')).lower() in ("1", "true")
+
+    # 動画は任意。動画ファイル（video）または動画のURL（video_url）を受け付ける
+    with media_input('video', 'video_url', ".mp4", data) as video_path:
+        if video_path is None and not text_input:
+            return jsonify({"error": "動画（ファイルまたはURL）かテキストのいずれかを指定してください"}), 400
+
+        # 動画・テキスト・発言者リサーチを並行に分析し、重・中・予のアラートに統合する
+        result = run_analysis(
+            "post",
+            {
+                "video_sha256": media_sha256(video_path) if video_path else None,
+                "text": text_input,
+                "speaker_background": speaker_background,
+                "live_research": live_research,
+            },
+            priority,
+            lambda: detailed_post_analysis(video_path, text_input, speaker_background, live_research),
+        )
+
+    video_result = result.get("video_result") or {}
+    text_result = result.get("text_result") or {}
+    transcript = video_result.get("transcript_result")
+    return build_analysis_response(result, {
+        "alert": result.get("alert"),
+        "transcript": transcript.to_dict(include_words=is_verbose_request()) if transcript is not None else None,
+        "compliance_analysis": video_result.get("compliance_result"),
+        "music_detection": video_result.get("music_detection_result"),
+        "text_analysis": text_result.get("analysis_result"),
+        "speaker_research": result.get("speaker_research"),
+    })
+
 if __name__ == '__main__':
+    # 最初のリクエストを待たずに起動する。デバッグモードのリローダーは子プロセスでアプリを再起動するため、
+    # 監視するだけの親プロセスでは起動せず、実際に処理する側でだけ起動する（2回起動しない）
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        ensure_prewarm_scheduler(analyze_with_gemini_deep_research)
     # 開発環境ではデバッグモードを有効化
     app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -1,17 +1,51 @@
-import whisper
 import google.generativeai as genaikey
 from google import genai
+from google.genai import types
+import logging
 import openai 
 import os
 import json 
 import re 
-import subprocess 
 from dotenv import load_dotenv
-# from acrcloud.recognizer import ACRCloudRecognizer, ACRCloudStatusCode 
 # from .agent.graph import graph as research_agent_graph
-from agent.graph import graph as research_agent_graph
+import pathlib
+from contextlib import ExitStack
+from typing import Optional
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from agent.checkpoint import ainvoke_resumable, invoke_resumable, new_run_id
+from analysis.alerts import integrate_multi_source_alerts, research_alert, text_alert, unverified_alert, video_alert
+from analysis.prewarm import enrich_speaker_background, research_speaker_for_post
+from analysis.violations import merge_violations
+from core.cassette import use_cassette, wait_for_remote
+from core.metrics import span, with_prompt_cache_metrics
+from core.rate_limiter import (
+    call_with_rate_limit,
+    read_gemini_prompt_cache,
+    read_gemini_token_usage,
+    read_openai_prompt_cache,
+    read_openai_token_usage,
+)
+from core.token_budget import estimate_tokens, get_transcript_budget
+from media.audio_pipeline import AudioDecodeError, DecodedAudio, decode_audio
+from media.fingerprint import AudioFingerprintError
+from media.music_index import get_music_index
+from media.transcript import Transcript
+from media.transcript_cache import get_transcript_cache, is_transcript_cache_enabled
+from media.transcript_compaction import fit_transcript_to_budget, refine_violation_times
+from media.video_windows import (
+    VideoWindow,
+    VideoWindowError,
+    cut_video_window,
+    get_window_concurrency,
+    merge_window_violations,
+    plan_video_windows,
+)
 import time
 
+logger = logging.getLogger(__name__)
+
 # .envファイルから環境変数をロード
 load_dotenv()
 
@@ -27,129 +61,181 @@ print(f"DEBUG: APIキーの先頭部分: {openai.api_key[:8] if openai.api_key e
 video_path = os.path.abspath("backend/data/videos/test_video.mp4")
 
 # --- 動画からの文字起こし ---
-def process_video_to_transcript(video_path: str) -> dict:
+def process_video_to_transcript(video_path: str, audio: DecodedAudio | None = None) -> Transcript:
     """
     動画ファイルをOpenAIのWhisper APIでタイムスタンプ付きの文字起こしを生成する。
 
     Args:
         video_path (str): 動画ファイルのパス。
+        audio (DecodedAudio, optional): デコード済みの音声（media/audio_pipeline.py）。
+            ある場合は指紋で文字起こしキャッシュを照合し、圧縮した音声だけをアップロードする。
+            ない場合（ffmpeg が使えないなど）はキャッシュを使わず、動画をそのままアップロードする。
 
     Returns:
-        dict: {
-            'segments': list[dict] - タイムスタンプ付きのセグメントデータ
-            'full_text': str - 会話全体の文字列
-        }
+        Transcript: セグメントと単語のタイムスタンプ付きの文字起こし（full_text で会話全体の文字列）。
+                    エラー時は空の Transcript。
     """
     if not os.path.exists(video_path):
         raise FileNotFoundError(f"動画ファイルが見つかりません: {video_path}")
 
     print(f"DEBUG: 動画 '{video_path}' から文字起こしを生成します。")
 
+    # 転載で再エンコードされた動画でも、同じ音声を文字起こし済みであれば Whisper を呼ばずに返す
+    fingerprint = None
+    if audio is not None and is_transcript_cache_enabled():
+        try:
+            fingerprint = audio.fingerprint()
+            with span("transcript_cache"):
+                cached_transcript = get_transcript_cache().find(fingerprint)
+            if cached_transcript is not None:
+                logger.debug("同じ音声の文字起こしが保存されているため、キャッシュから返します。")
+                return cached_transcript
+        except AudioFingerprintError as e:
+            logger.debug("音声の指紋を作れないため、文字起こしのキャッシュを使いません: %s", e)
+
+    if audio is not None and not audio.has_speech:
+        logger.debug("発話が検出されなかったため、文字起こしを行いません。")
+        return Transcript.empty()
+
+    # 文字起こしに必要なのは音声だけのため、圧縮した音声（発話の区間だけをつなげたもの）があればそれを送る
+    upload_path = audio.transcription_path if audio is not None and audio.transcription_path else video_path
+
     try:
         # OpenAIクライアントの初期化
         client = openai.OpenAI()
         
         # OpenAIのWhisper APIを使用して文字起こし
-        with open(video_path, "rb") as video_file:
-            transcript = client.audio.transcriptions.create(
-                model="whisper-1",  # モデル名を修正
-                file=video_file,
-                response_format="verbose_json",  # レスポンスフォーマットを変更
-                language="ja",
-                timestamp_granularities=["segment", "word"]  # タイムスタンプの粒度を指定
+        # レート制限で再試行したときに先頭から送り直せるよう、呼び出しごとにファイルを開く
+        def request_transcription():
+            with open(upload_path, "rb") as upload_file:
+                return client.audio.transcriptions.create(
+                    model="whisper-1",  # モデル名を修正
+                    file=upload_file,
+                    response_format="verbose_json",  # レスポンスフォーマットを変更
+                    language="ja",
+                    timestamp_granularities=["segment", "word"]  # タイムスタンプの粒度を指定
+                )
+
+        with span("transcription"):
+            transcript = call_with_rate_limit(
+                "openai",
+                "whisper-1",
+                request_transcription,
+                cassette_request={"file": pathlib.Path(upload_path), "language": "ja"},
             )
 
-        # 結果を整形
-        formatted_segments = []
-        full_text = ""
-
-        # セグメント情報の処理
-        if hasattr(transcript, 'segments'):
-            for segment in transcript.segments:
-                words_with_timestamps = []
-                if hasattr(segment, 'words'):
-                    for word in segment.words:
-                        words_with_timestamps.append({
-                            'word': word.word,
-                            'start': word.start,
-                            'end': word.end
-                        })
-                
-                segment_text = segment.text.strip()
-                formatted_segments.append({
-                    'start': segment.start,
-                    'end': segment.end,
-                    'text': segment_text,
-                    'words': words_with_timestamps
-                })
-                full_text += segment_text + " "
-        else:
-            # セグメント情報がない場合は、全体を1つのセグメントとして扱う
-            formatted_segments.append({
-                'start': 0.0,
-                'end': 0.0,
-                'text': transcript.text if hasattr(transcript, 'text') else "",
-                'words': []
-            })
-            full_text = transcript.text if hasattr(transcript, 'text') else ""
-        
-        full_text = full_text.strip()
-        
-        print(f"DEBUG: 文字起こしが完了しました。")
-        print(f"  全体の文字数: {len(full_text)}")
-        print(f"  セグメント数: {len(formatted_segments)}")
-        
+        # 結果を列ごとの配列にまとめる（セグメント・単語ごとの dict は作らない）
+        transcript_result = Transcript.from_whisper(transcript)
+        if upload_path != video_path and audio.speech_map is not None:
+            # 発話の区間だけをつなげた音声の時刻を、元の動画の時刻に戻す
+            transcript_result = transcript_result.map_times(audio.speech_map.to_original)
+
+        logger.debug(
+            "文字起こしが完了しました（文字数: %d, セグメント数: %d, 単語数: %d）",
+            len(transcript_result.full_text), len(transcript_result), transcript_result.word_count,
+        )
+
         # デバッグ用に最初のセグメントの詳細を表示
-        if formatted_segments:
-            print(f"DEBUG: 最初のセグメントの詳細:")
-            print(f"  テキスト: {formatted_segments[0]['text']}")
-            print(f"  時間: {formatted_segments[0]['start']:.2f} - {formatted_segments[0]['end']:.2f}")
-            if formatted_segments[0]['words']:
-                print("  単語レベルのタイムスタンプ:")
-                for word in formatted_segments[0]['words']:
-                    print(f"    {word['word']}: {word['start']:.2f} - {word['end']:.2f}")
-        
-        return {
-            'segments': formatted_segments,
-            'full_text': full_text
-        }
+        if transcript_result:
+            logger.debug(
+                "最初のセグメント: %s（%.2f - %.2f）単語: %s",
+                transcript_result.segment_text(0),
+                transcript_result.segment_starts[0],
+                transcript_result.segment_ends[0],
+                transcript_result.segment_words(0),
+            )
+
+        if fingerprint is not None and transcript_result:
+            get_transcript_cache().save(fingerprint, transcript_result)
+        return transcript_result
 
     except Exception as e:
         print(f"ERROR: Whisper APIによる文字起こし中にエラーが発生しました: {e}")
-        return {
-            'segments': [],
-            'full_text': ""
-        }
+        return Transcript.empty()
 # print(process_video_to_transcript(video_path))
 
 # --- プレーンテキスト抽出 ---
-def extract_plain_text(transcripts: list[dict]) -> str:
+def extract_plain_text(transcript: Transcript) -> str:
     """
     タイムスタンプ付き文字起こしデータからプレーンテキストを抽出する。
 
     Args:
-        transcripts (list[dict]): タイムスタンプ（'start', 'end'）とテキスト（'text'）を含む辞書のリスト。
+        transcript (Transcript): 文字起こし。
 
     Returns:
-        str: 結合されたプレーンテキスト。
+        str: 結合されたプレーンテキスト（セグメントは連結済みのため、そのまま返す）。
     """
-    if not transcripts:
+    if not transcript:
         print("DEBUG: 文字起こしデータが空のため、空の文字列を返します。")
         return ""
-        
-    plain_text = " ".join([segment['text'] for segment in transcripts])
-    return plain_text
+    return transcript.full_text
 
 # --- 3. Gemini Deep Researchによる背景傾向調査 ---
-def analyze_with_gemini_deep_research(speaker_info: dict = None) -> dict:
+def _build_research_query(speaker_info: dict = None) -> str:
+    """LangGraph エージェントへ渡す調査依頼文を組み立てる."""
+    user_query = "以下の情報から分析してください。もし発言者に関する情報があれば、その人物の公開されている過去のコンプライアンス関連情報もインターネットで検索し、分析に含めてください。特に、情報漏洩、ハラスメント、不正行為、不適切な発言など、組織にとってのリスクになりうる点を重点的に調べてください。判断リソースリンク以外を表示してください"
+
+    if speaker_info:
+        user_query += f"\n\n発言者/投稿者情報: 名前: {speaker_info.get('name', '不明')}, アカウントURL: {speaker_info.get('account_url', 'なし')}"
+    return user_query
+
+
+def _format_research_result(result: dict, run_id: str) -> dict:
+    """LangGraph エージェントの最終状態から、呼び出し元へ返す分析結果を組み立てる."""
+    final_message_content = ""
+    if "messages" in result and result["messages"]:
+        # 最後のメッセージがエージェントの最終的な回答と仮定
+        last_message = result["messages"][-1]
+        if hasattr(last_message, "type") and last_message.type == "ai" and hasattr(last_message, "content"):
+            final_message_content = last_message.content
+        elif hasattr(last_message, "content") and isinstance(last_message.content, list):
+            # contentがリストの場合（例: ToolOutputなど）、テキスト部分を結合
+            final_message_content = " ".join([
+                part.text for part in last_message.content if hasattr(part, "text")
+            ])
+
+    logger.debug("LangGraphエージェントの最終出力:\n%s...", final_message_content[:500])
+
+    # 文字列形式のまま返す
+    return {
+        'potential_issue': 'LangGraph分析結果',
+        'incident_category': '分析結果',
+        'keywords': [],
+        'gemini_summary': final_message_content,
+        'gemini_risk_assessment': '要評価',
+        'relevant_text_snippet': final_message_content[:200] if final_message_content else 'なし',
+        'user_research_summary': final_message_content,
+        # 調査にかかった時間・トークン数・検索回数と、打ち切った理由（予算切れなど）
+        'research_usage': result.get('research_usage'),
+        'research_run_id': run_id
+    }
+
+
+def _research_error_result(error: Exception, run_id: str) -> dict:
+    logger.error("LangGraph エージェントの実行中にエラーが発生しました（run_id: %s）: %s", run_id, error)
+    return {
+        'potential_issue': 'LangGraph分析エラー',
+        'incident_category': '不明',
+        'keywords': [],
+        'gemini_summary': f'LangGraphエージェントの実行中にエラーが発生しました: {error}',
+        'gemini_risk_assessment': '不明',
+        'user_research_summary': 'エージェントの調査中にエラーが発生しました。',
+        'error': str(error),
+        # 同じ run_id で呼び直すと、完了済みの検索を再利用して途中から再開できる
+        'research_run_id': run_id
+    }
+
+
+def analyze_with_gemini_deep_research(speaker_info: dict = None, run_id: str = None) -> dict:
     """
     LangGraph エージェントを用いてテキスト内容を深掘りし、発言者の過去の情報を取得する。
     発言者情報があれば、エージェントがツールを用いて過去情報を検索し、分析に含める。
+    調査の途中経過はチェックポイントとして保存され、失敗しても最後に完了したノードから再開する。
 
     Args:
-        text (str): 文字起こしされたテキスト。
         speaker_info (dict, optional): 発言者/投稿者に関する情報。
                                        例: {'name': 'フワちゃん', 'account_url': 'https://x.com/fuwa876'}
+        run_id (str, optional): 調査の実行ID。失敗した調査の `research_run_id` を渡すと途中から再開する。
 
     Returns:
         dict: 深掘りされた分析結果。事故の種類、内容、関係者、潜在的なリスクなど。
@@ -157,67 +243,44 @@ def analyze_with_gemini_deep_research(speaker_info: dict = None) -> dict:
     """
     print(f"DEBUG: LangGraph エージェントを用いて深掘り分析を開始します:")
     if speaker_info:
-        print(f"DEBUG: 発言者情報が提供されました: {speaker_info}")
+        logger.debug("発言者情報が提供されました: %s", speaker_info)
+
+    run_id = run_id or new_run_id()
+    try:
+        # initial_search_query_count や max_research_loops は configuration.py で設定されている
+        result = invoke_resumable({
+            "messages": [{"role": "human", "content": _build_research_query(speaker_info)}],
+        }, run_id=run_id)
+        return _format_research_result(result, run_id)
+    except Exception as e:
+        return _research_error_result(e, run_id)
 
-    # LangGraph エージェントへのプロンプトを構築
-    # LangGraphのPrompts.pyに定義されているSystem PromptとHuman Promptを考慮
-    
-        # user_query = f"以下の会議録テキストからコンプライアンス違反の可能性とリスクを深く調査し、分析してください。もし発言者に関する情報があれば、その人物の公開されている過去のコンプライアンス関連情報もインターネットで検索し、分析に含めてください。特に、情報漏洩、ハラスメント、不正行為、不適切な発言など、組織にとってのリスクになりうる点を重点的に調べてください。"
-        user_query = f"以下の情報から分析してください。もし発言者に関する情報があれば、その人物の公開されている過去のコンプライアンス関連情報もインターネットで検索し、分析に含めてください。特に、情報漏洩、ハラスメント、不正行為、不適切な発言など、組織にとってのリスクになりうる点を重点的に調べてください。判断リソースリンク以外を表示してください"
 
+async def aanalyze_with_gemini_deep_research(speaker_info: dict = None, run_id: str = None) -> dict:
+    """analyze_with_gemini_deep_research の非同期版.
+
+    非同期版のエージェントグラフを ainvoke で実行するため、複数の調査と
+    その並列 web_research ブランチを1つのイベントループ上で同時に進められる。
+
+    Args:
+        speaker_info (dict, optional): 発言者/投稿者に関する情報。
+        run_id (str, optional): 調査の実行ID。失敗した調査の `research_run_id` を渡すと途中から再開する。
+
+    Returns:
+        dict: analyze_with_gemini_deep_research と同じ形式の分析結果。
+    """
+    logger.debug("LangGraph エージェント（非同期）を用いて深掘り分析を開始します")
     if speaker_info:
-        user_query += f"\n\n発言者/投稿者情報: 名前: {speaker_info.get('name', '不明')}, アカウントURL: {speaker_info.get('account_url', 'なし')}"
+        logger.debug("発言者情報が提供されました: %s", speaker_info)
 
+    run_id = run_id or new_run_id()
     try:
-        # LangGraph エージェントの実行
-        # graph.py で定義された graph.invoke を使用
-        # LangGraph のクイックスタートでは state に messages を渡している
-        # initial_search_query_count や max_research_loops は configuration.py で設定されている
-        result = research_agent_graph.invoke({
-            "messages": [{"role": "human", "content": user_query}],
-            # 他の初期設定があればここに追加 (例: initial_search_query_count, max_research_loops など)
-            # これらは agent/configuration.py でデフォルト値が設定されていることが多い
-            # "initial_search_query_count": 3,
-            # "max_research_loops": 2,
-            # "reasoning_model": "gemini-pro"
-        })
-
-        # LangGraph エージェントの最終出力から必要な情報を抽出
-        final_message_content = ""
-        if "messages" in result and result["messages"]:
-            # 最後のメッセージがエージェントの最終的な回答と仮定
-            last_message = result["messages"][-1]
-            if hasattr(last_message, "type") and last_message.type == "ai" and hasattr(last_message, "content"):
-                final_message_content = last_message.content
-            elif hasattr(last_message, "content") and isinstance(last_message.content, list):
-                # contentがリストの場合（例: ToolOutputなど）、テキスト部分を結合
-                final_message_content = " ".join([
-                    part.text for part in last_message.content if hasattr(part, "text")
-                ])
-
-        print(f"DEBUG: LangGraphエージェントの最終出力:\n{final_message_content[:500]}...")
-
-        # 文字列形式のまま返す
-        return {
-            'potential_issue': 'LangGraph分析結果',
-            'incident_category': '分析結果',
-            'keywords': [],
-            'gemini_summary': final_message_content,
-            'gemini_risk_assessment': '要評価',
-            'relevant_text_snippet': final_message_content[:200] if final_message_content else 'なし',
-            'user_research_summary': final_message_content
-        }
-
+        result = await ainvoke_resumable({
+            "messages": [{"role": "human", "content": _build_research_query(speaker_info)}],
+        }, run_id=run_id)
+        return _format_research_result(result, run_id)
     except Exception as e:
-        print(f"ERROR: LangGraph エージェントの実行中にエラーが発生しました: {e}")
-        return {
-            'potential_issue': 'LangGraph分析エラー',
-            'incident_category': '不明',
-            'keywords': [],
-            'gemini_summary': f'LangGraphエージェントの実行中にエラーが発生しました: {e}',
-            'gemini_risk_assessment': '不明',
-            'user_research_summary': 'エージェントの調査中にエラーが発生しました。'
-        }
+        return _research_error_result(e, run_id)
     
 # テスト用
 # print(analyze_with_gemini_deep_research({
@@ -228,13 +291,242 @@ def analyze_with_gemini_deep_research(speaker_info: dict = None) -> dict:
 # --- 4. 事故の時間・分野のクロスチェックとショートアノテーション ---
 
 
-def analyze_video_compliance(video_path: str, transcripts: list[dict]) -> dict:
+@dataclass
+class UploadedVideo:
+    """Gemini にアップロードし、処理が完了した動画.
+
+    文字起こしとは独立しているため、文字起こしと並行して用意できる。
+
+    windows が None の場合は動画全体を1ファイルとしてアップロードしてあり、
+    区間に分けた場合は files[i] が windows[i] を切り出したもの。
+    """
+
+    client: object
+    windows: list[VideoWindow] | None
+    files: list
+
+
+VIDEO_ANALYSIS_MODEL = "gemini-2.5-flash-preview-05-20"
+# 発話が検出されなかった動画の文字起こしの代わりにプロンプトへ入れる文（映像だけで分析・判断させる）
+NO_SPEECH_TRANSCRIPT = "（発話は検出されませんでした）"
+# 動画の分析の指示と出力形式。すべての呼び出しで同じ内容にし、動画とともにプロンプトの先頭に置く
+VIDEO_ANALYSIS_INSTRUCTIONS = """
+    動画とその文字起こしデータを分析し、コンプライアンス違反の可能性がある箇所を特定してください。
+
+    以下の点について分析してください：
+    1. 動画内の不適切な動作（暴力、ハラスメント行為など）
+    2. 不適切な発言（差別的発言、ハラスメント発言など）
+    3. 各違反の具体的な時間帯
+
+    以下のJSON形式で出力してください：
+    {
+        "violations": [
+            {
+                "type": "動作" or "発言",
+                "description": "違反の具体的な説明",
+                "start_time": 開始時間（秒）,
+                "end_time": 終了時間（秒）,
+                "severity": "高" or "中" or "低",
+                "related_text": "関連する発言（発言タイプの場合）"
+            }
+        ],
+        "summary": "全体的な分析結果の要約"
+    }
+    """
+def _upload_video_file(client, video_path: str):
+    """動画（または切り出した区間）をアップロードし、サーバー側の処理が完了したファイルを返す."""
+    with span("upload"):
+        my_file = use_cassette(
+            "gemini",
+            "files.upload",
+            {"file": pathlib.Path(video_path)},
+            lambda: client.files.upload(file=video_path),
+        )
+
+    # ファイルの処理が完了するまで待機
+    with span("processing_wait"):
+        while my_file.state.name == "PROCESSING":
+            logger.debug("ビデオを処理中...")
+            wait_for_remote(5)
+            my_file = use_cassette(
+                "gemini", "files.get", {"name": my_file.name}, lambda: client.files.get(name=my_file.name)
+            )
+    return my_file
+
+
+def upload_video_for_analysis(video_path: str) -> UploadedVideo:
+    """コンプライアンス分析に使う動画を Gemini にアップロードする.
+
+    VIDEO_WINDOW_SECONDS より長い動画は区間に分け、区間ごとに切り出して並行にアップロードする。
+    """
+    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    try:
+        windows = plan_video_windows(video_path)
+    except VideoWindowError as e:
+        # ffmpeg が使えない環境などでは、従来どおり動画全体を1回で分析する
+        logger.debug("区間分割を行わずに分析します: %s", e)
+        windows = None
+
+    if not windows:
+        my_file = _upload_video_file(client, video_path)
+        return UploadedVideo(client=client, windows=None, files=[my_file])
+
+    def upload_window(window: VideoWindow):
+        # アップロードが済めば切り出したファイルは不要なため、すぐに削除する
+        with cut_video_window(video_path, window) as clip_path:
+            return _upload_video_file(client, clip_path)
+
+    logger.debug("動画を %d 区間に分けてアップロードします。", len(windows))
+    with ThreadPoolExecutor(max_workers=min(len(windows), get_window_concurrency())) as executor:
+        # スパンをこのリクエストの内訳に記録できるよう、区間ごとにコンテキストを引き継ぐ
+        futures = [executor.submit(contextvars.copy_context().run, upload_window, window) for window in windows]
+        files = [future.result() for future in futures]
+    return UploadedVideo(client=client, windows=windows, files=files)
+
+
+def _generate_video_analysis(client, model_name: str, my_file, transcript: Transcript) -> dict:
+    """アップロード済みの動画（または切り出した区間）と文字起こしを Gemini に送り、パースした分析結果のJSONを返す.
+
+    時刻は渡した動画の先頭を0秒として報告される。
+    """
+    # 文字起こしデータを整形（モデルの予算を超える場合は圧縮し、報告された時刻は後で元のセグメントに戻す）
+    transcript_text, compaction = fit_transcript_to_budget(transcript, model_name, get_transcript_budget(model_name))
+    if not transcript:
+        transcript_text = NO_SPEECH_TRANSCRIPT
+
+    logger.debug("文字起こしテキストの長さ: %d 文字", len(transcript_text))
+
+    # 指示と動画を先頭に置き、呼び出しごとに変わる文字起こしを最後に置く
+    prompt = f"""
+    文字起こしデータ:
+    {transcript_text}
+    """
+
+    logger.debug("Gemini APIで分析を開始します...")
+
+    # Gemini APIで分析を実行（動画は1回の呼び出しでしか使わないため、明示的なコンテキストキャッシュは作らず、
+    # 変わらない指示と動画を先頭に置いて再試行などで同じ先頭部分を送る場合にプロバイダー側のキャッシュが効くようにする）
+    with span("generation"):
+        response = call_with_rate_limit(
+            "gemini",
+            model_name,
+            with_prompt_cache_metrics(
+                "gemini",
+                model_name,
+                lambda: client.models.generate_content(
+                    model=model_name,
+                    contents=[my_file, prompt],
+                    config=types.GenerateContentConfig(system_instruction=VIDEO_ANALYSIS_INSTRUCTIONS),
+                ),
+                read_gemini_prompt_cache,
+            ),
+            estimated_tokens=estimate_tokens(prompt) + estimate_tokens(VIDEO_ANALYSIS_INSTRUCTIONS),
+            read_token_usage=read_gemini_token_usage,
+            cassette_request={"contents": [my_file.name, prompt], "system_instruction": VIDEO_ANALYSIS_INSTRUCTIONS},
+        )
+    logger.debug("Gemini APIからの応答を受信しました")
+
+    # JSONレスポンスをパース
+    try:
+        with span("parse"):
+            # レスポンスからテキストコンテンツを抽出
+            response_text = response.candidates[0].content.parts[0].text
+            # JSON部分を抽出（```json と ``` の間のテキスト）
+            json_text = re.search(r'```json\n(.*?)\n```', response_text, re.DOTALL)
+            if json_text:
+                analysis_result = json.loads(json_text.group(1))
+            else:
+                raise ValueError("JSONデータが見つかりませんでした")
+        logger.debug("JSONレスポンスのパースに成功しました")
+    except json.JSONDecodeError as e:
+        logger.error("JSONのパースに失敗しました: %s（受信したレスポンス: %s...）", e, response_text[:200])
+        raise
+    if compaction is not None:
+        refine_violation_times(analysis_result.get('violations', []), transcript, compaction)
+        analysis_result['transcript_compaction'] = compaction.to_dict()
+    return analysis_result
+
+
+def _analyze_video_windows(model_name: str, uploaded: UploadedVideo, transcript: Transcript) -> dict:
+    """区間ごとにアップロードした動画を並行に分析し、違反を動画全体の時刻に直してまとめる.
+
+    1回の呼び出しで送る動画と文字起こしが区間の長さに収まるため、動画が長くなっても待ち時間がほぼ変わらない。
+    一部の区間の分析に失敗した場合は残りの区間の結果を返し、失敗した区間を failed_windows に記録する（すべて失敗した場合は例外）。
+    """
+    windows = uploaded.windows
+
+    def analyze_window(window: VideoWindow, window_file) -> dict:
+        window_transcript = transcript.slice(window.start, window.end, rebase=True)
+        return _generate_video_analysis(uploaded.client, model_name, window_file, window_transcript)
+
+    logger.debug("動画を %d 区間に分けて分析します。", len(windows))
+    with ThreadPoolExecutor(max_workers=min(len(windows), get_window_concurrency())) as executor:
+        # スパンをこのリクエストの内訳に記録できるよう、区間ごとにコンテキストを引き継ぐ
+        futures = [
+            executor.submit(contextvars.copy_context().run, analyze_window, window, window_file)
+            for window, window_file in zip(windows, uploaded.files)
+        ]
+        window_results = []
+        for window, future in zip(windows, futures):
+            # 1つの区間の失敗で他の区間の結果を捨てないよう、区間ごとに例外を受け取る
+            try:
+                window_results.append((window, future.result(), None))
+            except Exception as e:
+                logger.error("区間 %d の分析に失敗しました: %s", window.index, e)
+                window_results.append((window, None, e))
+
+    errors = [error for _, _, error in window_results if error is not None]
+    if len(errors) == len(windows):
+        raise errors[0]
+
+    summaries = []
+    compactions = []
+    failed_windows = []
+    for window, window_result, error in window_results:
+        summary_end = window.end if window.owned_end == float("inf") else window.owned_end
+        if error is not None:
+            # 分析できなかった区間は、違反がなかったのではなく未確認であることが分かるように残す
+            failed_windows.append({'start_time': window.owned_start, 'end_time': summary_end, 'error': str(error)})
+            summaries.append(f"[{window.owned_start:.0f}-{summary_end:.0f}秒] この区間は分析できませんでした: {error}")
+            continue
+        if window_result.get('transcript_compaction'):
+            compactions.append({'window_start': window.start, **window_result['transcript_compaction']})
+        summaries.append(
+            f"[{window.owned_start:.0f}-{summary_end:.0f}秒] {window_result.get('summary', '分析結果なし')}"
+        )
+    violations = merge_window_violations(
+        [(window, window_result.get('violations', [])) for window, window_result, error in window_results if error is None]
+    )
+    violations.sort(key=lambda violation: _violation_start_time(violation))
+    result = {'violations': violations, 'summary': "\n".join(summaries)}
+    if compactions:
+        result['transcript_compactions'] = compactions
+    if failed_windows:
+        result['failed_windows'] = failed_windows
+    return result
+
+
+def _violation_start_time(violation: dict) -> float:
+    try:
+        return float(violation.get('start_time'))
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+def analyze_video_compliance(
+    video_path: str,
+    transcript: Transcript,
+    upload: Optional["Future[UploadedVideo]"] = None,
+) -> dict:
     """
     動画の動作と発言の両方からコンプライアンス違反を検出し、タイムスタンプ付きで出力する。
+    VIDEO_WINDOW_SECONDS より長い動画は区間に分けて並行に分析する。
 
     Args:
         video_path (str): 動画ファイルのパス
-        transcripts (list[dict]): タイムスタンプ付きの文字起こしデータ
+        transcript (Transcript): タイムスタンプ付きの文字起こしデータ
+        upload (Future[UploadedVideo], optional): 文字起こしと並行して開始した upload_video_for_analysis。
+            ない場合はここでアップロードする。
 
     Returns:
         dict: コンプライアンス違反の検出結果
@@ -247,8 +539,7 @@ def analyze_video_compliance(video_path: str, transcripts: list[dict]) -> dict:
     try:
         # Gemini APIの設定
         # model = genai.GenerativeModel('gemini-pro-vision')
-        client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-        model_name = "gemini-2.5-flash-preview-05-20"
+        model_name = VIDEO_ANALYSIS_MODEL
         # 動画ファイルの存在とサイズを確認
         file_size = os.path.getsize(video_path)
         print(f"DEBUG: 動画ファイルサイズ: {file_size / (1024*1024):.2f} MB")
@@ -256,89 +547,28 @@ def analyze_video_compliance(video_path: str, transcripts: list[dict]) -> dict:
         if file_size == 0:
             raise ValueError("動画ファイルが空です")
         
-        # 文字起こしデータの確認
-        if not transcripts:
-            raise ValueError("文字起こしデータが空です")
-        
-        print(f"DEBUG: 文字起こしデータのセグメント数: {len(transcripts)}")
-        
-        # 文字起こしデータを整形
-        transcript_text = "\n".join([
-            f"[{segment['start']:.2f}-{segment['end']:.2f}] {segment['text']}"
-            for segment in transcripts
-        ])
-        
-        print(f"DEBUG: 文字起こしテキストの長さ: {len(transcript_text)} 文字")
-
-        # プロンプトの設定
-        prompt = f"""
-        以下の動画と文字起こしデータを分析し、コンプライアンス違反の可能性がある箇所を特定してください。
-
-        文字起こしデータ:
-        {transcript_text}
-
-        以下の点について分析してください：
-        1. 動画内の不適切な動作（暴力、ハラスメント行為など）
-        2. 不適切な発言（差別的発言、ハラスメント発言など）
-        3. 各違反の具体的な時間帯
-
-        以下のJSON形式で出力してください：
-        {{
-            "violations": [
-                {{
-                    "type": "動作" or "発言",
-                    "description": "違反の具体的な説明",
-                    "start_time": 開始時間（秒）,
-                    "end_time": 終了時間（秒）,
-                    "severity": "高" or "中" or "低",
-                    "related_text": "関連する発言（発言タイプの場合）"
-                }}
-            ],
-            "summary": "全体的な分析結果の要約"
-        }}
-        """
+        # 発話のない動画（発話が検出されなかった場合を含む）でも、映像の動作は分析する
+        if not transcript:
+            logger.debug("文字起こしデータが空のため、映像だけを分析します。")
+        else:
+            logger.debug("文字起こしデータのセグメント数: %d", len(transcript))
 
-        print("DEBUG: Gemini APIで分析を開始します...")
-        
-        # 動画ファイルをアップロード
-        my_file = client.files.upload(file=video_path)
-            
-            # ファイルの処理が完了するまで待機
-        while my_file.state.name == "PROCESSING":
-            print("ビデオを処理中...", end="\r")
-            time.sleep(5)
-            my_file = client.files.get(name=my_file.name)
-        
-        # Gemini APIで分析を実行
-        response = client.models.generate_content(
-            model=model_name,
-            contents=[prompt, my_file]
-        )
-        print(response)
-        print("DEBUG: Gemini APIからの応答を受信しました")
-        
-        # JSONレスポンスをパース
-        try:
-            # レスポンスからテキストコンテンツを抽出
-            response_text = response.candidates[0].content.parts[0].text
-            # JSON部分を抽出（```json と ``` の間のテキスト）
-            json_text = re.search(r'```json\n(.*?)\n```', response_text, re.DOTALL)
-            if json_text:
-                analysis_result = json.loads(json_text.group(1))
-            else:
-                raise ValueError("JSONデータが見つかりませんでした")
-            print("DEBUG: JSONレスポンスのパースに成功しました")
-        except json.JSONDecodeError as e:
-            print(f"ERROR: JSONのパースに失敗しました: {e}")
-            print(f"受信したレスポンス: {response_text[:200]}...")  # 最初の200文字のみ表示
-            raise
+        # アップロードは文字起こしを必要としないため、先に開始していればその完了だけを待つ
+        uploaded = upload.result() if upload is not None else upload_video_for_analysis(video_path)
 
-        # 結果を整形して返す
-        return {
+        if uploaded.windows:
+            return _analyze_video_windows(model_name, uploaded, transcript)
+
+        analysis_result = _generate_video_analysis(uploaded.client, model_name, uploaded.files[0], transcript)
+
+        # 結果を整形して返す（パース後はレスポンス本体を保持しない）
+        result = {
             'violations': analysis_result.get('violations', []),
-            'summary': analysis_result.get('summary', '分析結果なし'),
-            'raw_response': response  # デバッグ用
+            'summary': analysis_result.get('summary', '分析結果なし')
         }
+        if analysis_result.get('transcript_compaction'):
+            result['transcript_compactions'] = [analysis_result['transcript_compaction']]
+        return result
 
     except Exception as e:
         print(f"ERROR: コンプライアンス分析中にエラーが発生しました: {e}")
@@ -346,14 +576,51 @@ def analyze_video_compliance(video_path: str, transcripts: list[dict]) -> dict:
         traceback.print_exc()
         return {
             'violations': [],
-            'summary': f"エラーが発生しました: {str(e)}",
-            'raw_response': None
+            'summary': f"エラーが発生しました: {str(e)}"
         }
 
 
 
 
+def _format_precomputed_research(speaker_background: dict) -> str:
+    """事前実行済みの発言者リサーチ（analysis/prewarm.py）をプロンプト用の1行にする.
+
+    結果がなければ空文字を返す。
+    """
+    research = speaker_background.get('precomputed_research')
+    if not research:
+        return ""
+    researched_on = time.strftime('%Y-%m-%d', time.localtime(research['researched_at']))
+    return f"事前調査による背景情報（{researched_on}時点）: {research['summary']}"
+
+
 # --- 5. GPTによる前後の文脈判断 ---
+CONTEXT_JUDGEMENT_MODEL = "gpt-3.5-turbo"
+# 文脈判断の指示と出力形式。すべての呼び出しで同じ内容にし、プロンプトの先頭に置く
+CONTEXT_JUDGEMENT_INSTRUCTIONS = """あなたは音声文からコンプライアンスリスクを評価する専門家です。発言者の背景や文脈を考慮して、発言の意図を正確に判断してください。ただし、貴方が大丈夫と通してしまうと、全世界に発信される可能性があるので、貴方の判断は慎重に厳しく倫理性を十分に考慮して行ってください。
+
+    これから「1. 発言者の背景情報」「2. 音声文の全文」「3. 問題の発言」を渡します。
+    以下の情報を分析し、問題の発言についてコンプライアンス違反の可能性を判断してください。
+
+    以下の点について分析してください：
+    1. 発言の意図（皮肉、冗談、真剣な情報伝達など）
+    2. 発言者のキャラクターや過去の発言スタイルを考慮した場合の許容可能性
+    3. 前後の文脈から判断される発言の真意
+    4. コンプライアンス違反の可能性（発言者の背景を考慮しても許容できないか）
+
+    分析結果は、以下のJSON形式で出力してください：
+
+    {
+        "contextual_intent": "発言の意図とニュアンスの具体的な説明",
+        "gpt_context_assessment": "文脈を踏まえた上でのコンプライアンスリスクへの影響評価",
+        "gpt_additional_risk_factor": "文脈から判断される追加のリスク要因または軽減要因",
+        "gpt_risk_modifier": "最終的なリスク修正の度合い ('増幅', '軽減', 'なし' のいずれか)",
+        "speaker_context_impact": "発言者の背景情報がリスク評価に与える影響",
+        "final_judgment": "発言者の背景を考慮した上での最終判断"
+    }
+    """
+
+
 def judge_context_with_gpt(
     full_transcript: str,          # 文字起こしの全文
     violation_record: dict,        # analyze_video_complianceからの違反レコード
@@ -417,50 +684,51 @@ def judge_context_with_gpt(
         キャラクタータイプ: {speaker_background.get('character_type', '不明')}
         通常の発言スタイル: {speaker_background.get('usual_style', '不明')}
         過去のコンプライアンス関連事案: {', '.join(speaker_background.get('past_incidents', ['なし']))}
+        {_format_precomputed_research(speaker_background)}
         """
 
-    prompt = f"""
-    以下の情報を分析し、コンプライアンス違反の可能性を判断してください。
+    # 違反ごとに変わらない指示・発言者の背景・全文を先頭に置き、違反の内容を最後に置く。
+    # 同じ動画の違反を続けて判断するとき、プロバイダーのプロンプトキャッシュが先頭の共通部分に効く
+    shared_context = f"""
+    1. 発言者の背景情報:
+    {speaker_info if speaker_info else "発言者の背景情報は提供されていません。"}
 
-    1. 問題の発言:
+    2. 音声文の全文:
+    {full_transcript}
+    """
+
+    violation_prompt = f"""
+    3. 問題の発言:
     タイムスタンプ: {incident_timestamp}
     違反タイプ: {violation_record.get('type', '不明')}
     重要度: {violation_record.get('severity', '不明')}
     説明: {violation_record.get('description', '不明')}
     関連テキスト: {violation_record.get('related_text', '不明')}
-
-    2. 発言者の背景情報:
-    {speaker_info if speaker_info else "発言者の背景情報は提供されていません。"}
-
-    3. 音声文の全文:
-    {full_transcript}
-
-    以下の点について分析してください：
-    1. 発言の意図（皮肉、冗談、真剣な情報伝達など）
-    2. 発言者のキャラクターや過去の発言スタイルを考慮した場合の許容可能性
-    3. 前後の文脈から判断される発言の真意
-    4. コンプライアンス違反の可能性（発言者の背景を考慮しても許容できないか）
-
-    分析結果は、以下のJSON形式で出力してください：
-
-    {{
-        "contextual_intent": "発言の意図とニュアンスの具体的な説明",
-        "gpt_context_assessment": "文脈を踏まえた上でのコンプライアンスリスクへの影響評価",
-        "gpt_additional_risk_factor": "文脈から判断される追加のリスク要因または軽減要因",
-        "gpt_risk_modifier": "最終的なリスク修正の度合い ('増幅', '軽減', 'なし' のいずれか)",
-        "speaker_context_impact": "発言者の背景情報がリスク評価に与える影響",
-        "final_judgment": "発言者の背景を考慮した上での最終判断"
-    }}
     """
 
+    messages = [
+        {"role": "system", "content": CONTEXT_JUDGEMENT_INSTRUCTIONS},
+        {"role": "user", "content": shared_context},
+        {"role": "user", "content": violation_prompt},
+    ]
+
     try:
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "あなたは音声文からコンプライアンスリスクを評価する専門家です。発言者の背景や文脈を考慮して、発言の意図を正確に判断してください。ただし、貴方が大丈夫と通してしまうと、全世界に発信される可能性があるので、貴方の判断は慎重に厳しく倫理性を十分に考慮して行ってください。"},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={ "type": "json_object" }
+        response = call_with_rate_limit(
+            "openai",
+            CONTEXT_JUDGEMENT_MODEL,
+            with_prompt_cache_metrics(
+                "openai",
+                CONTEXT_JUDGEMENT_MODEL,
+                lambda: openai.chat.completions.create(
+                    model=CONTEXT_JUDGEMENT_MODEL,
+                    messages=messages,
+                    response_format={ "type": "json_object" }
+                ),
+                read_openai_prompt_cache,
+            ),
+            estimated_tokens=sum(estimate_tokens(message["content"]) for message in messages),
+            read_token_usage=read_openai_token_usage,
+            cassette_request={"messages": messages},
         )
         
         response_content = response.choices[0].message.content
@@ -504,415 +772,52 @@ def judge_context_with_gpt(
             'final_judgment': '予期せぬエラーにより判断不能'
         }
 
-# --- 6. 音声抽出ヘルパー関数 ---
-def extract_audio_from_video(video_path: str, output_audio_path: str) -> bool:
+# --- 7. 著作権のある音楽検出（ローカルの指紋インデックス利用） ---
+def detect_copyrighted_music_from_audio(audio: DecodedAudio) -> dict:
     """
-    動画ファイルから音声を抽出し、指定されたパスに保存する。
-    ffmpegがシステムにインストールされている必要があります。
-
-    Args:
-        video_path (str): 入力動画ファイルのパス
-        output_audio_path (str): 出力音声ファイルのパス
-
-    Returns:
-        bool: 音声抽出が成功したかどうか
+    デコード済みの動画の音声から著作権のある音楽を検出する。
+    外部APIは呼ばず、管理している参照カタログから作った指紋インデックス（media/music_index.py）と照合する。
+    指紋は文字起こしキャッシュの照合で作ったものを使い回す。
     """
-    try:
-        command = [
-            'ffmpeg', '-y',  # 既存ファイルを上書き
-            '-i', video_path,
-            '-q:a', '0',     # 音質を高く設定 (VBR, high quality)
-            '-map', 'a',     # 音声ストリームのみを抽出
-            output_audio_path
-        ]
-        result = subprocess.run(command, capture_output=True, text=True, check=True)
-        print(f"DEBUG: 音声を '{output_audio_path}' に抽出しました。")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"ERROR: 音声抽出中にエラーが発生しました: {e}")
-        print(f"ERROR: コマンドエラー出力:\n{e.stderr}")
-        return False
-    except FileNotFoundError:
-        print("ERROR: 'ffmpeg' コマンドが見つかりません。ffmpegがインストールされ、PATHが通っているか確認してください。")
-        return False
-    except Exception as e:
-        print(f"ERROR: 予期せぬ音声抽出エラーが発生しました: {e}")
-        return False
+    logger.debug("動画の音声（%.1f秒）から著作権のある音楽を検出します（ローカルの指紋インデックス利用）。", audio.duration_seconds)
 
-# --- 7. 著作権のある音楽検出（ACRCloud利用） ---
-def detect_copyrighted_music_from_audio(audio_path: str) -> dict:
-    """
-    音声ファイルから著作権のある音楽を検出する。
-    ACRCloud APIを呼び出す具体的な実装例。
-    """
-    print(f"DEBUG: 音声ファイル '{audio_path}' から著作権のある音楽を検出します（ACRCloud利用）。")
-
-    acrcloud_host = os.getenv("ACRCLOUD_HOST")
-    acrcloud_access_key = os.getenv("ACRCLOUD_ACCESS_KEY")
-    acrcloud_access_secret = os.getenv("ACRCLOUD_ACCESS_SECRET")
-
-    if not all([acrcloud_host, acrcloud_access_key, acrcloud_access_secret]):
-        print("ERROR: ACRCloud APIキー（ACRCLOUD_HOST, ACRCLOUD_ACCESS_KEY, ACRCLOUD_ACCESS_SECRET）が設定されていません。音楽検出をスキップします。")
-        return {
-            'detected': False, 'title': None, 'artist': None,
-            'start_time': None, 'end_time': None, 'is_copyrighted': False,
-            'error': 'ACRCloud API keys not configured.'
-        }
-
-    config = {
-        'host': acrcloud_host,
-        'access_key': acrcloud_access_key,
-        'access_secret': acrcloud_access_secret,
-        'timeout': 10 # タイムアウト秒数
+    not_detected = {
+        'detected': False, 'title': None, 'artist': None,
+        'start_time': None, 'end_time': None, 'is_copyrighted': False,
+        'detection_method': 'local_fingerprint'
     }
-    re = ACRCloudRecognizer(config)
-
-    try:
-        result_json_str = re.recognize_by_file(audio_path, 0)
-        result = json.loads(result_json_str)
-        print(f"DEBUG: ACRCloudレスポンス: {json.dumps(result, indent=2)}")
-
-        if result.get('status', {}).get('code') == ACRCloudStatusCode.SUCCESS:
-            if 'metadata' in result and 'music' in result['metadata'] and len(result['metadata']['music']) > 0:
-                music_info = result['metadata']['music'][0]
-                is_copyrighted = True # 検出されたら著作権ありと仮定
-
-                return {
-                    'detected': True,
-                    'title': music_info.get('title'),
-                    'artist': ', '.join([art.get('name') for art in music_info.get('artists', [])]),
-                    'album': music_info.get('album', {}).get('name'),
-                    'genres': ', '.join([g.get('name') for g in music_info.get('genres', [])]) if music_info.get('genres') else None,
-                    'start_time': music_info.get('play_offset_ms', 0) / 1000.0,
-                    'end_time': (music_info.get('play_offset_ms', 0) + music_info.get('duration_ms', 0)) / 1000.0,
-                    'is_copyrighted': is_copyrighted,
-                    'detection_method': 'ACRCloud'
-                }
-            else:
-                print("DEBUG: ACRCloud: 音楽は検出されませんでした。")
-                return {
-                    'detected': False, 'title': None, 'artist': None,
-                    'start_time': None, 'end_time': None, 'is_copyrighted': False,
-                    'detection_method': 'ACRCloud'
-                }
-        else:
-            status_msg = result.get('status', {}).get('msg', 'Unknown status message')
-            print(f"ERROR: ACRCloud認識エラー: Code={result.get('status', {}).get('code')}, Message={status_msg}")
-            return {
-                'detected': False, 'title': None, 'artist': None,
-                'start_time': None, 'end_time': None, 'is_copyrighted': False,
-                'error': f'ACRCloud recognition failed: {status_msg}'
-            }
 
-    except FileNotFoundError:
-        print(f"ERROR: 音声ファイル '{audio_path}' が見つかりません。")
-        return {
-            'detected': False, 'title': None, 'artist': None,
-            'start_time': None, 'end_time': None, 'is_copyrighted': False,
-            'error': 'Audio file not found.'
-        }
-    except json.JSONDecodeError as e:
-        print(f"ERROR: ACRCloudからのレスポンスのJSONパースに失敗しました: {e}")
-        return {
-            'detected': False, 'title': None, 'artist': None,
-            'start_time': None, 'end_time': None, 'is_copyrighted': False,
-            'error': 'Failed to parse ACRCloud response JSON.'
-        }
-    except Exception as e:
-        print(f"ERROR: ACRCloud認識中に予期せぬエラーが発生しました: {e}")
-        return {
-            'detected': False, 'title': None, 'artist': None,
-            'start_time': None, 'end_time': None, 'is_copyrighted': False,
-            'error': f'Unexpected ACRCloud error: {e}'
-        }
+    music_index = get_music_index()
+    if music_index is None:
+        logger.error("音楽の指紋インデックスが作成されていません（python -m media.music_index で作成）。音楽検出をスキップします。")
+        return {**not_detected, 'error': 'Music index not built.'}
 
-# # --- 8. 単一ソースからのアラート生成 ---
-# def generate_alert(
-#     gemini_analysis: dict,
-#     incident_details: dict,
-#     gpt_context_judgement: dict,
-#     transcripts: list[dict],
-#     music_detection_result: dict = None,
-#     source_type: str = "video" # source_type を追加
-# ) -> dict:
-#     """
-#     全ての分析結果を統合し、コンプライアンスアラートを生成する。
-
-#     Args:
-#         gemini_analysis (dict): Geminiによる深掘り分析結果。
-#         incident_details (dict): 事故時刻と関連分野の詳細。
-#         gpt_context_judgement (dict): GPTによる文脈判断結果。
-#         transcripts (list[dict]): タイムスタンプ付き文字起こしデータ。
-#         music_detection_result (dict, optional): 著作権音楽検出の結果。
-#         source_type (str): このアラートが「video」または「text_input」のどちらのソースから生成されたか。
-
-#     Returns:
-#         dict: アラートレベル（重・中・予）、理由、関連タイムスタンプを含む辞書。
-#     """
-#     alert_level = "予"
-#     reasons = []
-    
-#     # 暫定のタイムスタンプとテキストを設定
-#     alert_timestamp = incident_details.get('incident_timestamp_approx', '不明')
-#     original_text_segment = '該当テキストなし'
-
-#     # --- original_text_segment の設定ロジック ---
-#     if source_type == "text_input":
-#         # テキスト入力のみの場合、transcriptsはダミーで、text_inputそのものがオリジナルテキスト
-#         # `cross_check_and_annotate_incident` で `context_for_gpt` に格納されたものが望ましい
-#         original_text_segment = incident_details.get('context_for_gpt', 'N/A')
-#         # テキスト入力の場合、タイムスタンプは通常不明
-#         alert_timestamp = "不明" # 明示的に不明にする
-#     elif source_type == "video":
-#         # 動画の場合、タイムスタンプに基づいて正確なテキストを抽出
-#         if ' - ' in alert_timestamp and alert_timestamp != '不明':
-#             try:
-#                 start_m, start_s = map(int, alert_timestamp.split(' - ')[0].split(':'))
-#                 end_m, end_s = map(int, alert_timestamp.split(' - ')[1].split(':'))
-#                 start_sec_float = float(start_m * 60 + start_s)
-#                 end_sec_float = float(end_m * 60 + end_s)
-                
-#                 for s in transcripts:
-#                     if max(s['start'], start_sec_float) < min(s['end'], end_sec_float):
-#                         original_text_segment = s['text']
-#                         break
-#             except ValueError:
-#                 pass # タイムスタンプ解析エラーの場合はデフォルト値のまま
-#     # --- original_text_segment の設定ロジックここまで ---
-
-#     print(f"DEBUG: generate_alert (Source: {source_type}): アラートを生成します。現在のレベル: {alert_level}")
-
-#     # --- 1. 著作権のある音楽が検出された場合の判断（最優先） ---
-#     # 音楽検出は動画ソースにのみ適用されるため、source_type == "video" で確認
-#     if source_type == "video" and music_detection_result and music_detection_result.get('detected') and music_detection_result.get('is_copyrighted'):
-#         alert_level = "重"
-#         reasons.append(
-#             f"**著作権違反の音楽検出**: 著作権保護された音楽 '{music_detection_result.get('title', '不明')}' "
-#             f"by '{music_detection_result.get('artist', '不明')}' が検出されました。"
-#         )
-#         # 音楽検出のタイムスタンプを優先的に採用
-#         if music_detection_result.get('start_time') is not None and music_detection_result.get('end_time') is not None:
-#              alert_timestamp = (
-#                  f"{int(music_detection_result['start_time'] // 60)}:{int(music_detection_result['start_time'] % 60):02d} - "
-#                  f"{int(music_detection_result['end_time'] // 60)}:{int(music_detection_result['end_time'] % 60):02d}"
-#              )
-#         original_text_segment = "動画内の音楽部分（文字起こしなし）" # 音楽なのでテキストはなし
-
-#     # --- 2. Geminiの初期評価に基づく判断 ---
-#     current_level_before_gemini = alert_level 
-#     if gemini_analysis.get('gemini_risk_assessment') == '高':
-#         if alert_level != "重":
-#             alert_level = "重"
-#         reasons.append(f"**Gemini初期評価**: 重大なコンプライアンスリスクが検出されました。理由: {gemini_analysis.get('gemini_summary', '不明')}")
-#     elif gemini_analysis.get('gemini_risk_assessment') == '中':
-#         if alert_level == "予":
-#             alert_level = "中"
-#         elif alert_level != "重":
-#             reasons.append(f"**Gemini初期評価**: 中程度のコンプライアンスリスクが検出されました。理由: {gemini_analysis.get('gemini_summary', '不明')}")
-    
-#     # --- 3. GPTによる文脈判断に基づく調整 ---
-#     gpt_risk_modifier = gpt_context_judgement.get('gpt_risk_modifier', 'なし')
-#     contextual_intent = gpt_context_judgement.get('contextual_intent', '')
-#     gpt_additional_risk_factor = gpt_context_judgement.get('gpt_additional_risk_factor', '')
-
-#     if gpt_risk_modifier == '増幅':
-#         if alert_level == "予":
-#             alert_level = "中"
-#             reasons.append(f"**文脈評価（GPT）**: 発言の意図がリスクを増幅させると判断されました。意図: {contextual_intent}")
-#         elif alert_level == "中":
-#             alert_level = "重"
-#             reasons.append(f"**文脈評価（GPT）**: 発言の意図がリスクをさらに増幅させると判断されました。意図: {contextual_intent}")
-#         if gpt_additional_risk_factor and gpt_additional_risk_factor != 'なし':
-#             reasons.append(f"追加のリスク要因: {gpt_additional_risk_factor}")
-#     elif gpt_risk_modifier == '軽減':
-#         if alert_level == "重":
-#             alert_level = "中"
-#             reasons.append(f"**文脈評価（GPT）**: 発言が皮肉や誤解の可能性があり、アラートレベルを調整しました。要詳細確認。意図: {contextual_intent}")
-#         elif alert_level == "中":
-#             alert_level = "予"
-#             reasons.append(f"**文脈評価（GPT）**: 発言が皮肉や誤解の可能性があり、アラートレベルを調整しました。要詳細確認。意図: {contextual_intent}")
-#         if gpt_additional_risk_factor and gpt_additional_risk_factor != 'なし':
-#             reasons.append(f"軽減要因: {gpt_additional_risk_factor}")
-#     else:
-#         if contextual_intent and "真剣な情報伝達" in contextual_intent:
-#             if alert_level == "予":
-#                 alert_level = "中"
-#                 reasons.append(f"**文脈評価（GPT）**: 発言が真剣な情報伝達であると確認されました。")
-#             elif alert_level == "中" and "深刻な" in gpt_context_judgement.get('gpt_context_assessment', ''):
-#                 alert_level = "重"
-#                 reasons.append(f"**文脈評価（GPT）**: 文脈からより深刻なリスクが示唆されました。")
-
-#     # --- 4. incident_details / accident_time / field からの直接的なアラート条件 ---
-#     if incident_details.get('relevant_field') == '情報セキュリティ・個人情報保護':
-#         if any(kw in gemini_analysis.get('keywords', []) for kw in ['顧客情報漏洩', '不適切発言', '個人情報流出']):
-#             if alert_level != "重":
-#                 alert_level = "重"
-#             reasons.append(f"**特定条件一致**: 関連分野「{incident_details.get('relevant_field')}」で「顧客情報漏洩」または「不適切発言」が検出されたため、重大なコンプライアンス違反の可能性。")
-    
-#     final_reason = " ".join(reasons) if reasons else "特段の懸念事項は見られませんでした。"
-    
-#     # タイムスタンプは、音楽検出が最優先、次にincident_details、最後にテキスト入力の場合は不明
-#     if alert_timestamp == '不明' and incident_details.get('incident_timestamp_approx') != 'N/A':
-#         alert_timestamp = incident_details.get('incident_timestamp_approx', '不明')
-    
-#     return {
-#         'level': alert_level,
-#         'reason': final_reason,
-#         'timestamp': alert_timestamp,
-#         'original_text_segment': original_text_segment
-#     }
-
-# # --- 9. アラートレベルの優先度を定義するヘルパー関数 ---
-# def get_alert_level_priority(level: str) -> int:
-#     if level == "重": return 3
-#     if level == "中": return 2
-#     if level == "予": return 1
-#     return 0 # 不明など
-
-# # --- 10. 複数ソースからのアラート統合 ---
-# def integrate_multi_source_alerts(video_result: dict = None, text_result: dict = None) -> dict:
-#     """
-#     動画由来とテキスト由来のアラート結果を統合し、最終的なコンプライアンスアラートを生成する。
-#     """
-#     final_alert_level = "予"
-#     final_reasons = []
-#     final_timestamp = "不明"
-#     final_original_text_segment = "N/A" # 最終的に最も関連性の高いテキストを保持
-
-#     # 動画由来のアラートを処理
-#     if video_result:
-#         video_specific_alert = generate_alert(
-#             video_result['gemini_analysis'],
-#             video_result['incident_details'],
-#             video_result['gpt_context_judgement'],
-#             video_result['transcripts'],
-#             video_result['music_detection_result'],
-#             source_type="video" # source_type を追加
-#         )
-#         # 動画由来のアラートレベルと理由を統合
-#         if get_alert_level_priority(video_specific_alert['level']) > get_alert_level_priority(final_alert_level):
-#             final_alert_level = video_specific_alert['level']
-#         final_reasons.append(f"[動画分析]: {video_specific_alert['reason']}")
-        
-#         # タイムスタンプとテキストセグメントは動画が優先される
-#         if video_specific_alert['timestamp'] != '不明':
-#             final_timestamp = video_specific_alert['timestamp']
-#         if video_specific_alert['original_text_segment'] != '該当テキストなし':
-#             final_original_text_segment = video_specific_alert['original_text_segment']
-
-#     # テキスト由来のアラートを処理
-#     if text_result:
-#         text_specific_alert = generate_alert(
-#             text_result['gemini_analysis'],
-#             text_result['incident_details'],
-#             text_result['gpt_context_judgement'],
-#             text_result['transcripts'], # ダミーのtranscript
-#             text_result['music_detection_result'], # None
-#             source_type="text_input" # source_type を追加
-#         )
-#         # テキスト由来のアラートレベルと理由を統合
-#         if get_alert_level_priority(text_specific_alert['level']) > get_alert_level_priority(final_alert_level):
-#             final_alert_level = text_specific_alert['level']
-#         final_reasons.append(f"[テキスト分析]: {text_specific_alert['reason']}")
-        
-#         # テキスト由来のタイムスタンプは通常「不明」だが、もし特定できれば、動画のタイムスタンプがなければ採用
-#         if text_specific_alert['timestamp'] != '不明' and final_timestamp == '不明':
-#              final_timestamp = text_specific_alert['timestamp']
-#         # テキスト由来のオリジナルテキストセグメントも、動画のものがなければ採用
-#         if text_specific_alert['original_text_segment'] != '該当テキストなし' and final_original_text_segment == 'N/A':
-#             final_original_text_segment = text_specific_alert['original_text_segment']
-
-#     return {
-#         'level': final_alert_level,
-#         'reason': " ".join(final_reasons),
-#         'timestamp': final_timestamp,
-#         'original_text_segment': final_original_text_segment
-#     }
-
-
-# # --- 11. エージェントの実行エントリポイント ---
-# def run_compliance_agent(text_input: str = None, video_path: str = None) -> dict:
-#     """
-#     コンプライアンス判定AIエージェントの全処理を実行する。
-#     テキストのみ、または動画パスを指定して実行可能。
-#     """
-#     video_alert_data = None
-#     text_alert_data = None
-
-#     # --- 入力タイプの判定と初期処理 ---
-#     if video_path and text_input:
-#         print("WARNING: 動画パスとテキスト入力の両方が指定されました。両方を分析し、結果を統合します。")
-        
-#         # 動画処理パス
-#         transcripts_with_timestamps_video = process_video_to_transcript(video_path)
-#         plain_text_from_video = extract_plain_text(transcripts_with_timestamps_video['segments'])
-#         music_detection_result = None
-#         audio_output_path = "temp_audio_for_music_detection.mp3"
-#         audio_extracted = extract_audio_from_video(video_path, audio_output_path)
-#         if audio_extracted:
-#             music_detection_result = detect_copyrighted_music_from_audio(audio_output_path)
-#             os.remove(audio_output_path)
-#         else:
-#             print("WARNING: 音声抽出に失敗したため、著作権音楽検出はスキップされます。")
-#         gemini_analysis_video = analyze_with_gemini_deep_research(plain_text_from_video)
-#         incident_details_video = cross_check_and_annotate_incident(gemini_analysis_video, transcripts_with_timestamps_video['segments'])
-#         gpt_context_judgement_video = judge_context_with_gpt(
-#             incident_details_video.get('context_for_gpt', plain_text_from_video),
-#             incident_details_video.get('incident_timestamp_approx', ''),
-#             incident_details_video.get('relevant_field', '')
-#         )
-#         video_alert_data = {
-#             'gemini_analysis': gemini_analysis_video,
-#             'incident_details': incident_details_video,
-#             'gpt_context_judgement': gpt_context_judgement_video,
-#             'transcripts': transcripts_with_timestamps_video['segments'],
-#             'music_detection_result': music_detection_result
-#         }
-
-#         # テキスト処理パス
-#         plain_text_from_input = text_input
-#         dummy_transcripts_for_text = [{"start": 0.0, "end": 0.0, "text": text_input}]
-#         gemini_analysis_text = analyze_with_gemini_deep_research(plain_text_from_input)
-#         incident_details_text = cross_check_and_annotate_incident(gemini_analysis_text, dummy_transcripts_for_text)
-#         gpt_context_judgement_text = judge_context_with_gpt(
-#             incident_details_text.get('context_for_gpt', plain_text_from_input),
-#             incident_details_text.get('incident_timestamp_approx', ''),
-#             incident_details_text.get('relevant_field', '')
-#         )
-#         text_alert_data = {
-#             'gemini_analysis': gemini_analysis_text,
-#             'incident_details': incident_details_text,
-#             'gpt_context_judgement': gpt_context_judgement_text,
-#             'transcripts': dummy_transcripts_for_text,
-#             'music_detection_result': None # テキスト入力の場合は音楽検出なし
-#         }
-
-#     elif video_path:
-#         print(f"DEBUG: 動画パス '{video_path}' を入力として処理を開始します。")
-#         transcripts_with_timestamps = process_video_to_transcript(video_path)
-#         plain_text = extract_plain_text(transcripts_with_timestamps['segments'])
-#         music_detection_result = None
-#         audio_output_path = "temp_audio_for_music_detection.mp3"
-#         audio_extracted = extract_audio_from_video(video_path, audio_output_path)
-#         if audio_extracted:
-#             music_detection_result = detect_copyrighted_music_from_audio(audio_output_path)
-#             os.remove(audio_output_path)
-#         else:
-#             print("WARNING: 音声抽出に失敗したため、著作権音楽検出はスキップされます。")
-#         gemini_analysis = analyze_with_gemini_deep_research(plain_text)
-#         incident_details = cross_check_and_annotate_incident(gemini_analysis, transcripts_with_timestamps['segments'])
-#         gpt_context_judgement = judge_context_with_gpt(
-#             incident_details.get('context_for_gpt', plain_text),
-#             incident_details.get('incident_timestamp_approx', ''),
-#             incident_details.get('relevant_field', '')
-#         )
-#         video_alert_data = {
-#             'gemini_analysis': gemini_analysis,
-#             'incident_details': incident_details,
-#             'gpt_context_judgement': gpt_context_judgement,
-#             'transcripts': transcripts_with_timestamps['segments'],
-#             'music_detection_result': music_detection_result
-#         }
+    try:
+        fingerprint = audio.fingerprint()
+    except AudioFingerprintError as e:
+        logger.error("音声の指紋を作れませんでした: %s", e)
+        return {**not_detected, 'error': f'Audio fingerprinting failed: {e}'}
+
+    with span("music_lookup"):
+        match = music_index.lookup(fingerprint)
+    if match is None:
+        logger.debug("参照カタログの音楽は検出されませんでした。")
+        return not_detected
+
+    track = match['track']
+    logger.debug("音楽を検出しました: %s（一致したハッシュ数: %d）", track.get("title"), match["matched_hashes"])
+    return {
+        'detected': True,
+        'title': track.get('title'),
+        'artist': track.get('artist'),
+        'album': track.get('album'),
+        'genres': ', '.join(track.get('genres', [])) or None,
+        'start_time': match['start_time'],
+        'end_time': match['end_time'],
+        'play_offset': match['play_offset'],
+        'is_copyrighted': track.get('is_copyrighted', True),
+        'detection_method': 'local_fingerprint'
+    }
 
 # # テスト用のコード
 # if __name__ == "__main__":
@@ -1114,6 +1019,7 @@ def analyze_image_and_text_compliance(
         キャラクタータイプ: {speaker_background.get('character_type', '不明')}
         通常の発言スタイル: {speaker_background.get('usual_style', '不明')}
         過去のコンプライアンス関連事案: {', '.join(speaker_background.get('past_incidents', ['なし']))}
+        {_format_precomputed_research(speaker_background)}
         """
 
     # プロンプトの構築
@@ -1121,7 +1027,7 @@ def analyze_image_and_text_compliance(
     以下の画像とテキストを分析し、コンプライアンス違反の可能性を評価してください。
 
     1. 分析対象:
-    {f"画像ファイル: {image_path}" if image_path else "画像なし"}
+    {"画像ファイル: 添付あり" if image_path else "画像なし"}
     {f"テキスト入力: {text_input}" if text_input else "テキスト入力なし"}
 
     2. 発言者/投稿者情報:
@@ -1162,33 +1068,51 @@ def analyze_image_and_text_compliance(
                 raise FileNotFoundError(f"画像ファイルが見つかりません: {image_path}")
             
             # 画像ファイルをアップロード
-            image_file = client.files.upload(file=image_path)
+            with span("upload"):
+                image_file = use_cassette(
+                    "gemini",
+                    "files.upload",
+                    {"file": pathlib.Path(image_path)},
+                    lambda: client.files.upload(file=image_path),
+                )
             
             # ファイルの処理が完了するまで待機
-            while image_file.state.name == "PROCESSING":
-                print("画像を処理中...", end="\r")
-                time.sleep(1)
-                image_file = client.files.get(name=image_file.name)
+            with span("processing_wait"):
+                while image_file.state.name == "PROCESSING":
+                    logger.debug("画像を処理中...")
+                    wait_for_remote(1)
+                    image_file = use_cassette(
+                        "gemini", "files.get", {"name": image_file.name}, lambda: client.files.get(name=image_file.name)
+                    )
 
         # Gemini APIで分析を実行
         contents = [prompt]
         if image_file:
             contents.append(image_file)
 
-        response = client.models.generate_content(
-            model=model_name,
-            contents=contents
-        )
+        with span("generation"):
+            response = call_with_rate_limit(
+                "gemini",
+                model_name,
+                lambda: client.models.generate_content(
+                    model=model_name,
+                    contents=contents
+                ),
+                estimated_tokens=estimate_tokens(prompt),
+                read_token_usage=read_gemini_token_usage,
+                cassette_request={"contents": [prompt, image_file.name if image_file else None]},
+            )
 
         # レスポンスの処理
-        response_text = response.candidates[0].content.parts[0].text
-        
-        # JSON部分を抽出（```json と ``` の間のテキスト）
-        json_text = re.search(r'```json\n(.*?)\n```', response_text, re.DOTALL)
-        if json_text:
-            analysis_result = json.loads(json_text.group(1))
-        else:
-            raise ValueError("JSONデータが見つかりませんでした")
+        with span("parse"):
+            response_text = response.candidates[0].content.parts[0].text
+            
+            # JSON部分を抽出（```json と ``` の間のテキスト）
+            json_text = re.search(r'```json\n(.*?)\n```', response_text, re.DOTALL)
+            if json_text:
+                analysis_result = json.loads(json_text.group(1))
+            else:
+                raise ValueError("JSONデータが見つかりませんでした")
 
         print(f"DEBUG: 分析が完了しました。リスクレベル: {analysis_result.get('risk_level')}")
         return analysis_result
@@ -1268,29 +1192,64 @@ def detailed_video_analysis(video_path, speaker_background=None):
         if os.path.exists(video_path):
             logs.append(f"動画ファイルサイズ: {os.path.getsize(video_path) / (1024*1024):.2f} MB")
 
+        speaker_background = enrich_speaker_background(speaker_background)
+
         # 1. 文字起こしを実行
         logs.append("=== 文字起こしの実行 ===")
-        transcript_result = process_video_to_transcript(video_path)
-        logs.append(f"セグメント数: {len(transcript_result['segments'])}")
-        logs.append(f"全体の文字数: {len(transcript_result['full_text'])}")
-
-        # 最初の3セグメントを表示
-        for i, segment in enumerate(transcript_result['segments'][:3]):
-            logs.append(f"セグメント {i+1}: 時間: {segment['start']:.2f} - {segment['end']:.2f}")
-            logs.append(f"テキスト: {segment['text']}")
-            if segment['words']:
-                logs.append("単語レベルのタイムスタンプ:")
-                for word in segment['words'][:5]:
-                    logs.append(f"  {word['word']}: {word['start']:.2f} - {word['end']:.2f}")
-
-        # 2. コンプライアンス分析を実行
-        logs.append("=== コンプライアンス分析の実行 ===")
-        compliance_result = analyze_video_compliance(video_path, transcript_result['segments'])
+        # Gemini へのアップロードとサーバー側の処理は文字起こしに依存しないため、文字起こしと並行して進める
+        # 文字起こしで例外が発生した場合も、アップロードが終わるまで動画ファイルを使い続けられるよう with で待つ
+        with ThreadPoolExecutor(max_workers=1) as upload_executor:
+            upload_future = upload_executor.submit(contextvars.copy_context().run, upload_video_for_analysis, video_path)
+
+            # 音声は1回だけデコードし、文字起こし用の圧縮と指紋（文字起こしキャッシュ・音楽検出）で共有する
+            with ExitStack() as audio_scope:
+                try:
+                    audio = audio_scope.enter_context(decode_audio(video_path))
+                except AudioDecodeError as e:
+                    logs.append(f"音声をデコードできないため、動画をそのまま文字起こしします: {e}")
+                    audio = None
+                transcript_result = process_video_to_transcript(video_path, audio)
+                # 指紋は文字起こしキャッシュの照合で作ったものを使い回すため、照合だけで済む
+                music_detection_result = detect_copyrighted_music_from_audio(audio) if audio is not None else None
+            if music_detection_result is not None:
+                logs.append(f"音楽の検出結果: {music_detection_result}")
+            logs.append(f"セグメント数: {len(transcript_result)}")
+            logs.append(f"全体の文字数: {len(transcript_result.full_text)}")
+
+            # 最初の3セグメントを表示
+            for i in range(min(3, len(transcript_result))):
+                logs.append(f"セグメント {i+1}: 時間: {transcript_result.segment_starts[i]:.2f} - {transcript_result.segment_ends[i]:.2f}")
+                logs.append(f"テキスト: {transcript_result.segment_text(i)}")
+                words = transcript_result.segment_words(i)
+                if words:
+                    logs.append("単語レベルのタイムスタンプ:")
+                    for word, word_start, word_end in words[:5]:
+                        logs.append(f"  {word}: {word_start:.2f} - {word_end:.2f}")
+
+            # 2. コンプライアンス分析を実行
+            logs.append("=== コンプライアンス分析の実行 ===")
+            compliance_result = analyze_video_compliance(video_path, transcript_result, upload=upload_future)
         logs.append(f"要約: {compliance_result['summary']}")
         violations = compliance_result.get('violations', [])
         logs.append(f"検出された違反数: {len(violations)}")
 
+        # 同じ場面の重複した報告をまとめ、文脈判断の呼び出しを減らす
+        violations = merge_violations(violations)
+        compliance_result['violations'] = violations
+        logs.append(f"統合後の違反数: {len(violations)}")
+
         # 3. 各違反に対して文脈判断を実行
+        # 文字起こしはすべての違反で同じものを渡す（予算を超える場合は1回だけ圧縮する）
+        judgement_transcript = transcript_result.full_text
+        if violations:
+            judgement_transcript, judgement_compaction = fit_transcript_to_budget(
+                transcript_result, CONTEXT_JUDGEMENT_MODEL, get_transcript_budget(CONTEXT_JUDGEMENT_MODEL), plain_text=True
+            )
+            if judgement_compaction is not None:
+                logs.append(f"文脈判断用に文字起こしを圧縮しました: {judgement_compaction.to_dict()}")
+                compliance_result.setdefault('transcript_compactions', []).append(judgement_compaction.to_dict())
+            if not transcript_result:
+                judgement_transcript = NO_SPEECH_TRANSCRIPT
         for i, violation in enumerate(violations, 1):
             logs.append(f"違反 {i}:")
             logs.append(f"タイプ: {violation['type']}")
@@ -1300,16 +1259,17 @@ def detailed_video_analysis(video_path, speaker_background=None):
             if violation.get('related_text'):
                 logs.append(f"関連テキスト: {violation['related_text']}")
             # 文脈判断
-            context_judgement = judge_context_with_gpt(
-                transcript_result['full_text'],
-                violation,
-                speaker_background or {
-                    'name': '不明',
-                    'past_incidents': [],
-                    'character_type': '不明',
-                    'usual_style': '不明'
-                }
-            )
+            with span("judgment", violation_index=i):
+                context_judgement = judge_context_with_gpt(
+                    judgement_transcript,
+                    violation,
+                    speaker_background or {
+                        'name': '不明',
+                        'past_incidents': [],
+                        'character_type': '不明',
+                        'usual_style': '不明'
+                    }
+                )
             logs.append(f"文脈判断結果: {context_judgement}")
             violation['context_judgement'] = context_judgement
             logs.append("="*50)
@@ -1317,7 +1277,8 @@ def detailed_video_analysis(video_path, speaker_background=None):
         return {
             "logs": logs,
             "transcript_result": transcript_result,
-            "compliance_result": compliance_result
+            "compliance_result": compliance_result,
+            "music_detection_result": music_detection_result
         }
     except Exception as e:
         logs.append(f"ERROR: {e}")
@@ -1331,6 +1292,7 @@ def detailed_image_text_analysis(image_path, text_input, speaker_background=None
         logs.append("=== 画像とテキストのコンプライアンス分析テスト ===")
         logs.append(f"画像パス: {image_path}")
         logs.append(f"テキスト: {text_input}")
+        speaker_background = enrich_speaker_background(speaker_background)
         logs.append(f"発言者背景: {speaker_background}")
 
         # 分析の実行
@@ -1377,6 +1339,7 @@ def detailed_text_only_analysis(text_input, speaker_background=None):
     try:
         logs.append("=== テキストのみのコンプライアンス分析テスト ===")
         logs.append(f"テキスト: {text_input}")
+        speaker_background = enrich_speaker_background(speaker_background)
         logs.append(f"発言者背景: {speaker_background}")
 
         # 分析の実行（画像なしでテキストのみ）
@@ -1416,4 +1379,89 @@ def detailed_text_only_analysis(text_input, speaker_background=None):
         logs.append(f"ERROR: {e}")
         import traceback
         logs.append(traceback.format_exc())
-        return {"logs": logs, "error": str(e)}
\ No newline at end of file
+        return {"logs": logs, "error": str(e)}
+
+def detailed_post_analysis(video_path=None, text_input=None, speaker_background=None, live_research=False):
+    """動画とテキストを含む投稿を分析し、両方の結果を重・中・予のアラートに統合する.
+
+    動画・テキスト・発言者リサーチの分析は互いに依存しないため並行に実行し、投稿全体の待ち時間を最も遅い分析の時間に抑える。
+
+    Args:
+        video_path (str, optional): 投稿の動画ファイルのパス。
+        text_input (str, optional): 投稿のテキスト。
+        speaker_background (dict, optional): 発言者/投稿者の背景情報。
+        live_research (bool): 保存済みの発言者リサーチがない場合に、エージェントを実行して調査するか。
+    """
+    logs = []
+    try:
+        logs.append("=== 投稿（動画・テキスト）のコンプライアンス分析 ===")
+        branches = {}
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            def submit(source: str, function, *args):
+                # スパンをこのリクエストの内訳に記録できるよう、分析ごとにコンテキストを引き継ぐ
+                def run_branch():
+                    with span("branch", source=source):
+                        return function(*args)
+                branches[source] = executor.submit(contextvars.copy_context().run, run_branch)
+
+            if video_path:
+                submit("video", detailed_video_analysis, video_path, speaker_background)
+            if text_input:
+                submit("text", detailed_text_only_analysis, text_input, speaker_background)
+            submit("research", research_speaker_for_post, speaker_background, analyze_with_gemini_deep_research, live_research)
+            results = {}
+            errors = []
+            failures = {}
+            for source, future in branches.items():
+                # 1つの分析の例外で他の分析の結果を捨てないよう、分析ごとに受け取り、残りの結果でアラートを作る
+                try:
+                    results[source] = future.result()
+                except Exception as e:
+                    logs.append(f"ERROR: {source} の分析に失敗しました: {e}")
+                    errors.append(f"{source}: {e}")
+                    failures[source] = str(e)
+
+        video_result = results.get("video")
+        text_result = results.get("text")
+        for source, label in (("video", "動画"), ("text", "テキスト")):
+            if results.get(source) is not None:
+                logs.append(f"=== {label}の分析 ===")
+                logs.extend(results[source].get("logs", []))
+
+        def branch_alert(source, result_key, to_alert):
+            # 失敗した（結果のない）分析を「懸念なし」として扱わないよう、未確認のアラートにする
+            if source not in branches:
+                return None
+            result = results.get(source)
+            if result is None or result.get("error") or result.get(result_key) is None:
+                error = failures.get(source) or (result or {}).get("error") or f"{result_key} がありません"
+                return unverified_alert(error)
+            return to_alert(result)
+
+        alert = integrate_multi_source_alerts(
+            video_result=branch_alert(
+                "video",
+                "compliance_result",
+                lambda result: video_alert(result["compliance_result"], result.get("music_detection_result")),
+            ),
+            text_result=branch_alert("text", "analysis_result", lambda result: text_alert(result["analysis_result"])),
+            research_result=research_alert(results.get("research")),
+        )
+        logs.append(f"統合したアラート: {alert['level']} {alert['reason']}")
+
+        errors.extend(f"{source}: {result['error']}" for source, result in results.items() if result and result.get("error"))
+        post_result = {
+            "logs": logs,
+            "alert": alert,
+            "video_result": video_result,
+            "text_result": text_result,
+            "speaker_research": results.get("research"),
+        }
+        if errors:
+            post_result["error"] = "; ".join(errors)
+        return post_result
+    except Exception as e:
+        logs.append(f"ERROR: {e}")
+        import traceback
+        logs.append(traceback.format_exc())
+        return {"logs": logs, "error": str(e)}
@@ -0,0 +1 @@
+"""チェッカーとリサーチエージェントが共有する基盤機能."""
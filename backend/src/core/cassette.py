@@ -0,0 +1,221 @@
+"""外部APIの呼び出しをディスクに記録し、そのまま再生するカセット."""
+
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import pathlib
+import threading
+import time
+from typing import Any, Awaitable, Callable, TypeVar, cast
+
+from pydantic import BaseModel
+
+from core.hashing import file_sha256, json_sha256
+from core.paths import resolve_cache_path
+
+T = TypeVar("T")
+
+CASSETTE_MODES = ("off", "record", "replay")
+DEFAULT_CASSETTE_DIRNAME = "cassettes"
+
+
+class CassetteMissError(LookupError):
+    """リプレイ中に、記録されていないリクエストが送られたことを示す."""
+
+
+_lock = threading.Lock()
+# リプレイ用に読み込んだカセット（パス -> 記録内容）
+_loaded_cassettes: dict[str, dict[str, Any]] = {}
+# 同じリクエストが何回目か（ポーリングなど、同一リクエストで応答が変わる場合に記録順で返す）
+_replay_positions: dict[str, int] = {}
+# このプロセスで記録を始めたカセット。初回は上書きし、以降は応答を追記する
+_recorded_paths: set[str] = set()
+
+
+def get_cassette_mode() -> str:
+    """環境変数 CASSETTE_MODE を返す.
+
+    off: 通常どおりAPIを呼ぶ / record: 呼び出して応答を記録する / replay: 記録した応答を返し、APIは呼ばない。
+    """
+    mode = os.getenv("CASSETTE_MODE", "off")
+    if mode not in CASSETTE_MODES:
+        raise ValueError(
+            f"CASSETTE_MODE は {', '.join(CASSETTE_MODES)} のいずれかを指定してください: {mode}"
+        )
+    return mode
+
+
+def is_replaying() -> bool:
+    """カセットを再生中（CASSETTE_MODE=replay）であれば True を返す."""
+    return get_cassette_mode() == "replay"
+
+
+def wait_for_remote(seconds: float) -> None:
+    """外部サービス側の処理（アップロードしたファイルの処理など）を待つ.
+
+    リプレイ中は応答が記録済みのため待たない。
+    """
+    if not is_replaying():
+        time.sleep(seconds)
+
+
+def get_cassette_dir() -> str:
+    """カセットの保存先.
+
+    環境変数 CASSETTE_DIR で変更できる（既定: キャッシュディレクトリ内の cassettes/）。
+    """
+    cassette_dir = os.getenv("CASSETTE_DIR") or resolve_cache_path(
+        DEFAULT_CASSETTE_DIRNAME
+    )
+    os.makedirs(cassette_dir, exist_ok=True)
+    return cassette_dir
+
+
+def _encode_request(value: Any) -> Any:
+    """リクエストを照合用のJSONに変換する.
+
+    Path は一時ファイル名に依存しないよう内容のハッシュで、bytes もハッシュで表す。
+    """
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, pathlib.Path):
+        return {"file_sha256": file_sha256(str(value))}
+    if isinstance(value, bytes):
+        return {"bytes_sha256": hashlib.sha256(value).hexdigest()}
+    if isinstance(value, dict):
+        return {str(key): _encode_request(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_request(item) for item in value]
+    return value
+
+
+def _encode_response(value: Any) -> Any:
+    """SDKの応答（pydantic モデルを含む dict / list）を、型を復元できる形でJSONに変換する."""
+    if isinstance(value, BaseModel):
+        model_class = type(value)
+        return {
+            "__model__": f"{model_class.__module__}:{model_class.__qualname__}",
+            "data": json.loads(value.model_dump_json()),
+        }
+    if isinstance(value, dict):
+        return {key: _encode_response(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_response(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"カセットに記録できない応答の型です: {type(value).__name__}")
+
+
+def _decode_response(value: Any) -> Any:
+    if isinstance(value, dict) and "__model__" in value:
+        module_name, qualname = value["__model__"].split(":")
+        model_class = importlib.import_module(module_name)
+        for name in qualname.split("."):
+            model_class = getattr(model_class, name)
+        return model_class.model_validate_json(json.dumps(value["data"]))
+    if isinstance(value, dict):
+        return {key: _decode_response(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode_response(item) for item in value]
+    return value
+
+
+def _cassette_path(provider: str, name: str, encoded_request: Any) -> tuple[str, str]:
+    """リクエストからカセットのキーとファイルパスを求める."""
+    key = json_sha256({"provider": provider, "name": name, "request": encoded_request})
+    return key, os.path.join(get_cassette_dir(), provider, f"{key}.json")
+
+
+def _replay(provider: str, name: str, request_payload: Any) -> Any:
+    key, path = _cassette_path(provider, name, _encode_request(request_payload))
+    with _lock:
+        cassette = _loaded_cassettes.get(path)
+        if cassette is None:
+            if not os.path.exists(path):
+                raise CassetteMissError(
+                    f"{provider}/{name} のリクエストは記録されていません（キー: {key}）"
+                )
+            with open(path, encoding="utf-8") as cassette_file:
+                cassette = json.load(cassette_file)
+            _loaded_cassettes[path] = cassette
+
+        # 記録より多く呼ばれた場合は最後の応答を返し続ける
+        position = _replay_positions.get(path, 0)
+        _replay_positions[path] = position + 1
+        recorded = cassette["responses"][min(position, len(cassette["responses"]) - 1)]
+    return _decode_response(recorded)
+
+
+def _record(provider: str, name: str, request_payload: Any, response: Any) -> None:
+    encoded_request = _encode_request(request_payload)
+    _, path = _cassette_path(provider, name, encoded_request)
+    encoded_response = _encode_response(response)
+    with _lock:
+        cassette = None
+        if path in _recorded_paths and os.path.exists(path):
+            with open(path, encoding="utf-8") as cassette_file:
+                cassette = json.load(cassette_file)
+        if cassette is None:
+            cassette = {
+                "provider": provider,
+                "name": name,
+                "request": encoded_request,
+                "responses": [],
+            }
+        cassette["responses"].append(encoded_response)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as cassette_file:
+            json.dump(cassette, cassette_file, ensure_ascii=False, indent=1)
+        os.replace(temp_path, path)
+        _recorded_paths.add(path)
+
+
+def use_cassette(
+    provider: str, name: str, request_payload: Any | None, request: Callable[[], T]
+) -> T:
+    """CASSETTE_MODE に応じて、外部APIの呼び出しを記録・再生する.
+
+    Args:
+        provider (str): "openai" または "gemini"。
+        name (str): モデル名または操作名（例: "files.upload"）。
+        request_payload (Any): リクエストを識別する内容（プロンプト、設定、ファイルの Path など）。
+                               None の場合は記録・再生の対象にしない。
+        request (Callable): 実際のAPI呼び出し。
+
+    Returns:
+        request の戻り値、またはリプレイ時は記録された応答。
+    """
+    mode = get_cassette_mode()
+    if request_payload is None or mode == "off":
+        return request()
+    if mode == "replay":
+        return cast(T, _replay(provider, name, request_payload))
+
+    response = request()
+    _record(provider, name, request_payload, response)
+    return response
+
+
+async def ause_cassette(
+    provider: str,
+    name: str,
+    request_payload: Any | None,
+    request: Callable[[], Awaitable[T]],
+) -> T:
+    """use_cassette の非同期版.
+
+    request はコルーチンを返す関数を渡す。
+    """
+    mode = get_cassette_mode()
+    if request_payload is None or mode == "off":
+        return await request()
+    if mode == "replay":
+        return await asyncio.to_thread(_replay, provider, name, request_payload)
+
+    response = await request()
+    await asyncio.to_thread(_record, provider, name, request_payload, response)
+    return response
@@ -0,0 +1,28 @@
+"""ファイルの内容とJSON値の SHA-256（カセットや合流のキーに使う）."""
+
+import hashlib
+import json
+from typing import Any
+
+FILE_HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """ファイルの内容の SHA-256 を返す.
+
+    大きな動画でもメモリに載せないよう、チャンクごとに読む。
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(FILE_HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def json_sha256(value: Any) -> str:
+    """JSONに変換できる値の SHA-256 を返す.
+
+    キーの順序に依存しないよう並べ替えてから計算する。
+    """
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
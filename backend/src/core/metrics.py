@@ -0,0 +1,316 @@
+"""処理段階ごとの所要時間とモデルAPI呼び出しの Prometheus メトリクス."""
+
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, TypeVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+
+T = TypeVar("T")
+
+# モデル呼び出しや動画処理は数十秒から数分かかるため、既定より長い区間までバケットを用意する
+DURATION_BUCKETS = (
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    20,
+    40,
+    60,
+    120,
+    300,
+    600,
+)
+
+STAGE_DURATION = Histogram(
+    "compliance_stage_duration_seconds",
+    "処理段階ごとの所要時間",
+    ["stage", "status"],
+    buckets=DURATION_BUCKETS,
+)
+REQUEST_DURATION = Histogram(
+    "compliance_request_duration_seconds",
+    "APIリクエスト全体の所要時間",
+    ["endpoint", "status_code"],
+    buckets=DURATION_BUCKETS,
+)
+MODEL_CALLS = Counter(
+    "compliance_model_calls_total",
+    "モデルAPIの呼び出し回数",
+    ["provider", "model", "status"],
+)
+MODEL_TOKENS = Counter(
+    "compliance_model_tokens_total",
+    "モデルAPIが報告した消費トークン数",
+    ["provider", "model"],
+)
+MODEL_PROMPT_TOKENS = Counter(
+    "compliance_model_prompt_tokens_total",
+    "モデルAPIが報告した入力トークン数",
+    ["provider", "model"],
+)
+MODEL_CACHED_TOKENS = Counter(
+    "compliance_model_cached_tokens_total",
+    "入力トークンのうちプロバイダーのキャッシュから読まれたトークン数",
+    ["provider", "model"],
+)
+MODEL_CALL_DURATION = Histogram(
+    "compliance_model_call_duration_seconds",
+    "モデルAPIの1回の呼び出しの所要時間（入力の一部がキャッシュから読まれたか別）",
+    ["provider", "model", "prompt_cache"],
+    buckets=DURATION_BUCKETS,
+)
+TRANSCRIPT_COMPACTIONS = Counter(
+    "compliance_transcript_compactions_total",
+    "プロンプトの予算を超えたため圧縮した文字起こしの数（圧縮しても収まらなかったものは over_budget）",
+    ["model", "result"],
+)
+COALESCED_REQUESTS = Counter(
+    "compliance_coalesced_requests_total",
+    "実行中の同じ分析の結果を共有したリクエストの数",
+    ["endpoint"],
+)
+MODEL_CALLS_AVOIDED = Counter(
+    "compliance_model_calls_avoided_total",
+    "同じ分析の結果を共有したことで省略できたモデルAPIの呼び出し回数",
+    ["endpoint"],
+)
+ANALYSIS_QUEUE_DEPTH = Gauge(
+    "compliance_analysis_queue_depth",
+    "実行枠を待っている分析リクエストの数",
+    ["priority"],
+)
+
+
+class RequestTiming:
+    """1リクエスト内で記録されたスパンの一覧.
+
+    エージェントのノードなど別スレッドからも記録されるため、追加はロックで保護する。
+    """
+
+    def __init__(self, request_id: str) -> None:
+        """計測を開始した時刻を記録する."""
+        self.request_id = request_id
+        self.started_at = time.perf_counter()
+        self._spans: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span_record: dict[str, Any]) -> None:
+        """終了したスパンを内訳に加える."""
+        with self._lock:
+            self._spans.append(span_record)
+
+    def to_dict(self) -> dict[str, Any]:
+        """レスポンスに含める所要時間の内訳を返す."""
+        with self._lock:
+            spans = sorted(self._spans, key=lambda record: record["start_ms"])
+        return {
+            "request_id": self.request_id,
+            "total_ms": round((time.perf_counter() - self.started_at) * 1000, 1),
+            "spans": spans,
+        }
+
+
+class ModelCallCount:
+    """count_model_calls の間に行われたモデルAPIの呼び出し回数."""
+
+    def __init__(self) -> None:
+        """0 から数え始める."""
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def increment(self) -> None:
+        """呼び出し回数を1増やす."""
+        with self._lock:
+            self.value += 1
+
+
+_current_timing: contextvars.ContextVar[RequestTiming | None] = contextvars.ContextVar(
+    "current_request_timing", default=None
+)
+_current_model_call_count: contextvars.ContextVar[ModelCallCount | None] = (
+    contextvars.ContextVar("current_model_call_count", default=None)
+)
+_current_span_attributes: contextvars.ContextVar[dict[str, Any] | None] = (
+    contextvars.ContextVar("current_span_attributes", default=None)
+)
+
+
+def new_request_id() -> str:
+    """リクエストの計測に使うIDを新しく作る."""
+    return uuid.uuid4().hex
+
+
+def start_request(
+    request_id: str | None = None,
+) -> tuple[RequestTiming, contextvars.Token[RequestTiming | None]]:
+    """現在のコンテキストでリクエストの計測を開始する.
+
+    戻り値のトークンを end_request に渡して元のコンテキストへ戻す。
+    """
+    timing = RequestTiming(request_id or new_request_id())
+    return timing, _current_timing.set(timing)
+
+
+def end_request(token: contextvars.Token[RequestTiming | None]) -> None:
+    """start_request で開始した計測を終え、元のコンテキストへ戻す."""
+    _current_timing.reset(token)
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[None]:
+    """処理段階の所要時間を計測し、ヒストグラムと現在のリクエストの内訳に記録する.
+
+    Args:
+        stage (str): 段階名（例: "transcription", "agent.web_research"）。メトリクスのラベルになるため固定の名前にする。
+        **attributes: 内訳にだけ含める補足情報（違反の番号など）。
+    """
+    attributes = dict(attributes)
+    attributes_token = _current_span_attributes.set(attributes)
+    started_at = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        finished_at = time.perf_counter()
+        _current_span_attributes.reset(attributes_token)
+        STAGE_DURATION.labels(stage=stage, status=status).observe(
+            finished_at - started_at
+        )
+
+        timing = _current_timing.get()
+        if timing is not None:
+            timing.add_span(
+                {
+                    "stage": stage,
+                    "start_ms": round((started_at - timing.started_at) * 1000, 1),
+                    "duration_ms": round((finished_at - started_at) * 1000, 1),
+                    "status": status,
+                    **attributes,
+                }
+            )
+
+
+def annotate_span(**attributes: Any) -> None:
+    """実行中の最も内側のスパンの内訳に補足情報を追加する（スパンの外で呼んだ場合は何もしない）."""
+    current = _current_span_attributes.get()
+    if current is not None:
+        current.update(attributes)
+
+
+@contextmanager
+def count_model_calls() -> Iterator[ModelCallCount]:
+    """ブロック内（エージェントのノードなど別スレッドを含む）で行われたモデルAPIの呼び出し回数を数える."""
+    count = ModelCallCount()
+    token = _current_model_call_count.set(count)
+    try:
+        yield count
+    finally:
+        _current_model_call_count.reset(token)
+
+
+def record_model_call(
+    provider: str, model: str, status: str, tokens: int | None = None
+) -> None:
+    """モデルAPIの呼び出し結果（ok / rate_limited / error）と消費トークン数を記録する."""
+    MODEL_CALLS.labels(provider=provider, model=model, status=status).inc()
+    count = _current_model_call_count.get()
+    if count is not None:
+        count.increment()
+    if tokens:
+        MODEL_TOKENS.labels(provider=provider, model=model).inc(tokens)
+
+
+def record_prompt_cache(
+    provider: str,
+    model: str,
+    prompt_tokens: int,
+    cached_tokens: int,
+    duration_seconds: float,
+) -> None:
+    """入力トークンのうちキャッシュから読まれた数と呼び出しの所要時間を記録する.
+
+    キャッシュの効き具合は compliance_model_cached_tokens_total / compliance_model_prompt_tokens_total で、
+    短縮できた時間は compliance_model_call_duration_seconds の prompt_cache="hit" と "miss" の比較で分かる。
+    """
+    MODEL_PROMPT_TOKENS.labels(provider=provider, model=model).inc(prompt_tokens)
+    MODEL_CACHED_TOKENS.labels(provider=provider, model=model).inc(cached_tokens)
+    MODEL_CALL_DURATION.labels(
+        provider=provider, model=model, prompt_cache="hit" if cached_tokens else "miss"
+    ).observe(duration_seconds)
+    annotate_span(prompt_tokens=prompt_tokens, cached_tokens=cached_tokens)
+
+
+def with_prompt_cache_metrics(
+    provider: str,
+    model: str,
+    request: Callable[[], T],
+    read_prompt_cache: Callable[[T], tuple[int, int] | None],
+) -> Callable[[], T]:
+    """モデルAPIの呼び出しを、プロンプトキャッシュの利用状況を記録する関数で包む.
+
+    1回ごとの所要時間を計り、成功した場合にキャッシュから読まれたトークン数と合わせて
+    record_prompt_cache で記録する。call_with_rate_limit に渡す request を包んで使う（429 で再試行した呼び出しも1回ずつ記録する）。
+
+    Args:
+        read_prompt_cache (Callable): レスポンスから (入力トークン数, うちキャッシュから読まれた数) を読む関数。読めなければ None を返す。
+    """
+
+    def timed_request() -> T:
+        started_at = time.perf_counter()
+        response = request()
+        usage = read_prompt_cache(response)
+        if usage is not None:
+            record_prompt_cache(
+                provider, model, usage[0], usage[1], time.perf_counter() - started_at
+            )
+        return response
+
+    return timed_request
+
+
+def record_transcript_compaction(model: str, over_budget: bool) -> None:
+    """文字起こしを圧縮した回数を、予算に収まったかどうかと合わせて記録する."""
+    TRANSCRIPT_COMPACTIONS.labels(
+        model=model, result="over_budget" if over_budget else "compacted"
+    ).inc()
+
+
+def record_coalesced_request(endpoint: str, avoided_model_calls: int) -> None:
+    """リクエストの合流と、それで省略できたモデルAPIの呼び出し回数を記録する."""
+    COALESCED_REQUESTS.labels(endpoint=endpoint).inc()
+    MODEL_CALLS_AVOIDED.labels(endpoint=endpoint).inc(avoided_model_calls)
+
+
+def set_queue_depth(priority: str, depth: int) -> None:
+    """実行枠を待っている分析の数を記録する."""
+    ANALYSIS_QUEUE_DEPTH.labels(priority=priority).set(depth)
+
+
+def observe_request(endpoint: str, status_code: int, duration_seconds: float) -> None:
+    """APIリクエストの所要時間をエンドポイントとステータスコードごとに記録する."""
+    REQUEST_DURATION.labels(endpoint=endpoint, status_code=str(status_code)).observe(
+        duration_seconds
+    )
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Prometheus のテキスト形式でメトリクスを返す."""
+    return generate_latest(), CONTENT_TYPE_LATEST
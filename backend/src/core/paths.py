@@ -0,0 +1,24 @@
+"""ローカルに永続化するファイル（SQLiteストアなど）の保存先を解決する."""
+
+import os
+
+# 複数のワーカープロセスが同じストアを共有できるよう、作業ディレクトリに依存しない絶対パスを既定にする
+DEFAULT_CACHE_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", ".cache")
+)
+
+
+def resolve_cache_path(filename: str) -> str:
+    """ローカルに永続化するファイル（SQLiteストアなど）のパスを解決する.
+
+    保存先は環境変数 BACKEND_CACHE_DIR で変更できる。
+
+    Args:
+        filename (str): キャッシュディレクトリ内のファイル名。
+
+    Returns:
+        str: ファイルの絶対パス。ディレクトリは必要に応じて作成される。
+    """
+    cache_dir = os.getenv("BACKEND_CACHE_DIR", DEFAULT_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, filename)
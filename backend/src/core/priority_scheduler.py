@@ -0,0 +1,171 @@
+"""分析の同時実行数を制限し、実行枠を優先度の高いリクエストから割り当てる."""
+
+import os
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Union
+
+from core.metrics import set_queue_depth, span
+
+# interactive: 投稿前チェック（ユーザーが結果を待っている） / background: タイムラインなどの受動的なスキャン
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+DEFAULT_PRIORITY = INTERACTIVE
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_RESERVED_INTERACTIVE_SLOTS = 2
+
+
+class UnknownPriorityError(ValueError):
+    """リクエストの priority が interactive / background のいずれでもないことを示す."""
+
+
+def parse_priority(value: str | None) -> str:
+    """リクエストの priority を検証する.
+
+    指定がなければ interactive として扱う。
+    """
+    if not value:
+        return DEFAULT_PRIORITY
+    if value not in PRIORITIES:
+        raise UnknownPriorityError(
+            f"priority は {', '.join(PRIORITIES)} のいずれかを指定してください: {value}"
+        )
+    return value
+
+
+class SlotTicket:
+    """1件の分析の実行枠の要求.
+
+    待っている間に promote で優先度を上げられる。
+
+    同じ内容の分析に合流したリクエストは、先に実行しているリクエストの優先度が低くても、
+    自分の優先度で枠を待てるようにする（background の待ち行列に投稿前チェックが巻き込まれないようにする）。
+    """
+
+    def __init__(self, priority: str):
+        """指定した優先度で実行枠を待つチケットを作る."""
+        self.priority = priority
+        self.ready = threading.Event()
+
+
+class PriorityScheduler:
+    """分析の同時実行数を制限し、空いた実行枠を優先度の高いリクエストから割り当てるスケジューラー.
+
+    優先度ごとに別の待ち行列（FIFO）を持ち、枠が空くと interactive の先頭から割り当てる。
+    background は interactive の待ちがないときだけ実行し、さらに reserved_interactive_slots 枠は使わない。
+    そのため background のスキャンが続いていても、投稿前チェックは長い分析の終了を待たずに開始できる。
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        reserved_interactive_slots: int = DEFAULT_RESERVED_INTERACTIVE_SLOTS,
+    ):
+        """reserved_interactive_slots 個の枠は interactive のリクエストのために空けておく."""
+        self.max_concurrency = max_concurrency
+        self.reserved_interactive_slots = min(
+            reserved_interactive_slots, max_concurrency - 1
+        )
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queues: dict[str, deque[SlotTicket]] = {
+            priority: deque() for priority in PRIORITIES
+        }
+
+    def _can_start(self, priority: str) -> bool:
+        if priority == INTERACTIVE:
+            return self._running < self.max_concurrency
+        return (
+            not self._queues[INTERACTIVE]
+            and self._running < self.max_concurrency - self.reserved_interactive_slots
+        )
+
+    def _dispatch(self) -> None:
+        """空いている枠を、待っているリクエストに優先度の高い順で割り当てる.
+
+        ロックを保持して呼ぶ。
+        """
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._can_start(priority):
+                self._running += 1
+                queue.popleft().ready.set()
+            set_queue_depth(priority, len(queue))
+
+    def acquire(self, ticket: SlotTicket) -> None:
+        """実行枠が割り当てられるまで待つ."""
+        with self._lock:
+            if not self._queues[ticket.priority] and self._can_start(ticket.priority):
+                self._running += 1
+                return
+            self._queues[ticket.priority].append(ticket)
+            set_queue_depth(ticket.priority, len(self._queues[ticket.priority]))
+        ticket.ready.wait()
+
+    def promote(self, ticket: SlotTicket) -> None:
+        """要求を interactive にする.
+
+        background の待ち行列にあれば interactive の末尾へ移し、枠が空いていればすぐに割り当てる。
+        すでに実行中・実行済みの要求や、まだ待ち行列に入っていない要求は、優先度を書き換えるだけにする。
+        """
+        with self._lock:
+            if ticket.priority == INTERACTIVE:
+                return
+            queue = self._queues[ticket.priority]
+            ticket.priority = INTERACTIVE
+            if ticket in queue:
+                queue.remove(ticket)
+                self._queues[INTERACTIVE].append(ticket)
+                self._dispatch()
+
+    def release(self) -> None:
+        """実行枠を返し、待っているリクエストに割り当てる."""
+        with self._lock:
+            self._running -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, ticket: Union[str, SlotTicket]) -> Iterator[None]:
+        """実行枠が割り当てられるまで待ち、ブロックを抜けると枠を返す.
+
+        待ち時間は queue_wait として記録する。
+
+        Args:
+            ticket (str | SlotTicket): 優先度、または待っている間に優先度を上げられるようにする場合は SlotTicket。
+        """
+        if isinstance(ticket, str):
+            ticket = SlotTicket(ticket)
+        with span("queue_wait", priority=ticket.priority):
+            self.acquire(ticket)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+_scheduler: PriorityScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_analysis_scheduler() -> PriorityScheduler:
+    """プロセス内で共有するスケジューラーを返す.
+
+    同時実行数は ANALYSIS_MAX_CONCURRENCY、interactive 専用の枠数は ANALYSIS_RESERVED_INTERACTIVE_SLOTS で変更できる。
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PriorityScheduler(
+                max_concurrency=int(
+                    os.getenv("ANALYSIS_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)
+                ),
+                reserved_interactive_slots=int(
+                    os.getenv(
+                        "ANALYSIS_RESERVED_INTERACTIVE_SLOTS",
+                        DEFAULT_RESERVED_INTERACTIVE_SLOTS,
+                    )
+                ),
+            )
+        return _scheduler
@@ -0,0 +1,98 @@
+"""CPUを使うメディア処理を別プロセスで実行する、処理数に上限のあるプール."""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from core.metrics import span
+
+T = TypeVar("T")
+
+DEFAULT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+# ワーカー1つあたりに送り込める処理の数（実行中 + 待ち）。超えた分は呼び出し側で待たせる
+DEFAULT_MAX_PENDING_PER_WORKER = 2
+# forkserver で事前に読み込んでおくモジュール。ワーカーの起動のたびに読み込み直さないようにする
+WORKER_PRELOAD_MODULES = ["media.fingerprint", "media.vad"]
+
+
+def _get_mp_context() -> multiprocessing.context.BaseContext:
+    """ワーカーの起動方法を返す.
+
+    スレッドを使うサーバーから fork するとロックの状態ごと複製されて固まることがあるため、
+    使える環境では forkserver、それ以外では spawn でワーカーを起動する。
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(WORKER_PRELOAD_MODULES)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+class BoundedProcessPool:
+    """CPUを使うメディア処理（音声の指紋や発話の検出などの信号処理）を別プロセスで実行するプール.
+
+    GILを持ったまま長く計算する処理をリクエストのスレッドから外し、I/O待ちのリクエストの応答性を保つ。
+    送り込める処理の数に上限を設け、上限に達したら空くまで呼び出し側を待たせる（メモリに処理を溜め込まない）。
+    max_workers が 0 の場合はプロセスを使わず、呼び出したスレッドでそのまま実行する。
+    """
+
+    def __init__(self, max_workers: int, max_pending: int) -> None:
+        """ワーカープロセスは最初の処理を受け取ったときに起動する."""
+        self.max_workers = max_workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
+        self._pending = threading.BoundedSemaphore(max(1, max_pending))
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=_get_mp_context()
+                )
+            return self._executor
+
+    def run(self, stage: str, function: Callable[..., T], *args: Any) -> T:
+        """関数をワーカープロセスで実行し、結果を返す.
+
+        Args:
+            stage (str): 処理段階名。待ち時間を含む所要時間を media.<stage> のスパンとして記録する。
+            function (Callable): モジュールの最上位で定義された関数（ワーカーに送るため pickle できること）。
+            *args: 関数の引数（pickle できること。大きなデータはファイルのパスで渡す）。
+        """
+        with span(f"media.{stage}"):
+            if self.max_workers == 0:
+                return function(*args)
+
+            self._pending.acquire()
+            try:
+                future = self._get_executor().submit(function, *args)
+            except BaseException:
+                self._pending.release()
+                raise
+            future.add_done_callback(lambda _: self._pending.release())
+            return future.result()
+
+
+_pool: BoundedProcessPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_media_pool() -> BoundedProcessPool:
+    """プロセス内で共有するプールを返す.
+
+    ワーカー数は MEDIA_POOL_WORKERS（0 でプロセスを使わない）、送り込める処理の数は MEDIA_POOL_MAX_PENDING で変更できる。
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            max_workers = int(os.getenv("MEDIA_POOL_WORKERS", DEFAULT_MAX_WORKERS))
+            max_pending = int(
+                os.getenv(
+                    "MEDIA_POOL_MAX_PENDING",
+                    max_workers * DEFAULT_MAX_PENDING_PER_WORKER,
+                )
+            )
+            _pool = BoundedProcessPool(max_workers, max_pending)
+        return _pool
@@ -0,0 +1,617 @@
+"""プロバイダー/モデル単位の、複数プロセスで共有するレートリミッター."""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, TypeVar
+
+from core.cassette import ause_cassette, use_cassette
+from core.metrics import record_model_call
+from core.paths import resolve_cache_path
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ProviderQuota:
+    """プロバイダー/モデルごとの1分あたりの上限.
+
+    tokens_per_minute が 0 の場合はトークン数を制限しない。
+    """
+
+    requests_per_minute: float
+    tokens_per_minute: float = 0
+
+
+# 無料枠〜標準的な有料枠を想定した控えめな既定値。実際の契約に合わせて RATE_LIMIT_QUOTAS で上書きする
+DEFAULT_QUOTAS: dict[str, ProviderQuota] = {
+    "openai": ProviderQuota(requests_per_minute=500, tokens_per_minute=200_000),
+    "openai:whisper-1": ProviderQuota(requests_per_minute=50),
+    "gemini": ProviderQuota(requests_per_minute=60, tokens_per_minute=1_000_000),
+}
+
+# 429を受けたときにレートを何倍に絞るか、成功ごとにどれだけ戻すか（AIMD制御）
+RATE_SCALE_DECREASE = 0.5
+RATE_SCALE_INCREASE = 0.05
+MIN_RATE_SCALE = 0.1
+DEFAULT_BACKOFF_SECONDS = 2.0
+DEFAULT_MAX_ATTEMPTS = 5
+# レート制限を表す例外の型名（openai.RateLimitError / google.api_core.exceptions.ResourceExhausted）
+RATE_LIMIT_ERROR_TYPES = frozenset(
+    {"RateLimitError", "ResourceExhausted", "TooManyRequests"}
+)
+
+
+def load_quotas() -> dict[str, ProviderQuota]:
+    """既定のクォータに環境変数 RATE_LIMIT_QUOTAS（JSON）の設定を重ねて返す.
+
+    例: {"gemini:gemini-2.0-flash": {"rpm": 15, "tpm": 1000000}, "openai": {"rpm": 3500}}
+    """
+    quotas = dict(DEFAULT_QUOTAS)
+    raw_overrides = os.getenv("RATE_LIMIT_QUOTAS")
+    if not raw_overrides:
+        return quotas
+
+    for key, value in json.loads(raw_overrides).items():
+        quotas[key] = ProviderQuota(
+            requests_per_minute=float(value["rpm"]),
+            tokens_per_minute=float(value.get("tpm", 0)),
+        )
+    return quotas
+
+
+def read_openai_token_usage(response: Any) -> int | None:
+    """OpenAIのレスポンスから消費トークン数を取り出す.
+
+    取得できなければ None。
+    """
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage else None
+
+
+def read_gemini_token_usage(response: Any) -> int | None:
+    """Gemini（google-genai）のレスポンスから消費トークン数を取り出す.
+
+    取得できなければ None。
+    """
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "total_token_count", None) if usage else None
+
+
+def read_openai_prompt_cache(response: Any) -> tuple[int, int] | None:
+    """OpenAIのレスポンスから (入力トークン数, うちキャッシュから読まれた数) を取り出す.
+
+    取得できなければ None。
+    """
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None) if usage else None
+    if prompt_tokens is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) if details else None
+    return prompt_tokens, cached_tokens or 0
+
+
+def read_gemini_prompt_cache(response: Any) -> tuple[int, int] | None:
+    """Gemini（google-genai）のレスポンスから (入力トークン数, うちキャッシュから読まれた数) を取り出す.
+
+    取得できなければ None。
+    """
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", None) if usage else None
+    if prompt_tokens is None:
+        return None
+    return prompt_tokens, getattr(usage, "cached_content_token_count", None) or 0
+
+
+def read_langchain_token_usage(message: Any) -> int | None:
+    """LangChainのAIMessageから消費トークン数を取り出す.
+
+    取得できなければ None。
+    """
+    usage = getattr(message, "usage_metadata", None)
+    return usage.get("total_tokens") if usage else None
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """例外がプロバイダーのレート制限（HTTP 429 / RESOURCE_EXHAUSTED）によるものかを判定する.
+
+    メッセージの文字列ではなく、ステータスコード・ステータス名・例外の型で判定する。
+    LangChainなどが元の例外を包んで送出する場合に備え、__cause__ もたどる。
+    """
+    current: BaseException | None = error
+    seen: set[int] = set()
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        if _is_rate_limit_exception(current):
+            return True
+        current = current.__cause__
+    return False
+
+
+def _is_rate_limit_exception(error: BaseException) -> bool:
+    if any(cls.__name__ in RATE_LIMIT_ERROR_TYPES for cls in type(error).__mro__):
+        return True
+    response = getattr(error, "response", None)
+    for status in (
+        getattr(error, "status_code", None),
+        getattr(error, "code", None),
+        getattr(response, "status_code", None),
+    ):
+        if status == 429:
+            return True
+    # google-genai の APIError はステータス名を status に持つ
+    return getattr(error, "status", None) == "RESOURCE_EXHAUSTED"
+
+
+def read_retry_after(error: Exception) -> float | None:
+    """レート制限エラーに Retry-After ヘッダーがあれば秒数を返す."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def request_capacity(quota: ProviderQuota, rate_scale: float) -> float:
+    """リクエスト数のバケットの容量を返す.
+
+    1分あたりの上限が小さいモデルでレートを絞ると容量が1件を下回り、二度と予約できなくなるため、最低でも1件にする。
+    """
+    return max(1.0, quota.requests_per_minute * rate_scale)
+
+
+class RateLimiter:
+    """プロバイダー/モデル単位で、リクエスト数とトークン数の2つのトークンバケットを管理する.
+
+    バケットの状態はローカルのSQLiteファイルに保存し、BEGIN IMMEDIATE による排他で
+    同一マシン上の複数ワーカープロセス間でも同じクォータを共有する。
+    429を受けるとレートを半減して一定時間送信を止め、成功が続くと少しずつ元のレートへ戻す。
+    """
+
+    def __init__(self, db_path: str, quotas: dict[str, ProviderQuota]):
+        """db_path のデータベースを開き、なければテーブルを作る."""
+        self.db_path = db_path
+        self.quotas = quotas
+        self._local = threading.local()
+        self._initialize_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3の接続はスレッド間で共有できないため、スレッドごとに保持する
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _initialize_schema(self) -> None:
+        self._connect().execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                request_tokens REAL NOT NULL,
+                token_tokens REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                rate_scale REAL NOT NULL DEFAULT 1.0,
+                blocked_until REAL NOT NULL DEFAULT 0
+            )
+            """
+        )
+
+    def resolve_quota(self, provider: str, model: str) -> ProviderQuota:
+        """モデル固有の設定があればそれを、なければプロバイダーの設定を返す."""
+        return self.quotas.get(f"{provider}:{model}") or self.quotas[provider]
+
+    def _load_bucket(
+        self, connection: sqlite3.Connection, key: str, quota: ProviderQuota, now: float
+    ) -> dict[str, Any]:
+        row = connection.execute(
+            "SELECT request_tokens, token_tokens, updated_at, rate_scale, blocked_until FROM buckets WHERE key = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return {
+                "request_tokens": request_capacity(quota, 1.0),
+                "token_tokens": quota.tokens_per_minute,
+                "updated_at": now,
+                "rate_scale": 1.0,
+                "blocked_until": 0.0,
+            }
+
+        request_tokens, token_tokens, updated_at, rate_scale, blocked_until = row
+        # 経過時間に応じて補充する。容量は1分あたりの上限 × 現在のレート倍率
+        elapsed = max(0.0, now - updated_at)
+        refill_ratio = elapsed / 60.0 * rate_scale
+        return {
+            "request_tokens": min(
+                request_capacity(quota, rate_scale),
+                request_tokens + quota.requests_per_minute * refill_ratio,
+            ),
+            "token_tokens": min(
+                quota.tokens_per_minute * rate_scale,
+                token_tokens + quota.tokens_per_minute * refill_ratio,
+            ),
+            "updated_at": now,
+            "rate_scale": rate_scale,
+            "blocked_until": blocked_until,
+        }
+
+    def _save_bucket(
+        self, connection: sqlite3.Connection, key: str, bucket: dict[str, Any]
+    ) -> None:
+        connection.execute(
+            """
+            INSERT OR REPLACE INTO buckets (key, request_tokens, token_tokens, updated_at, rate_scale, blocked_until)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                key,
+                bucket["request_tokens"],
+                bucket["token_tokens"],
+                bucket["updated_at"],
+                bucket["rate_scale"],
+                bucket["blocked_until"],
+            ),
+        )
+
+    def _update_bucket(
+        self,
+        provider: str,
+        model: str,
+        mutate: Callable[[dict[str, Any], ProviderQuota, float], T],
+    ) -> T:
+        """バケットを読み込み、mutate で更新して保存するまでを1つの排他トランザクションで行う."""
+        quota = self.resolve_quota(provider, model)
+        key = f"{provider}:{model}"
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            bucket = self._load_bucket(connection, key, quota, now)
+            outcome = mutate(bucket, quota, now)
+            self._save_bucket(connection, key, bucket)
+            connection.execute("COMMIT")
+            return outcome
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def try_acquire(
+        self, provider: str, model: str, estimated_tokens: int = 0
+    ) -> float:
+        """リクエスト1件分と推定トークン分を予約する.
+
+        Returns:
+            float: 予約できた場合は 0。できなかった場合は再試行までに待つべき秒数。
+        """
+        wait_seconds, _ = self._try_reserve(provider, model, estimated_tokens)
+        return wait_seconds
+
+    def _try_reserve(
+        self, provider: str, model: str, estimated_tokens: int
+    ) -> tuple[float, float]:
+        """try_acquire と同じく予約し、(待つべき秒数, 予約したトークン数) を返す."""
+
+        def reserve(
+            bucket: dict[str, Any], quota: ProviderQuota, now: float
+        ) -> tuple[float, float]:
+            blocked_until: float = bucket["blocked_until"]
+            if now < blocked_until:
+                return blocked_until - now, 0.0
+
+            scale = bucket["rate_scale"]
+            # 上限を超える巨大なリクエストが永久に待たされないよう、必要量はバケット容量で頭打ちにする
+            token_cost = min(float(estimated_tokens), quota.tokens_per_minute * scale)
+            has_request_budget = bucket["request_tokens"] >= 1
+            has_token_budget = (
+                quota.tokens_per_minute <= 0 or bucket["token_tokens"] >= token_cost
+            )
+            if has_request_budget and has_token_budget:
+                bucket["request_tokens"] -= 1
+                if quota.tokens_per_minute <= 0:
+                    return 0.0, 0.0
+                bucket["token_tokens"] -= token_cost
+                return 0.0, token_cost
+
+            request_wait = 0.0
+            if not has_request_budget:
+                request_wait = (1 - bucket["request_tokens"]) / (
+                    quota.requests_per_minute * scale / 60.0
+                )
+            token_wait = 0.0
+            if not has_token_budget:
+                token_wait = (token_cost - bucket["token_tokens"]) / (
+                    quota.tokens_per_minute * scale / 60.0
+                )
+            return max(request_wait, token_wait), 0.0
+
+        return self._update_bucket(provider, model, reserve)
+
+    def acquire(self, provider: str, model: str, estimated_tokens: int = 0) -> float:
+        """予約できるまでブロックして待機する.
+
+        Returns:
+            float: 予約したトークン数。推定がバケット容量を超える場合は容量で頭打ちにした値で、
+                   record_usage にはこの値を渡す。
+        """
+        while True:
+            wait_seconds, reserved_tokens = self._try_reserve(
+                provider, model, estimated_tokens
+            )
+            if wait_seconds <= 0:
+                return reserved_tokens
+            # 複数プロセスが同時に起きて再び衝突しないよう、わずかに揺らぎを加える
+            time.sleep(wait_seconds + random.uniform(0, 0.05))
+
+    async def aacquire(
+        self, provider: str, model: str, estimated_tokens: int = 0
+    ) -> float:
+        """非同期版の acquire.
+
+        待機中もイベントループを止めない。
+        """
+        while True:
+            # SQLiteのロック待ちでイベントループを止めないよう、予約処理はスレッドで行う
+            wait_seconds, reserved_tokens = await asyncio.to_thread(
+                self._try_reserve, provider, model, estimated_tokens
+            )
+            if wait_seconds <= 0:
+                return reserved_tokens
+            await asyncio.sleep(wait_seconds + random.uniform(0, 0.05))
+
+    def record_usage(
+        self, provider: str, model: str, reserved_tokens: float, actual_tokens: int
+    ) -> None:
+        """予約したトークン数（acquire の戻り値）と実際の消費量の差分をトークンバケットに反映する."""
+        quota = self.resolve_quota(provider, model)
+        if quota.tokens_per_minute <= 0 or actual_tokens == reserved_tokens:
+            return
+
+        def reconcile(bucket: dict[str, Any], quota: ProviderQuota, now: float) -> None:
+            bucket["token_tokens"] += reserved_tokens - actual_tokens
+
+        self._update_bucket(provider, model, reconcile)
+
+    def record_success(self, provider: str, model: str) -> None:
+        """成功したリクエストに応じてレート倍率を少しずつ戻す."""
+
+        def increase(bucket: dict[str, Any], quota: ProviderQuota, now: float) -> None:
+            bucket["rate_scale"] = min(1.0, bucket["rate_scale"] + RATE_SCALE_INCREASE)
+
+        self._update_bucket(provider, model, increase)
+
+    def record_rate_limited(
+        self, provider: str, model: str, retry_after: float | None = None
+    ) -> None:
+        """429を受けたときにレートを絞り、バケットを空にして一定時間送信を止める."""
+
+        def decrease(bucket: dict[str, Any], quota: ProviderQuota, now: float) -> None:
+            bucket["rate_scale"] = max(
+                MIN_RATE_SCALE, bucket["rate_scale"] * RATE_SCALE_DECREASE
+            )
+            bucket["request_tokens"] = 0.0
+            bucket["token_tokens"] = 0.0
+            pause = (
+                retry_after
+                if retry_after is not None
+                else DEFAULT_BACKOFF_SECONDS / bucket["rate_scale"]
+            )
+            bucket["blocked_until"] = max(bucket["blocked_until"], now + pause)
+
+        self._update_bucket(provider, model, decrease)
+        logger.warning(
+            "%s:%s でレート制限を検出しました。送信レートを絞ります。", provider, model
+        )
+
+
+_rate_limiter: RateLimiter | None = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """プロセス内で共有するレートリミッターを返す."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            db_path = os.getenv("RATE_LIMIT_DB_PATH") or resolve_cache_path(
+                "rate_limits.sqlite3"
+            )
+            _rate_limiter = RateLimiter(db_path, load_quotas())
+        return _rate_limiter
+
+
+def is_rate_limit_enabled() -> bool:
+    """RATE_LIMIT_ENABLED=0 でなければ True を返す."""
+    return os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+
+
+def call_with_rate_limit(
+    provider: str,
+    model: str,
+    request: Callable[[], T],
+    estimated_tokens: int = 0,
+    read_token_usage: Callable[[T], int | None] | None = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    cassette_request: Any | None = None,
+) -> T:
+    """共有クォータを予約してからモデルAPIを呼び出す.
+
+    429を受けた場合はリミッターへ通知してレートを下げ、予約からやり直す。
+    cassette_request を渡すと CASSETTE_MODE に応じて応答を記録・再生する（再生時はクォータを消費しない）。
+
+    Args:
+        provider (str): "openai" または "gemini"。
+        model (str): モデル名。モデル単位でクォータを管理する。
+        request (Callable): 実際のAPI呼び出し。再試行のため、呼ぶたびに新しいリクエストを送れること。
+        estimated_tokens (int): 予約するトークン数の見積もり。
+        read_token_usage (Callable, optional): レスポンスから実際の消費トークン数を読む関数。
+        max_attempts (int): 429を受けたときの最大試行回数。
+        cassette_request (Any, optional): カセットでリクエストを照合するための内容（core/cassette.py）。
+
+    Returns:
+        request の戻り値。
+    """
+    return use_cassette(
+        provider,
+        model,
+        cassette_request,
+        lambda: _call_with_rate_limit(
+            provider, model, request, estimated_tokens, read_token_usage, max_attempts
+        ),
+    )
+
+
+def _call_with_rate_limit(
+    provider: str,
+    model: str,
+    request: Callable[[], T],
+    estimated_tokens: int,
+    read_token_usage: Callable[[T], int | None] | None,
+    max_attempts: int,
+) -> T:
+    if not is_rate_limit_enabled():
+        # リミッターを無効にしていても、呼び出しのメトリクスは記録する
+        try:
+            response = request()
+        except Exception as error:
+            _record_failure(provider, model, error)
+            raise
+        _record_unlimited_completion(provider, model, response, read_token_usage)
+        return response
+
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        attempt += 1
+        reserved_tokens = limiter.acquire(provider, model, estimated_tokens)
+        try:
+            response = request()
+        except Exception as error:
+            _record_failure(provider, model, error)
+            if not is_rate_limit_error(error):
+                raise
+            # 最後の試行で受けた429もレートと送信の停止に反映してから諦める
+            limiter.record_rate_limited(provider, model, read_retry_after(error))
+            if attempt >= max_attempts:
+                raise
+            continue
+
+        _record_completion(
+            limiter, provider, model, response, reserved_tokens, read_token_usage
+        )
+        return response
+
+
+async def acall_with_rate_limit(
+    provider: str,
+    model: str,
+    request: Callable[[], Awaitable[T]],
+    estimated_tokens: int = 0,
+    read_token_usage: Callable[[T], int | None] | None = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    cassette_request: Any | None = None,
+) -> T:
+    """call_with_rate_limit の非同期版.
+
+    request はコルーチンを返す関数を渡す。
+    """
+    return await ause_cassette(
+        provider,
+        model,
+        cassette_request,
+        lambda: _acall_with_rate_limit(
+            provider, model, request, estimated_tokens, read_token_usage, max_attempts
+        ),
+    )
+
+
+async def _acall_with_rate_limit(
+    provider: str,
+    model: str,
+    request: Callable[[], Awaitable[T]],
+    estimated_tokens: int,
+    read_token_usage: Callable[[T], int | None] | None,
+    max_attempts: int,
+) -> T:
+    if not is_rate_limit_enabled():
+        try:
+            response = await request()
+        except Exception as error:
+            _record_failure(provider, model, error)
+            raise
+        _record_unlimited_completion(provider, model, response, read_token_usage)
+        return response
+
+    limiter = get_rate_limiter()
+    attempt = 0
+    while True:
+        attempt += 1
+        reserved_tokens = await limiter.aacquire(provider, model, estimated_tokens)
+        try:
+            response = await request()
+        except Exception as error:
+            _record_failure(provider, model, error)
+            if not is_rate_limit_error(error):
+                raise
+            await asyncio.to_thread(
+                limiter.record_rate_limited, provider, model, read_retry_after(error)
+            )
+            if attempt >= max_attempts:
+                raise
+            continue
+
+        await asyncio.to_thread(
+            _record_completion,
+            limiter,
+            provider,
+            model,
+            response,
+            reserved_tokens,
+            read_token_usage,
+        )
+        return response
+
+
+def _record_completion(
+    limiter: RateLimiter,
+    provider: str,
+    model: str,
+    response: Any,
+    reserved_tokens: float,
+    read_token_usage: Callable[[Any], int | None] | None,
+) -> None:
+    """成功したリクエストをリミッターとメトリクスへ反映する."""
+    limiter.record_success(provider, model)
+    actual_tokens = read_token_usage(response) if read_token_usage else None
+    record_model_call(provider, model, "ok", actual_tokens)
+    if actual_tokens is not None:
+        limiter.record_usage(provider, model, reserved_tokens, actual_tokens)
+
+
+def _record_unlimited_completion(
+    provider: str,
+    model: str,
+    response: Any,
+    read_token_usage: Callable[[Any], int | None] | None,
+) -> None:
+    """リミッターが無効なときに、成功したリクエストをメトリクスへ反映する."""
+    record_model_call(
+        provider, model, "ok", read_token_usage(response) if read_token_usage else None
+    )
+
+
+def _record_failure(provider: str, model: str, error: Exception) -> None:
+    status = "rate_limited" if is_rate_limit_error(error) else "error"
+    record_model_call(provider, model, status)
@@ -0,0 +1,50 @@
+"""APIレスポンスの整形（フィールドの選択と gzip 圧縮）."""
+
+import gzip
+from typing import Any
+
+# これより小さいレスポンスは圧縮しても効果が薄いため、そのまま返す
+MIN_COMPRESS_BYTES = 1024
+COMPRESS_LEVEL = 6
+
+
+def select_fields(body: dict[str, Any], field_paths: list[str]) -> dict[str, Any]:
+    """レスポンスから指定したフィールドだけを取り出す.
+
+    status は常に含める。
+
+    Args:
+        body (dict): 元のレスポンス。
+        field_paths (list[str]): ドット区切りのフィールドのパス（例: "analysis_result.risk_level"）。
+                                 存在しないパスは無視する。
+
+    Returns:
+        dict: 指定したフィールドだけを元の階層のまま含むレスポンス。
+    """
+    selected: dict[str, Any] = {"status": body.get("status")}
+    for field_path in field_paths:
+        keys = [key for key in field_path.strip().split(".") if key]
+        if not keys:
+            continue
+
+        value: Any = body
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = selected
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = value
+    return selected
+
+
+def gzip_body(body: bytes, accept_encoding: str) -> bytes | None:
+    """クライアントが gzip を受け付け、圧縮する価値のある大きさであれば圧縮したボディを返す.
+
+    圧縮しない場合は None を返す。
+    """
+    if "gzip" not in accept_encoding.lower() or len(body) < MIN_COMPRESS_BYTES:
+        return None
+    return gzip.compress(body, compresslevel=COMPRESS_LEVEL)
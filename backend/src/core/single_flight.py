@@ -0,0 +1,97 @@
+"""入力内容が同じ分析が実行中であれば、その結果を待って共有する（リクエストの合流）."""
+
+import copy
+import threading
+from typing import Any, Callable, Generic, TypeVar, cast
+
+from core.metrics import count_model_calls, record_coalesced_request, span
+
+T = TypeVar("T")
+
+
+class _Flight(Generic[T]):
+    """実行中の1件の分析.
+
+    完了すると結果（またはエラー）を待っているリクエストに渡す。
+    """
+
+    def __init__(self, context: Any = None) -> None:
+        self.done = threading.Event()
+        self.result: T | None = None
+        self.error: BaseException | None = None
+        self.model_calls = 0
+        self.context = context
+
+
+class SingleFlight:
+    """同じキーの処理が実行中であれば、新しく実行せずにその結果を待って共有する（リクエストの合流）.
+
+    話題の投稿を複数のタブやユーザーが同時に確認した場合など、同じ内容の分析が並行して届いたときに、
+    最初のリクエストだけが分析を実行し、後から届いたリクエストはその結果を受け取る。
+    完了した結果は保持しないため、実行中に重なったリクエストだけが合流する。
+    """
+
+    def __init__(self) -> None:
+        """実行中の処理がない状態で作る."""
+        self._lock = threading.Lock()
+        self._flights: dict[str, _Flight[Any]] = {}
+
+    def do(
+        self,
+        endpoint: str,
+        key: str,
+        run: Callable[[], T],
+        context: Any = None,
+        on_join: Callable[[Any], None] | None = None,
+    ) -> tuple[T, bool]:
+        """処理を実行するか、実行中の同じキーの処理に合流してその結果を返す.
+
+        Args:
+            endpoint (str): メトリクスのラベルに使うエンドポイント名。
+            key (str): 処理内容を識別するキー（入力内容のハッシュ）。
+            run (Callable): 実際の処理。
+            context (Any, optional): 処理を実行する場合に、合流したリクエストへ渡す値（実行枠の要求など）。
+            on_join (Callable, optional): 実行中の処理に合流する場合に、待つ前に先のリクエストの context を渡して呼ぶ関数。
+
+        Returns:
+            tuple: (結果, 他のリクエストの結果を共有したかどうか)。
+                   共有した結果は呼び出し側で変更しても影響しないよう複製して返す。
+        """
+        with self._lock:
+            running = self._flights.get(key)
+            if running is None:
+                flight: _Flight[T] = _Flight(context)
+                self._flights[key] = flight
+
+        if running is not None:
+            if on_join is not None:
+                on_join(running.context)
+            with span("coalesced_wait"):
+                running.done.wait()
+            record_coalesced_request(endpoint, running.model_calls)
+            if running.error is not None:
+                raise running.error
+            return cast(T, copy.deepcopy(running.result)), True
+
+        model_calls = None
+        try:
+            with count_model_calls() as model_calls:
+                result = run()
+                flight.result = result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            flight.model_calls = model_calls.value if model_calls is not None else 0
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return result, False
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """プロセス内で共有する SingleFlight を返す."""
+    return _single_flight
@@ -0,0 +1,76 @@
+"""トークン数の概算と、モデルごとにプロンプトへ入れる文字起こしの上限."""
+
+import json
+import os
+from functools import lru_cache
+
+# プロンプトに入れる文字起こしの上限（推定トークン数）。モデルのコンテキスト長から指示・背景情報・出力の分を引き、
+# 待ち時間と料金が膨らみすぎないよう控えめにしてある。PROMPT_TOKEN_BUDGETS（JSON）でモデルごとに上書きできる
+DEFAULT_TRANSCRIPT_BUDGETS: dict[str, int] = {
+    # コンテキスト長 16,385
+    "gpt-3.5-turbo": 12_000,
+    # コンテキスト長 1,048,576（動画のトークンも同じコンテキストに入る）
+    "gemini-2.5-flash-preview-05-20": 100_000,
+}
+DEFAULT_TRANSCRIPT_BUDGET = 12_000
+
+
+class TokenBudgetConfigError(ValueError):
+    """PROMPT_TOKEN_BUDGETS の設定が正しくないことを示す."""
+
+
+def estimate_tokens(text: str) -> int:
+    """リクエスト前のトークン数を概算する.
+
+    日本語は1文字あたり約1トークン、ASCIIは約4文字で1トークンとして数える。
+    長い文字起こしでも1文字ずつ調べずに済むよう、ASCIIの文字数はエンコードで数える。
+    """
+    if not text:
+        return 0
+    ascii_count = len(text.encode("ascii", errors="ignore"))
+    return (ascii_count // 4) + (len(text) - ascii_count) + 1
+
+
+@lru_cache(maxsize=4)
+def _parse_budget_overrides(raw_overrides: str) -> dict[str, int]:
+    """PROMPT_TOKEN_BUDGETS を解釈する.
+
+    呼び出しごとにパースしないよう、同じ値の結果は使い回す。
+
+    Raises:
+        TokenBudgetConfigError: JSONでない、モデル名から正の整数へのオブジェクトでない場合。
+    """
+    try:
+        overrides = json.loads(raw_overrides)
+    except json.JSONDecodeError as e:
+        raise TokenBudgetConfigError(
+            f"PROMPT_TOKEN_BUDGETS をJSONとして読めません: {e}"
+        ) from e
+    if not isinstance(overrides, dict):
+        raise TokenBudgetConfigError(
+            'PROMPT_TOKEN_BUDGETS はモデル名から推定トークン数へのオブジェクトで指定してください（例: {"gpt-3.5-turbo": 8000}）'
+        )
+    budgets = {}
+    for model, value in overrides.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise TokenBudgetConfigError(
+                f"PROMPT_TOKEN_BUDGETS の {model} の値は正の数で指定してください: {value!r}"
+            )
+        budgets[model] = int(value)
+    return budgets
+
+
+def get_transcript_budget(model: str) -> int:
+    """モデルのプロンプトに入れる文字起こしの上限（推定トークン数）を返す.
+
+    例: PROMPT_TOKEN_BUDGETS='{"gpt-3.5-turbo": 8000}'
+
+    Raises:
+        TokenBudgetConfigError: PROMPT_TOKEN_BUDGETS の設定が正しくない場合。
+    """
+    raw_overrides = os.getenv("PROMPT_TOKEN_BUDGETS")
+    if raw_overrides:
+        overrides = _parse_budget_overrides(raw_overrides)
+        if model in overrides:
+            return overrides[model]
+    return DEFAULT_TRANSCRIPT_BUDGETS.get(model, DEFAULT_TRANSCRIPT_BUDGET)
@@ -0,0 +1 @@
+"""分析対象のメディア（動画・画像）の取得と前処理."""
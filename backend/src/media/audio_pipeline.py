@@ -0,0 +1,362 @@
+"""動画の音声を1回だけデコードし、PCMを文字起こし用のエンコーダーと一時ファイルへ同時に流す."""
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import IO, Iterator, Protocol, cast
+
+import numpy as np
+
+from core.metrics import span
+from core.process_pool import get_media_pool
+from media.fingerprint import (
+    AudioFingerprint,
+    AudioFingerprintError,
+    fingerprint_pcm_file,
+)
+from media.vad import (
+    FULL_SPEECH_RATIO,
+    OffsetMap,
+    compact_speech,
+    detect_speech_regions_in_file,
+    is_vad_enabled,
+)
+
+logger = logging.getLogger(__name__)
+
+# デコードした音声のサンプリングレート（Whisper が内部で使うものと同じ。指紋は間引いて使う）
+PCM_SAMPLE_RATE = 16000
+PCM_CHUNK_BYTES = 64 * 1024
+PCM_CHUNK_SAMPLES = PCM_CHUNK_BYTES // 2
+# 文字起こし用に圧縮する音声のビットレート（発話を聞き取るには十分で、アップロードが小さく済む）
+TRANSCRIPTION_AUDIO_BITRATE = "24k"
+TRANSCRIPTION_AUDIO_FILENAME = "transcription.ogg"
+# デコードしたPCMを書き出すファイル（1時間の音声で約115MB）。プロセスプールのワーカーには配列ではなくこのパスを渡す
+PCM_FILENAME = "pcm.s16le"
+ENCODER_TIMEOUT_SECONDS = 120
+
+
+class AudioDecodeError(Exception):
+    """ffmpeg による音声のデコードに失敗した、または動画に音声がないことを示す."""
+
+
+class PcmSink(Protocol):
+    """デコードしたPCM（モノラル・16bit・PCM_SAMPLE_RATE）を順に受け取る出力先."""
+
+    def write(self, chunk: bytes) -> None:
+        """PCMの断片を受け取る."""
+
+    def close(self) -> None:
+        """デコードが終わったときに呼ばれる."""
+
+
+class PcmFileSink:
+    """PCMを一時ファイルに書き出す.
+
+    指紋や発話の検出はプロセスプールで行うため、
+    音声全体の配列を pickle してワーカーへ送る代わりに、このファイルのパスを渡してワーカーに読み込ませる。
+    リクエストのプロセスは音声全体を読み込まず、必要な部分だけをメモリマップで読む。
+    """
+
+    def __init__(self, path: str):
+        """書き出し先のファイルを開く."""
+        self.path = path
+        self._file = open(path, "wb")
+
+    def write(self, chunk: bytes) -> None:
+        """PCMの断片をファイルに追記する."""
+        self._file.write(chunk)
+
+    def close(self) -> None:
+        """ファイルを閉じる."""
+        if self._file.closed:
+            return
+        size = self._file.tell()
+        # 読み込みの区切りで端数のバイトが出ることはないが、壊れたストリームで末尾が半端な場合に備えて切り捨てる
+        if size % 2:
+            self._file.truncate(size - 1)
+        self._file.close()
+
+    def samples(self) -> np.ndarray:
+        """書き出したPCMを読み取り専用のメモリマップで返す（ページは参照したときにだけ読み込まれる）."""
+        if os.path.getsize(self.path) == 0:
+            # 空のファイルはメモリマップできない
+            return np.zeros(0, dtype=np.int16)
+        return np.memmap(self.path, dtype=np.int16, mode="r")
+
+
+class EncoderSink:
+    """PCMを標準入力から受け取る ffmpeg に流し込み、文字起こし用の小さな音声ファイル（Opus）にする.
+
+    エンコーダーが使えない・途中で終了した場合は failed を立て、残りのPCMは捨てる（デコードは止めない）。
+    """
+
+    def __init__(self, output_path: str):
+        """エンコーダー（ffmpeg）を起動する。起動できなければ failed にする."""
+        self.output_path = output_path
+        self.failed = False
+        command = [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-y",
+            "-nostdin",
+            "-f",
+            "s16le",
+            "-ar",
+            str(PCM_SAMPLE_RATE),
+            "-ac",
+            "1",
+            "-i",
+            "pipe:0",
+            "-c:a",
+            "libopus",
+            "-b:a",
+            TRANSCRIPTION_AUDIO_BITRATE,
+            "-application",
+            "voip",
+            output_path,
+        ]
+        try:
+            self._process: subprocess.Popen[bytes] | None = subprocess.Popen(
+                command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as e:
+            logger.error("文字起こし用の音声のエンコードを開始できませんでした: %s", e)
+            self._process = None
+            self.failed = True
+
+    def write(self, chunk: bytes) -> None:
+        """PCMの断片をエンコーダーに渡す."""
+        if self.failed or self._process is None or self._process.stdin is None:
+            return
+        try:
+            self._process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            self.failed = True
+
+    def close(self) -> None:
+        """入力を閉じてエンコードの終了を待つ。失敗した場合は failed にする."""
+        if self._process is None or self._process.stdin is None:
+            return
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            self.failed = True
+        try:
+            return_code = self._process.wait(timeout=ENCODER_TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+            return_code = -1
+        if return_code != 0:
+            self.failed = True
+        if self.failed:
+            logger.error(
+                "文字起こし用の音声のエンコードに失敗しました。元の動画をアップロードします。"
+            )
+
+
+class DecodedAudio:
+    """1回のデコードで得た動画の音声.
+
+    文字起こし・文字起こしキャッシュ・音楽検出はすべてこれを共有する。
+
+    samples はモノラル・16bit の PCM（PCM_SAMPLE_RATE）を書き出した pcm_path のメモリマップで、
+    pcm_path はプロセスプールのワーカーに渡す。
+    transcription_path は文字起こし用に圧縮した音声ファイルで、作れなかった場合は None（元の動画をアップロードする）。
+    speech_map は transcription_path が発話の区間だけをつなげたものである場合の時刻の対応で、切り詰めていなければ None。
+    発話が見つからなかった場合は has_speech が False になり、文字起こしを行わない。
+    """
+
+    def __init__(
+        self,
+        samples: np.ndarray,
+        sample_rate: int,
+        pcm_path: str,
+        transcription_path: str | None,
+        speech_map: OffsetMap | None = None,
+        has_speech: bool = True,
+    ):
+        """speech_map は発話だけをつなげて文字起こしする場合の時刻の対応（音声全体を送る場合は None）."""
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.pcm_path = pcm_path
+        self.transcription_path = transcription_path
+        self.speech_map = speech_map
+        self.has_speech = has_speech
+        self._fingerprint: AudioFingerprint | None = None
+        self._fingerprint_error: AudioFingerprintError | None = None
+        self._fingerprint_lock = threading.Lock()
+
+    @property
+    def duration_seconds(self) -> float:
+        """音声の長さ（秒）を返す."""
+        return len(self.samples) / self.sample_rate
+
+    def fingerprint(self) -> AudioFingerprint:
+        """音声の指紋を返す.
+
+        最初の呼び出しでプロセスプールを使って作り、以降は同じもの（失敗した場合は同じ例外）を返す。
+
+        Raises:
+            AudioFingerprintError: 音声が照合に使えない場合。
+        """
+        with self._fingerprint_lock:
+            if self._fingerprint_error is not None:
+                raise self._fingerprint_error
+            if self._fingerprint is None:
+                try:
+                    self._fingerprint = get_media_pool().run(
+                        "fingerprint",
+                        fingerprint_pcm_file,
+                        self.pcm_path,
+                        self.sample_rate,
+                    )
+                except AudioFingerprintError as e:
+                    self._fingerprint_error = e
+                    raise
+            return self._fingerprint
+
+
+def _stream_pcm(media_path: str, sinks: list[PcmSink], stderr_file: IO[bytes]) -> None:
+    """動画の音声を ffmpeg で1回だけデコードし、標準出力のPCMを読み込んだ順にすべての出力先へ渡す."""
+    command = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-nostdin",
+        "-i",
+        media_path,
+        "-vn",
+        "-ac",
+        "1",
+        "-ar",
+        str(PCM_SAMPLE_RATE),
+        "-f",
+        "s16le",
+        "pipe:1",
+    ]
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr_file)
+    except OSError as e:
+        raise AudioDecodeError(f"ffmpeg を起動できませんでした: {e}") from e
+    # stdout=PIPE を指定しているため None にならない
+    stdout = cast(IO[bytes], process.stdout)
+
+    try:
+        while True:
+            chunk = stdout.read(PCM_CHUNK_BYTES)
+            if not chunk:
+                break
+            for sink in sinks:
+                sink.write(chunk)
+    finally:
+        stdout.close()
+        return_code = process.wait()
+        for sink in sinks:
+            sink.close()
+    if return_code != 0:
+        stderr_file.seek(0)
+        message = stderr_file.read().decode("utf-8", errors="replace").strip()
+        raise AudioDecodeError(f"音声のデコードに失敗しました: {message}")
+
+
+def _encode_speech(
+    samples: np.ndarray, pcm_path: str, output_path: str
+) -> tuple[str | None, OffsetMap | None, bool]:
+    """発話の区間を求め、発話だけをつなげた音声を文字起こし用に圧縮する.
+
+    (圧縮した音声のパス, 時刻の対応, 発話があるか) を返す。エンコードに失敗した場合のパスは None。
+    """
+    regions = get_media_pool().run(
+        "vad", detect_speech_regions_in_file, pcm_path, PCM_SAMPLE_RATE
+    )
+    if not regions:
+        return None, None, False
+
+    speech_seconds = sum(region.duration for region in regions)
+    speech_map = None
+    if speech_seconds < FULL_SPEECH_RATIO * len(samples) / PCM_SAMPLE_RATE:
+        samples, speech_map = compact_speech(samples, PCM_SAMPLE_RATE, regions)
+        logger.debug(
+            "発話の区間 %d 個（%.1f秒）だけを文字起こしします。",
+            len(regions),
+            speech_seconds,
+        )
+
+    encoder_sink = EncoderSink(output_path)
+    with span("transcription_encode"):
+        for start in range(0, len(samples), PCM_CHUNK_SAMPLES):
+            encoder_sink.write(samples[start : start + PCM_CHUNK_SAMPLES].tobytes())
+        encoder_sink.close()
+    if encoder_sink.failed:
+        return None, None, True
+    return output_path, speech_map, True
+
+
+@contextmanager
+def decode_audio(
+    media_path: str, encode_for_transcription: bool = True
+) -> Iterator[DecodedAudio]:
+    """動画（または音声ファイル）の音声を1回だけデコードし、PCMを文字起こし用のエンコーダーと一時ファイルへ同時に流す.
+
+    PCMのファイルはプロセスプールのワーカーに渡すためのもので、一時ファイルはすべてブロックを抜けると削除する。
+
+    発話の検出（TRANSCRIPTION_VAD）が有効な場合は、発話の区間を求めるために音声全体が必要なため、
+    デコードの後にPCMのファイルから発話の区間だけをつなげて圧縮する（動画をデコードし直すことはない）。
+
+    Args:
+        encode_for_transcription (bool): False の場合はPCMだけを取り出す（参照カタログの指紋作成など）。
+
+    Raises:
+        AudioDecodeError: デコードに失敗した、または音声がない場合。
+    """
+    temp_dir = tempfile.mkdtemp(prefix="audio_")
+    pcm_sink = None
+    try:
+        pcm_sink = PcmFileSink(os.path.join(temp_dir, PCM_FILENAME))
+        sinks: list[PcmSink] = [pcm_sink]
+        encoder_sink = None
+        use_vad = encode_for_transcription and is_vad_enabled()
+        if encode_for_transcription and not use_vad:
+            encoder_sink = EncoderSink(
+                os.path.join(temp_dir, TRANSCRIPTION_AUDIO_FILENAME)
+            )
+            sinks.append(encoder_sink)
+
+        with span("audio_decode"), tempfile.TemporaryFile(dir=temp_dir) as stderr_file:
+            _stream_pcm(media_path, sinks, stderr_file)
+
+        samples = pcm_sink.samples()
+        if len(samples) == 0:
+            raise AudioDecodeError("動画に音声が含まれていません")
+        transcription_path, speech_map, has_speech = None, None, True
+        if use_vad:
+            transcription_path, speech_map, has_speech = _encode_speech(
+                samples,
+                pcm_sink.path,
+                os.path.join(temp_dir, TRANSCRIPTION_AUDIO_FILENAME),
+            )
+        elif encoder_sink is not None and not encoder_sink.failed:
+            transcription_path = encoder_sink.output_path
+        yield DecodedAudio(
+            samples,
+            PCM_SAMPLE_RATE,
+            pcm_sink.path,
+            transcription_path,
+            speech_map,
+            has_speech,
+        )
+    finally:
+        if pcm_sink is not None:
+            # ffmpeg を起動できなかった場合は閉じられていないため、削除の前に閉じる
+            pcm_sink.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
@@ -0,0 +1,664 @@
+"""URLで指定されたメディアを取得して保存する、容量上限付きのLRUディスクキャッシュ."""
+
+import hashlib
+import http.client
+import ipaddress
+import logging
+import mimetypes
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from typing import IO, Any, Iterator
+
+from core.metrics import span
+from core.paths import resolve_cache_path
+
+DEFAULT_MAX_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MAX_DOWNLOAD_BYTES = 512 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+DOWNLOAD_TIMEOUT_SECONDS = 30
+# 接続が途中で切れた場合に、Range で続きから取り直す回数
+MAX_DOWNLOAD_ATTEMPTS = 3
+ALLOWED_URL_SCHEMES = ("http", "https")
+# 同じURLの同時取得を1回にまとめるためのロックの数（URLのハッシュで振り分ける）
+URL_LOCK_STRIPES = 64
+USER_AGENT = "compliance-checker-media-fetcher/1.0"
+# socket.create_connection と同じ「タイムアウトの指定なし」を表す値（http.client が渡してくる）
+_DEFAULT_TIMEOUT: object = getattr(socket, "_GLOBAL_DEFAULT_TIMEOUT")
+# 分析中のファイルの使用期限。プロセスが異常終了して使用中の記録が残っても、この時間が過ぎれば削除できる
+DEFAULT_PIN_LEASE_SECONDS = 6 * 60 * 60
+# 取得中の記録の期限。取得中のプロセスが異常終了しても、この時間が過ぎれば他のプロセスが取得し直す
+DEFAULT_DOWNLOAD_CLAIM_LEASE_SECONDS = 10 * 60
+# 他のプロセスが同じURLを取得中の場合に、登録されたかを確かめる間隔
+DOWNLOAD_CLAIM_POLL_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+
+class MediaDownloadError(Exception):
+    """メディアのURLが不正、または取得に失敗したことを示す."""
+
+
+def get_allowed_hosts() -> tuple[str, ...]:
+    """MEDIA_ALLOWED_HOSTS（カンマ区切り）で指定された、取得を許可するホストを返す.
+
+    指定したホストとそのサブドメインだけを許可する。未設定の場合は空（ホストでは制限しない）。
+    """
+    raw_hosts = os.getenv("MEDIA_ALLOWED_HOSTS", "")
+    return tuple(
+        host.strip().lower().rstrip(".")
+        for host in raw_hosts.split(",")
+        if host.strip()
+    )
+
+
+def _is_public_address(address: str) -> bool:
+    """インターネット上の宛先か（プライベート・ループバック・リンクローカル・予約済みなどでないか）を判定する."""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _resolve_public_addresses(host: str, port: int) -> list[tuple[Any, ...]]:
+    """ホスト名を解決し、すべてのアドレスが公開されたものであれば getaddrinfo の結果を返す.
+
+    1つでも内部のアドレス（169.254.169.254 のメタデータサーバーなど）を含む場合は MediaDownloadError にする。
+    """
+    try:
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as error:
+        raise MediaDownloadError(
+            f"メディアのホストを解決できませんでした: {host}"
+        ) from error
+    for *_, sockaddr in addresses:
+        if not _is_public_address(str(sockaddr[0])):
+            raise MediaDownloadError(
+                f"内部ネットワークのアドレスからは取得できません: {host}"
+            )
+    return addresses
+
+
+def validate_media_url(url: str) -> None:
+    """サーバー側で取得してよいURLかを確認する（SSRF対策）.
+
+    http / https のみ、MEDIA_ALLOWED_HOSTS が設定されていればそのホストのみ、
+    ホスト名の解決結果がプライベート・ループバック・リンクローカルなどのアドレスでないもののみ許可する。
+    """
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme not in ALLOWED_URL_SCHEMES:
+        raise MediaDownloadError(f"取得できるのは http / https のURLのみです: {url}")
+    host = (parsed.hostname or "").lower().rstrip(".")
+    if not host:
+        raise MediaDownloadError(f"URLにホストがありません: {url}")
+    allowed_hosts = get_allowed_hosts()
+    if allowed_hosts and not any(
+        host == allowed or host.endswith(f".{allowed}") for allowed in allowed_hosts
+    ):
+        raise MediaDownloadError(f"取得が許可されていないホストです: {host}")
+    try:
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError as error:
+        raise MediaDownloadError(f"URLのポートが不正です: {url}") from error
+    _resolve_public_addresses(host, port)
+
+
+def _create_public_connection(
+    address: tuple[str, int],
+    timeout: Any = _DEFAULT_TIMEOUT,
+    source_address: tuple[str, int] | None = None,
+) -> socket.socket:
+    """socket.create_connection の代わりに使う.
+
+    接続する直前に名前を解決し直し、確認したアドレスにだけ接続する。
+    確認後にDNSの応答を内部のアドレスへ切り替える攻撃（DNS rebinding）でも内部へ接続しない。
+    """
+    host, port = address
+    last_error: OSError | None = None
+    for family, socket_type, proto, _, sockaddr in _resolve_public_addresses(
+        host, port
+    ):
+        sock = socket.socket(family, socket_type, proto)
+        try:
+            if timeout is not _DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as error:
+            sock.close()
+            last_error = error
+    raise last_error or OSError(f"接続できませんでした: {host}")
+
+
+class _PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._create_connection = _create_public_connection
+
+
+class _PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._create_connection = _create_public_connection
+
+
+class _PublicHTTPHandler(urllib.request.HTTPHandler):
+    def do_open(
+        self, http_class: Any, req: urllib.request.Request, **http_conn_args: Any
+    ) -> http.client.HTTPResponse:
+        return super().do_open(_PublicHTTPConnection, req, **http_conn_args)
+
+
+class _PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def do_open(
+        self, http_class: Any, req: urllib.request.Request, **http_conn_args: Any
+    ) -> http.client.HTTPResponse:
+        return super().do_open(_PublicHTTPSConnection, req, **http_conn_args)
+
+
+class _ValidatingRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """リダイレクト先も取得前と同じ条件で確認する（標準のハンドラーは ftp などへのリダイレクトも許す）."""
+
+    def redirect_request(
+        self,
+        req: urllib.request.Request,
+        fp: IO[bytes],
+        code: int,
+        msg: str,
+        headers: http.client.HTTPMessage,
+        newurl: str,
+    ) -> urllib.request.Request | None:
+        validate_media_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def _build_opener() -> urllib.request.OpenerDirector:
+    # 環境変数のプロキシを使うと接続先のアドレスを確認できないため、直接接続する
+    return urllib.request.build_opener(
+        urllib.request.ProxyHandler({}),
+        _PublicHTTPHandler(),
+        _PublicHTTPSHandler(),
+        _ValidatingRedirectHandler(),
+    )
+
+
+def _resume_validator(headers: http.client.HTTPMessage) -> str | None:
+    """続きを取得するときに If-Range で送る版（強い ETag、なければ Last-Modified）を返す."""
+    etag = headers.get("ETag")
+    # If-Range には弱い ETag を使えない
+    if etag and not etag.startswith("W/"):
+        return str(etag)
+    last_modified = headers.get("Last-Modified")
+    return str(last_modified) if last_modified else None
+
+
+def _resumes_at(response: http.client.HTTPResponse, received: int) -> bool:
+    """応答が取得済みの位置 received からの続き（206 で Content-Range が received から始まる）か."""
+    if response.status != 206:
+        return False
+    content_range = response.headers.get("Content-Range") or ""
+    unit, _, byte_range = content_range.partition(" ")
+    start, _, _ = byte_range.partition("-")
+    return unit == "bytes" and start.strip().isdigit() and int(start) == received
+
+
+def _guess_suffix(url: str, content_type: str | None, default_suffix: str) -> str:
+    """保存するファイルの拡張子を決める.
+
+    Gemini へのアップロード時に拡張子から MIME タイプが判定されるため、Content-Type を優先する。
+    """
+    if content_type:
+        suffix = mimetypes.guess_extension(content_type.split(";")[0].strip())
+        if suffix:
+            return suffix
+    _, suffix = os.path.splitext(urllib.parse.urlparse(url).path)
+    return suffix or default_suffix
+
+
+class MediaCache:
+    """URLから取得したメディアを保存する、容量上限付きのLRUディスクキャッシュ.
+
+    ファイルは内容のハッシュ（SHA-256）をファイル名にして保存し、URL -> ハッシュの対応をSQLiteに記録する。
+    同じURLは二度取得せず、別のURLでも内容が同じであれば1つのファイルを共有する。
+    合計サイズが上限を超えると、最後に使われた時刻が古いものから削除する（分析中のファイルは削除しない）。
+
+    インデックスは同じキャッシュディレクトリを使う複数のワーカープロセスで共有するため、
+    分析中のファイルの記録（media_pins）と取得中のURLの記録（media_downloads）も同じSQLiteに置き、
+    検索・登録・削除はそれぞれ1つの排他トランザクションで行う。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_cache_bytes: int,
+        max_download_bytes: int,
+        pin_lease_seconds: float = DEFAULT_PIN_LEASE_SECONDS,
+        download_claim_lease_seconds: float = DEFAULT_DOWNLOAD_CLAIM_LEASE_SECONDS,
+    ):
+        """cache_dir にキャッシュを置き、全体を max_cache_bytes、1ファイルを max_download_bytes までに制限する."""
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self.max_download_bytes = max_download_bytes
+        self.pin_lease_seconds = pin_lease_seconds
+        self.download_claim_lease_seconds = download_claim_lease_seconds
+        os.makedirs(cache_dir, exist_ok=True)
+        self._local = threading.local()
+        self._url_locks = [threading.Lock() for _ in range(URL_LOCK_STRIPES)]
+        self._opener = _build_opener()
+        self._initialize_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3の接続はスレッド間で共有できないため、スレッドごとに保持する
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                os.path.join(self.cache_dir, "index.sqlite3"),
+                timeout=30,
+                isolation_level=None,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _initialize_schema(self) -> None:
+        connection = self._connect()
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_blobs (
+                content_hash TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_urls (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+            """
+        )
+        # 分析中のファイル。fetch の with ブロック1つにつき1行で、期限を過ぎた行は異常終了したプロセスの残りとみなす
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_pins (
+                pin_id TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS media_pins_content_hash ON media_pins (content_hash)"
+        )
+        # 取得中のURL。同じキャッシュを使う他のプロセスが同じURLを同時に取得しないようにする
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS media_downloads (
+                url TEXT PRIMARY KEY,
+                claim_id TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """BEGIN IMMEDIATE による排他トランザクション.
+
+        他のプロセスの検索・登録・削除と重ならない。
+        """
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    @contextmanager
+    def fetch(self, url: str, default_suffix: str) -> Iterator[str]:
+        """URLのメディアをキャッシュから取り出し、なければ取得して保存する.
+
+        Args:
+            url (str): http / https のURL。
+            default_suffix (str): Content-Type やURLから拡張子を判定できない場合の拡張子（例: ".mp4"）。
+
+        Yields:
+            str: キャッシュ内のファイルのパス。with ブロックの間は削除されない。ファイルは変更しないこと。
+        """
+        validate_media_url(url)
+
+        url_lock = self._url_locks[
+            int(hashlib.sha256(url.encode("utf-8")).hexdigest(), 16) % URL_LOCK_STRIPES
+        ]
+        # プロセス内の同時取得はロックで、他のプロセスとの同時取得は media_downloads の記録でまとめる
+        with url_lock:
+            claim_id = uuid.uuid4().hex
+            while True:
+                with self._transaction() as connection:
+                    entry = self._find(connection, url)
+                    if entry is not None:
+                        pin_id = self._pin(connection, entry[0])
+                        break
+                    is_claimed = self._claim(connection, url, claim_id)
+                if is_claimed:
+                    break
+                # 他のプロセスが同じURLを取得中のため、登録されるのを待つ
+                time.sleep(DOWNLOAD_CLAIM_POLL_SECONDS)
+
+            if entry is None:
+                try:
+                    with span("download"):
+                        temp_path, content_type, content_hash, size = self._download(
+                            url
+                        )
+                    with self._transaction() as connection:
+                        entry = self._register(
+                            connection,
+                            url,
+                            default_suffix,
+                            temp_path,
+                            content_type,
+                            content_hash,
+                            size,
+                        )
+                        pin_id = self._pin(connection, content_hash)
+                finally:
+                    self._release_claim(url, claim_id)
+            _, path = entry
+
+        try:
+            yield path
+        finally:
+            self._unpin(pin_id)
+            self._evict()
+
+    def _find(self, connection: sqlite3.Connection, url: str) -> tuple[str, str] | None:
+        row = connection.execute(
+            """
+            SELECT media_blobs.content_hash, media_blobs.filename
+            FROM media_urls JOIN media_blobs ON media_urls.content_hash = media_blobs.content_hash
+            WHERE media_urls.url = ?
+            """,
+            (url,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        content_hash, filename = row
+        path = os.path.join(self.cache_dir, filename)
+        if not os.path.exists(path):
+            # ファイルだけが消えている場合は取得し直す
+            connection.execute(
+                "DELETE FROM media_blobs WHERE content_hash = ?", (content_hash,)
+            )
+            return None
+        connection.execute(
+            "UPDATE media_blobs SET last_used_at = ? WHERE content_hash = ?",
+            (time.time(), content_hash),
+        )
+        return content_hash, path
+
+    def _claim(self, connection: sqlite3.Connection, url: str, claim_id: str) -> bool:
+        """URLを取得中として記録する.
+
+        他のプロセスが取得中（期限内）であれば False を返す。検索と同じトランザクションで呼ぶ。
+        期限を過ぎた記録は異常終了したプロセスの残りとみなして置き換える。
+        """
+        now = time.time()
+        connection.execute(
+            "DELETE FROM media_downloads WHERE url = ? AND expires_at < ?", (url, now)
+        )
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO media_downloads (url, claim_id, expires_at) VALUES (?, ?, ?)",
+            (url, claim_id, now + self.download_claim_lease_seconds),
+        )
+        return cursor.rowcount == 1
+
+    def _release_claim(self, url: str, claim_id: str) -> None:
+        self._connect().execute(
+            "DELETE FROM media_downloads WHERE url = ? AND claim_id = ?",
+            (url, claim_id),
+        )
+
+    def _download(self, url: str) -> tuple[str, str | None, str, int]:
+        """URLをストリーミングでキャッシュディレクトリ内の一時ファイルに保存する.
+
+        Returns:
+            tuple: (一時ファイルのパス, Content-Type, 内容のSHA-256, バイト数)
+        """
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=self.cache_dir, suffix=".partial"
+        )
+        try:
+            with os.fdopen(file_descriptor, "w+b") as temp_file:
+                content_type, content_hash, size = self._stream_to_file(url, temp_file)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return temp_path, content_type, content_hash, size
+
+    def _register(
+        self,
+        connection: sqlite3.Connection,
+        url: str,
+        default_suffix: str,
+        temp_path: str,
+        content_type: str | None,
+        content_hash: str,
+        size: int,
+    ) -> tuple[str, str]:
+        """取得した一時ファイルを内容のハッシュの名前で保存し、URLとの対応を記録する."""
+        try:
+            filename = (
+                f"{content_hash}{_guess_suffix(url, content_type, default_suffix)}"
+            )
+            existing = connection.execute(
+                "SELECT filename FROM media_blobs WHERE content_hash = ?",
+                (content_hash,),
+            ).fetchone()
+            if existing and os.path.exists(os.path.join(self.cache_dir, existing[0])):
+                # 別のURLで同じ内容を取得済みの場合は、既存のファイルを共有する
+                filename = existing[0]
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, os.path.join(self.cache_dir, filename))
+
+            now = time.time()
+            connection.execute(
+                """
+                INSERT INTO media_blobs (content_hash, filename, size, last_used_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(content_hash) DO UPDATE SET filename = excluded.filename, last_used_at = excluded.last_used_at
+                """,
+                (content_hash, filename, size, now),
+            )
+            connection.execute(
+                """
+                INSERT INTO media_urls (url, content_hash, fetched_at) VALUES (?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET content_hash = excluded.content_hash, fetched_at = excluded.fetched_at
+                """,
+                (url, content_hash, now),
+            )
+            return content_hash, os.path.join(self.cache_dir, filename)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _stream_to_file(
+        self, url: str, temp_file: IO[bytes]
+    ) -> tuple[str | None, str, int]:
+        """URLの内容をチャンクごとに書き込みながらハッシュを計算する.
+
+        接続が途中で切れた場合は、サーバーが対応していれば Range で続きから取得する。
+        続きは If-Range で最初の応答と同じ版（ETag または Last-Modified）のときだけ返させ、
+        応答の Content-Range が取得済みの位置から始まることを確かめる。
+        版を確かめられない場合や、確かめた結果が合わない場合は最初から取得し直す（別の版をつなげて保存しない）。
+
+        Returns:
+            tuple: (Content-Type, 内容のSHA-256, バイト数)
+        """
+        digest = hashlib.sha256()
+        received = 0
+        validator = None
+        attempt = 0
+        while True:
+            attempt += 1
+            headers = {"User-Agent": USER_AGENT}
+            if received and validator:
+                headers["Range"] = f"bytes={received}-"
+                headers["If-Range"] = validator
+            try:
+                with self._opener.open(
+                    urllib.request.Request(url, headers=headers),
+                    timeout=DOWNLOAD_TIMEOUT_SECONDS,
+                ) as response:
+                    if received and not _resumes_at(response, received):
+                        # Range に対応していない・版が変わった（If-Range）サーバーは全体を返すため、最初から書き直す
+                        temp_file.seek(0)
+                        temp_file.truncate()
+                        digest = hashlib.sha256()
+                        received = 0
+                        if response.status == 206:
+                            # 取得済みの位置と違う部分だけが返ったため、この応答は使わずに取り直す
+                            raise http.client.HTTPException(
+                                f"Content-Range が取得済みの位置と一致しません: {response.headers.get('Content-Range')}"
+                            )
+                    if not received:
+                        validator = _resume_validator(response.headers)
+
+                    content_length = response.headers.get("Content-Length")
+                    expected_bytes = (
+                        received + int(content_length) if content_length else None
+                    )
+                    if (
+                        expected_bytes is not None
+                        and expected_bytes > self.max_download_bytes
+                    ):
+                        raise MediaDownloadError(
+                            f"メディアが大きすぎます（上限 {self.max_download_bytes} バイト）: {url}"
+                        )
+
+                    while chunk := response.read(DOWNLOAD_CHUNK_BYTES):
+                        received += len(chunk)
+                        if received > self.max_download_bytes:
+                            raise MediaDownloadError(
+                                f"メディアが大きすぎます（上限 {self.max_download_bytes} バイト）: {url}"
+                            )
+                        digest.update(chunk)
+                        temp_file.write(chunk)
+                    # 接続が途中で切れても read は空を返すだけのため、Content-Length と比べて検出する
+                    if expected_bytes is not None and received < expected_bytes:
+                        raise http.client.IncompleteRead(b"", expected_bytes - received)
+                    return (
+                        response.headers.get("Content-Type"),
+                        digest.hexdigest(),
+                        received,
+                    )
+            except urllib.error.HTTPError as error:
+                raise MediaDownloadError(
+                    f"メディアを取得できませんでした（HTTP {error.code}）: {url}"
+                ) from error
+            except (OSError, http.client.HTTPException) as error:
+                if attempt >= MAX_DOWNLOAD_ATTEMPTS:
+                    raise MediaDownloadError(
+                        f"メディアを取得できませんでした: {url}: {error}"
+                    ) from error
+                logger.info(
+                    "メディアの取得が中断されたため再開します（%d バイト取得済み）: %s",
+                    received,
+                    error,
+                )
+
+    def _pin(self, connection: sqlite3.Connection, content_hash: str) -> str:
+        """ファイルを分析中として記録し、解除に使うIDを返す.
+
+        検索・登録と同じトランザクションで呼ぶ。
+        """
+        pin_id = uuid.uuid4().hex
+        connection.execute(
+            "INSERT INTO media_pins (pin_id, content_hash, expires_at) VALUES (?, ?, ?)",
+            (pin_id, content_hash, time.time() + self.pin_lease_seconds),
+        )
+        return pin_id
+
+    def _unpin(self, pin_id: str) -> None:
+        self._connect().execute("DELETE FROM media_pins WHERE pin_id = ?", (pin_id,))
+
+    def _evict(self) -> None:
+        """合計サイズが上限を超えている間、使われていない古いファイルから削除する.
+
+        他のプロセスが削除中のファイルを見つけて使い始めないよう、ファイルの削除までトランザクションの中で行う。
+        """
+        connection = self._connect()
+        total_bytes = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM media_blobs"
+        ).fetchone()[0]
+        if total_bytes <= self.max_cache_bytes:
+            return
+
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM media_pins WHERE expires_at < ?", (time.time(),)
+            )
+            total_bytes = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM media_blobs"
+            ).fetchone()[0]
+            rows = connection.execute(
+                """
+                SELECT content_hash, filename, size FROM media_blobs
+                WHERE content_hash NOT IN (SELECT content_hash FROM media_pins)
+                ORDER BY last_used_at
+                """
+            ).fetchall()
+            for content_hash, filename, size in rows:
+                if total_bytes <= self.max_cache_bytes:
+                    break
+                path = os.path.join(self.cache_dir, filename)
+                if os.path.exists(path):
+                    os.remove(path)
+                connection.execute(
+                    "DELETE FROM media_blobs WHERE content_hash = ?", (content_hash,)
+                )
+                connection.execute(
+                    "DELETE FROM media_urls WHERE content_hash = ?", (content_hash,)
+                )
+                total_bytes -= size
+
+
+_cache: MediaCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_media_cache() -> MediaCache:
+    """プロセス内で共有するキャッシュを返す.
+
+    保存先は MEDIA_CACHE_DIR、容量の上限は MEDIA_CACHE_MAX_BYTES、1ファイルの上限は MEDIA_MAX_DOWNLOAD_BYTES で変更できる。
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MediaCache(
+                cache_dir=os.getenv("MEDIA_CACHE_DIR") or resolve_cache_path("media"),
+                max_cache_bytes=int(
+                    os.getenv("MEDIA_CACHE_MAX_BYTES", DEFAULT_MAX_CACHE_BYTES)
+                ),
+                max_download_bytes=int(
+                    os.getenv("MEDIA_MAX_DOWNLOAD_BYTES", DEFAULT_MAX_DOWNLOAD_BYTES)
+                ),
+            )
+        return _cache
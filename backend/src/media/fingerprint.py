@@ -0,0 +1,183 @@
+"""デコード済みの音声のスペクトルのピークの組から音声の指紋（ハッシュの列）を作る."""
+
+from dataclasses import dataclass
+
+import numpy as np
+
+# 発話の帯域を含み、計算量を抑えられるサンプリングレート
+FINGERPRINT_SAMPLE_RATE = 8000
+FFT_SIZE = 1024
+HOP_SIZE = 256
+# 指紋の時刻（フレーム番号）1つあたりの秒数
+FRAME_SECONDS = HOP_SIZE / FINGERPRINT_SAMPLE_RATE
+SPECTROGRAM_CHUNK_FRAMES = 2048
+# スペクトルのピークとみなす近傍の大きさ（フレーム数, 周波数ビン数）
+PEAK_NEIGHBORHOOD = (15, 15)
+# ピークとみなす強さ（スペクトログラム全体の中央値＝雑音の水準からの対数振幅の差。2.3 でおよそ 20 dB）
+PEAK_MIN_LEVEL_ABOVE_MEDIAN = 2.3
+# 1秒あたりに残すピークの数の上限（強いものから残す）
+MAX_PEAKS_PER_SECOND = 30
+# 1つのピーク（アンカー）と組み合わせる後続のピークの数と、組み合わせる時間差（フレーム数）の範囲
+FAN_OUT = 5
+MIN_PAIR_DELTA_FRAMES = 1
+MAX_PAIR_DELTA_FRAMES = 63
+# これより少ないハッシュしか得られない音声（無音・極端に短いもの）は照合に使わない
+MIN_HASHES = 50
+# ハッシュと時刻を1つの整数にまとめて照合するときの時刻の桁（フレーム番号はこれより小さい）
+TIME_KEY_RANGE = 1 << 32
+# 間引く前にかける低域通過フィルターの長さ
+RESAMPLE_FILTER_TAPS = 63
+
+
+class AudioFingerprintError(Exception):
+    """照合に使えるだけの音声がないことを示す."""
+
+
+@dataclass
+class AudioFingerprint:
+    """音声のスペクトルのピークの組から作ったハッシュの列.
+
+    hashes[i] は2つのピークの周波数と時間差を詰めた値、times[i] はアンカーのピークのフレーム番号。
+    再エンコードや再多重化では波形は変わってもピークの位置はほぼ保たれるため、
+    同じ時刻に同じハッシュが多く現れるかどうかで同じ音声かを判定できる。
+    """
+
+    hashes: np.ndarray
+    times: np.ndarray
+    duration_seconds: float
+
+
+def _resample_for_fingerprint(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """16bit PCM を float32 にし、FINGERPRINT_SAMPLE_RATE に間引く（間引く前に低域通過フィルターで折り返しを防ぐ）."""
+    values = samples.astype(np.float32) / 32768.0
+    if sample_rate == FINGERPRINT_SAMPLE_RATE:
+        return values
+    if sample_rate % FINGERPRINT_SAMPLE_RATE:
+        raise AudioFingerprintError(
+            f"サンプリングレート {sample_rate} Hz の音声には対応していません"
+        )
+    factor = sample_rate // FINGERPRINT_SAMPLE_RATE
+    taps = np.arange(RESAMPLE_FILTER_TAPS) - (RESAMPLE_FILTER_TAPS - 1) / 2
+    lowpass = (
+        np.sinc(taps / factor) / factor * np.hamming(RESAMPLE_FILTER_TAPS)
+    ).astype(np.float32)
+    return np.convolve(values, lowpass, mode="same")[::factor]
+
+
+def _log_spectrogram(samples: np.ndarray) -> np.ndarray:
+    """(フレーム数, 周波数ビン数) の対数振幅スペクトログラム.
+
+    長い音声でも複素数の中間結果が膨らまないよう分けて計算する。
+    """
+    frames = np.lib.stride_tricks.sliding_window_view(samples, FFT_SIZE)[::HOP_SIZE]
+    window = np.hanning(FFT_SIZE).astype(np.float32)
+    spectrogram = np.empty((len(frames), FFT_SIZE // 2 + 1), dtype=np.float32)
+    for start in range(0, len(frames), SPECTROGRAM_CHUNK_FRAMES):
+        chunk = frames[start : start + SPECTROGRAM_CHUNK_FRAMES]
+        spectrogram[start : start + len(chunk)] = np.log(
+            np.abs(np.fft.rfft(chunk * window, axis=1)) + 1e-6
+        )
+    return spectrogram
+
+
+def _local_maximum(values: np.ndarray, size: int, axis: int) -> np.ndarray:
+    """指定した軸方向の移動最大値（端は -inf で埋める）."""
+    pad = [(0, 0)] * values.ndim
+    pad[axis] = (size // 2, size // 2)
+    padded = np.pad(values, pad, constant_values=-np.inf)
+    maximum: np.ndarray = np.lib.stride_tricks.sliding_window_view(
+        padded, size, axis=axis
+    ).max(axis=-1)
+    return maximum
+
+
+def _find_peaks(spectrogram: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """近傍で最大かつ雑音の水準より十分に強い点をピークとし、時刻順の (フレーム番号, 周波数ビン) を返す.
+
+    再エンコードで加わる雑音のピークが混ざると後続のピークとの組み合わせがずれるため、弱いピークは使わない。
+    """
+    neighborhood_max = _local_maximum(
+        _local_maximum(spectrogram, PEAK_NEIGHBORHOOD[0], 0), PEAK_NEIGHBORHOOD[1], 1
+    )
+    min_level = np.median(spectrogram) + PEAK_MIN_LEVEL_ABOVE_MEDIAN
+    is_peak = (spectrogram == neighborhood_max) & (spectrogram > min_level)
+    frames, bins = np.nonzero(is_peak)
+    strengths = spectrogram[frames, bins]
+
+    # 1秒ごとに強いピークだけを残し、密度をそろえる
+    seconds = (frames * FRAME_SECONDS).astype(np.int64)
+    order = np.lexsort((-strengths, seconds))
+    frames, bins, seconds = frames[order], bins[order], seconds[order]
+    _, first_in_second = np.unique(seconds, return_index=True)
+    rank_in_second = np.arange(len(seconds)) - np.repeat(
+        first_in_second, np.diff(np.append(first_in_second, len(seconds)))
+    )
+    keep = rank_in_second < MAX_PEAKS_PER_SECOND
+    frames, bins = frames[keep], bins[keep]
+
+    order = np.lexsort((bins, frames))
+    return frames[order], bins[order]
+
+
+def _pair_peaks(frames: np.ndarray, bins: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """各ピークを後続の FAN_OUT 個のピークと組み合わせ、(周波数1, 周波数2, 時間差) をハッシュにする."""
+    hashes = []
+    times = []
+    for step in range(1, FAN_OUT + 1):
+        anchor_frames, target_frames = frames[:-step], frames[step:]
+        delta = target_frames - anchor_frames
+        valid = (delta >= MIN_PAIR_DELTA_FRAMES) & (delta <= MAX_PAIR_DELTA_FRAMES)
+        hashes.append(
+            (bins[:-step][valid].astype(np.int64) << 16)
+            | (bins[step:][valid].astype(np.int64) << 6)
+            | delta[valid].astype(np.int64)
+        )
+        times.append(anchor_frames[valid].astype(np.int32))
+    return np.concatenate(hashes), np.concatenate(times)
+
+
+def fingerprint_samples(samples: np.ndarray, sample_rate: int) -> AudioFingerprint:
+    """デコード済みの音声（モノラルの16bit PCM）から指紋を作る.
+
+    CPUを使うため、プロセスプール（core/process_pool.py）から呼ぶ。
+
+    Raises:
+        AudioFingerprintError: 音声が無音・短すぎて照合に使えない場合。
+    """
+    values = _resample_for_fingerprint(samples, sample_rate)
+    if len(values) < FFT_SIZE:
+        raise AudioFingerprintError("音声が短すぎるため指紋を作れません")
+    frames, bins = _find_peaks(_log_spectrogram(values))
+    hashes, times = _pair_peaks(frames, bins)
+    if len(hashes) < MIN_HASHES:
+        raise AudioFingerprintError("音声の特徴が少なすぎるため指紋を作れません")
+    return AudioFingerprint(
+        hashes=hashes,
+        times=times,
+        duration_seconds=len(values) / FINGERPRINT_SAMPLE_RATE,
+    )
+
+
+def fingerprint_pcm_file(pcm_path: str, sample_rate: int) -> AudioFingerprint:
+    """ファイルに書き出したPCM（モノラル・16bit）から指紋を作る.
+
+    プロセスプールへ音声全体を pickle して送らず、ワーカーがファイルから読み込むために使う。
+    """
+    return fingerprint_samples(np.fromfile(pcm_path, dtype=np.int16), sample_rate)
+
+
+def match_ratio(
+    query: AudioFingerprint, stored: AudioFingerprint, time_tolerance_frames: int
+) -> float:
+    """照合する指紋 query のハッシュのうち、stored に同じハッシュがほぼ同じ時刻（±time_tolerance_frames）にある割合を返す.
+
+    文字起こしのタイムスタンプをそのまま使えるよう、時刻のずれがない（同じ位置から始まる）場合だけを一致とみなす。
+    """
+    stored_keys = stored.hashes * TIME_KEY_RANGE + stored.times
+    matched = np.zeros(len(query.hashes), dtype=bool)
+    for shift in range(-time_tolerance_frames, time_tolerance_frames + 1):
+        query_keys = query.hashes * TIME_KEY_RANGE + (
+            query.times.astype(np.int64) + shift
+        )
+        matched |= np.isin(query_keys, stored_keys)
+    return float(matched.mean())
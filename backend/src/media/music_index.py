@@ -0,0 +1,233 @@
+"""参照カタログの曲の指紋から作る転置インデックス。動画の音声に含まれる著作権のある音楽を検出する."""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+from typing import Any
+
+import numpy as np
+
+from core.paths import resolve_cache_path
+from media.audio_pipeline import AudioDecodeError, decode_audio
+from media.fingerprint import (
+    FRAME_SECONDS,
+    AudioFingerprint,
+    AudioFingerprintError,
+    fingerprint_samples,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "music_catalog.json")
+)
+DEFAULT_INDEX_DIRNAME = "music_index"
+TRACKS_FILENAME = "tracks.json"
+# 同じ曲の同じ位置で一致したハッシュがこれ以上あれば検出とみなす
+MIN_ALIGNED_MATCHES = 15
+# 時刻のずれ（フレーム数）をこの幅でまとめて数える（再エンコードによるわずかなずれを吸収する）
+OFFSET_BIN_FRAMES = 2
+# 多くの曲に現れるハッシュは曲の区別に役立たないため、これより多く登録されているハッシュは照合に使わない
+MAX_POSTINGS_PER_HASH = 2000
+
+
+class MusicIndex:
+    """参照カタログの曲の指紋から作った転置インデックス.
+
+    全曲のハッシュを値の順に並べた配列と、対応する曲番号・曲内の時刻（フレーム番号）の配列を
+    ディスクに保存し、メモリマップで読む。照合は二分探索でハッシュごとの登録位置を求め、
+    (曲, 曲内の時刻 - 照合する音声内の時刻) ごとに一致数を数えて、最も多いものを検出結果とする。
+    同じ曲の同じ位置で一致したハッシュだけを数えるため、雑音や発言が重なっていても検出できる。
+    """
+
+    def __init__(self, index_dir: str):
+        """index_dir に作成したインデックスを読み込む（配列はメモリに展開せずマップする）."""
+        self.index_dir = index_dir
+        self.hashes = np.load(os.path.join(index_dir, "hashes.npy"), mmap_mode="r")
+        self.track_ids = np.load(
+            os.path.join(index_dir, "track_ids.npy"), mmap_mode="r"
+        )
+        self.times = np.load(os.path.join(index_dir, "times.npy"), mmap_mode="r")
+        with open(
+            os.path.join(index_dir, TRACKS_FILENAME), encoding="utf-8"
+        ) as tracks_file:
+            self.tracks: list[dict[str, Any]] = json.load(tracks_file)
+
+    def lookup(self, fingerprint: AudioFingerprint) -> dict[str, Any] | None:
+        """音声に含まれる曲を探す.
+
+        Returns:
+            dict | None: {'track': カタログの曲情報, 'start_time', 'end_time': 音声内で曲が流れている範囲（秒）,
+                          'play_offset': start_time の時点での曲内の再生位置（秒）, 'matched_hashes': 一致したハッシュの数}。
+                         見つからなければ None。
+        """
+        lower = np.searchsorted(self.hashes, fingerprint.hashes, side="left")
+        upper = np.searchsorted(self.hashes, fingerprint.hashes, side="right")
+        counts = upper - lower
+        informative = counts <= MAX_POSTINGS_PER_HASH
+        lower, counts, query_times = (
+            lower[informative],
+            counts[informative],
+            fingerprint.times[informative],
+        )
+        total = int(counts.sum())
+        if total == 0:
+            return None
+
+        # 一致した登録位置をすべて列挙する（ハッシュ i の登録位置は lower[i] から counts[i] 個）
+        starts_in_result = np.cumsum(counts) - counts
+        positions = np.repeat(lower, counts) + (
+            np.arange(total) - np.repeat(starts_in_result, counts)
+        )
+        matched_query_times = np.repeat(query_times.astype(np.int64), counts)
+        matched_tracks = np.asarray(self.track_ids[positions], dtype=np.int64)
+        offset_bins = (
+            np.asarray(self.times[positions], dtype=np.int64) - matched_query_times
+        ) // OFFSET_BIN_FRAMES
+
+        keys = matched_tracks * (1 << 32) + offset_bins
+        unique_keys, inverse, key_counts = np.unique(
+            keys, return_inverse=True, return_counts=True
+        )
+        best = int(np.argmax(key_counts))
+        if key_counts[best] < MIN_ALIGNED_MATCHES:
+            return None
+
+        aligned = inverse == best
+        aligned_query_times = matched_query_times[aligned]
+        start_frame = int(aligned_query_times.min())
+        end_frame = int(aligned_query_times.max())
+        track_id = int(matched_tracks[aligned][0])
+        play_offset_frame = (
+            int(offset_bins[aligned][0]) * OFFSET_BIN_FRAMES + start_frame
+        )
+        return {
+            "track": self.tracks[track_id],
+            "start_time": start_frame * FRAME_SECONDS,
+            "end_time": end_frame * FRAME_SECONDS,
+            "play_offset": max(0.0, play_offset_frame * FRAME_SECONDS),
+            "matched_hashes": int(key_counts[best]),
+        }
+
+
+def build_music_index(catalog_path: str, index_dir: str) -> int:
+    """参照カタログ（JSON）の曲から指紋インデックスを作り、index_dir に保存する.
+
+    作成した曲数を返す。
+
+    カタログは曲の配列で、各曲は audio_path（カタログからの相対パス可）と title / artist などのメタデータを持つ。
+    作り直している間も照合できるよう、別のディレクトリに書き出してから置き換える。
+    """
+    with open(catalog_path, encoding="utf-8") as catalog_file:
+        catalog = json.load(catalog_file)
+    catalog_dir = os.path.dirname(os.path.abspath(catalog_path))
+
+    tracks: list[dict[str, Any]] = []
+    hash_parts, track_id_parts, time_parts = [], [], []
+    for entry in catalog:
+        audio_path = os.path.join(catalog_dir, entry["audio_path"])
+        try:
+            # 照合する動画と同じデコード・間引きを通し、同じ音声から同じ指紋が得られるようにする
+            with decode_audio(audio_path, encode_for_transcription=False) as audio:
+                fingerprint = fingerprint_samples(audio.samples, audio.sample_rate)
+        except (AudioDecodeError, AudioFingerprintError) as e:
+            logger.error("曲 '%s' の指紋を作れませんでした: %s", entry.get("title"), e)
+            continue
+        track_id = len(tracks)
+        tracks.append(
+            {
+                **{key: value for key, value in entry.items() if key != "audio_path"},
+                "duration": fingerprint.duration_seconds,
+            }
+        )
+        hash_parts.append(fingerprint.hashes)
+        track_id_parts.append(
+            np.full(len(fingerprint.hashes), track_id, dtype=np.int32)
+        )
+        time_parts.append(fingerprint.times.astype(np.int32))
+        logger.debug(
+            "曲 '%s' を追加しました（ハッシュ数: %d）",
+            entry.get("title"),
+            len(fingerprint.hashes),
+        )
+
+    hashes = np.concatenate(hash_parts) if hash_parts else np.empty(0, dtype=np.int64)
+    order = np.argsort(hashes, kind="stable")
+
+    staging_dir = f"{index_dir}.building"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(staging_dir)
+    np.save(os.path.join(staging_dir, "hashes.npy"), hashes[order])
+    np.save(
+        os.path.join(staging_dir, "track_ids.npy"),
+        np.concatenate(track_id_parts)[order]
+        if tracks
+        else np.empty(0, dtype=np.int32),
+    )
+    np.save(
+        os.path.join(staging_dir, "times.npy"),
+        np.concatenate(time_parts)[order] if tracks else np.empty(0, dtype=np.int32),
+    )
+    # tracks.json を最後に書き、揃ったインデックスだけが読まれるようにする
+    with open(
+        os.path.join(staging_dir, TRACKS_FILENAME), "w", encoding="utf-8"
+    ) as tracks_file:
+        json.dump(tracks, tracks_file, ensure_ascii=False, indent=1)
+
+    previous_dir = f"{index_dir}.previous"
+    shutil.rmtree(previous_dir, ignore_errors=True)
+    if os.path.exists(index_dir):
+        os.replace(index_dir, previous_dir)
+    os.replace(staging_dir, index_dir)
+    shutil.rmtree(previous_dir, ignore_errors=True)
+    return len(tracks)
+
+
+def get_music_index_dir() -> str:
+    """インデックスの保存先（MUSIC_INDEX_DIR）を返す."""
+    return os.getenv("MUSIC_INDEX_DIR") or resolve_cache_path(DEFAULT_INDEX_DIRNAME)
+
+
+_index: MusicIndex | None = None
+_index_mtime: float | None = None
+_index_lock = threading.Lock()
+
+
+def get_music_index() -> MusicIndex | None:
+    """プロセス内で共有するインデックスを返す.
+
+    作成されていなければ None を返す。
+    インデックスを作り直した場合は、次の呼び出しで読み込み直す。
+    """
+    global _index, _index_mtime
+    index_dir = get_music_index_dir()
+    tracks_path = os.path.join(index_dir, TRACKS_FILENAME)
+    with _index_lock:
+        try:
+            mtime = os.path.getmtime(tracks_path)
+        except OSError:
+            _index, _index_mtime = None, None
+            return None
+        if _index is None or _index.index_dir != index_dir or mtime != _index_mtime:
+            _index, _index_mtime = MusicIndex(index_dir), mtime
+        return _index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="参照カタログから音楽の指紋インデックスを作成する"
+    )
+    parser.add_argument(
+        "catalog",
+        nargs="?",
+        default=os.getenv("MUSIC_CATALOG_PATH", DEFAULT_CATALOG_PATH),
+    )
+    parser.add_argument("--index-dir", default=None)
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    index_dir = arguments.index_dir or get_music_index_dir()
+    track_count = build_music_index(arguments.catalog, index_dir)
+    logger.info("%d 曲のインデックスを %s に作成しました", track_count, index_dir)
@@ -0,0 +1,264 @@
+"""文字起こしを列ごとの配列で保持する Transcript."""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Callable, Iterable
+
+# 結合したテキストでセグメントを区切る文字（full_text もこの区切りで連結したものになる）
+SEGMENT_SEPARATOR = " "
+
+
+def _text_buffer(texts: Iterable[str], separator: str) -> "tuple[str, array[int]]":
+    """テキストを1つの文字列に連結し、各テキストの開始位置（末尾に全体の長さを加えたもの）を返す."""
+    offsets = array("q", [0])
+    parts = []
+    position = 0
+    for index, text in enumerate(texts):
+        if index:
+            parts.append(separator)
+            position += len(separator)
+            offsets[-1] = position
+        parts.append(text)
+        position += len(text)
+        offsets.append(position)
+    return "".join(parts), offsets
+
+
+class Transcript:
+    """タイムスタンプ付きの文字起こしを列ごとの配列で保持する.
+
+    長い動画では単語が数万件になるため、セグメント・単語ごとに dict を作らず、
+    開始・終了時刻は double の配列、テキストは1つの文字列とその区切り位置の配列で持つ。
+    セグメントのテキストは区切り文字で連結してあるため、full_text は作り直さずにそのまま返せる。
+    dict のリストへの変換は APIレスポンスを返すとき（to_dict）だけ行う。
+    """
+
+    __slots__ = (
+        "segment_starts",
+        "segment_ends",
+        "text",
+        "segment_offsets",
+        "word_starts",
+        "word_ends",
+        "word_text",
+        "word_offsets",
+        "segment_word_offsets",
+    )
+
+    def __init__(
+        self,
+        segment_starts: "array[float]",
+        segment_ends: "array[float]",
+        text: str,
+        segment_offsets: "array[int]",
+        word_starts: "array[float]",
+        word_ends: "array[float]",
+        word_text: str,
+        word_offsets: "array[int]",
+        segment_word_offsets: "array[int]",
+    ) -> None:
+        """列ごとの配列から作る（通常は build または from_dict を使う）."""
+        self.segment_starts = segment_starts
+        self.segment_ends = segment_ends
+        # セグメントのテキストを連結したもの。i 番目は text[segment_offsets[i]:segment_offsets[i + 1]]（末尾の区切り文字を除く）
+        self.text = text
+        self.segment_offsets = segment_offsets
+        self.word_starts = word_starts
+        self.word_ends = word_ends
+        self.word_text = word_text
+        self.word_offsets = word_offsets
+        # i 番目のセグメントの単語は segment_word_offsets[i] から segment_word_offsets[i + 1] の手前まで
+        self.segment_word_offsets = segment_word_offsets
+
+    @classmethod
+    def build(
+        cls,
+        segments: list[tuple[float, float, str]],
+        words: list[tuple[str, float, float]],
+    ) -> "Transcript":
+        """セグメントと単語の一覧から Transcript を作る.
+
+        Args:
+            segments: (開始, 終了, テキスト) のリスト（開始時刻順）。
+            words: (単語, 開始, 終了) のリスト（開始時刻順）。各単語は開始時刻を含むセグメントに割り当てる。
+        """
+        segment_starts = array("d", (segment[0] for segment in segments))
+        segment_ends = array("d", (segment[1] for segment in segments))
+        text, segment_offsets = _text_buffer(
+            (segment[2] for segment in segments), SEGMENT_SEPARATOR
+        )
+        word_starts = array("d", (word[1] for word in words))
+        word_ends = array("d", (word[2] for word in words))
+        word_text, word_offsets = _text_buffer((word[0] for word in words), "")
+
+        segment_word_offsets = array("q", [0])
+        if segments:
+            segment_word_offsets.extend(
+                bisect_left(word_starts, start) for start in segment_starts[1:]
+            )
+            segment_word_offsets.append(len(word_starts))
+        return cls(
+            segment_starts,
+            segment_ends,
+            text,
+            segment_offsets,
+            word_starts,
+            word_ends,
+            word_text,
+            word_offsets,
+            segment_word_offsets,
+        )
+
+    @classmethod
+    def empty(cls) -> "Transcript":
+        """セグメントのない文字起こしを返す."""
+        return cls.build([], [])
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Transcript":
+        """to_dict（単語を含む）で変換したものから作り直す."""
+        segments = data.get("segments", [])
+        return cls.build(
+            [
+                (segment["start"], segment["end"], segment["text"])
+                for segment in segments
+            ],
+            [
+                (word["word"], word["start"], word["end"])
+                for segment in segments
+                for word in segment.get("words", [])
+            ],
+        )
+
+    @classmethod
+    def from_whisper(cls, response: Any) -> "Transcript":
+        """Whisper API（verbose_json）のレスポンスから作る.
+
+        単語のタイムスタンプはセグメントではなくレスポンスの最上位（words）に含まれる。
+        セグメントがない場合は全体を1つのセグメントとして扱う。
+        """
+        segments = getattr(response, "segments", None)
+        if segments:
+            segment_rows = [
+                (segment.start, segment.end, segment.text.strip())
+                for segment in segments
+            ]
+        else:
+            segment_rows = [(0.0, 0.0, (getattr(response, "text", None) or "").strip())]
+        word_rows = [
+            (word.word, word.start, word.end)
+            for word in getattr(response, "words", None) or []
+        ]
+        return cls.build(segment_rows, word_rows)
+
+    def __len__(self) -> int:
+        """セグメントの数を返す."""
+        return len(self.segment_starts)
+
+    @property
+    def word_count(self) -> int:
+        """単語の数を返す."""
+        return len(self.word_starts)
+
+    @property
+    def full_text(self) -> str:
+        """セグメントを空白で連結した文字列を返す."""
+        return self.text
+
+    def segment_text(self, index: int) -> str:
+        """指定した番号のセグメントのテキストを返す."""
+        end = self.segment_offsets[index + 1]
+        if index + 1 < len(self):
+            end -= len(SEGMENT_SEPARATOR)
+        return self.text[self.segment_offsets[index] : end]
+
+    def segment_words(self, index: int) -> list[tuple[str, float, float]]:
+        """セグメントの単語を (単語, 開始, 終了) のリストで返す."""
+        return [
+            (
+                self.word_text[self.word_offsets[word] : self.word_offsets[word + 1]],
+                self.word_starts[word],
+                self.word_ends[word],
+            )
+            for word in range(
+                self.segment_word_offsets[index], self.segment_word_offsets[index + 1]
+            )
+        ]
+
+    def slice(self, start: float, end: float, rebase: bool = False) -> "Transcript":
+        """[start, end) に重なるセグメントを取り出す.
+
+        セグメントは時刻順のため二分探索で範囲を求める。
+
+        Args:
+            rebase (bool): True の場合、start を0秒とした時刻にしてセグメントと単語を [0, end - start] に収める（切り出した動画と合わせる）。
+        """
+        first = bisect_right(self.segment_ends, start)
+        last = bisect_left(self.segment_starts, end)
+        offset = start if rebase else 0.0
+        length = end - start
+
+        segments = []
+        words = []
+        for index in range(first, max(first, last)):
+            segment_start = self.segment_starts[index] - offset
+            segment_end = self.segment_ends[index] - offset
+            if rebase:
+                segment_start, segment_end = (
+                    max(0.0, segment_start),
+                    min(length, segment_end),
+                )
+            segments.append((segment_start, segment_end, self.segment_text(index)))
+            for word, word_start, word_end in self.segment_words(index):
+                word_start, word_end = word_start - offset, word_end - offset
+                if rebase:
+                    # 区間の境界をまたぐセグメントの単語も、セグメントと同じく [0, end - start] に収める
+                    word_start = min(length, max(0.0, word_start))
+                    word_end = max(word_start, min(length, word_end))
+                words.append((word, word_start, word_end))
+        return Transcript.build(segments, words)
+
+    def map_times(self, mapping: Callable[[float], float]) -> "Transcript":
+        """すべての時刻を mapping で変換した Transcript を返す（発話の区間だけを文字起こしした時刻を元の動画の時刻に戻す）.
+
+        mapping は単調増加である必要がある（セグメントへの単語の割り当てをそのまま使う）。テキストの列は共有する。
+        """
+        return Transcript(
+            array("d", map(mapping, self.segment_starts)),
+            array("d", map(mapping, self.segment_ends)),
+            self.text,
+            self.segment_offsets,
+            array("d", map(mapping, self.word_starts)),
+            array("d", map(mapping, self.word_ends)),
+            self.word_text,
+            self.word_offsets,
+            self.segment_word_offsets,
+        )
+
+    def timestamped_text(self) -> str:
+        """プロンプト用に、セグメントごとに "[開始-終了] テキスト" の行にする."""
+        return "\n".join(
+            f"[{self.segment_starts[index]:.2f}-{self.segment_ends[index]:.2f}] {self.segment_text(index)}"
+            for index in range(len(self))
+        )
+
+    def to_dict(self, include_words: bool = True) -> dict[str, Any]:
+        """APIレスポンス用の形式（従来の文字起こし結果と同じ dict）に変換する.
+
+        Args:
+            include_words (bool): 単語単位のタイムスタンプを含めるか。件数が多いため詳細表示のときだけ含める。
+        """
+        segments = []
+        for index in range(len(self)):
+            segment = {
+                "start": self.segment_starts[index],
+                "end": self.segment_ends[index],
+                "text": self.segment_text(index),
+            }
+            if include_words:
+                segment["words"] = [
+                    {"word": word, "start": word_start, "end": word_end}
+                    for word, word_start, word_end in self.segment_words(index)
+                ]
+            segments.append(segment)
+        return {"segments": segments, "full_text": self.full_text}
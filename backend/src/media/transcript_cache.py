@@ -0,0 +1,171 @@
+"""音声の指紋をキーに文字起こしを保存するSQLiteストア."""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from core.paths import resolve_cache_path
+from media.fingerprint import AudioFingerprint, match_ratio
+from media.transcript import Transcript
+
+DEFAULT_MAX_ENTRIES = 2000
+# 同じ音声とみなす、一致したハッシュの割合（両方向で計算した小さい方）
+DEFAULT_MIN_MATCH_RATIO = 0.25
+# 再エンコードで先頭に入る無音（エンコーダーの遅延）を許容する時刻のずれ（フレーム数。1フレーム = 32ms）
+MATCH_TIME_TOLERANCE_FRAMES = 2
+# 長さがこれ以上違う音声は照合しない（秒）
+DURATION_TOLERANCE_SECONDS = 1.0
+# 長さが近い候補のうち、照合する数の上限（最近使われたものから）
+MAX_CANDIDATES = 50
+
+
+class TranscriptCache:
+    """音声の指紋をキーに文字起こしを保存するSQLiteストア.
+
+    再エンコード・再多重化された転載動画はファイルのハッシュが変わっても音声の指紋はほぼ一致するため、
+    一度文字起こしした音声であれば Whisper を呼ばずに保存済みの文字起こしを返せる。
+    長さの近いものだけを候補にし、同じ時刻に同じハッシュが一定以上の割合で現れれば同じ音声とみなす。
+    """
+
+    def __init__(self, db_path: str, max_entries: int, min_match_ratio: float):
+        """db_path のデータベースを開き、なければテーブルを作る."""
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.min_match_ratio = min_match_ratio
+        self._local = threading.local()
+        self._initialize_schema()
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3の接続はスレッド間で共有できないため、スレッドごとに保持する
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def _initialize_schema(self) -> None:
+        connection = self._connect()
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS audio_transcripts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                duration_seconds REAL NOT NULL,
+                hashes BLOB NOT NULL,
+                times BLOB NOT NULL,
+                transcript TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            """
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS audio_transcripts_duration ON audio_transcripts (duration_seconds)"
+        )
+
+    def find(self, fingerprint: AudioFingerprint) -> Transcript | None:
+        """同じ音声の文字起こしが保存されていれば返す.
+
+        なければ None を返す。
+        """
+        connection = self._connect()
+        candidates = connection.execute(
+            """
+            SELECT id, duration_seconds, hashes, times FROM audio_transcripts
+            WHERE duration_seconds BETWEEN ? AND ?
+            ORDER BY last_used_at DESC LIMIT ?
+            """,
+            (
+                fingerprint.duration_seconds - DURATION_TOLERANCE_SECONDS,
+                fingerprint.duration_seconds + DURATION_TOLERANCE_SECONDS,
+                MAX_CANDIDATES,
+            ),
+        ).fetchall()
+
+        for entry_id, duration_seconds, hashes, times in candidates:
+            stored = AudioFingerprint(
+                hashes=np.frombuffer(hashes, dtype=np.int64),
+                times=np.frombuffer(times, dtype=np.int32),
+                duration_seconds=duration_seconds,
+            )
+            # 一方が他方を含むだけの場合（同じBGMに別の発言を重ねた動画など）を除くため、両方向で確かめる
+            ratio = min(
+                match_ratio(fingerprint, stored, MATCH_TIME_TOLERANCE_FRAMES),
+                match_ratio(stored, fingerprint, MATCH_TIME_TOLERANCE_FRAMES),
+            )
+            if ratio < self.min_match_ratio:
+                continue
+            connection.execute(
+                "UPDATE audio_transcripts SET last_used_at = ? WHERE id = ?",
+                (time.time(), entry_id),
+            )
+            row = connection.execute(
+                "SELECT transcript FROM audio_transcripts WHERE id = ?", (entry_id,)
+            ).fetchone()
+            if row is not None:
+                return Transcript.from_dict(json.loads(row[0]))
+        return None
+
+    def save(self, fingerprint: AudioFingerprint, transcript: Transcript) -> None:
+        """文字起こしを保存し、件数が上限を超えたら最後に使われた時刻が古いものから削除する."""
+        now = time.time()
+        connection = self._connect()
+        connection.execute(
+            """
+            INSERT INTO audio_transcripts (duration_seconds, hashes, times, transcript, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (
+                fingerprint.duration_seconds,
+                fingerprint.hashes.astype(np.int64).tobytes(),
+                fingerprint.times.astype(np.int32).tobytes(),
+                json.dumps(transcript.to_dict(), ensure_ascii=False),
+                now,
+                now,
+            ),
+        )
+        connection.execute(
+            """
+            DELETE FROM audio_transcripts WHERE id NOT IN (
+                SELECT id FROM audio_transcripts ORDER BY last_used_at DESC LIMIT ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+
+_cache: TranscriptCache | None = None
+_cache_lock = threading.Lock()
+
+
+def is_transcript_cache_enabled() -> bool:
+    """TRANSCRIPT_CACHE_ENABLED=0 でなければ True を返す."""
+    return os.getenv("TRANSCRIPT_CACHE_ENABLED", "1") != "0"
+
+
+def get_transcript_cache() -> TranscriptCache:
+    """プロセス内で共有するキャッシュを返す.
+
+    保存先は TRANSCRIPT_CACHE_DB_PATH（既定: backend/.cache/transcripts.sqlite3）、
+    件数の上限は TRANSCRIPT_CACHE_MAX_ENTRIES、一致とみなす割合は TRANSCRIPT_CACHE_MIN_MATCH_RATIO で変更できる。
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TranscriptCache(
+                db_path=os.getenv("TRANSCRIPT_CACHE_DB_PATH")
+                or resolve_cache_path("transcripts.sqlite3"),
+                max_entries=int(
+                    os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+                ),
+                min_match_ratio=float(
+                    os.getenv(
+                        "TRANSCRIPT_CACHE_MIN_MATCH_RATIO", DEFAULT_MIN_MATCH_RATIO
+                    )
+                ),
+            )
+        return _cache
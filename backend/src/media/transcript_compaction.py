@@ -0,0 +1,229 @@
+"""プロンプトに入れる文字起こしをモデルの予算に収まるよう圧縮する."""
+
+import logging
+import math
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from core.metrics import annotate_span, record_transcript_compaction, span
+from core.token_budget import estimate_tokens
+from media.transcript import Transcript
+
+logger = logging.getLogger(__name__)
+
+# 意味を持たないことがはっきりしている言いよどみ。「あの」「その」「なんか」のように指示語や副詞と区別できないものは含めない
+FILLER_PATTERN = re.compile(
+    r"(?:^|(?<=[\s、。，,！？!?]))"
+    r"(?:えーっと|えーと|えっと|ええと|えー+|あのー+|そのー+|うー+ん|うーん|んー+|まー+|あー+|uhm|um+|uh+|erm)"
+    r"(?:[\s、。，,…]+|$)",
+    re.IGNORECASE,
+)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# 関連テキストとセグメントを照合するときに無視する文字
+MATCH_IGNORED_PATTERN = re.compile(r"[\s、。，,.!?！？…「」『』\"']")
+# 予算に収まるまで、隣り合うセグメントをこの長さ（秒）の行にまとめていく
+MERGE_BLOCK_SECONDS = (15, 30, 60, 120)
+# 関連テキストで元のセグメントを探すときの最短の長さ（短すぎると別の発言にも一致する）
+MIN_MATCH_CHARS = 2
+
+
+@dataclass
+class TranscriptCompaction:
+    """プロンプトに入れる前に文字起こしへ加えた変更の記録.
+
+    レスポンスに含め、報告された時刻の精度が分かるようにする。
+
+    time_resolution_seconds はプロンプト上の1行が表す時間の粒度。秒に丸めただけなら 1、
+    セグメントを MERGE_BLOCK_SECONDS の行にまとめた場合はその長さで、モデルが報告する時刻はこの範囲でずれうる。
+    時刻を含まない全文（plain_text）を圧縮した場合は 0。
+    """
+
+    model: str
+    budget_tokens: int
+    original_tokens: int
+    tokens: int
+    original_lines: int
+    lines: int
+    steps: list[str] = field(default_factory=list)
+    time_resolution_seconds: float = 1.0
+    over_budget: bool = False
+
+    def to_dict(self) -> dict[str, Any]:
+        """APIレスポンス用の dict に変換する."""
+        return asdict(self)
+
+
+def drop_fillers(text: str) -> str:
+    """言いよどみを取り除き、連続する空白を1つにする."""
+    return WHITESPACE_PATTERN.sub(" ", FILLER_PATTERN.sub("", text)).strip()
+
+
+def _format_rows(rows: list[tuple[int, int, str]]) -> str:
+    return "\n".join(f"[{start}-{end}] {text}" for start, end, text in rows)
+
+
+def _merge_rows(
+    rows: list[tuple[int, int, str]], block_seconds: int
+) -> list[tuple[int, int, str]]:
+    """隣り合う行を、開始から終了までが block_seconds を超えない範囲で1行にまとめる."""
+    merged: list[tuple[int, int, str]] = []
+    for start, end, text in rows:
+        if merged and end - merged[-1][0] <= block_seconds:
+            merged_start, _, merged_text = merged[-1]
+            merged[-1] = (
+                merged_start,
+                max(end, merged[-1][1]),
+                f"{merged_text} {text}",
+            )
+        else:
+            merged.append((start, end, text))
+    return merged
+
+
+def fit_transcript_to_budget(
+    transcript: Transcript, model: str, budget_tokens: int, plain_text: bool = False
+) -> tuple[str, TranscriptCompaction | None]:
+    """プロンプトに入れる文字起こしのトークン数を数え、予算を超える場合は圧縮する.
+
+    圧縮は段階的に行い、予算に収まった時点で止める。
+      1. 言いよどみを取り除き、時刻を秒に丸める（開始は切り捨て、終了は切り上げで、元の範囲を必ず含む）
+      2. 隣り合うセグメントを MERGE_BLOCK_SECONDS の行にまとめる（短い行から順に試す）
+    plain_text の場合は時刻を含めないため、言いよどみを取り除くだけにする。
+    最も粗くまとめても収まらない場合は over_budget を立ててそのまま返す。
+
+    Args:
+        plain_text (bool): True の場合、予算に収まるときは時刻なしの全文を返す（文脈判断用）。
+
+    Returns:
+        (プロンプトに入れる文字起こし, 圧縮の記録)。圧縮しなかった場合の記録は None。
+    """
+    with span("prompt_budget", model=model):
+        text = transcript.full_text if plain_text else transcript.timestamped_text()
+        original_tokens = estimate_tokens(text)
+        annotate_span(tokens=original_tokens, budget_tokens=budget_tokens)
+        if original_tokens <= budget_tokens:
+            return text, None
+
+        rows = []
+        for index in range(len(transcript)):
+            segment_text = drop_fillers(transcript.segment_text(index))
+            if segment_text:
+                rows.append(
+                    (
+                        math.floor(transcript.segment_starts[index]),
+                        math.ceil(transcript.segment_ends[index]),
+                        segment_text,
+                    )
+                )
+        compaction = TranscriptCompaction(
+            model=model,
+            budget_tokens=budget_tokens,
+            original_tokens=original_tokens,
+            tokens=0,
+            original_lines=len(transcript),
+            lines=len(rows),
+            steps=["drop_filler"],
+        )
+        if plain_text:
+            # 時刻を含まない全文では、行をまとめても減らないため言いよどみを取り除くだけにする
+            text = " ".join(row[2] for row in rows)
+            tokens = estimate_tokens(text)
+            compaction.time_resolution_seconds = 0.0
+        else:
+            compaction.steps.append("round_timestamps")
+            text = _format_rows(rows)
+            tokens = estimate_tokens(text)
+            for block_seconds in MERGE_BLOCK_SECONDS:
+                if tokens <= budget_tokens:
+                    break
+                merged = _merge_rows(rows, block_seconds)
+                text = _format_rows(merged)
+                tokens = estimate_tokens(text)
+                compaction.lines = len(merged)
+                compaction.steps[2:] = [f"merge_segments_{block_seconds}s"]
+                compaction.time_resolution_seconds = float(block_seconds)
+
+        compaction.tokens = tokens
+        compaction.over_budget = tokens > budget_tokens
+        annotate_span(
+            compacted_tokens=tokens,
+            steps=list(compaction.steps),
+            over_budget=compaction.over_budget,
+        )
+        record_transcript_compaction(model, compaction.over_budget)
+        if compaction.over_budget:
+            logger.error(
+                "文字起こしを圧縮しても予算に収まりません（%d / %d トークン, %s）",
+                tokens,
+                budget_tokens,
+                model,
+            )
+        else:
+            logger.debug(
+                "文字起こしを圧縮しました（%d → %d トークン, %s）",
+                original_tokens,
+                tokens,
+                ", ".join(compaction.steps),
+            )
+        return text, compaction
+
+
+def _match_key(text: str) -> str:
+    return MATCH_IGNORED_PATTERN.sub("", drop_fillers(text))
+
+
+def refine_violation_times(
+    violations: list[dict[str, Any]],
+    transcript: Transcript,
+    compaction: TranscriptCompaction | None,
+) -> None:
+    """圧縮した文字起こしをもとに報告された違反の時刻を、元のセグメントの時刻に戻す（violations をその場で書き換える）.
+
+    報告された範囲の前後 time_resolution_seconds にあるセグメントのうち、関連テキストを含むものがあればその範囲にする。
+    関連テキストがない・見つからない場合は、開始と終了をそれぞれ最も近いセグメントの境界に合わせる。
+    """
+    if (
+        compaction is None
+        or compaction.time_resolution_seconds == 0
+        or len(transcript) == 0
+    ):
+        return
+    tolerance = compaction.time_resolution_seconds
+    for violation in violations:
+        try:
+            start, end = float(violation["start_time"]), float(violation["end_time"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        first = bisect_right(transcript.segment_ends, start - tolerance)
+        last = bisect_left(transcript.segment_starts, end + tolerance)
+        candidates = list(range(first, max(first, last)))
+        if not candidates:
+            continue
+
+        related = _match_key(violation.get("related_text") or "")
+        if len(related) >= MIN_MATCH_CHARS:
+            # 関連テキストが1つのセグメントに含まれる場合と、複数のセグメントにまたがる場合の両方を探す
+            matched = [
+                index
+                for index in candidates
+                if (segment_key := _match_key(transcript.segment_text(index)))
+                and (related in segment_key or segment_key in related)
+            ]
+            if matched:
+                violation["start_time"] = transcript.segment_starts[matched[0]]
+                violation["end_time"] = transcript.segment_ends[matched[-1]]
+                continue
+
+        violation["start_time"] = min(
+            (transcript.segment_starts[index] for index in candidates),
+            key=lambda value: abs(value - start),
+        )
+        violation["end_time"] = max(
+            min(
+                (transcript.segment_ends[index] for index in candidates),
+                key=lambda value: abs(value - end),
+            ),
+            violation["start_time"],
+        )
@@ -0,0 +1,204 @@
+"""音声のフレームごとの特徴から発話の区間を求め、発話だけをつなげた音声と時刻の対応を作る."""
+
+import os
+from bisect import bisect_right
+from dataclasses import dataclass
+
+import numpy as np
+
+# 特徴量を計算するフレームの長さ（秒）。フレームは重ねずに並べる
+FRAME_SECONDS = 0.02
+FEATURE_CHUNK_FRAMES = 4096
+# 発話の主な帯域（Hz。基本周波数から子音の帯域まで）
+SPEECH_BAND = (80.0, 4000.0)
+# 雑音の水準とみなすフレームのエネルギーの百分位数と、そこからの差（dB）
+NOISE_FLOOR_PERCENTILE = 10
+MIN_LEVEL_ABOVE_NOISE_DB = 9.0
+# これより小さいフレームは雑音の水準にかかわらず無音とみなす（dBFS）
+MIN_LEVEL_DBFS = -55.0
+# 発話の帯域に含まれるエネルギーの割合の下限
+MIN_SPEECH_BAND_RATIO = 0.6
+# スペクトルの平坦度の上限（1に近いほど雑音に近い）
+MAX_SPECTRAL_FLATNESS = 0.35
+# 発話は音節ごとにエネルギーが上下するため、この長さの範囲でエネルギーの変動（標準偏差, dB）が小さいものは持続音とみなす
+MODULATION_WINDOW_SECONDS = 0.5
+MIN_MODULATION_DB = 4.0
+# 区間の整形: この長さより短い途切れはつなげ、短い区間は捨て、前後に余白を付ける（秒）
+MAX_MERGE_GAP_SECONDS = 0.5
+MIN_REGION_SECONDS = 0.25
+REGION_PADDING_SECONDS = 0.2
+# 切り詰めた音声で区間の間に入れる無音（秒）。Whisper が前後の区間の発話を1つにつなげないようにする
+COMPACT_GAP_SECONDS = 0.3
+# 発話の割合がこれ以上の音声は切り詰めても効果が小さいため、そのまま文字起こしする
+FULL_SPEECH_RATIO = 0.9
+
+
+@dataclass(frozen=True)
+class SpeechRegion:
+    """発話を含む区間（元の音声での秒数）."""
+
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        """区間の長さ（秒）を返す."""
+        return self.end - self.start
+
+
+class OffsetMap:
+    """発話の区間だけをつなげた音声の時刻と、元の動画の時刻の対応.
+
+    i 番目の区間は切り詰めた音声の compact_starts[i] 秒から始まり、元の動画の regions[i].start 秒に当たる。
+    区間の間に入れた無音の時刻は、直前の区間の終わりに対応させる。
+    """
+
+    def __init__(
+        self, regions: list[SpeechRegion], gap_seconds: float = COMPACT_GAP_SECONDS
+    ):
+        """発話の区間を gap_seconds の無音をはさんでつなげた場合の時刻の対応を作る."""
+        self.regions = regions
+        self.compact_starts = []
+        position = 0.0
+        for region in regions:
+            self.compact_starts.append(position)
+            position += region.duration + gap_seconds
+
+    def to_original(self, time_seconds: float) -> float:
+        """切り詰めた音声の時刻を元の動画の時刻に変換する."""
+        if not self.regions:
+            return time_seconds
+        index = max(0, bisect_right(self.compact_starts, time_seconds) - 1)
+        region = self.regions[index]
+        offset = min(
+            max(0.0, time_seconds - self.compact_starts[index]), region.duration
+        )
+        return region.start + offset
+
+
+def is_vad_enabled() -> bool:
+    """TRANSCRIPTION_VAD=0 でなければ True を返す."""
+    return os.getenv("TRANSCRIPTION_VAD", "1") != "0"
+
+
+def _frame_features(
+    samples: np.ndarray, sample_rate: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """フレームごとのエネルギー（dBFS）、発話の帯域に含まれるエネルギーの割合、スペクトルの平坦度を返す.
+
+    長い音声でもスペクトルの中間結果が膨らまないよう、FEATURE_CHUNK_FRAMES ずつ計算する。
+    """
+    frame_length = int(sample_rate * FRAME_SECONDS)
+    frame_count = len(samples) // frame_length
+    frames = samples[: frame_count * frame_length].reshape(frame_count, frame_length)
+    frequencies = np.fft.rfftfreq(frame_length, 1 / sample_rate)
+    in_band = (frequencies >= SPEECH_BAND[0]) & (frequencies <= SPEECH_BAND[1])
+    window = np.hanning(frame_length).astype(np.float32)
+
+    energy_db = np.empty(frame_count, dtype=np.float32)
+    band_ratio = np.empty(frame_count, dtype=np.float32)
+    flatness = np.empty(frame_count, dtype=np.float32)
+    for start in range(0, frame_count, FEATURE_CHUNK_FRAMES):
+        chunk = (
+            frames[start : start + FEATURE_CHUNK_FRAMES].astype(np.float32) / 32768.0
+        )
+        chunk -= chunk.mean(axis=1, keepdims=True)
+        power = np.abs(np.fft.rfft(chunk * window, axis=1)) ** 2 + 1e-12
+        total = power.sum(axis=1)
+        end = start + len(chunk)
+        # rfft の片側のパワーの合計から二乗平均を求める（パーセバルの定理）
+        energy_db[start:end] = 10 * np.log10(2 * total / frame_length**2)
+        band_ratio[start:end] = power[:, in_band].sum(axis=1) / total
+        flatness[start:end] = np.exp(np.log(power).mean(axis=1)) / power.mean(axis=1)
+    return energy_db, band_ratio, flatness
+
+
+def _modulation(energy_db: np.ndarray) -> np.ndarray:
+    """各フレームを中心とした MODULATION_WINDOW_SECONDS の範囲でのエネルギーの標準偏差（dB）."""
+    size = max(3, int(MODULATION_WINDOW_SECONDS / FRAME_SECONDS) | 1)
+    padded = np.pad(energy_db, size // 2, mode="edge")
+    deviations: np.ndarray = np.lib.stride_tricks.sliding_window_view(padded, size).std(
+        axis=1
+    )
+    return deviations
+
+
+def _to_regions(active: np.ndarray, duration: float) -> list[SpeechRegion]:
+    """発話と判定したフレームの並びを区間にし、短い途切れをつなげ、短い区間を捨て、余白を付ける."""
+    edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1) * FRAME_SECONDS
+    ends = np.flatnonzero(edges == -1) * FRAME_SECONDS
+
+    merged: list[list[float]] = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if merged and start - merged[-1][1] <= MAX_MERGE_GAP_SECONDS:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    regions: list[SpeechRegion] = []
+    for start, end in merged:
+        if end - start < MIN_REGION_SECONDS:
+            continue
+        start = max(0.0, start - REGION_PADDING_SECONDS)
+        end = min(duration, end + REGION_PADDING_SECONDS)
+        if regions and start <= regions[-1].end:
+            regions[-1] = SpeechRegion(regions[-1].start, end)
+        else:
+            regions.append(SpeechRegion(start, end))
+    return regions
+
+
+def detect_speech_regions(samples: np.ndarray, sample_rate: int) -> list[SpeechRegion]:
+    """モノラルの16bit PCM から発話を含む区間を求める.
+
+    CPUを使うため、プロセスプール（core/process_pool.py）から呼ぶ。
+
+    フレームごとに、雑音の水準より十分に大きく、エネルギーが発話の帯域に集まり、スペクトルが平坦でない（雑音でない）もので、
+    周囲のエネルギーが音節のように上下している（持続音でない）ものを発話とみなす。
+    """
+    energy_db, band_ratio, flatness = _frame_features(samples, sample_rate)
+    if len(energy_db) == 0:
+        return []
+    noise_floor = np.percentile(energy_db, NOISE_FLOOR_PERCENTILE)
+    active = (
+        (energy_db > noise_floor + MIN_LEVEL_ABOVE_NOISE_DB)
+        & (energy_db > MIN_LEVEL_DBFS)
+        & (band_ratio > MIN_SPEECH_BAND_RATIO)
+        & (flatness < MAX_SPECTRAL_FLATNESS)
+        & (_modulation(energy_db) > MIN_MODULATION_DB)
+    )
+    return _to_regions(active, len(samples) / sample_rate)
+
+
+def detect_speech_regions_in_file(
+    pcm_path: str, sample_rate: int
+) -> list[SpeechRegion]:
+    """ファイルに書き出したPCM（モノラル・16bit）から発話を含む区間を求める.
+
+    プロセスプールへ音声全体を pickle して送らず、ワーカーがファイルから読み込むために使う。
+    """
+    return detect_speech_regions(np.fromfile(pcm_path, dtype=np.int16), sample_rate)
+
+
+def compact_speech(
+    samples: np.ndarray, sample_rate: int, regions: list[SpeechRegion]
+) -> tuple[np.ndarray, OffsetMap]:
+    """発話の区間だけを短い無音をはさんでつなげた音声と、その時刻を元の動画の時刻に戻す対応を返す."""
+    gap = np.zeros(int(COMPACT_GAP_SECONDS * sample_rate), dtype=samples.dtype)
+    parts = []
+    for region in regions:
+        parts.append(
+            samples[int(region.start * sample_rate) : int(region.end * sample_rate)]
+        )
+        parts.append(gap)
+    compacted = np.concatenate(parts) if parts else samples[:0]
+    # サンプル数に丸めた長さで対応を作り、区間を重ねるほど時刻がずれないようにする
+    rounded = [
+        SpeechRegion(
+            int(region.start * sample_rate) / sample_rate,
+            int(region.end * sample_rate) / sample_rate,
+        )
+        for region in regions
+    ]
+    return compacted, OffsetMap(rounded, len(gap) / sample_rate)
@@ -0,0 +1,271 @@
+"""長い動画を時間の区間に分け、文字起こしと違反の時刻を区間と動画全体の間で変換する."""
+
+import os
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator
+
+from core.metrics import span
+
+# 0 で区間分割を行わない
+DEFAULT_WINDOW_SECONDS = 300
+# 区間の境界をまたぐ違反を見落とさないよう、前後の区間と重ねる秒数
+DEFAULT_OVERLAP_SECONDS = 10
+DEFAULT_WINDOW_CONCURRENCY = 4
+# 切り出し開始位置をキーフレームの時刻よりわずかに後ろにして、浮動小数点の誤差で1つ前のキーフレームから切り出されないようにする
+SEEK_EPSILON_SECONDS = 0.001
+FFMPEG_TIMEOUT_SECONDS = 120
+
+
+class VideoWindowError(Exception):
+    """ffprobe / ffmpeg による動画の解析・切り出しに失敗したことを示す."""
+
+
+@dataclass(frozen=True)
+class VideoWindow:
+    """動画から切り出す1区間.
+
+    start / end は切り出す範囲（動画全体での秒数）。start はキーフレームに合わせてあり、
+    切り出した動画の0秒が動画全体の start 秒に当たる。
+    owned_start / owned_end はこの区間が担当する範囲で、隣の区間と重なった部分で検出された違反は
+    中央の時刻を担当する区間の結果だけを残す。
+    """
+
+    index: int
+    start: float
+    end: float
+    owned_start: float
+    owned_end: float
+
+    def owns(self, time_seconds: float) -> bool:
+        """time_seconds がこの区間の担当範囲に含まれれば True を返す."""
+        return self.owned_start <= time_seconds < self.owned_end
+
+
+def get_window_seconds() -> float:
+    """区間の長さ（VIDEO_WINDOW_SECONDS）を返す。0 なら区間分割を行わない."""
+    return float(os.getenv("VIDEO_WINDOW_SECONDS", DEFAULT_WINDOW_SECONDS))
+
+
+def get_window_concurrency() -> int:
+    """同時に分析する区間の数（VIDEO_WINDOW_CONCURRENCY）を返す."""
+    return max(
+        1, int(os.getenv("VIDEO_WINDOW_CONCURRENCY", DEFAULT_WINDOW_CONCURRENCY))
+    )
+
+
+def _run_ffprobe(arguments: list[str]) -> str:
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", *arguments],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=FFMPEG_TIMEOUT_SECONDS,
+        )
+    except (OSError, subprocess.SubprocessError) as error:
+        raise VideoWindowError(
+            f"ffprobe による動画の解析に失敗しました: {error}"
+        ) from error
+    return result.stdout
+
+
+def probe_duration(video_path: str) -> float:
+    """動画の長さ（秒）を返す."""
+    output = _run_ffprobe(
+        ["-show_entries", "format=duration", "-of", "csv=p=0", video_path]
+    ).strip()
+    try:
+        return float(output)
+    except ValueError as error:
+        raise VideoWindowError(
+            f"動画の長さを取得できませんでした: {output!r}"
+        ) from error
+
+
+def probe_keyframes(video_path: str) -> list[float]:
+    """映像のキーフレームの時刻（秒）を昇順で返す.
+
+    フレームをデコードせずパケットのフラグだけを読むため、長い動画でも読み出しの時間で済む。
+    """
+    output = _run_ffprobe(
+        [
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,flags",
+            "-of",
+            "csv=p=0",
+            video_path,
+        ]
+    )
+    keyframes = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    return sorted(keyframes)
+
+
+def plan_windows(
+    duration: float,
+    keyframes: list[float],
+    window_seconds: float,
+    overlap_seconds: float,
+) -> list[VideoWindow]:
+    """動画を window_seconds ごとの区間に分ける.
+
+    区間 i は [i * window_seconds, (i + 1) * window_seconds) を担当し、前後に overlap_seconds ずつ広げて切り出す。
+    再エンコードせずに切り出すため、切り出し開始位置はその直前のキーフレームまで前にずらす。
+    """
+    if not keyframes:
+        raise VideoWindowError(
+            "キーフレームが見つからないため、動画を区間に分けられません"
+        )
+
+    windows: list[VideoWindow] = []
+    boundary = 0.0
+    while boundary < duration:
+        owned_end = min(boundary + window_seconds, duration)
+        desired_start = max(0.0, boundary - overlap_seconds)
+        start = max(
+            [keyframe for keyframe in keyframes if keyframe <= desired_start],
+            default=keyframes[0],
+        )
+        windows.append(
+            VideoWindow(
+                index=len(windows),
+                start=start,
+                end=min(owned_end + overlap_seconds, duration),
+                owned_start=boundary,
+                owned_end=owned_end if owned_end < duration else float("inf"),
+            )
+        )
+        boundary = owned_end
+    return windows
+
+
+def plan_video_windows(video_path: str) -> list[VideoWindow] | None:
+    """VIDEO_WINDOW_SECONDS より長い動画を区間に分ける.
+
+    区間分割が無効、または動画が短い場合は None を返す。
+    """
+    window_seconds = get_window_seconds()
+    if window_seconds <= 0:
+        return None
+    with span("window_plan"):
+        duration = probe_duration(video_path)
+        if duration <= window_seconds:
+            return None
+        overlap_seconds = float(
+            os.getenv("VIDEO_WINDOW_OVERLAP_SECONDS", DEFAULT_OVERLAP_SECONDS)
+        )
+        return plan_windows(
+            duration, probe_keyframes(video_path), window_seconds, overlap_seconds
+        )
+
+
+@contextmanager
+def cut_video_window(video_path: str, window: VideoWindow) -> Iterator[str]:
+    """区間を再エンコードせずに一時ファイルへ切り出し、そのパスを返す.
+
+    ブロックを抜けると削除する。
+    """
+    suffix = os.path.splitext(video_path)[1] or ".mp4"
+    with tempfile.TemporaryDirectory(prefix="video_window_") as temp_dir:
+        clip_path = os.path.join(temp_dir, f"window_{window.index}{suffix}")
+        command = [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-y",
+            "-ss",
+            f"{window.start + SEEK_EPSILON_SECONDS:.3f}",
+            "-i",
+            video_path,
+            "-t",
+            f"{window.end - window.start:.3f}",
+            "-c",
+            "copy",
+            "-avoid_negative_ts",
+            "make_zero",
+            clip_path,
+        ]
+        with span("window_cut", window_index=window.index):
+            try:
+                subprocess.run(
+                    command,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                    timeout=FFMPEG_TIMEOUT_SECONDS,
+                )
+            except (OSError, subprocess.SubprocessError) as error:
+                raise VideoWindowError(
+                    f"区間 {window.index} の切り出しに失敗しました: {error}"
+                ) from error
+        yield clip_path
+
+
+def _as_seconds(value: Any) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_global_violations(
+    violations: list[dict[str, Any]], window: VideoWindow
+) -> list[dict[str, Any]]:
+    """区間内の時刻で報告された違反を動画全体の時刻に直し、この区間が担当する違反だけを返す.
+
+    時刻が数値でない違反は担当を判断できないため、そのまま残す。
+    """
+    global_violations = []
+    for violation in violations:
+        start_time = _as_seconds(violation.get("start_time"))
+        end_time = _as_seconds(violation.get("end_time"))
+        if start_time is None or end_time is None:
+            global_violations.append(violation)
+            continue
+        start_time += window.start
+        end_time += window.start
+        if window.owns((start_time + end_time) / 2):
+            global_violations.append(
+                {**violation, "start_time": start_time, "end_time": end_time}
+            )
+    return global_violations
+
+
+def _untimed_key(violation: dict[str, Any]) -> tuple[Any, ...]:
+    return (
+        violation.get("type"),
+        violation.get("description"),
+        violation.get("related_text"),
+    )
+
+
+def merge_window_violations(
+    window_violations: list[tuple[VideoWindow, list[dict[str, Any]]]],
+) -> list[dict[str, Any]]:
+    """区間ごとに報告された違反を to_global_violations で動画全体の時刻に直してまとめる.
+
+    時刻が数値でない違反は担当の区間を決められず、重なり部分や動画全体について複数の区間から同じものが報告されるため、
+    種類・説明・関連テキストが同じものは最初の1つだけを残す。
+    """
+    violations = []
+    seen_untimed = set()
+    for window, window_result in window_violations:
+        for violation in to_global_violations(window_result, window):
+            if (
+                _as_seconds(violation.get("start_time")) is None
+                or _as_seconds(violation.get("end_time")) is None
+            ):
+                key = _untimed_key(violation)
+                if key in seen_untimed:
+                    continue
+                seen_untimed.add(key)
+            violations.append(violation)
+    return violations
@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# アプリは backend/src をカレントディレクトリとして動かすため、テストでも同じ import パスにする
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src"))
+
+# agent/graph.py と checker.py は import 時にAPIキーを確認する。テストでは外部APIを呼ばない
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+os.environ.setdefault("OPENAI_API_KEY", "test-openai-key")
@@ -0,0 +1,88 @@
+import numpy as np
+
+import media.audio_pipeline as audio_pipeline
+from core.process_pool import BoundedProcessPool
+from media.audio_pipeline import PCM_SAMPLE_RATE, DecodedAudio, PcmFileSink
+from media.vad import detect_speech_regions, detect_speech_regions_in_file
+
+
+def syllables(seconds, seed=0):
+    """音節のように0.1〜0.3秒ごとに上下する、倍音を含む声に似た信号（16bit PCM）。"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * PCM_SAMPLE_RATE)) / PCM_SAMPLE_RATE
+    signal = np.zeros(len(t))
+    position = 0.0
+    while position < seconds - 0.3:
+        duration = rng.uniform(0.12, 0.28)
+        f0 = rng.uniform(120, 220)
+        mask = (t >= position) & (t < position + duration)
+        envelope = np.sin(np.pi * (t[mask] - position) / duration)
+        for harmonic in range(1, 15):
+            signal[mask] += (
+                envelope * np.sin(2 * np.pi * f0 * harmonic * t[mask]) * 0.3 / harmonic
+            )
+        position += duration + rng.uniform(0.05, 0.15)
+    signal += rng.normal(0, 0.002, len(t))
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+def write_pcm(tmp_path, samples):
+    sink = PcmFileSink(str(tmp_path / "pcm.s16le"))
+    sink.write(samples.tobytes())
+    sink.close()
+    return sink
+
+
+def test_pcm_file_sink_drops_a_trailing_half_sample(tmp_path):
+    sink = PcmFileSink(str(tmp_path / "pcm.s16le"))
+    sink.write(np.array([1, -2, 3], dtype=np.int16).tobytes() + b"\x01")
+    sink.close()
+    sink.close()
+    assert sink.samples().tolist() == [1, -2, 3]
+
+
+def test_pcm_file_sink_maps_samples_instead_of_loading(tmp_path):
+    sink = write_pcm(tmp_path, syllables(1))
+    empty = PcmFileSink(str(tmp_path / "empty.s16le"))
+    empty.close()
+
+    assert isinstance(sink.samples(), np.memmap)
+    assert len(empty.samples()) == 0
+
+
+class RecordingPool:
+    def __init__(self):
+        self.calls = []
+
+    def run(self, stage, function, *args):
+        self.calls.append((stage, args))
+        return function(*args)
+
+
+def test_pool_receives_pcm_path_instead_of_samples(tmp_path, monkeypatch):
+    samples = np.concatenate([np.zeros(PCM_SAMPLE_RATE, dtype=np.int16), syllables(8)])
+    sink = write_pcm(tmp_path, samples)
+    pool = RecordingPool()
+    monkeypatch.setattr(audio_pipeline, "get_media_pool", lambda: pool)
+
+    audio = DecodedAudio(
+        sink.samples(), PCM_SAMPLE_RATE, sink.path, transcription_path=None
+    )
+    audio.fingerprint()
+    audio_pipeline._encode_speech(
+        audio.samples, sink.path, str(tmp_path / "speech.ogg")
+    )
+
+    assert [stage for stage, _ in pool.calls] == ["fingerprint", "vad"]
+    assert all(args == (sink.path, PCM_SAMPLE_RATE) for _, args in pool.calls)
+
+
+def test_worker_process_reads_samples_from_file(tmp_path):
+    samples = np.concatenate(
+        [np.zeros(2 * PCM_SAMPLE_RATE, dtype=np.int16), syllables(5)]
+    )
+    sink = write_pcm(tmp_path, samples)
+    pool = BoundedProcessPool(max_workers=1, max_pending=2)
+    regions = pool.run("vad", detect_speech_regions_in_file, sink.path, PCM_SAMPLE_RATE)
+    assert regions == detect_speech_regions(samples, PCM_SAMPLE_RATE)
+    assert regions
@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+
+import agent.checkpoint as checkpoint
+
+
+@pytest.fixture
+def checkpoint_db(tmp_path, monkeypatch):
+    monkeypatch.setenv(
+        "RESEARCH_CHECKPOINT_DB_PATH", str(tmp_path / "checkpoints.sqlite3")
+    )
+    monkeypatch.setattr(checkpoint, "_graph", None)
+    monkeypatch.setattr(checkpoint, "_saver", None)
+    return tmp_path
+
+
+def snapshot(created_at, next_nodes=("web_research",), started_at=0.0):
+    return SimpleNamespace(
+        next=next_nodes,
+        values={"research_started_at": started_at},
+        created_at=datetime.fromtimestamp(created_at, timezone.utc).isoformat(),
+    )
+
+
+def test_pause_counts_from_last_checkpoint():
+    assert checkpoint._paused_since_checkpoint(snapshot(100.0), now=160.0) == 60.0
+    # 前回の試行が新しいチェックポイントを残さずに失敗した場合は、その試行の開始から数える
+    assert (
+        checkpoint._paused_since_checkpoint(
+            snapshot(100.0), now=160.0, last_attempt_at=130.0
+        )
+        == 30.0
+    )
+
+
+def test_no_pause_for_new_or_unstarted_runs():
+    assert (
+        checkpoint._paused_since_checkpoint(snapshot(100.0, next_nodes=()), now=160.0)
+        == 0.0
+    )
+    assert (
+        checkpoint._paused_since_checkpoint(snapshot(100.0, started_at=None), now=160.0)
+        == 0.0
+    )
+
+
+def test_begin_attempt_accumulates_pauses(checkpoint_db, monkeypatch):
+    clock = [1_000.0]
+    monkeypatch.setattr(checkpoint.time, "time", lambda: clock[0])
+    assert checkpoint._begin_attempt("run", snapshot(900.0, next_nodes=())) == 0.0
+
+    clock[0] = 1_100.0
+    assert checkpoint._begin_attempt("run", snapshot(1_040.0)) == 60.0
+    # 再開した試行も同じチェックポイントのまま失敗し、10秒後にもう一度再開した
+    clock[0] = 1_150.0
+    assert checkpoint._begin_attempt("run", snapshot(1_040.0)) == 110.0
+
+
+def test_sweep_deletes_only_expired_runs(checkpoint_db, monkeypatch):
+    monkeypatch.setenv("RESEARCH_CHECKPOINT_TTL_SECONDS", "3600")
+    checkpoint.get_checkpointed_graph()
+    for run_id in ("old", "recent"):
+        config = {"configurable": {"thread_id": run_id, "checkpoint_ns": ""}}
+        checkpoint._saver.put(config, empty_checkpoint(), {}, {})
+
+    clock = [10_000.0]
+    monkeypatch.setattr(checkpoint.time, "time", lambda: clock[0])
+    checkpoint._begin_attempt("old", snapshot(0.0, next_nodes=()))
+    clock[0] = 13_000.0
+    checkpoint._begin_attempt("recent", snapshot(0.0, next_nodes=()))
+
+    assert checkpoint.sweep_expired_runs(now=14_000.0) == 1
+    assert (
+        checkpoint._saver.get_tuple(
+            {"configurable": {"thread_id": "old", "checkpoint_ns": ""}}
+        )
+        is None
+    )
+    assert (
+        checkpoint._saver.get_tuple(
+            {"configurable": {"thread_id": "recent", "checkpoint_ns": ""}}
+        )
+        is not None
+    )
@@ -0,0 +1,66 @@
+from agent.utils import SHORT_URL_PREFIX, expand_short_urls, insert_citation_markers
+
+
+def citation(start, end, *labels):
+    return {
+        "start_index": start,
+        "end_index": end,
+        "segments": [
+            {"label": label, "short_url": f"{SHORT_URL_PREFIX}0-{label}"}
+            for label in labels
+        ],
+    }
+
+
+def test_inserts_markers_at_end_indices():
+    text = "Alpha beta. Gamma delta."
+    result = insert_citation_markers(
+        text, [citation(12, 24, "2"), citation(0, 11, "1")]
+    )
+    assert (
+        result
+        == f"Alpha beta. [1]({SHORT_URL_PREFIX}0-1) Gamma delta. [2]({SHORT_URL_PREFIX}0-2)"
+    )
+
+
+def test_citations_sharing_an_end_index_keep_previous_order():
+    # 終了位置が同じなら開始位置の小さいものが先、位置が同じなら後に並んだものが先
+    text = "Alpha beta."
+    result = insert_citation_markers(
+        text, [citation(6, 11, "b"), citation(0, 11, "a"), citation(0, 11, "c")]
+    )
+    assert result == (
+        f"Alpha beta. [c]({SHORT_URL_PREFIX}0-c) [a]({SHORT_URL_PREFIX}0-a) [b]({SHORT_URL_PREFIX}0-b)"
+    )
+
+
+def test_end_index_past_text_is_clamped():
+    result = insert_citation_markers("Alpha", [citation(0, 99, "1")])
+    assert result == f"Alpha [1]({SHORT_URL_PREFIX}0-1)"
+
+
+def test_expand_short_urls_replaces_in_one_pass_and_dedupes_sources():
+    sources = [
+        {
+            "label": "a",
+            "short_url": f"{SHORT_URL_PREFIX}1-1",
+            "value": "https://example.com/a",
+        },
+        {
+            "label": "b",
+            "short_url": f"{SHORT_URL_PREFIX}1-10",
+            "value": "https://example.com/b",
+        },
+        {
+            "label": "a2",
+            "short_url": f"{SHORT_URL_PREFIX}1-2",
+            "value": "https://example.com/a",
+        },
+    ]
+    text = f"x ({SHORT_URL_PREFIX}1-10) y ({SHORT_URL_PREFIX}1-1) z ({SHORT_URL_PREFIX}1-2) w ({SHORT_URL_PREFIX}9-9)"
+    expanded, used = expand_short_urls(text, sources)
+    # ".../id/1-1" が ".../id/1-10" の途中に一致しないこと
+    assert expanded == (
+        f"x (https://example.com/b) y (https://example.com/a) z (https://example.com/a) w ({SHORT_URL_PREFIX}9-9)"
+    )
+    assert [source["label"] for source in used] == ["b", "a"]
@@ -0,0 +1,290 @@
+import http.server
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import media.download_cache as download_cache
+from media.download_cache import MediaCache, MediaDownloadError, validate_media_url
+
+# テスト用の名前解決。media.test はローカルのテストサーバー、metadata.test はクラウドのメタデータサーバーに見立てる
+HOSTS = {
+    "media.test": "127.0.0.1",
+    "cdn.media.test": "127.0.0.1",
+    "metadata.test": "169.254.169.254",
+    "intranet.test": "10.0.0.8",
+}
+
+
+@pytest.fixture(autouse=True)
+def fake_dns(monkeypatch):
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        return real_getaddrinfo(HOSTS.get(host, host), port, *args, **kwargs)
+
+    monkeypatch.setattr(download_cache.socket, "getaddrinfo", getaddrinfo)
+    # テストサーバーだけは公開されたアドレスとして扱う
+    real_is_public = download_cache._is_public_address
+    monkeypatch.setattr(
+        download_cache,
+        "_is_public_address",
+        lambda address: address == "127.0.0.1" or real_is_public(address),
+    )
+    monkeypatch.delenv("MEDIA_ALLOWED_HOSTS", raising=False)
+
+
+@pytest.fixture
+def media_server():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/redirect"):
+                self.send_response(302)
+                self.send_header("Location", self.path.split("to=", 1)[1])
+                self.end_headers()
+                return
+            body = self.path.encode("utf-8") * 100
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mp4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://media.test:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "file:///etc/passwd",
+        "ftp://media.test/video.mp4",
+        "http://169.254.169.254/latest/meta-data/",
+        "http://metadata.test/latest/meta-data/",
+        "http://intranet.test/video.mp4",
+        "http://[::1]/video.mp4",
+        "http://[::ffff:127.0.0.2]/video.mp4",
+        "http://127.0.0.2/video.mp4",
+        "http:///video.mp4",
+    ],
+)
+def test_validate_rejects_non_http_and_internal_urls(url):
+    with pytest.raises(MediaDownloadError):
+        validate_media_url(url)
+
+
+def test_validate_applies_allowed_hosts(monkeypatch):
+    monkeypatch.setenv("MEDIA_ALLOWED_HOSTS", "media.test, videos.example")
+    validate_media_url("http://media.test/video.mp4")
+    validate_media_url("http://cdn.media.test/video.mp4")
+    with pytest.raises(MediaDownloadError):
+        validate_media_url("http://evilmedia.test/video.mp4")
+
+
+def test_fetch_caches_public_media(tmp_path, media_server):
+    cache = MediaCache(
+        str(tmp_path), max_cache_bytes=10_000_000, max_download_bytes=1_000_000
+    )
+    with cache.fetch(f"{media_server}/a", ".mp4") as path:
+        with open(path, "rb") as media_file:
+            assert media_file.read() == b"/a" * 100
+        assert path.endswith(".mp4")
+
+
+def test_redirect_to_internal_address_is_rejected(tmp_path, media_server):
+    cache = MediaCache(
+        str(tmp_path), max_cache_bytes=10_000_000, max_download_bytes=1_000_000
+    )
+    with pytest.raises(MediaDownloadError, match="内部ネットワーク"):
+        with cache.fetch(
+            f"{media_server}/redirect?to=http://metadata.test/latest/meta-data/", ".mp4"
+        ):
+            pass
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".partial")]
+
+
+def test_connection_rechecks_address_after_validation(
+    tmp_path, media_server, monkeypatch
+):
+    cache = MediaCache(
+        str(tmp_path), max_cache_bytes=10_000_000, max_download_bytes=1_000_000
+    )
+    url = f"{media_server}/a"
+    # 事前の確認のあとで、名前解決の結果が内部のアドレスに変わる（DNS rebinding）
+    real_validate = download_cache.validate_media_url
+
+    def validate_then_rebind(checked_url):
+        real_validate(checked_url)
+        monkeypatch.setitem(HOSTS, "media.test", "169.254.169.254")
+
+    monkeypatch.setattr(download_cache, "validate_media_url", validate_then_rebind)
+    with pytest.raises(MediaDownloadError, match="内部ネットワーク"):
+        with cache.fetch(url, ".mp4"):
+            pass
+
+
+def test_file_in_use_by_another_process_is_not_evicted(tmp_path, media_server):
+    # 同じキャッシュディレクトリを使う2つのワーカープロセスに見立てる
+    worker_a = MediaCache(
+        str(tmp_path), max_cache_bytes=300, max_download_bytes=1_000_000
+    )
+    worker_b = MediaCache(
+        str(tmp_path), max_cache_bytes=300, max_download_bytes=1_000_000
+    )
+    with worker_a.fetch(f"{media_server}/a", ".mp4") as path_a:
+        with worker_b.fetch(f"{media_server}/b", ".mp4"):
+            pass
+        assert os.path.exists(path_a)
+    # 使い終わったあとは、上限を超えている古いものから削除される
+    with worker_b.fetch(f"{media_server}/c", ".mp4"):
+        pass
+    assert not os.path.exists(path_a)
+
+
+def test_expired_pin_does_not_block_eviction(tmp_path, media_server):
+    crashed = MediaCache(
+        str(tmp_path),
+        max_cache_bytes=300,
+        max_download_bytes=1_000_000,
+        pin_lease_seconds=-1,
+    )
+    fetch = crashed.fetch(f"{media_server}/a", ".mp4")
+    # with ブロックを抜けずに異常終了したプロセスの使用中の記録が残る
+    path_a = fetch.__enter__()
+    worker = MediaCache(
+        str(tmp_path), max_cache_bytes=300, max_download_bytes=1_000_000
+    )
+    with worker.fetch(f"{media_server}/b", ".mp4"):
+        pass
+    assert not os.path.exists(path_a)
+
+
+@pytest.fixture
+def flaky_server():
+    """最初の応答を途中で切り、2回目以降は mode に応じて続きを返すサーバー."""
+    state = {"version": 1, "mode": "resume", "requests": []}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["requests"].append(
+                (self.headers.get("Range"), self.headers.get("If-Range"))
+            )
+            body = f"v{state['version']}".encode() * 1000
+            etag = f'"v{state["version"]}"'
+            if len(state["requests"]) == 1:
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body[: len(body) // 2])
+                self.close_connection = True
+                if state["mode"] == "changed":
+                    state["version"] = 2
+                return
+            requested = self.headers.get("Range")
+            if requested and self.headers.get("If-Range") == etag:
+                start = int(requested.split("=")[1].rstrip("-"))
+                if state["mode"] == "wrong_range":
+                    start = 0
+                part = body[start:]
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+                )
+                self.send_header("Content-Length", str(len(part)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(part)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://media.test:{server.server_address[1]}", state
+    server.shutdown()
+
+
+@pytest.mark.parametrize(
+    ("mode", "expected_body", "request_count"),
+    [
+        ("resume", b"v1" * 1000, 2),
+        # 中断の間にファイルが変わった場合は、If-Range で全体が返り、新しい版だけを保存する
+        ("changed", b"v2" * 1000, 2),
+        # 取得済みの位置と違う Content-Range が返った場合は、最初から取得し直す
+        ("wrong_range", b"v1" * 1000, 3),
+    ],
+    ids=["resume", "changed", "wrong_range"],
+)
+def test_resume_never_splices_different_content(
+    tmp_path, flaky_server, mode, expected_body, request_count
+):
+    base_url, state = flaky_server
+    state["mode"] = mode
+    cache = MediaCache(
+        str(tmp_path), max_cache_bytes=10_000_000, max_download_bytes=1_000_000
+    )
+
+    with cache.fetch(f"{base_url}/video", ".mp4") as path:
+        with open(path, "rb") as media_file:
+            assert media_file.read() == expected_body
+
+    assert len(state["requests"]) == request_count
+    assert state["requests"][1] == ("bytes=1000-", '"v1"')
+
+
+def test_processes_do_not_download_same_url_twice(tmp_path, monkeypatch):
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            time.sleep(0.3)
+            body = b"media" * 100
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(download_cache, "DOWNLOAD_CLAIM_POLL_SECONDS", 0.05)
+    url = f"http://media.test:{server.server_address[1]}/shared"
+    # 同じキャッシュディレクトリを使う2つのワーカープロセスに見立てる（プロセス内のロックは共有しない）
+    workers = [
+        MediaCache(
+            str(tmp_path), max_cache_bytes=10_000_000, max_download_bytes=1_000_000
+        )
+        for _ in range(2)
+    ]
+    paths = []
+
+    def fetch(worker):
+        with worker.fetch(url, ".mp4") as path:
+            paths.append(path)
+
+    threads = [threading.Thread(target=fetch, args=(worker,)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    assert requests == ["/shared"]
+    assert len(paths) == 2 and paths[0] == paths[1]
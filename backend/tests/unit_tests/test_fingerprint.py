@@ -0,0 +1,128 @@
+import contextlib
+import json
+
+import numpy as np
+import pytest
+
+import media.music_index as music_index
+from media.fingerprint import (
+    FRAME_SECONDS,
+    AudioFingerprintError,
+    fingerprint_samples,
+    match_ratio,
+)
+from media.music_index import MusicIndex, build_music_index
+from media.transcript_cache import DEFAULT_MIN_MATCH_RATIO
+
+SAMPLE_RATE = 16000
+
+
+def melody(seconds, seed):
+    """0.1〜0.3秒ごとに音程が変わる、倍音を含む旋律（16bit PCM）。"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = np.zeros(len(t))
+    position = 0.0
+    while position < seconds:
+        duration = rng.uniform(0.1, 0.3)
+        frequency = rng.uniform(200, 1500)
+        mask = (t >= position) & (t < position + duration)
+        for harmonic in range(1, 4):
+            signal[mask] += (
+                np.sin(2 * np.pi * frequency * harmonic * t[mask]) * 0.25 / harmonic
+            )
+        position += duration
+    return (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+
+
+def add_noise(samples, level, seed=99):
+    noise = np.random.default_rng(seed).normal(0, level * 32767, len(samples))
+    return np.clip(samples + noise, -32768, 32767).astype(np.int16)
+
+
+def reencode(samples):
+    """音量を下げ、高域を少し削り、量子化の雑音を加える（再エンコードで波形が変わる代わり）。"""
+    softened = np.convolve(samples * 0.8, [0.25, 0.5, 0.25], mode="same")
+    return add_noise(softened.astype(np.int16), 0.003, seed=7)
+
+
+def test_fingerprint_matches_reencoded_copy_only():
+    recording = add_noise(melody(10, seed=1), 0.01, seed=5)
+    original = fingerprint_samples(recording, SAMPLE_RATE)
+    copy = fingerprint_samples(reencode(recording), SAMPLE_RATE)
+    other = fingerprint_samples(
+        add_noise(melody(10, seed=2), 0.01, seed=5), SAMPLE_RATE
+    )
+
+    assert (
+        match_ratio(copy, original, time_tolerance_frames=2) > DEFAULT_MIN_MATCH_RATIO
+    )
+    assert (
+        match_ratio(original, copy, time_tolerance_frames=2) > DEFAULT_MIN_MATCH_RATIO
+    )
+    assert match_ratio(other, original, time_tolerance_frames=2) < 0.05
+
+
+def test_match_ratio_requires_same_start():
+    recording = add_noise(melody(10, seed=1), 0.01, seed=5)
+    original = fingerprint_samples(recording, SAMPLE_RATE)
+    shifted = fingerprint_samples(recording[SAMPLE_RATE:], SAMPLE_RATE)
+
+    assert match_ratio(shifted, original, time_tolerance_frames=2) < 0.05
+
+
+def test_fingerprint_rejects_silence_and_unsupported_rate():
+    with pytest.raises(AudioFingerprintError):
+        fingerprint_samples(np.zeros(SAMPLE_RATE * 5, dtype=np.int16), SAMPLE_RATE)
+    with pytest.raises(AudioFingerprintError):
+        fingerprint_samples(melody(5, seed=1), 11025)
+
+
+@pytest.fixture
+def catalog_index(tmp_path, monkeypatch):
+    tracks = {"first.wav": melody(30, seed=1), "second.wav": melody(30, seed=2)}
+
+    @contextlib.contextmanager
+    def fake_decode_audio(path, encode_for_transcription=True):
+        yield type(
+            "Decoded",
+            (),
+            {"samples": tracks[path.rsplit("/", 1)[-1]], "sample_rate": SAMPLE_RATE},
+        )()
+
+    monkeypatch.setattr(music_index, "decode_audio", fake_decode_audio)
+    catalog_path = tmp_path / "catalog.json"
+    catalog_path.write_text(
+        json.dumps(
+            [
+                {"audio_path": "first.wav", "title": "First"},
+                {"audio_path": "second.wav", "title": "Second"},
+            ]
+        )
+    )
+    index_dir = str(tmp_path / "index")
+    assert build_music_index(str(catalog_path), index_dir) == 2
+    return MusicIndex(index_dir), tracks
+
+
+def test_music_index_finds_track_and_play_offset(catalog_index):
+    index, tracks = catalog_index
+    # 発言の後ろで2曲目の10秒目から流れている音声
+    excerpt = tracks["second.wav"][10 * SAMPLE_RATE : 20 * SAMPLE_RATE]
+    query = np.concatenate(
+        [np.zeros(3 * SAMPLE_RATE, dtype=np.int16), add_noise(excerpt, 0.05)]
+    )
+
+    match = index.lookup(fingerprint_samples(query, SAMPLE_RATE))
+
+    assert match["track"]["title"] == "Second"
+    assert match["play_offset"] == pytest.approx(
+        10.0 + match["start_time"] - 3.0, abs=4 * FRAME_SECONDS
+    )
+    assert 3.0 - 0.5 <= match["start_time"] and match["end_time"] <= 13.0
+
+
+def test_music_index_returns_none_for_unknown_audio(catalog_index):
+    index, _ = catalog_index
+
+    assert index.lookup(fingerprint_samples(melody(10, seed=3), SAMPLE_RATE)) is None
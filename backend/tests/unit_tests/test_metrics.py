@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+from prometheus_client import REGISTRY
+
+from core.metrics import with_prompt_cache_metrics
+from core.rate_limiter import read_gemini_prompt_cache
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_prompt_cache_metrics_record_each_call():
+    labels = {"provider": "gemini", "model": "metrics-test"}
+    usage = SimpleNamespace(prompt_token_count=1000, cached_content_token_count=600)
+    before = sample("compliance_model_cached_tokens_total", **labels)
+    before_hits = sample(
+        "compliance_model_call_duration_seconds_count", prompt_cache="hit", **labels
+    )
+
+    request = with_prompt_cache_metrics(
+        "gemini",
+        "metrics-test",
+        lambda: SimpleNamespace(usage_metadata=usage),
+        read_gemini_prompt_cache,
+    )
+    request()
+    request()
+
+    assert sample("compliance_model_cached_tokens_total", **labels) == before + 1200
+    assert (
+        sample(
+            "compliance_model_call_duration_seconds_count", prompt_cache="hit", **labels
+        )
+        == before_hits + 2
+    )
+
+
+def test_prompt_cache_metrics_skip_responses_without_usage():
+    labels = {"provider": "gemini", "model": "metrics-test-empty"}
+
+    response = with_prompt_cache_metrics(
+        "gemini", "metrics-test-empty", lambda: "ok", read_gemini_prompt_cache
+    )()
+
+    assert response == "ok"
+    assert sample("compliance_model_prompt_tokens_total", **labels) == 0.0
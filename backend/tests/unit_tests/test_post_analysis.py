@@ -0,0 +1,84 @@
+import checker
+from analysis.alerts import (
+    NO_CONCERN_REASON,
+    integrate_multi_source_alerts,
+    research_alert,
+)
+
+
+def test_research_adds_reason_without_raising_level():
+    research = research_alert(
+        {
+            "source": "precomputed",
+            "summary": "過去に炎上した発言がある",
+            "researched_at": 0,
+        }
+    )
+    text = {
+        "level": "中",
+        "reason": "テキスト",
+        "timestamp": "不明",
+        "original_text_segment": "該当テキストなし",
+    }
+
+    alert = integrate_multi_source_alerts(text_result=text, research_result=research)
+
+    assert alert["level"] == "中"
+    assert (
+        "[発言者リサーチ]: **発言者の背景（事前調査）**: 過去に炎上した発言がある"
+        in alert["reason"]
+    )
+    assert research_alert({"source": "live", "summary": "", "error": "timeout"}) is None
+    assert research_alert(None) is None
+
+
+def test_failed_branch_keeps_other_results(monkeypatch):
+    def failing_video_analysis(video_path, speaker_background):
+        raise RuntimeError("upload failed")
+
+    def text_analysis(text_input, speaker_background):
+        return {
+            "logs": [],
+            "analysis_result": {
+                "risk_level": "高",
+                "summary": "差別的な表現",
+                "violations": [],
+            },
+        }
+
+    def research(speaker_background, analyze, live_research):
+        return {"source": "precomputed", "summary": "過去の発言", "researched_at": 0}
+
+    monkeypatch.setattr(checker, "detailed_video_analysis", failing_video_analysis)
+    monkeypatch.setattr(checker, "detailed_text_only_analysis", text_analysis)
+    monkeypatch.setattr(checker, "research_speaker_for_post", research)
+
+    result = checker.detailed_post_analysis("video.mp4", "本文", {"name": "someone"})
+
+    assert result["error"] == "video: upload failed"
+    assert result["video_result"] is None
+    assert result["text_result"]["analysis_result"]["risk_level"] == "高"
+    assert result["alert"]["level"] == "重"
+    assert "[発言者リサーチ]" in result["alert"]["reason"]
+    assert "[動画分析]: **未確認**" in result["alert"]["reason"]
+    assert "upload failed" in result["alert"]["reason"]
+    assert result["alert"]["unverified_sources"] == ["動画分析"]
+    assert result["speaker_research"]["summary"] == "過去の発言"
+
+
+def test_branch_error_result_is_unverified_not_no_concern(monkeypatch):
+    def video_analysis(video_path, speaker_background):
+        return {"logs": [], "error": "Gemini quota exceeded"}
+
+    def research(speaker_background, analyze, live_research):
+        return None
+
+    monkeypatch.setattr(checker, "detailed_video_analysis", video_analysis)
+    monkeypatch.setattr(checker, "research_speaker_for_post", research)
+
+    result = checker.detailed_post_analysis("video.mp4", None, None)
+
+    assert result["error"] == "video: Gemini quota exceeded"
+    assert NO_CONCERN_REASON not in result["alert"]["reason"]
+    assert "Gemini quota exceeded" in result["alert"]["reason"]
+    assert result["alert"]["unverified_sources"] == ["動画分析"]
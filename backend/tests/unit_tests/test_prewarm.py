@@ -0,0 +1,35 @@
+import analysis.prewarm as prewarm
+
+
+def test_scheduler_starts_once_per_process(monkeypatch):
+    started = []
+    monkeypatch.setattr(
+        prewarm,
+        "start_prewarm_scheduler_from_env",
+        lambda research: started.append(research) or f"scheduler-{len(started)}",
+    )
+    monkeypatch.setattr(prewarm, "_scheduler", None)
+    monkeypatch.setattr(prewarm, "_scheduler_pid", None)
+
+    def research(speaker):
+        return {}
+
+    first = prewarm.ensure_prewarm_scheduler(research)
+    assert prewarm.ensure_prewarm_scheduler(research) == first
+    # フォークしたワーカープロセスでは改めて起動する
+    monkeypatch.setattr(prewarm.os, "getpid", lambda: -1)
+    assert prewarm.ensure_prewarm_scheduler(research) == "scheduler-2"
+    assert started == [research, research]
+
+
+def test_app_starts_scheduler_on_first_request(monkeypatch):
+    import app
+
+    started = []
+    monkeypatch.setattr(
+        app, "ensure_prewarm_scheduler", lambda research: started.append(research)
+    )
+
+    app.app.test_client().get("/metrics")
+
+    assert started == [app.analyze_with_gemini_deep_research]
@@ -0,0 +1,91 @@
+import threading
+
+from core.priority_scheduler import (
+    BACKGROUND,
+    INTERACTIVE,
+    PriorityScheduler,
+    SlotTicket,
+)
+
+
+def start_waiting(scheduler, ticket, started):
+    def wait_for_slot():
+        scheduler.acquire(ticket)
+        started.append(ticket)
+
+    thread = threading.Thread(target=wait_for_slot, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until_queued(scheduler, priority, count):
+    for _ in range(1000):
+        with scheduler._lock:
+            if len(scheduler._queues[priority]) == count:
+                return
+        threading.Event().wait(0.001)
+    raise AssertionError(f"{priority} の待ち行列が {count} 件になりませんでした")
+
+
+def test_background_never_takes_reserved_interactive_slots():
+    scheduler = PriorityScheduler(max_concurrency=3, reserved_interactive_slots=1)
+    scheduler.acquire(SlotTicket(BACKGROUND))
+    scheduler.acquire(SlotTicket(BACKGROUND))
+    started = []
+    start_waiting(scheduler, SlotTicket(BACKGROUND), started)
+    wait_until_queued(scheduler, BACKGROUND, 1)
+    # 残りの1枠は interactive 専用
+    scheduler.acquire(SlotTicket(INTERACTIVE))
+    assert scheduler._running == 3
+    assert started == []
+
+
+def test_freed_slot_goes_to_interactive_first():
+    scheduler = PriorityScheduler(max_concurrency=1, reserved_interactive_slots=0)
+    scheduler.acquire(SlotTicket(BACKGROUND))
+    started = []
+    background = SlotTicket(BACKGROUND)
+    interactive = SlotTicket(INTERACTIVE)
+    threads = [start_waiting(scheduler, background, started)]
+    wait_until_queued(scheduler, BACKGROUND, 1)
+    threads.append(start_waiting(scheduler, interactive, started))
+    wait_until_queued(scheduler, INTERACTIVE, 1)
+
+    scheduler.release()
+    threads[1].join(timeout=1)
+    assert started == [interactive]
+    scheduler.release()
+    threads[0].join(timeout=1)
+    assert started == [interactive, background]
+
+
+def test_promote_moves_queued_background_request_to_interactive_slot():
+    scheduler = PriorityScheduler(max_concurrency=2, reserved_interactive_slots=1)
+    scheduler.acquire(SlotTicket(BACKGROUND))
+    started = []
+    queued = SlotTicket(BACKGROUND)
+    thread = start_waiting(scheduler, queued, started)
+    wait_until_queued(scheduler, BACKGROUND, 1)
+
+    # 合流した投稿前チェックが優先度を上げると、interactive 専用の枠ですぐに始まる
+    scheduler.promote(queued)
+    thread.join(timeout=1)
+    assert started == [queued]
+    assert queued.priority == INTERACTIVE
+    assert not scheduler._queues[BACKGROUND]
+
+
+def test_promote_before_queueing_uses_interactive_queue():
+    scheduler = PriorityScheduler(max_concurrency=2, reserved_interactive_slots=1)
+    scheduler.acquire(SlotTicket(BACKGROUND))
+    ticket = SlotTicket(BACKGROUND)
+    scheduler.promote(ticket)
+    scheduler.acquire(ticket)
+    assert scheduler._running == 2
+
+
+def test_slot_accepts_priority_name():
+    scheduler = PriorityScheduler(max_concurrency=1, reserved_interactive_slots=0)
+    with scheduler.slot(INTERACTIVE):
+        assert scheduler._running == 1
+    assert scheduler._running == 0
@@ -0,0 +1,111 @@
+import pytest
+
+from core.rate_limiter import (
+    MIN_RATE_SCALE,
+    ProviderQuota,
+    RateLimiter,
+    call_with_rate_limit,
+    is_rate_limit_error,
+    request_capacity,
+)
+
+
+@pytest.fixture
+def limiter(tmp_path):
+    quotas = {
+        "openai": ProviderQuota(requests_per_minute=5, tokens_per_minute=1_000),
+        "gemini": ProviderQuota(requests_per_minute=60),
+    }
+    return RateLimiter(str(tmp_path / "rate_limits.sqlite3"), quotas)
+
+
+def test_request_capacity_never_drops_below_one_request():
+    quota = ProviderQuota(requests_per_minute=5)
+    assert request_capacity(quota, MIN_RATE_SCALE) == 1.0
+    assert request_capacity(quota, 1.0) == 5.0
+
+
+def test_try_acquire_recovers_after_rate_limit_on_low_rpm_model(limiter, monkeypatch):
+    clock = [1_000.0]
+    monkeypatch.setattr("core.rate_limiter.time.time", lambda: clock[0])
+    # 何度も429を受けてレート倍率が下限まで下がった状態にする
+    for _ in range(10):
+        limiter.record_rate_limited("openai", "gpt", retry_after=1.0)
+
+    wait_seconds = limiter.try_acquire("openai", "gpt")
+    assert wait_seconds > 0
+    # 待つべき時間が経てば、容量が1件を下回らないので必ず予約できる
+    clock[0] += wait_seconds
+    wait_seconds = limiter.try_acquire("openai", "gpt")
+    assert wait_seconds > 0
+    clock[0] += wait_seconds + 0.001
+    assert limiter.try_acquire("openai", "gpt") == 0.0
+
+
+def test_try_acquire_consumes_request_budget(limiter):
+    for _ in range(5):
+        assert limiter.try_acquire("openai", "gpt", estimated_tokens=100) == 0.0
+    assert limiter.try_acquire("openai", "gpt", estimated_tokens=100) > 0
+
+
+def test_usage_is_reconciled_against_capped_reservation(limiter, monkeypatch):
+    monkeypatch.setattr("core.rate_limiter.time.time", lambda: 1_000.0)
+
+    # 推定がバケット容量（1,000）を超える場合は容量だけを予約する
+    reserved_tokens = limiter.acquire("openai", "gpt", estimated_tokens=5_000)
+    limiter.record_usage("openai", "gpt", reserved_tokens, actual_tokens=3_000)
+
+    assert reserved_tokens == 1_000
+    # 予約を超えて消費した分は返さず、次の予約を待たせる
+    assert limiter.try_acquire("openai", "gpt", estimated_tokens=100) > 0
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def test_last_rate_limited_attempt_is_recorded(limiter, monkeypatch):
+    monkeypatch.setattr("core.rate_limiter.get_rate_limiter", lambda: limiter)
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "1")
+
+    def request():
+        raise RateLimitError("slow down")
+
+    with pytest.raises(RateLimitError):
+        call_with_rate_limit("gemini", "flash", request, max_attempts=1)
+
+    assert limiter.try_acquire("gemini", "flash") > 0
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+
+class FakeAPIError(Exception):
+    def __init__(self, message, status_code=None, status=None):
+        super().__init__(message)
+        self.response = FakeResponse(status_code) if status_code else None
+        self.status = status
+
+
+def test_is_rate_limit_error_uses_status_and_type():
+    assert is_rate_limit_error(RateLimitError("slow down"))
+    assert is_rate_limit_error(FakeAPIError("too many", status_code=429))
+    assert is_rate_limit_error(FakeAPIError("quota", status="RESOURCE_EXHAUSTED"))
+
+
+def test_is_rate_limit_error_ignores_429_in_message():
+    assert not is_rate_limit_error(ValueError("動画 429 は見つかりません"))
+    assert not is_rate_limit_error(FakeAPIError("request 4291 failed", status_code=500))
+
+
+def test_is_rate_limit_error_follows_wrapped_cause():
+    try:
+        try:
+            raise RateLimitError("slow down")
+        except RateLimitError as error:
+            raise RuntimeError("structured output failed") from error
+    except RuntimeError as wrapped:
+        assert is_rate_limit_error(wrapped)
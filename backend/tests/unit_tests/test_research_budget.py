@@ -0,0 +1,113 @@
+from agent.budget import (
+    ResearchBudget,
+    elapsed_seconds,
+    find_exhausted_budget,
+    remaining_searches,
+    summarize_usage,
+)
+from agent.configuration import Configuration
+
+BUDGET = ResearchBudget(deadline_seconds=100.0, max_tokens=10_000, max_searches=6)
+
+
+def test_from_state_prefers_state_overrides():
+    configurable = Configuration(
+        research_deadline_seconds=60.0, max_research_tokens=5_000, max_search_queries=4
+    )
+    budget = ResearchBudget.from_state(
+        {"max_search_queries": 9, "max_research_tokens": None}, configurable
+    )
+    assert budget == ResearchBudget(
+        deadline_seconds=60.0, max_tokens=5_000, max_searches=9
+    )
+
+
+def test_elapsed_seconds_is_zero_before_start():
+    assert elapsed_seconds({}) == 0.0
+    assert elapsed_seconds({"research_started_at": 10.0}, now=25.0) == 15.0
+
+
+def test_another_loop_fits():
+    state = {
+        "research_started_at": 0.0,
+        "research_loop_count": 1,
+        "tokens_used": 2_000,
+        "search_query": ["a", "b"],
+    }
+    assert find_exhausted_budget(state, BUDGET, now=20.0) is None
+
+
+def test_stops_when_next_loop_would_pass_deadline():
+    # 次のループまで含めて、締め切りの8割（80秒）に収まるかで判断する
+    state = {
+        "research_started_at": 0.0,
+        "research_loop_count": 1,
+        "tokens_used": 0,
+        "search_query": [],
+    }
+    assert find_exhausted_budget(state, BUDGET, now=35.0) is None
+    assert find_exhausted_budget(state, BUDGET, now=45.0) == "deadline"
+
+
+def test_stops_when_tokens_would_run_out():
+    # 最終回答の分としてもう1ループ分を残す
+    state = {
+        "research_started_at": 0.0,
+        "research_loop_count": 2,
+        "tokens_used": 7_000,
+        "search_query": [],
+    }
+    assert find_exhausted_budget(state, BUDGET, now=1.0) == "max_research_tokens"
+
+
+def test_stops_when_searches_are_used_up():
+    state = {
+        "research_started_at": 0.0,
+        "research_loop_count": 1,
+        "tokens_used": 0,
+        "search_query": list("abcdef"),
+    }
+    assert find_exhausted_budget(state, BUDGET, now=1.0) == "max_search_queries"
+    assert remaining_searches(state, BUDGET) == 0
+    assert remaining_searches({"search_query": ["a"]}, BUDGET) == 5
+
+
+def test_summarize_usage_reports_budget_and_reason():
+    state = {
+        "research_started_at": 0.0,
+        "research_loop_count": 2,
+        "tokens_used": 1_234,
+        "search_query": ["a", "b"],
+    }
+    usage = summarize_usage(state, BUDGET, "deadline", now=12.3456)
+    assert usage == {
+        "elapsed_seconds": 12.346,
+        "tokens_used": 1_234,
+        "searches_run": 2,
+        "research_loops": 2,
+        "stopped_by": "deadline",
+        "budget": {"deadline_seconds": 100.0, "max_tokens": 10_000, "max_searches": 6},
+    }
+
+
+def test_paused_time_of_a_resumed_run_is_not_counted():
+    configurable = Configuration(
+        research_deadline_seconds=100.0, research_paused_seconds=3_600.0
+    )
+    budget = ResearchBudget.from_state({}, configurable)
+    # 1時間前に始まって失敗し、今再開した実行は、まだ40秒しか使っていない
+    state = {
+        "research_started_at": 0.0,
+        "research_loop_count": 1,
+        "tokens_used": 0,
+        "search_query": [],
+    }
+    assert (
+        elapsed_seconds(state, now=3_640.0, paused_seconds=budget.paused_seconds)
+        == 40.0
+    )
+    assert find_exhausted_budget(state, budget, now=3_635.0) is None
+    assert (
+        summarize_usage(state, budget, "sufficient", now=3_640.0)["elapsed_seconds"]
+        == 40.0
+    )
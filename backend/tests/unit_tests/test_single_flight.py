@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+import core.single_flight as single_flight
+from core.single_flight import SingleFlight
+
+
+def run_concurrently(
+    flights, key, leader_run, follower_count, context=None, on_join=None
+):
+    """先のリクエストが実行中の間に follower_count 件を合流させ、(先の結果, 合流した結果のリスト) を返す。"""
+    release_leader = threading.Event()
+    joined = threading.Semaphore(0)
+    results = []
+
+    def leader():
+        release_leader.wait(timeout=5)
+        return leader_run()
+
+    def join(leader_context):
+        if on_join is not None:
+            on_join(leader_context)
+        joined.release()
+
+    def follower():
+        results.append(
+            capture(
+                lambda: flights.do(
+                    "video",
+                    key,
+                    lambda: pytest.fail("合流したリクエストが実行された"),
+                    on_join=join,
+                )
+            )
+        )
+
+    leader_result = []
+    leader_thread = threading.Thread(
+        target=lambda: leader_result.append(
+            capture(lambda: flights.do("video", key, leader, context=context))
+        )
+    )
+    leader_thread.start()
+    while key not in flights._flights:
+        threading.Event().wait(0.001)
+    followers = [threading.Thread(target=follower) for _ in range(follower_count)]
+    for thread in followers:
+        thread.start()
+    for _ in range(follower_count):
+        assert joined.acquire(timeout=5)
+    release_leader.set()
+    leader_thread.join(timeout=5)
+    for thread in followers:
+        thread.join(timeout=5)
+    return leader_result[0], results
+
+
+def capture(call):
+    try:
+        return call()
+    except Exception as error:
+        return error
+
+
+def test_followers_share_a_copy_of_the_result():
+    flights = SingleFlight()
+    leader, followers = run_concurrently(
+        flights, "k", lambda: {"violations": [1]}, follower_count=3
+    )
+    assert leader == ({"violations": [1]}, False)
+    assert followers == [({"violations": [1]}, True)] * 3
+    followers[0][0]["violations"].append(2)
+    assert leader[0] == {"violations": [1]}
+    assert flights._flights == {}
+
+
+def test_followers_receive_the_leader_error():
+    flights = SingleFlight()
+
+    def fail():
+        raise ValueError("分析に失敗しました")
+
+    leader, followers = run_concurrently(flights, "k", fail, follower_count=2)
+    assert isinstance(leader, ValueError)
+    assert all(isinstance(result, ValueError) for result in followers)
+
+
+def test_on_join_receives_the_leader_context():
+    flights = SingleFlight()
+    joined = []
+    run_concurrently(
+        flights,
+        "k",
+        lambda: "done",
+        follower_count=2,
+        context="leader-ticket",
+        on_join=joined.append,
+    )
+    assert joined == ["leader-ticket", "leader-ticket"]
+
+
+def test_failure_before_counting_model_calls_does_not_mask_the_error(monkeypatch):
+    def broken_count_model_calls():
+        raise RuntimeError("メトリクスを初期化できません")
+
+    monkeypatch.setattr(single_flight, "count_model_calls", broken_count_model_calls)
+    flights = SingleFlight()
+    with pytest.raises(RuntimeError, match="メトリクス"):
+        flights.do("video", "k", lambda: "done")
+    assert flights._flights == {}
@@ -0,0 +1,40 @@
+import pytest
+
+from core import token_budget
+from core.token_budget import (
+    DEFAULT_TRANSCRIPT_BUDGET,
+    TokenBudgetConfigError,
+    estimate_tokens,
+    get_transcript_budget,
+)
+
+
+def test_estimate_tokens_counts_japanese_per_character():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcdefgh") == 3
+    assert estimate_tokens("こんにちは") == 6
+
+
+def test_overrides_are_parsed_once(monkeypatch):
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGETS", '{"gpt-3.5-turbo": 8000}')
+    token_budget._parse_budget_overrides.cache_clear()
+
+    assert get_transcript_budget("gpt-3.5-turbo") == 8000
+    assert get_transcript_budget("unknown-model") == DEFAULT_TRANSCRIPT_BUDGET
+    assert token_budget._parse_budget_overrides.cache_info().misses == 1
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        '{"gpt-3.5-turbo": 8000',
+        "[8000]",
+        '{"gpt-3.5-turbo": "8000"}',
+        '{"gpt-3.5-turbo": 0}',
+    ],
+)
+def test_invalid_overrides_raise_config_error(monkeypatch, raw):
+    monkeypatch.setenv("PROMPT_TOKEN_BUDGETS", raw)
+
+    with pytest.raises(TokenBudgetConfigError, match="PROMPT_TOKEN_BUDGETS"):
+        get_transcript_budget("gpt-3.5-turbo")
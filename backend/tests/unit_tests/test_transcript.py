@@ -0,0 +1,66 @@
+from media.transcript import Transcript
+
+
+def make_transcript():
+    return Transcript.build(
+        [
+            (0.0, 4.0, "おはよう ございます"),
+            (4.0, 9.0, "今日は 晴れ"),
+            (9.0, 12.0, "です"),
+        ],
+        [
+            ("おはよう", 0.0, 2.0),
+            ("ございます", 2.0, 4.0),
+            ("今日は", 4.0, 6.0),
+            ("晴れ", 6.0, 9.0),
+            ("です", 9.0, 12.0),
+        ],
+    )
+
+
+def test_build_assigns_words_to_segments():
+    transcript = make_transcript()
+
+    assert len(transcript) == 3
+    assert transcript.word_count == 5
+    assert transcript.full_text == "おはよう ございます 今日は 晴れ です"
+    assert transcript.segment_text(1) == "今日は 晴れ"
+    assert transcript.segment_words(1) == [("今日は", 4.0, 6.0), ("晴れ", 6.0, 9.0)]
+
+
+def test_slice_keeps_overlapping_segments():
+    sliced = make_transcript().slice(5.0, 10.0)
+
+    assert [sliced.segment_text(index) for index in range(len(sliced))] == [
+        "今日は 晴れ",
+        "です",
+    ]
+    assert list(sliced.segment_starts) == [4.0, 9.0]
+
+
+def test_slice_rebase_clamps_segment_and_word_times():
+    sliced = make_transcript().slice(5.0, 10.0, rebase=True)
+
+    assert list(sliced.segment_starts) == [0.0, 4.0]
+    assert list(sliced.segment_ends) == [4.0, 5.0]
+    assert sliced.segment_words(0) == [("今日は", 0.0, 1.0), ("晴れ", 1.0, 4.0)]
+    assert sliced.segment_words(1) == [("です", 4.0, 5.0)]
+    assert min(sliced.word_starts) >= 0.0
+    assert max(sliced.word_ends) <= 5.0
+
+
+def test_map_times_and_round_trip():
+    transcript = make_transcript()
+
+    shifted = transcript.map_times(lambda seconds: seconds + 100.0)
+    restored = Transcript.from_dict(shifted.to_dict())
+
+    assert list(restored.segment_starts) == [100.0, 104.0, 109.0]
+    assert restored.segment_words(2) == [("です", 109.0, 112.0)]
+    assert "[104.00-109.00] 今日は 晴れ" in restored.timestamped_text()
+
+
+def test_to_dict_without_words():
+    segments = make_transcript().to_dict(include_words=False)["segments"]
+
+    assert segments[0] == {"start": 0.0, "end": 4.0, "text": "おはよう ございます"}
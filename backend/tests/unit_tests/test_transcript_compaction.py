@@ -0,0 +1,111 @@
+import logging
+
+from media.transcript import Transcript
+from media.transcript_compaction import (
+    TranscriptCompaction,
+    drop_fillers,
+    fit_transcript_to_budget,
+    refine_violation_times,
+)
+
+
+def long_transcript(count=120):
+    return Transcript.build(
+        [
+            (index * 2.5, index * 2.5 + 2.2, f"えーと、これは{index}番目の発言です")
+            for index in range(count)
+        ],
+        [],
+    )
+
+
+def test_drop_fillers_keeps_demonstratives():
+    assert drop_fillers("えーと、あの店は あのー 高い") == "あの店は 高い"
+
+
+def test_within_budget_returns_timestamped_text_unchanged():
+    transcript = long_transcript(3)
+
+    text, compaction = fit_transcript_to_budget(transcript, "model", 10_000)
+
+    assert text == transcript.timestamped_text()
+    assert compaction is None
+
+
+def test_compacts_in_stages_until_within_budget():
+    transcript = long_transcript()
+
+    text, compaction = fit_transcript_to_budget(transcript, "model", 1500)
+
+    assert compaction.tokens <= 1500 < compaction.original_tokens
+    assert compaction.steps[:2] == ["drop_filler", "round_timestamps"]
+    assert compaction.steps[-1].startswith("merge_segments_")
+    assert compaction.time_resolution_seconds > 1
+    assert "えーと" not in text
+    assert not compaction.over_budget
+
+
+def test_over_budget_is_logged(caplog):
+    with caplog.at_level(logging.ERROR, logger="media.transcript_compaction"):
+        _, compaction = fit_transcript_to_budget(long_transcript(), "model", 10)
+
+    assert compaction.over_budget
+    assert "予算に収まりません" in caplog.text
+
+
+def test_plain_text_only_drops_fillers():
+    text, compaction = fit_transcript_to_budget(
+        long_transcript(), "model", 100, plain_text=True
+    )
+
+    assert compaction.steps == ["drop_filler"]
+    assert compaction.time_resolution_seconds == 0.0
+    assert text.startswith("これは0番目の発言です これは1番目")
+
+
+def compaction_with_resolution(seconds):
+    return TranscriptCompaction(
+        model="model",
+        budget_tokens=1,
+        original_tokens=2,
+        tokens=1,
+        original_lines=1,
+        lines=1,
+        time_resolution_seconds=seconds,
+    )
+
+
+def test_refine_violation_times_uses_related_text():
+    transcript = long_transcript()
+    violations = [
+        {"start_time": 30.0, "end_time": 60.0, "related_text": "これは17番目の発言です"}
+    ]
+
+    refine_violation_times(violations, transcript, compaction_with_resolution(30.0))
+
+    assert (violations[0]["start_time"], violations[0]["end_time"]) == (42.5, 44.7)
+
+
+def test_refine_violation_times_snaps_to_segment_boundaries():
+    transcript = long_transcript()
+    violations = [
+        {"start_time": 31.0, "end_time": 36.0},
+        {"start_time": "不明", "end_time": None},
+    ]
+
+    refine_violation_times(violations, transcript, compaction_with_resolution(1.0))
+
+    assert violations[0]["start_time"] == 30.0
+    assert violations[0]["end_time"] == 37.2
+    assert violations[1] == {"start_time": "不明", "end_time": None}
+
+
+def test_refine_violation_times_ignores_plain_text_compaction():
+    violations = [{"start_time": 31.0, "end_time": 36.0}]
+
+    refine_violation_times(
+        violations, long_transcript(), compaction_with_resolution(0.0)
+    )
+    refine_violation_times(violations, long_transcript(), None)
+
+    assert violations == [{"start_time": 31.0, "end_time": 36.0}]
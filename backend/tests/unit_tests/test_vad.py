@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from test_audio_pipeline import RecordingPool, syllables, write_pcm
+
+import media.audio_pipeline as audio_pipeline
+from media.audio_pipeline import PCM_SAMPLE_RATE
+from media.vad import SpeechRegion, compact_speech, detect_speech_regions
+
+
+def silence(seconds):
+    return np.zeros(int(seconds * PCM_SAMPLE_RATE), dtype=np.int16)
+
+
+def test_detects_speech_between_silences():
+    samples = np.concatenate([silence(3), syllables(4), silence(3)])
+
+    regions = detect_speech_regions(samples, PCM_SAMPLE_RATE)
+
+    assert regions
+    assert regions[0].start == pytest.approx(3.0, abs=0.5)
+    assert regions[-1].end == pytest.approx(7.0, abs=0.5)
+
+
+@pytest.mark.parametrize("name", ["silence", "noise", "tone"])
+def test_ignores_non_speech(name):
+    t = np.arange(8 * PCM_SAMPLE_RATE) / PCM_SAMPLE_RATE
+    signals = {
+        "silence": silence(8),
+        "noise": (np.random.default_rng(0).normal(0, 0.1, len(t)) * 32767).astype(
+            np.int16
+        ),
+        "tone": (np.sin(2 * np.pi * 440 * t) * 0.3 * 32767).astype(np.int16),
+    }
+
+    assert detect_speech_regions(signals[name], PCM_SAMPLE_RATE) == []
+
+
+def test_compacted_times_map_back_to_original():
+    samples = silence(20)
+    regions = [SpeechRegion(2.0, 4.0), SpeechRegion(10.0, 11.5)]
+
+    compacted, speech_map = compact_speech(samples, PCM_SAMPLE_RATE, regions)
+
+    assert len(compacted) == pytest.approx(
+        (2.0 + 1.5 + 2 * 0.3) * PCM_SAMPLE_RATE, abs=2
+    )
+    assert speech_map.to_original(0.5) == pytest.approx(2.5)
+    assert speech_map.to_original(2.3 + 1.0) == pytest.approx(11.0)
+    # 区間の間に入れた無音は直前の区間の終わりに対応させる
+    assert speech_map.to_original(2.1) == pytest.approx(4.0)
+
+
+def test_no_speech_skips_transcription_audio(tmp_path, monkeypatch):
+    sink = write_pcm(tmp_path, silence(5))
+    monkeypatch.setattr(audio_pipeline, "get_media_pool", RecordingPool)
+
+    result = audio_pipeline._encode_speech(
+        sink.samples(), sink.path, str(tmp_path / "speech.ogg")
+    )
+
+    assert result == (None, None, False)
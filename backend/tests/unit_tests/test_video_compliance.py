@@ -0,0 +1,65 @@
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import checker
+from media.transcript import Transcript
+
+
+def test_empty_transcript_still_analyzes_video(tmp_path, monkeypatch):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"\0" * 16)
+    upload = Future()
+    upload.set_result(
+        checker.UploadedVideo(client=object(), windows=None, files=["file-0"])
+    )
+    prompts = []
+
+    def fake_generate(client, model_name, my_file, transcript, cache_name=None):
+        prompts.append(transcript)
+        return {
+            "violations": [
+                {
+                    "type": "動作",
+                    "description": "暴行",
+                    "start_time": 1.0,
+                    "end_time": 2.0,
+                }
+            ],
+            "summary": "映像のみ",
+        }
+
+    monkeypatch.setattr(checker, "_generate_video_analysis", fake_generate)
+
+    result = checker.analyze_video_compliance(
+        str(video_path), Transcript.empty(), upload=upload
+    )
+
+    assert len(prompts) == 1
+    assert result["summary"] == "映像のみ"
+    assert result["violations"][0]["description"] == "暴行"
+
+
+def test_empty_transcript_prompt_says_no_speech(monkeypatch):
+    sent = []
+    response_text = '```json\n{"violations": [], "summary": "問題なし"}\n```'
+    part = SimpleNamespace(text=response_text)
+    response = SimpleNamespace(
+        candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))]
+    )
+    client = SimpleNamespace(
+        models=SimpleNamespace(
+            generate_content=lambda **kwargs: sent.append(kwargs) or response
+        )
+    )
+    monkeypatch.setattr(
+        checker,
+        "call_with_rate_limit",
+        lambda provider, model, request, **kwargs: request(),
+    )
+
+    result = checker._generate_video_analysis(
+        client, "model", SimpleNamespace(name="files/0"), Transcript.empty()
+    )
+
+    assert result["summary"] == "問題なし"
+    assert checker.NO_SPEECH_TRANSCRIPT in sent[0]["contents"][-1]
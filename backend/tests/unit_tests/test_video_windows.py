@@ -0,0 +1,121 @@
+import pytest
+
+import checker
+from media.transcript import Transcript
+from media.video_windows import VideoWindow, merge_window_violations, plan_windows
+
+
+def make_windows():
+    return [
+        VideoWindow(index=0, start=0.0, end=110.0, owned_start=0.0, owned_end=100.0),
+        VideoWindow(
+            index=1, start=90.0, end=200.0, owned_start=100.0, owned_end=float("inf")
+        ),
+    ]
+
+
+def test_plan_windows_covers_duration_with_overlap():
+    windows = plan_windows(
+        250.0, [0.0, 95.0, 190.0], window_seconds=100.0, overlap_seconds=10.0
+    )
+
+    assert windows[0].owned_start == 0.0
+    assert windows[-1].owned_end == float("inf")
+    for previous, current in zip(windows, windows[1:]):
+        assert previous.owned_end == current.owned_start
+        assert current.start <= current.owned_start
+
+
+def test_merge_window_violations_keeps_owner_of_overlap():
+    windows = make_windows()
+    overlap = {
+        "type": "発言",
+        "description": "暴言",
+        "start_time": 14.0,
+        "end_time": 16.0,
+    }
+
+    merged = merge_window_violations(
+        [
+            (windows[0], [{**overlap, "start_time": 104.0, "end_time": 106.0}]),
+            (windows[1], [overlap]),
+        ]
+    )
+
+    assert merged == [{**overlap, "start_time": 104.0, "end_time": 106.0}]
+
+
+def test_merge_window_violations_dedupes_untimed():
+    windows = make_windows()
+    untimed = {
+        "type": "動作",
+        "description": "全体的に威圧的",
+        "start_time": None,
+        "end_time": None,
+    }
+    other = {
+        "type": "動作",
+        "description": "別の指摘",
+        "start_time": "不明",
+        "end_time": "不明",
+    }
+
+    merged = merge_window_violations(
+        [(windows[0], [untimed]), (windows[1], [dict(untimed), other])]
+    )
+
+    assert merged == [untimed, other]
+
+
+def test_analyze_video_windows_reports_failed_window(monkeypatch):
+    windows = make_windows()
+    uploaded = checker.UploadedVideo(
+        client=object(), windows=windows, files=["file-0", "file-1"]
+    )
+    transcript = Transcript.build([(10.0, 12.0, "こんにちは")], [])
+
+    def fake_generate(
+        client, model_name, window_file, window_transcript, cache_name=None
+    ):
+        if window_file == "file-1":
+            raise RuntimeError("quota exceeded")
+        return {
+            "violations": [
+                {
+                    "type": "発言",
+                    "description": "暴言",
+                    "start_time": 10.0,
+                    "end_time": 12.0,
+                },
+                {"type": "動作", "description": "全体的に威圧的"},
+            ],
+            "summary": "前半の要約",
+        }
+
+    monkeypatch.setattr(checker, "_generate_video_analysis", fake_generate)
+
+    result = checker._analyze_video_windows("model", uploaded, transcript)
+
+    assert [violation["description"] for violation in result["violations"]] == [
+        "暴言",
+        "全体的に威圧的",
+    ]
+    assert result["failed_windows"] == [
+        {"start_time": 100.0, "end_time": 200.0, "error": "quota exceeded"}
+    ]
+    assert "[0-100秒] 前半の要約" in result["summary"]
+    assert "[100-200秒] この区間は分析できませんでした" in result["summary"]
+
+
+def test_analyze_video_windows_raises_when_every_window_fails(monkeypatch):
+    uploaded = checker.UploadedVideo(
+        client=object(), windows=make_windows(), files=["file-0", "file-1"]
+    )
+
+    def fake_generate(*args, **kwargs):
+        raise RuntimeError("unavailable")
+
+    monkeypatch.setattr(checker, "_generate_video_analysis", fake_generate)
+
+    with pytest.raises(RuntimeError, match="unavailable"):
+        checker._analyze_video_windows("model", uploaded, Transcript.empty())
@@ -0,0 +1,91 @@
+from analysis.violations import merge_violations
+
+
+def violation(
+    violation_type, description, start_time, end_time, severity="中", related_text=None
+):
+    item = {
+        "type": violation_type,
+        "description": description,
+        "start_time": start_time,
+        "end_time": end_time,
+        "severity": severity,
+    }
+    if related_text is not None:
+        item["related_text"] = related_text
+    return item
+
+
+def test_merges_action_and_speech_about_same_scene():
+    merged = merge_violations(
+        [
+            violation("動作", "相手を殴る動作", 10.0, 14.0, severity="高"),
+            violation(
+                "発言", "殴ってやると脅す発言", 12.0, 15.0, related_text="殴ってやる"
+            ),
+        ]
+    )
+
+    assert len(merged) == 1
+    assert merged[0]["type"] == "動作・発言"
+    assert merged[0]["description"] == "相手を殴る動作 / 殴ってやると脅す発言"
+    assert (merged[0]["start_time"], merged[0]["end_time"]) == (10.0, 15.0)
+    assert merged[0]["severity"] == "高"
+    assert merged[0]["related_text"] == "殴ってやる"
+
+
+def test_keeps_different_problems_in_same_scene_apart():
+    merged = merge_violations(
+        [
+            violation("発言", "特定の民族に対する差別的な発言", 10.0, 14.0),
+            violation("動作", "机を叩く暴力的な動作", 11.0, 13.0),
+        ]
+    )
+
+    assert [item["description"] for item in merged] == [
+        "特定の民族に対する差別的な発言",
+        "机を叩く暴力的な動作",
+    ]
+
+
+def test_merges_adjacent_fragments_of_same_utterance():
+    merged = merge_violations(
+        [
+            violation("発言", "視聴者への侮辱", 0.0, 2.0, related_text="お前らは"),
+            violation("発言", "視聴者への侮辱", 2.5, 4.0, related_text="本当に馬鹿だ"),
+            violation("発言", "視聴者への侮辱", 10.0, 11.0),
+        ]
+    )
+
+    assert [(item["start_time"], item["end_time"]) for item in merged] == [
+        (0.0, 4.0),
+        (10.0, 11.0),
+    ]
+    assert merged[0]["related_text"] == "お前らは / 本当に馬鹿だ"
+
+
+def test_uncategorized_descriptions_merge_only_when_similar():
+    similar = merge_violations(
+        [
+            violation("発言", "不適切な表現の使用", 0.0, 3.0),
+            violation("発言", "不適切な表現", 1.0, 2.0),
+        ]
+    )
+    unrelated = merge_violations(
+        [
+            violation("発言", "未成年の飲酒を勧める", 0.0, 3.0),
+            violation("発言", "個人情報の公開", 1.0, 2.0),
+        ]
+    )
+
+    assert len(similar) == 1
+    assert len(unrelated) == 2
+
+
+def test_untimed_violations_are_kept_at_end():
+    untimed = violation("動作", "全体的に威圧的", None, None)
+
+    merged = merge_violations([untimed, violation("発言", "暴言", 5.0, 6.0)])
+
+    assert merged[-1] is untimed
+    assert len(merged) == 2
@@ -40,7 +40,14 @@ interface GetOEmbedMessage {
     url: string;
 }
 
-type Message = GetSettingsMessage | UpdateSettingsMessage | GetOEmbedMessage;
+interface AddWarningMessage {
+    type: 'ADD_WARNING';
+    data: any;
+    // 分析の優先度（投稿前チェックは interactive、タイムラインのスキャンは background）
+    priority?: 'interactive' | 'background';
+}
+
+type Message = GetSettingsMessage | UpdateSettingsMessage | GetOEmbedMessage | AddWarningMessage;
 
 // レスポンスの型定義
 interface SettingsResponse {
@@ -155,6 +162,8 @@ chrome.runtime.onMessage.addListener((message: Message, sender, sendResponse) =>
 
     if (message.type === "ADD_WARNING") {
         const tweetData = message.data;
+        // 投稿前チェック（interactive）はタイムラインのスキャン（background）より優先して分析される
+        const priority = message.priority === 'interactive' ? 'interactive' : 'background';
 
         // Flaskバックエンドにデータを送信
         (async () => {
@@ -168,11 +177,30 @@ chrome.runtime.onMessage.addListener((message: Message, sender, sendResponse) =>
                 if (tweetData.video) {
                     endpoint = '/api/analyze/video';
 
-                    // FormDataオブジェクトを作成
-                    const formData = new FormData();
+                    // 発言者の背景情報
+                    const speakerBackground = tweetData.user ? {
+                        name: tweetData.user,
+                        past_incidents: [],
+                        character_type: "一般ユーザー",
+                        usual_style: "通常の発言スタイル"
+                    } : undefined;
 
-                    // 動画のblobURLからファイルを取得
-                    try {
+                    if (/^https?:\/\//.test(tweetData.video)) {
+                        // 公開URLの動画はバックエンドが直接取得する（拡張機能では動画をダウンロードしない）
+                        response = await fetch(`http://localhost:5000${endpoint}`, {
+                            method: 'POST',
+                            headers: {
+                                'Content-Type': 'application/json',
+                            },
+                            body: JSON.stringify({
+                                text: tweetData.text,
+                                video_url: tweetData.video,
+                                speaker_background: speakerBackground,
+                                priority
+                            })
+                        });
+                    } else {
+                        // blob: URL はページ内でしか読めないため、取得してファイルとしてアップロードする
                         const videoResponse = await fetch(tweetData.video);
                         const videoBlob = await videoResponse.blob();
 
@@ -186,51 +214,29 @@ chrome.runtime.onMessage.addListener((message: Message, sender, sendResponse) =>
                             extension = 'ogg';
                         }
 
-                        // Fileオブジェクトを作成
+                        // FormDataオブジェクトを作成
+                        const formData = new FormData();
+                        formData.append('priority', priority);
                         const videoFile = new File([videoBlob], `video.${extension}`, {type: contentType});
-
-                        // FormDataに追加
                         formData.append('video', videoFile);
-
                         console.log(`動画をFile形式に変換しました: ${videoFile.name} (${videoFile.size} bytes)`);
-                    } catch (error) {
-                        console.error("動画の取得に失敗しました:", error);
-                        // 失敗した場合はJSONで送信
+
+                        if (speakerBackground) {
+                            formData.append('speaker_background', JSON.stringify(speakerBackground));
+                        }
+
+                        // multipart/form-dataでリクエスト送信
                         response = await fetch(`http://localhost:5000${endpoint}`, {
                             method: 'POST',
-                            headers: {
-                                'Content-Type': 'application/json',
-                            },
-                            body: JSON.stringify({
-                                text: tweetData.text,
-                                video_url: tweetData.video
-                            })
+                            body: formData
                         });
-                        // 以降の処理をスキップ
-                        return;
-                    }
-
-                    // 発言者の背景情報があれば追加
-                    if (tweetData.user) {
-                        const speakerBackground = {
-                            name: tweetData.user,
-                            past_incidents: [],
-                            character_type: "一般ユーザー",
-                            usual_style: "通常の発言スタイル"
-                        };
-                        formData.append('speaker_background', JSON.stringify(speakerBackground));
                     }
-
-                    // multipart/form-dataでリクエスト送信
-                    response = await fetch(`http://localhost:5000${endpoint}`, {
-                        method: 'POST',
-                        body: formData
-                    });
                 } else if (tweetData.images && tweetData.images.length > 0) {
                     endpoint = '/api/analyze/image-text';
 
                     // FormDataオブジェクトを作成
                     const formData = new FormData();
+                    formData.append('priority', priority);
 
                     // テキストを追加
                     if (tweetData.text) {
@@ -319,7 +325,8 @@ chrome.runtime.onMessage.addListener((message: Message, sender, sendResponse) =>
                                 past_incidents: [],
                                 character_type: "一般ユーザー",
                                 usual_style: "通常の発言スタイル"
-                            } : undefined
+                            } : undefined,
+                            priority
                         })
                     });
                 }
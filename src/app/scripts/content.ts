@@ -461,7 +461,8 @@ function createCheckButton(postButton: HTMLElement): HTMLElement {
             console.log("取得した投稿中データ:", composingTweet);
 
             // TODO: バックグラウンドにデータを送信しAIに解析
-            chrome.runtime.sendMessage({ type: "ADD_WARNING", data: composingTweet });
+            // 投稿前チェックはユーザーが結果を待っているため、最優先で分析する
+            chrome.runtime.sendMessage({ type: "ADD_WARNING", data: composingTweet, priority: "interactive" });
         });
 
         return checkButton;